@@ -15,6 +15,7 @@ def run_files(args: argparse.Namespace) -> None:
         args.api,
         dry_run_mode=args.dry_run,
         edit_batch_size=args.batch_size,
+        adaptive_batch=args.adaptive_batch,
         editgroup_description=args.editgroup_description_override,
     )
     JsonLinePusher(fmi, args.json_file).run()
@@ -26,6 +27,11 @@ def main() -> None:
         "--fatcat-api-url", default="http://localhost:9411/v0", help="connect to this host/port"
     )
     parser.add_argument("--batch-size", help="size of batch to send", default=50, type=int)
+    parser.add_argument(
+        "--adaptive-batch",
+        action="store_true",
+        help="pick batch sizes based on API latency (starting from --batch-size)",
+    )
     parser.add_argument(
         "--editgroup-description-override",
         help="editgroup description override",
@@ -24,6 +24,9 @@ def run_crossref(args: argparse.Namespace) -> None:
         contact_email=args.contact_email,
         start_date=args.start_date,
         end_date=args.end_date,
+        concurrency=args.concurrency,
+        rate_limit=args.rate_limit,
+        page_size=args.page_size,
     )
     worker.run(continuous=args.continuous)
 
@@ -36,6 +39,12 @@ def run_datacite(args: argparse.Namespace) -> None:
         contact_email=args.contact_email,
         start_date=args.start_date,
         end_date=args.end_date,
+        concurrency=args.concurrency,
+        rate_limit=args.rate_limit,
+        page_size=args.page_size,
+        window_max_records=args.window_max_records,
+        window_min_seconds=args.window_min_seconds,
+        window_concurrency=args.window_concurrency,
     )
     worker.run(continuous=args.continuous)
 
@@ -47,6 +56,8 @@ def run_arxiv(args: argparse.Namespace) -> None:
         state_topic=f"fatcat-{args.env}.oaipmh-arxiv-state",
         start_date=args.start_date,
         end_date=args.end_date,
+        concurrency=args.concurrency,
+        rate_limit=args.rate_limit,
     )
     worker.run(continuous=args.continuous)
 
@@ -58,6 +69,9 @@ def run_pubmed(args: argparse.Namespace) -> None:
         state_topic=f"fatcat-{args.env}.ftp-pubmed-state",
         start_date=args.start_date,
         end_date=args.end_date,
+        concurrency=args.concurrency,
+        rate_limit=args.rate_limit,
+        download_base_url=args.download_base_url,
     )
     worker.run(continuous=args.continuous)
 
@@ -69,6 +83,8 @@ def run_doaj_article(args: argparse.Namespace) -> None:
         state_topic="fatcat-{args.env}.oaipmh-doaj-article-state",
         start_date=args.start_date,
         end_date=args.end_date,
+        concurrency=args.concurrency,
+        rate_limit=args.rate_limit,
     )
     worker.run(continuous=args.continuous)
 
@@ -80,6 +96,8 @@ def run_doaj_journal(args: argparse.Namespace) -> None:
         state_topic=f"fatcat-{args.env}.oaipmh-doaj-journal-state",
         start_date=args.start_date,
         end_date=args.end_date,
+        concurrency=args.concurrency,
+        rate_limit=args.rate_limit,
     )
     worker.run(continuous=args.continuous)
 
@@ -110,17 +128,59 @@ def main() -> None:
     parser.add_argument(
         "--continuous", action="store_true", help="continue harvesting indefinitely in a loop?"
     )
+    parser.add_argument(
+        "--concurrency",
+        default=1,
+        type=int,
+        help="number of dates to harvest at the same time",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        default=None,
+        type=float,
+        help="maximum API requests (or file downloads) per second, across all dates",
+    )
     subparsers = parser.add_subparsers()
 
     sub_crossref = subparsers.add_parser(
         "crossref", help="harvest DOI metadata from Crossref API (JSON)"
     )
     sub_crossref.set_defaults(func=run_crossref)
+    sub_crossref.add_argument(
+        "--page-size",
+        default=50,
+        type=int,
+        help="number of records per API request (crossref allows up to 1000)",
+    )
 
     sub_datacite = subparsers.add_parser(
         "datacite", help="harvest DOI metadata from Datacite API (JSON)"
     )
     sub_datacite.set_defaults(func=run_datacite)
+    sub_datacite.add_argument(
+        "--page-size",
+        default=50,
+        type=int,
+        help="number of records per API request (datacite allows up to 1000)",
+    )
+    sub_datacite.add_argument(
+        "--window-max-records",
+        default=None,
+        type=int,
+        help="split days with more updates than this in to smaller time windows",
+    )
+    sub_datacite.add_argument(
+        "--window-min-seconds",
+        default=600,
+        type=int,
+        help="smallest time window to split days in to",
+    )
+    sub_datacite.add_argument(
+        "--window-concurrency",
+        default=1,
+        type=int,
+        help="number of time windows (within a day) to harvest at the same time",
+    )
 
     sub_arxiv = subparsers.add_parser(
         "arxiv", help="harvest metadata from arxiv.org OAI-PMH endpoint (XML)"
@@ -131,6 +191,11 @@ def main() -> None:
         "pubmed", help="harvest MEDLINE/PubMed metadata from daily FTP updates (XML)"
     )
     sub_pubmed.set_defaults(func=run_pubmed)
+    sub_pubmed.add_argument(
+        "--download-base-url",
+        default="http://159.69.240.245:15201",
+        help="mirror of the NCBI FTP server to stream update files from (ftp, http, or file URL)",
+    )
 
     # DOAJ stuff disabled because API range-requests are broken
     # sub_doaj_article = subparsers.add_parser('doaj-article')
@@ -4,6 +4,7 @@ import argparse
 import os
 import sys
 
+import elasticsearch
 import sentry_sdk
 
 from fatcat_tools import authenticated_api
@@ -24,6 +25,7 @@ from fatcat_tools.importers import (
     FileMetaImporter,
     FilesetImporter,
     GrobidMetadataImporter,
+    IdentSnapshot,
     IngestFileResultImporter,
     IngestFilesetFileResultImporter,
     IngestFilesetResultImporter,
@@ -34,6 +36,7 @@ from fatcat_tools.importers import (
     JstorImporter,
     KafkaBs4XmlPusher,
     KafkaJsonPusher,
+    KnownDois,
     LinePusher,
     MatchedImporter,
     OrcidImporter,
@@ -51,6 +54,12 @@ def run_crossref(args: argparse.Namespace) -> None:
         args.api,
         args.issn_map_file,
         edit_batch_size=args.batch_size,
+        ident_snapshot=args.ident_snapshot,
+        known_dois=args.known_dois,
+        precheck_batch_size=args.precheck_batch_size,
+        inflight_batches=args.inflight_batches,
+        adaptive_batch=args.adaptive_batch,
+        max_batch_size=args.max_batch_size,
         bezerk_mode=args.bezerk_mode,
     )
     if args.kafka_mode:
@@ -61,13 +70,19 @@ def run_crossref(args: argparse.Namespace) -> None:
             "api-crossref",
             "fatcat-{}-import-crossref".format(args.kafka_env),
             consume_batch_size=args.batch_size,
+            partition_workers=args.partition_workers,
         ).run()
     else:
         JsonLinePusher(fci, args.json_file).run()
 
 
 def run_jalc(args: argparse.Namespace) -> None:
-    ji = JalcImporter(args.api, args.issn_map_file)
+    ji = JalcImporter(
+        args.api,
+        args.issn_map_file,
+        ident_snapshot=args.ident_snapshot,
+        precheck_batch_size=args.precheck_batch_size,
+    )
     Bs4XmlLinesPusher(ji, args.xml_file, "<rdf:Description").run()
 
 
@@ -80,6 +95,7 @@ def run_arxiv(args: argparse.Namespace) -> None:
             args.kafka_env,
             "oaipmh-arxiv",
             "fatcat-{}-import-arxiv".format(args.kafka_env),
+            partition_workers=args.partition_workers,
         ).run()
     else:
         if args.xml_file == sys.stdin:
@@ -92,6 +108,11 @@ def run_pubmed(args: argparse.Namespace) -> None:
         args.api,
         args.issn_map_file,
         edit_batch_size=args.batch_size,
+        ident_snapshot=args.ident_snapshot,
+        precheck_batch_size=args.precheck_batch_size,
+        inflight_batches=args.inflight_batches,
+        adaptive_batch=args.adaptive_batch,
+        max_batch_size=args.max_batch_size,
         do_updates=args.do_updates,
         lookup_refs=(not args.no_lookup_refs),
     )
@@ -102,6 +123,7 @@ def run_pubmed(args: argparse.Namespace) -> None:
             args.kafka_env,
             "ftp-pubmed",
             "fatcat-{}-import-pubmed".format(args.kafka_env),
+            partition_workers=args.partition_workers,
         ).run()
     else:
         Bs4XmlLargeFilePusher(
@@ -112,12 +134,24 @@ def run_pubmed(args: argparse.Namespace) -> None:
 
 
 def run_jstor(args: argparse.Namespace) -> None:
-    ji = JstorImporter(args.api, args.issn_map_file, edit_batch_size=args.batch_size)
+    ji = JstorImporter(
+        args.api,
+        args.issn_map_file,
+        edit_batch_size=args.batch_size,
+        ident_snapshot=args.ident_snapshot,
+    )
     Bs4XmlFileListPusher(ji, args.list_file, "article").run()
 
 
 def run_orcid(args: argparse.Namespace) -> None:
-    foi = OrcidImporter(args.api, edit_batch_size=args.batch_size)
+    foi = OrcidImporter(
+        args.api,
+        edit_batch_size=args.batch_size,
+        precheck_batch_size=args.precheck_batch_size,
+        inflight_batches=args.inflight_batches,
+        adaptive_batch=args.adaptive_batch,
+        max_batch_size=args.max_batch_size,
+    )
     JsonLinePusher(foi, args.json_file).run()
 
 
@@ -138,6 +172,7 @@ def run_matched(args: argparse.Namespace) -> None:
         editgroup_description=args.editgroup_description_override,
         default_link_rel=args.default_link_rel,
         default_mimetype=args.default_mimetype,
+        precheck_batch_size=args.precheck_batch_size,
     )
     JsonLinePusher(fmi, args.json_file).run()
 
@@ -154,6 +189,7 @@ def run_arabesque_match(args: argparse.Namespace) -> None:
         crawl_id=args.crawl_id,
         default_link_rel=args.default_link_rel,
         edit_batch_size=args.batch_size,
+        precheck_batch_size=args.precheck_batch_size,
     )
     if args.sqlite_file:
         SqlitePusher(ami, args.sqlite_file, "crawl_result", ARABESQUE_MATCH_WHERE_CLAUSE).run()
@@ -170,6 +206,10 @@ def run_ingest_file(args: argparse.Namespace) -> None:
         default_link_rel=args.default_link_rel,
         require_grobid=(not args.no_require_grobid),
         edit_batch_size=args.batch_size,
+        precheck_batch_size=args.precheck_batch_size,
+        inflight_batches=args.inflight_batches,
+        adaptive_batch=args.adaptive_batch,
+        max_batch_size=args.max_batch_size,
     )
     if args.kafka_mode:
         KafkaJsonPusher(
@@ -180,6 +220,7 @@ def run_ingest_file(args: argparse.Namespace) -> None:
             "fatcat-{}-ingest-file-result".format(args.kafka_env),
             kafka_namespace="sandcrawler",
             consume_batch_size=args.batch_size,
+            partition_workers=args.partition_workers,
         ).run()
     else:
         JsonLinePusher(ifri, args.json_file).run()
@@ -204,6 +245,7 @@ def run_ingest_web(args: argparse.Namespace) -> None:
             kafka_namespace="sandcrawler",
             consume_batch_size=args.batch_size,
             force_flush=True,
+            partition_workers=args.partition_workers,
         ).run()
     else:
         JsonLinePusher(iwri, args.json_file).run()
@@ -228,6 +270,7 @@ def run_ingest_fileset(args: argparse.Namespace) -> None:
             kafka_namespace="sandcrawler",
             consume_batch_size=args.batch_size,
             force_flush=True,
+            partition_workers=args.partition_workers,
         ).run()
     else:
         JsonLinePusher(ifri, args.json_file).run()
@@ -252,6 +295,7 @@ def run_ingest_fileset_file(args: argparse.Namespace) -> None:
             kafka_namespace="sandcrawler",
             consume_batch_size=args.batch_size,
             force_flush=True,
+            partition_workers=args.partition_workers,
         ).run()
     else:
         JsonLinePusher(ifri, args.json_file).run()
@@ -273,6 +317,7 @@ def run_savepapernow_file(args: argparse.Namespace) -> None:
             kafka_namespace="sandcrawler",
             consume_batch_size=args.batch_size,
             force_flush=True,
+            partition_workers=args.partition_workers,
         ).run()
     else:
         JsonLinePusher(ifri, args.json_file).run()
@@ -294,6 +339,7 @@ def run_savepapernow_web(args: argparse.Namespace) -> None:
             kafka_namespace="sandcrawler",
             consume_batch_size=args.batch_size,
             force_flush=True,
+            partition_workers=args.partition_workers,
         ).run()
     else:
         JsonLinePusher(ifri, args.json_file).run()
@@ -315,6 +361,7 @@ def run_savepapernow_fileset(args: argparse.Namespace) -> None:
             kafka_namespace="sandcrawler",
             consume_batch_size=args.batch_size,
             force_flush=True,
+            partition_workers=args.partition_workers,
         ).run()
     else:
         JsonLinePusher(ifri, args.json_file).run()
@@ -331,7 +378,9 @@ def run_grobid_metadata(args: argparse.Namespace) -> None:
 
 
 def run_shadow_lib(args: argparse.Namespace) -> None:
-    fmi = ShadowLibraryImporter(args.api, edit_batch_size=100)
+    fmi = ShadowLibraryImporter(
+        args.api, edit_batch_size=100, precheck_batch_size=args.precheck_batch_size
+    )
     JsonLinePusher(fmi, args.json_file).run()
 
 
@@ -340,6 +389,12 @@ def run_datacite(args: argparse.Namespace) -> None:
         args.api,
         args.issn_map_file,
         edit_batch_size=args.batch_size,
+        ident_snapshot=args.ident_snapshot,
+        known_dois=args.known_dois,
+        precheck_batch_size=args.precheck_batch_size,
+        inflight_batches=args.inflight_batches,
+        adaptive_batch=args.adaptive_batch,
+        max_batch_size=args.max_batch_size,
         bezerk_mode=args.bezerk_mode,
         debug=args.debug,
         insert_log_file=args.insert_log_file,
@@ -352,6 +407,7 @@ def run_datacite(args: argparse.Namespace) -> None:
             "api-datacite",
             "fatcat-{}-import-datacite".format(args.kafka_env),
             consume_batch_size=args.batch_size,
+            partition_workers=args.partition_workers,
         ).run()
     else:
         JsonLinePusher(dci, args.json_file).run()
@@ -362,6 +418,14 @@ def run_doaj_article(args: argparse.Namespace) -> None:
         args.api,
         args.issn_map_file,
         edit_batch_size=args.batch_size,
+        ident_snapshot=args.ident_snapshot,
+        inflight_batches=args.inflight_batches,
+        adaptive_batch=args.adaptive_batch,
+        max_batch_size=args.max_batch_size,
+        precheck_batch_size=args.precheck_batch_size,
+        es_client=args.es_client,
+        fuzzy_verify_workers=args.fuzzy_verify_workers,
+        fuzzy_cache_ttl=args.fuzzy_cache_ttl,
         do_updates=args.do_updates,
     )
     if args.kafka_mode:
@@ -372,6 +436,7 @@ def run_doaj_article(args: argparse.Namespace) -> None:
             "api-doaj",
             "fatcat-{}-import-doaj".format(args.kafka_env),
             consume_batch_size=args.batch_size,
+            partition_workers=args.partition_workers,
         ).run()
     else:
         JsonLinePusher(dai, args.json_file).run()
@@ -382,6 +447,14 @@ def run_dblp_release(args: argparse.Namespace) -> None:
         args.api,
         dblp_container_map_file=args.dblp_container_map_file,
         edit_batch_size=args.batch_size,
+        ident_snapshot=args.ident_snapshot,
+        inflight_batches=args.inflight_batches,
+        adaptive_batch=args.adaptive_batch,
+        max_batch_size=args.max_batch_size,
+        precheck_batch_size=args.precheck_batch_size,
+        es_client=args.es_client,
+        fuzzy_verify_workers=args.fuzzy_verify_workers,
+        fuzzy_cache_ttl=args.fuzzy_cache_ttl,
         do_updates=args.do_updates,
         dump_json_mode=args.dump_json_mode,
     )
@@ -438,6 +511,76 @@ def main() -> None:
         "--kafka-env", default="dev", help="Kafka topic namespace to use (eg, prod, qa)"
     )
     parser.add_argument("--batch-size", help="size of batch to send", default=50, type=int)
+    parser.add_argument(
+        "--adaptive-batch",
+        action="store_true",
+        help="pick batch sizes based on API latency (starting from --batch-size)",
+    )
+    parser.add_argument(
+        "--max-batch-size",
+        help="upper bound on batch size when using --adaptive-batch",
+        default=500,
+        type=int,
+    )
+    parser.add_argument(
+        "--inflight-batches",
+        help="number of batch insert/accept API calls to keep in flight in the background (0 for synchronous)",
+        default=0,
+        type=int,
+    )
+    parser.add_argument(
+        "--partition-workers",
+        help="in kafka mode, number of partitions to import from concurrently (threads, each with its own editgroups)",
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "--precheck-batch-size",
+        help="number of records to look up existing entities for concurrently, ahead of updates (0 to disable)",
+        default=0,
+        type=int,
+    )
+    parser.add_argument(
+        "--ident-snapshot",
+        help="local identifier snapshot file (see: fatcat_transform.py ident-snapshot)",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--known-dois",
+        help="known-DOI filter file, for skipping existing DOIs in crossref/datacite imports (see: fatcat_transform.py known-dois)",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--known-dois-refresh-interval",
+        help="how often (in seconds) to update the known-DOI filter from the changelog (0 to disable)",
+        default=3600.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--known-dois-save-interval",
+        help="how often (in seconds, at most) to re-write the known-DOI filter file with refreshed DOIs; also written at exit",
+        default=6 * 3600.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--elasticsearch-backend",
+        help="elasticsearch backend to use for fuzzy matching (a local endpoint is preferred, but public is default)",
+        default="https://search.fatcat.wiki",
+    )
+    parser.add_argument(
+        "--fuzzy-verify-workers",
+        help="number of processes to verify fuzzy match candidates in (0 to verify in-line)",
+        default=0,
+        type=int,
+    )
+    parser.add_argument(
+        "--fuzzy-cache-ttl",
+        help="seconds to cache fuzzy match candidates for, by title, and batch fuzzy match searches (0 to disable)",
+        default=0.0,
+        type=float,
+    )
     parser.add_argument(
         "--editgroup-description-override",
         help="editgroup description override",
@@ -1072,6 +1215,16 @@ def main() -> None:
     ):
         args.editgroup_description_override = os.environ.get("FATCAT_EDITGROUP_DESCRIPTION")
 
+    if args.ident_snapshot:
+        args.ident_snapshot = IdentSnapshot(args.ident_snapshot)
+    args.es_client = elasticsearch.Elasticsearch(args.elasticsearch_backend, timeout=120)
+    if args.known_dois:
+        args.known_dois = KnownDois.load(
+            args.known_dois,
+            refresh_interval=args.known_dois_refresh_interval,
+            save_interval=args.known_dois_save_interval,
+        )
+
     args.api = authenticated_api(
         args.host_url,
         # token is an optional kwarg (can be empty string, None, etc)
@@ -1079,6 +1232,8 @@ def main() -> None:
     )
     sentry_sdk.init()
     args.func(args)
+    if args.known_dois:
+        args.known_dois.maybe_save(force=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,202 @@
+"""
+Adaptive sizing of edit batches, shared by importers, mergers, and cleaners.
+
+A fixed edit_batch_size is a compromise: small batches waste API round-trips,
+while large batches of "heavy" entities (eg, releases with hundreds of refs)
+result in huge auto-batch payloads which are slow and sometimes time out. In
+adaptive mode the batch size is instead chosen from observed API response
+times (aiming for a target latency per call), and batches are also cut early
+if the serialized payload grows past a byte limit.
+"""
+
+import threading
+from typing import Any, Dict, Optional
+
+# don't let a single fast or slow response swing the batch size too far
+MAX_GROWTH_FACTOR: float = 2.0
+LATENCY_SMOOTHING: float = 0.3
+# rough serialized sizes, for estimate_entity_bytes()
+ENTITY_BASE_BYTES: int = 1024
+LIST_ITEM_BYTES: int = 256
+
+
+class AdaptiveBatchSizer:
+    """
+    Tracks the current target batch size, within [min_size, max_size].
+
+    Callers check should_flush() as entities accumulate, and call record()
+    with the size and latency of each batch API call once it completes.
+    record() may be called from background threads.
+    """
+
+    def __init__(
+        self,
+        initial_size: int,
+        min_size: int = 10,
+        max_size: int = 500,
+        target_latency: float = 5.0,
+        max_bytes: Optional[int] = None,
+    ) -> None:
+        assert 1 <= min_size <= max_size
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_latency = target_latency
+        self.max_bytes = max_bytes
+        self.size = max(min_size, min(max_size, initial_size))
+        self._lock = threading.Lock()
+        # smoothed estimate of API latency per entity in a batch (seconds)
+        self._per_item_latency: Optional[float] = None
+        self._batches = 0
+        self._total_latency = 0.0
+        self._max_latency = 0.0
+        self._min_seen_size: Optional[int] = None
+        self._max_seen_size = 0
+
+    def should_flush(self, count: int, nbytes: int = 0) -> bool:
+        if count >= self.size:
+            return True
+        if self.max_bytes and nbytes >= self.max_bytes:
+            return True
+        return False
+
+    def record(self, count: int, latency: float) -> None:
+        """
+        Updates the target size based on the latency (in seconds) of a batch
+        API call covering 'count' entities.
+        """
+        if count <= 0:
+            return
+        with self._lock:
+            self._batches += 1
+            self._total_latency += latency
+            self._max_latency = max(self._max_latency, latency)
+            self._max_seen_size = max(self._max_seen_size, count)
+            if self._min_seen_size is None or count < self._min_seen_size:
+                self._min_seen_size = count
+
+            per_item = latency / count
+            if self._per_item_latency is None:
+                self._per_item_latency = per_item
+            else:
+                self._per_item_latency = (
+                    LATENCY_SMOOTHING * per_item
+                    + (1.0 - LATENCY_SMOOTHING) * self._per_item_latency
+                )
+            if self._per_item_latency <= 0:
+                ideal = self.max_size
+            else:
+                ideal = int(self.target_latency / self._per_item_latency)
+            ideal = min(ideal, int(self.size * MAX_GROWTH_FACTOR))
+            self.size = max(self.min_size, min(self.max_size, ideal))
+
+    def stats(self, prefix: str = "batch") -> Dict[str, Any]:
+        """
+        Summary values, intended to be merged in to importer counts.
+        """
+        with self._lock:
+            if not self._batches:
+                return {}
+            return {
+                "{}-adaptive.count".format(prefix): self._batches,
+                "{}-adaptive.size-current".format(prefix): self.size,
+                "{}-adaptive.size-min".format(prefix): self._min_seen_size,
+                "{}-adaptive.size-max".format(prefix): self._max_seen_size,
+                "{}-adaptive.latency-avg-ms".format(prefix): int(
+                    1000 * self._total_latency / self._batches
+                ),
+                "{}-adaptive.latency-max-ms".format(prefix): int(1000 * self._max_latency),
+            }
+
+
+def estimate_entity_bytes(entity: Any) -> int:
+    """
+    Cheap estimate of the serialized (JSON) size of an API entity, for
+    cutting batches by payload size without serializing every entity: the
+    length of top-level strings, plus a fixed size for each item of
+    top-level lists (refs, contribs, URLs, manifest entries, etc) and the
+    length of any list item 'content' (abstracts).
+    """
+    nbytes = ENTITY_BASE_BYTES
+    for name in getattr(entity, "openapi_types", None) or ():
+        val = getattr(entity, name, None)
+        if isinstance(val, str):
+            nbytes += len(val)
+        elif isinstance(val, list):
+            for item in val:
+                nbytes += LIST_ITEM_BYTES
+                content = getattr(item, "content", None)
+                if isinstance(content, str):
+                    nbytes += len(content)
+    return nbytes
+
+
+def make_batch_sizer(
+    edit_batch_size: int, kwargs: Dict[str, Any]
+) -> Optional[AdaptiveBatchSizer]:
+    """
+    Helper for importer/merger/cleaner constructors. Returns None (fixed batch
+    size) unless the 'adaptive_batch' kwarg is set. A max_batch_size below
+    the minimum lowers the minimum (so batches are always that size).
+    """
+    if not kwargs.get("adaptive_batch"):
+        return None
+    max_size = max(1, kwargs.get("max_batch_size") or max(500, edit_batch_size))
+    return AdaptiveBatchSizer(
+        edit_batch_size,
+        min_size=min(kwargs.get("min_batch_size") or 10, max_size),
+        max_size=max_size,
+        target_latency=kwargs.get("batch_target_latency") or 5.0,
+        max_bytes=kwargs.get("batch_max_bytes") or 8 * 1024 * 1024,
+    )
+
+
+def test_adaptive_batch_sizer() -> None:
+    bs = AdaptiveBatchSizer(100, min_size=10, max_size=400, target_latency=2.0, max_bytes=1000)
+    assert bs.should_flush(100)
+    assert not bs.should_flush(99, nbytes=10)
+    assert bs.should_flush(5, nbytes=1000)
+
+    # fast responses grow the batch size, but only gradually
+    bs.record(100, 0.1)
+    assert bs.size == 200
+    bs.record(200, 0.2)
+    assert bs.size == 400
+    bs.record(400, 0.4)
+    assert bs.size == 400
+
+    # slow responses shrink it, down to the floor
+    for _ in range(10):
+        bs.record(bs.size, 60.0)
+    assert bs.size == 10
+
+    stats = bs.stats()
+    assert stats["batch-adaptive.count"] == 13
+    assert stats["batch-adaptive.size-max"] == 400
+    assert stats["batch-adaptive.latency-max-ms"] == 60000
+    assert AdaptiveBatchSizer(5).stats() == {}
+
+
+def test_make_batch_sizer() -> None:
+    assert make_batch_sizer(100, dict()) is None
+    bs = make_batch_sizer(100, dict(adaptive_batch=True))
+    assert bs and (bs.min_size, bs.max_size, bs.size) == (10, 500, 100)
+    # max below the default min is clamped, not an error
+    bs = make_batch_sizer(100, dict(adaptive_batch=True, max_batch_size=5))
+    assert bs and (bs.min_size, bs.max_size, bs.size) == (5, 5, 5)
+
+
+def test_estimate_entity_bytes() -> None:
+    from fatcat_openapi_client import ReleaseAbstract, ReleaseEntity, ReleaseRef
+
+    small = ReleaseEntity(title="example", ext_ids={})
+    assert estimate_entity_bytes(small) == ENTITY_BASE_BYTES + len("example")
+    big = ReleaseEntity(
+        title="example",
+        ext_ids={},
+        refs=[ReleaseRef(index=i) for i in range(100)],
+        abstracts=[ReleaseAbstract(content="x" * 5000)],
+    )
+    assert (
+        estimate_entity_bytes(big)
+        == estimate_entity_bytes(small) + 101 * LIST_ITEM_BYTES + 5000
+    )
@@ -0,0 +1,156 @@
+"""
+Small in-process cache, shared by importer and web helpers (fuzzy match
+candidates, release lookups, search results, computed entity docs, etc).
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache. Counts hits and misses.
+
+    Entries are bounded by count (max_size), and optionally by total weight
+    (max_weight, with weigh() giving the weight of a value, eg its length),
+    and may expire after ttl seconds. Values weighing more than
+    max_item_weight are returned to the caller but not cached. A max_size of
+    zero disables the cache.
+
+    Cached values are shared between callers, and must not be modified.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl: Optional[float] = None,
+        weigh: Optional[Callable[[Any], int]] = None,
+        max_weight: Optional[int] = None,
+        max_item_weight: Optional[int] = None,
+    ) -> None:
+        assert max_size >= 0
+        assert ttl is None or ttl > 0
+        self.max_size = max_size
+        self.ttl = ttl
+        self.weigh = weigh
+        self.max_weight = max_weight
+        self.max_item_weight = max_item_weight
+        self.hits = 0
+        self.misses = 0
+        self.weight = 0
+        self._lock = threading.Lock()
+        # values are (inserted timestamp, weight, value)
+        self._entries: "OrderedDict[Hashable, Tuple[float, int, Any]]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """
+        Returns (found, value); a (False, None) result counts as a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl and time.monotonic() - entry[0] > self.ttl:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return (False, None)
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return (True, entry[2])
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if not self.max_size:
+            return
+        weight = self.weigh(value) if self.weigh else 0
+        if self.max_item_weight is not None and weight > self.max_item_weight:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic(), weight, value)
+            self.weight += weight
+            while len(self._entries) > self.max_size or (
+                self.max_weight is not None and self.weight > self.max_weight
+            ):
+                self._remove(next(iter(self._entries)))
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        Returns the cached value for key, or calls compute() and caches the
+        result. Concurrent misses on the same key may each call compute().
+        Errors are not cached.
+        """
+        found, value = self.get(key)
+        if not found:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def _remove(self, key: Hashable) -> None:
+        # caller must hold the lock
+        self.weight -= self._entries.pop(key)[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.weight = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses, size=len(self._entries))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def test_lru_cache() -> None:
+    cache = LRUCache(max_size=2)
+    assert cache.get("a") == (False, None)
+    cache.put("a", 1)
+    cache.put("b", None)
+    assert cache.get("a") == (True, 1)
+    # "b" is least recently used
+    cache.put("c", 3)
+    assert cache.get("b") == (False, None)
+    assert len(cache) == 2
+    assert cache.stats() == dict(hits=1, misses=2, size=2)
+    assert cache.get_or_compute("c", lambda: 30) == 3
+    assert cache.get_or_compute("d", lambda: 4) == 4
+    assert cache.get("a") == (False, None)
+
+    disabled = LRUCache(max_size=0)
+    disabled.put("a", 1)
+    assert disabled.get("a") == (False, None)
+
+
+def test_lru_cache_ttl() -> None:
+    cache = LRUCache(max_size=10, ttl=60.0)
+    cache.put("a", 1)
+    assert cache.get("a") == (True, 1)
+    cache.ttl = 0.0001
+    time.sleep(0.01)
+    assert cache.get("a") == (False, None)
+    assert len(cache) == 0
+
+
+def test_lru_cache_weight() -> None:
+    cache = LRUCache(max_size=10, weigh=len, max_weight=10, max_item_weight=6)
+    cache.put("a", "aaaa")
+    cache.put("b", "bbbb")
+    assert cache.weight == 8
+    # too big to cache at all
+    cache.put("c", "ccccccc")
+    assert cache.get("c") == (False, None)
+    assert cache.weight == 8
+    # evicts "a" to stay under max_weight
+    cache.put("d", "dddd")
+    assert cache.get("a") == (False, None)
+    assert cache.get("b") == (True, "bbbb")
+    assert cache.weight == 8
+    # replacing an entry doesn't double-count it
+    cache.put("b", "bb")
+    assert cache.weight == 6
+    cache.clear()
+    assert cache.weight == 0 and len(cache) == 0
@@ -2,11 +2,13 @@ import copy
 import json
 import subprocess
 import sys
+import time
 from collections import Counter
-from typing import Any, Dict, List, Sequence
+from typing import Any, Dict, List, Optional, Sequence
 
 from fatcat_openapi_client import ApiClient, Editgroup
 
+from fatcat_tools.batch_sizing import AdaptiveBatchSizer, make_batch_sizer
 from fatcat_tools.transforms import entity_from_dict, entity_to_dict
 
 
@@ -45,6 +47,10 @@ class EntityCleaner:
             "editgroup_description", "Generic Entity Cleaner Bot"
         )
         self.editgroup_extra = eg_extra
+        # optional; sizes editgroups based on accept_editgroup() latency
+        self._batch_sizer: Optional[AdaptiveBatchSizer] = make_batch_sizer(
+            self.edit_batch_size, kwargs
+        )
         self.reset()
         self.ac = ApiClient()
 
@@ -101,13 +107,20 @@ class EntityCleaner:
             self._edit_count += updated
             self._idents_inflight.append(entity.ident)
 
-        if self._edit_count >= self.edit_batch_size:
-            self.api.accept_editgroup(self._editgroup_id)
-            self._editgroup_id = None
-            self._edit_count = 0
-            self._idents_inflight = []
+        batch_size = self._batch_sizer.size if self._batch_sizer else self.edit_batch_size
+        if self._edit_count >= batch_size:
+            self._accept_editgroup()
         return
 
+    def _accept_editgroup(self) -> None:
+        start = time.monotonic()
+        self.api.accept_editgroup(self._editgroup_id)
+        if self._batch_sizer:
+            self._batch_sizer.record(self._edit_count, time.monotonic() - start)
+        self._editgroup_id = None
+        self._edit_count = 0
+        self._idents_inflight = []
+
     def clean_entity(self, entity: Any) -> Any:
         """
         Mutates entity in-place and returns it
@@ -127,11 +140,11 @@ class EntityCleaner:
 
     def finish(self) -> Counter:
         if self._edit_count > 0:
-            self.api.accept_editgroup(self._editgroup_id)
-            self._editgroup_id = None
-            self._edit_count = 0
-            self._idents_inflight = []
+            self._accept_editgroup()
 
+        if self._batch_sizer:
+            for k, v in self._batch_sizer.stats(prefix="editgroup").items():
+                self.counts[k] = v
         return self.counts
 
     def get_editgroup_id(self) -> str:
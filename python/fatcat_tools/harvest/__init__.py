@@ -1,4 +1,4 @@
 from .doi_registrars import HarvestCrossrefWorker, HarvestDataciteWorker
-from .harvest_common import HarvestState
+from .harvest_common import HarvestState, KafkaStateStore
 from .oaipmh import HarvestArxivWorker, HarvestDoajArticleWorker, HarvestDoajJournalWorker
 from .pubmed import PubmedFTPWorker
@@ -2,12 +2,22 @@ import datetime
 import json
 import sys
 import time
-from typing import Any, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
 from urllib.parse import parse_qs, urlparse
 
-from confluent_kafka import KafkaException, Producer
+import requests
+from confluent_kafka import KafkaException
 
-from .harvest_common import HarvestState, requests_retry_session
+from fatcat_tools.kafka import TrackedProducer, kafka_producer
+
+from .harvest_common import (
+    HarvestState,
+    RateLimiter,
+    harvest_spans,
+    requests_retry_session,
+    window_key,
+)
 
 
 class HarvestCrossrefWorker:
@@ -56,10 +66,23 @@ class HarvestCrossrefWorker:
         - start a loop for just that date, using resumption token for this query
         - when done, publish to state feed, with immediate sync
 
-    TODO: what sort of parallelism? I guess multi-processing on dates, but need
-    to be careful how state is serialized back into kafka.
+    Several dates can be harvested at once (with 'concurrency' threads, see
+    harvest_spans()); state is only ever serialized back into kafka from the
+    main thread. All threads share one rate limit (requests per second) for
+    the API.
+
+    Where the API supports timestamp ranges (datacite, not crossref, whose
+    date filters only go down to whole days), a day with more than
+    'window_max_records' updates is split in to smaller time windows (by
+    repeatedly halving, down to 'window_min_seconds'), which are harvested
+    with up to 'window_concurrency' cursors at once. Completed windows are
+    recorded in the harvest state, so a restart of a huge day resumes from
+    the windows which are not yet done.
     """
 
+    # whether params can be restricted to a sub-day time window (window_params())
+    supports_windows: bool = False
+
     def __init__(
         self,
         kafka_hosts: str,
@@ -69,6 +92,12 @@ class HarvestCrossrefWorker:
         api_host_url: str = "https://api.crossref.org/works",
         start_date: Optional[datetime.date] = None,
         end_date: Optional[datetime.date] = None,
+        concurrency: int = 1,
+        rate_limit: Optional[float] = None,
+        page_size: int = 50,
+        window_max_records: Optional[int] = None,
+        window_min_seconds: int = 600,
+        window_concurrency: int = 1,
     ) -> None:
 
         self.api_host_url = api_host_url
@@ -84,11 +113,16 @@ class HarvestCrossrefWorker:
         self.state.initialize_from_kafka(self.state_topic, self.kafka_config)
 
         self.loop_sleep = 60 * 60  # how long to wait, in seconds, between date checks
-        self.api_batch_size = 50
+        self.api_batch_size = page_size
+        self.concurrency = concurrency
+        self.window_max_records = window_max_records
+        self.window_min_seconds = window_min_seconds
+        self.window_concurrency = window_concurrency
+        self.rate_limiter = RateLimiter(rate_limit)
         self.name = "Crossref"
         self.producer = self._kafka_producer()
 
-    def _kafka_producer(self) -> Producer:
+    def _kafka_producer(self) -> TrackedProducer:
         def fail_fast(err: Any, _msg: Any) -> None:
             if err is not None:
                 print("Kafka producer delivery error: {}".format(err), file=sys.stderr)
@@ -98,16 +132,7 @@ class HarvestCrossrefWorker:
 
         self._kafka_fail_fast = fail_fast
 
-        producer_conf = self.kafka_config.copy()
-        producer_conf.update(
-            {
-                "delivery.report.only.error": True,
-                "default.topic.config": {
-                    "request.required.acks": -1,  # all brokers must confirm
-                },
-            }
-        )
-        return Producer(producer_conf)
+        return kafka_producer(self.kafka_config)
 
     def params(self, date_str: str) -> Dict[str, Any]:
         filter_param = "from-update-date:{},until-update-date:{}".format(date_str, date_str)
@@ -124,10 +149,22 @@ class HarvestCrossrefWorker:
     def extract_key(self, obj: Dict[str, Any]) -> bytes:
         return obj["DOI"].encode("utf-8")
 
-    def fetch_date(self, date: datetime.date) -> None:
+    def window_params(self, start: datetime.datetime, end: datetime.datetime) -> Dict[str, Any]:
+        """
+        Like params(), but for the half-open time window [start, end) (UTC).
+        Only implemented if supports_windows is set.
+        """
+        raise NotImplementedError()
+
+    def count_params(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Variant of (initial) params which only fetches the total count.
+        """
+        params = params.copy()
+        params["rows"] = 0
+        return params
 
-        date_str = date.isoformat()
-        params = self.params(date_str)
+    def _http_session(self) -> requests.Session:
         http_session = requests_retry_session()
         http_session.headers.update(
             {
@@ -136,8 +173,13 @@ class HarvestCrossrefWorker:
                 ),
             }
         )
-        count = 0
+        return http_session
+
+    def _api_get(
+        self, http_session: requests.Session, params: Dict[str, Any]
+    ) -> Tuple[requests.Response, Any]:
         while True:
+            self.rate_limiter.wait()
             http_resp = http_session.get(self.api_host_url, params=params)
             if http_resp.status_code == 503:
                 # crude backoff; now redundant with session exponential
@@ -153,7 +195,7 @@ class HarvestCrossrefWorker:
             http_resp.raise_for_status()
             try:
                 resp_body = http_resp.text
-                resp = json.loads(resp_body)
+                return http_resp, json.loads(resp_body)
             except json.JSONDecodeError as exc:
                 # Datacite API returned HTTP 200, but JSON seemed unparseable.
                 # It might be a glitch, so we retry.
@@ -162,6 +204,67 @@ class HarvestCrossrefWorker:
                     file=sys.stderr,
                 )
                 raise exc
+
+    def plan_windows(
+        self, http_session: requests.Session, date: datetime.date
+    ) -> Optional[List[Tuple[datetime.datetime, datetime.datetime]]]:
+        """
+        Returns None if the date should be harvested as a single query, or a
+        list of time windows (which haven't been completed already) covering
+        the date.
+
+        Windows are always aligned halves of the day (or of a larger window),
+        so that the same window keys come up again after a restart.
+        """
+        if not (self.supports_windows and self.window_max_records):
+            return None
+
+        def count_window(start: datetime.datetime, end: datetime.datetime) -> int:
+            _, resp = self._api_get(
+                http_session, self.count_params(self.window_params(start, end))
+            )
+            return self.extract_total(resp)
+
+        day_start = datetime.datetime.combine(date, datetime.time())
+        day_end = day_start + datetime.timedelta(days=1)
+        day_total = None
+        if not self.state.completed_windows.get(date):
+            day_total = count_window(day_start, day_end)
+            if day_total <= self.window_max_records:
+                return None
+
+        windows = []
+        pending = [(day_start, day_end)]
+        while pending:
+            start, end = pending.pop()
+            if self.state.window_completed(date, window_key(start, end)):
+                continue
+            half = (end - start) / 2
+            if half.total_seconds() >= self.window_min_seconds:
+                if (start, end) == (day_start, day_end) and day_total is not None:
+                    total = day_total
+                else:
+                    total = count_window(start, end)
+                if total > self.window_max_records:
+                    pending.append((start + half, end))
+                    pending.append((start, start + half))
+                    continue
+            windows.append((start, end))
+        windows.sort()
+        print(
+            "Splitting {} in to {} time windows".format(date.isoformat(), len(windows)),
+            file=sys.stderr,
+        )
+        return windows
+
+    def fetch_params(self, http_session: requests.Session, params: Dict[str, Any]) -> int:
+        """
+        Pages through all results for a query (with a cursor), publishing them
+        to Kafka. Returns the number of records.
+        """
+        count = 0
+        while True:
+            http_resp, resp = self._api_get(http_session, params)
             items = self.extract_items(resp)
             count += len(items)
             print(
@@ -182,6 +285,39 @@ class HarvestCrossrefWorker:
             if len(items) < self.api_batch_size:
                 break
             params = self.update_params(params, resp)
+        return count
+
+    def fetch_window(
+        self, date: datetime.date, start: datetime.datetime, end: datetime.datetime
+    ) -> None:
+        print("Fetching updates for {} to {} (UTC)".format(start, end), file=sys.stderr)
+        self.fetch_params(self._http_session(), self.window_params(start, end))
+        # records must be delivered before the window is recorded as done
+        self.producer.flush()
+        self.state.complete_window(
+            date,
+            window_key(start, end),
+            kafka_topic=self.state_topic,
+            kafka_config=self.kafka_config,
+        )
+
+    def fetch_date(self, date: datetime.date) -> None:
+
+        http_session = self._http_session()
+        windows = self.plan_windows(http_session, date)
+        if windows is None:
+            self.fetch_params(http_session, self.params(date.isoformat()))
+        elif windows:
+            with ThreadPoolExecutor(
+                max_workers=max(1, self.window_concurrency),
+                thread_name_prefix="fatcat-harvest-window",
+            ) as executor:
+                futures = [
+                    executor.submit(self.fetch_window, date, start, end)
+                    for (start, end) in windows
+                ]
+                for future in futures:
+                    future.result()
         self.producer.flush()
 
     def extract_items(self, resp: Dict[str, Any]) -> List[Dict]:
@@ -190,17 +326,19 @@ class HarvestCrossrefWorker:
     def extract_total(self, resp: Dict[str, Any]) -> int:
         return resp["message"]["total-results"]
 
+    def commit_date(self, date: datetime.date) -> None:
+        self.state.complete(date, kafka_topic=self.state_topic, kafka_config=self.kafka_config)
+
     def run(self, continuous: bool = False) -> None:
 
         while True:
-            current = self.state.next_span(continuous)
-            if current:
-                print("Fetching DOIs updated on {} (UTC)".format(current), file=sys.stderr)
-                self.fetch_date(current)
-                self.state.complete(
-                    current, kafka_topic=self.state_topic, kafka_config=self.kafka_config
-                )
-                continue
+            harvest_spans(
+                self.state,
+                self.fetch_date,
+                self.commit_date,
+                concurrency=self.concurrency,
+                continuous=continuous,
+            )
 
             if continuous:
                 print("Sleeping {} seconds...".format(self.loop_sleep), file=sys.stderr)
@@ -220,8 +358,13 @@ class HarvestDataciteWorker(HarvestCrossrefWorker):
 
     fundamentally, very similar to crossref. don't have a scrape... maybe
     could/should use this script for that, and dump to JSON?
+
+    The "updated" query takes full timestamps, so days can be split in to
+    time windows (see HarvestCrossrefWorker).
     """
 
+    supports_windows = True
+
     def __init__(
         self,
         kafka_hosts: str,
@@ -231,6 +374,12 @@ class HarvestDataciteWorker(HarvestCrossrefWorker):
         api_host_url: str = "https://api.datacite.org/dois",
         start_date: Optional[datetime.date] = None,
         end_date: Optional[datetime.date] = None,
+        concurrency: int = 1,
+        rate_limit: Optional[float] = None,
+        page_size: int = 50,
+        window_max_records: Optional[int] = None,
+        window_min_seconds: int = 600,
+        window_concurrency: int = 1,
     ):
         super().__init__(
             kafka_hosts=kafka_hosts,
@@ -240,6 +389,12 @@ class HarvestDataciteWorker(HarvestCrossrefWorker):
             contact_email=contact_email,
             start_date=start_date,
             end_date=end_date,
+            concurrency=concurrency,
+            rate_limit=rate_limit,
+            page_size=page_size,
+            window_max_records=window_max_records,
+            window_min_seconds=window_min_seconds,
+            window_concurrency=window_concurrency,
         )
 
         # for datecite, it's "from-update-date"
@@ -257,6 +412,23 @@ class HarvestDataciteWorker(HarvestCrossrefWorker):
             "page[cursor]": 1,
         }
 
+    def window_params(self, start: datetime.datetime, end: datetime.datetime) -> Dict[str, Any]:
+        last = end - datetime.timedelta(milliseconds=1)
+        return {
+            "query": "updated:[{}Z TO {}Z]".format(
+                start.isoformat(timespec="milliseconds"),
+                last.isoformat(timespec="milliseconds"),
+            ),
+            "page[size]": self.api_batch_size,
+            "page[cursor]": 1,
+        }
+
+    def count_params(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        params = params.copy()
+        params["page[size]"] = 0
+        params.pop("page[cursor]", None)
+        return params
+
     def extract_items(self, resp: Dict[str, Any]) -> List[Dict]:
         return resp["data"]
 
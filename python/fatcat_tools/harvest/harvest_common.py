@@ -1,7 +1,11 @@
 import datetime
+import heapq
 import json
 import sys
-from typing import Any, Dict, Optional, Sequence, Set
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
 
 import requests
 from confluent_kafka import Consumer, KafkaException, Producer, TopicPartition
@@ -38,6 +42,212 @@ def requests_retry_session(
     return session
 
 
+class RateLimiter:
+    """
+    Simple thread-safe limiter, spacing out calls to wait() so there are at
+    most max_per_second of them. Shared by all the threads of a harvester, so
+    the limit applies to the source as a whole.
+    """
+
+    def __init__(self, max_per_second: Optional[float] = None) -> None:
+        self.min_interval = (1.0 / max_per_second) if max_per_second else 0.0
+        self._lock = threading.Lock()
+        self._next_time = 0.0
+
+    def wait(self) -> None:
+        if not self.min_interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.min_interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def dates_to_ranges(dates: Set[datetime.date]) -> List[Tuple[str, str]]:
+    """
+    Compacts a set of dates into a sorted list of inclusive (start, end) ISO
+    date string ranges.
+    """
+    ranges: List[Tuple[str, str]] = []
+    start = prev = None
+    for d in sorted(dates):
+        if prev is not None and d == prev + datetime.timedelta(days=1):
+            prev = d
+            continue
+        if start is not None and prev is not None:
+            ranges.append((str(start), str(prev)))
+        start = prev = d
+    if start is not None and prev is not None:
+        ranges.append((str(start), str(prev)))
+    return ranges
+
+
+def ranges_to_dates(ranges: Sequence[Sequence[str]]) -> Set[datetime.date]:
+    dates = set()
+    for start_str, end_str in ranges:
+        current = datetime.datetime.strptime(start_str, DATE_FMT).date()
+        end = datetime.datetime.strptime(end_str, DATE_FMT).date()
+        while current <= end:
+            dates.add(current)
+            current += datetime.timedelta(days=1)
+    return dates
+
+
+def window_key(start: datetime.datetime, end: datetime.datetime) -> str:
+    """
+    State key for a time window within a date (see
+    HarvestState.complete_window()).
+    """
+    return "{}/{}".format(start.isoformat(), end.isoformat())
+
+
+class KafkaStateStore:
+    """
+    Persists harvest state messages to a (single-partition) Kafka topic.
+
+    A single producer is kept for the life of the store. Commits are batched:
+    messages are produced as they come in, but only flushed (waiting for
+    broker acks) every commit_batch_size commits or commit_interval seconds,
+    and on flush(). Losing un-flushed state on a crash is safe; those dates
+    just get harvested again.
+
+    Every message carries a full snapshot of completed dates (as ranges) and
+    is produced with the same key, so the topic can be compacted, and loading
+    state only requires reading the most recent message.
+    """
+
+    MESSAGE_KEY: bytes = b"harvest-state"
+
+    def __init__(
+        self,
+        kafka_topic: str,
+        kafka_config: Dict[str, Any],
+        commit_batch_size: int = 10,
+        commit_interval: float = 60.0,
+    ) -> None:
+        self.kafka_topic = kafka_topic
+        self.kafka_config = kafka_config
+        self.commit_batch_size = commit_batch_size
+        self.commit_interval = commit_interval
+        self._producer: Optional[Producer] = None
+        self._unflushed = 0
+        self._last_flush = time.monotonic()
+
+    def _get_producer(self) -> Producer:
+        if self._producer is None:
+            producer_conf = self.kafka_config.copy()
+            producer_conf.update(
+                {
+                    "delivery.report.only.error": True,
+                    "default.topic.config": {
+                        "request.required.acks": -1,  # all brokers must confirm
+                    },
+                }
+            )
+            self._producer = Producer(producer_conf)
+        return self._producer
+
+    def commit(self, state_json: bytes) -> None:
+        def fail_fast(err: Any, _msg: Any) -> None:
+            if err:
+                raise KafkaException(err)
+
+        producer = self._get_producer()
+        producer.produce(
+            self.kafka_topic, state_json, key=self.MESSAGE_KEY, on_delivery=fail_fast
+        )
+        producer.poll(0)
+        self._unflushed += 1
+        if (
+            self._unflushed >= self.commit_batch_size
+            or time.monotonic() - self._last_flush >= self.commit_interval
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        if self._producer is not None and self._unflushed:
+            print(
+                "Committing {} status updates to Kafka: {}".format(
+                    self._unflushed, self.kafka_topic
+                ),
+                file=sys.stderr,
+            )
+            self._producer.flush()
+        self._unflushed = 0
+        self._last_flush = time.monotonic()
+
+    def load(self, state: "HarvestState") -> None:
+        """
+        Reads persisted state into 'state'.
+
+        If the most recent message in the topic is a full snapshot, that is
+        the only message read. Otherwise (older message formats), the full
+        topic history is replayed.
+
+        TODO: this method does not fail if client can't connect to host.
+        """
+        print("Fetching state from kafka topic: {}".format(self.kafka_topic), file=sys.stderr)
+        conf = self.kafka_config.copy()
+        conf.update(
+            {
+                "group.id": "dummy_init_group",  # should never be committed
+                "enable.auto.commit": False,
+                "auto.offset.reset": "earliest",
+                "session.timeout.ms": 10000,
+            }
+        )
+        consumer = Consumer(conf)
+
+        # this watermark fetch is mostly to ensure we are connected to broker and
+        # fail fast if not, but we also confirm that we read to end below.
+        hwm = consumer.get_watermark_offsets(
+            TopicPartition(self.kafka_topic, 0), timeout=5.0, cached=False
+        )
+        if not hwm:
+            raise Exception(
+                "Kafka consumer timeout, or topic {} doesn't exist".format(self.kafka_topic)
+            )
+        low, high = hwm
+        if high <= low:
+            consumer.close()
+            print("... no state messages", file=sys.stderr)
+            return
+
+        # first, try just the latest message
+        consumer.assign([TopicPartition(self.kafka_topic, 0, high - 1)])
+        msg = self._poll(consumer)
+        if msg and state.update(msg.value().decode("utf-8")):
+            consumer.close()
+            print("... loaded state snapshot at offset {}".format(high - 1), file=sys.stderr)
+            return
+
+        # otherwise replay everything
+        consumer.assign([TopicPartition(self.kafka_topic, 0, low)])
+        c = 0
+        last_offset = -1
+        while True:
+            msg = self._poll(consumer)
+            if not msg:
+                break
+            state.update(msg.value().decode("utf-8"))
+            last_offset = msg.offset()
+            c += 1
+        consumer.close()
+
+        # verify that we got at least to HWM
+        assert last_offset >= high - 1
+        print("... got {} state update messages, done".format(c), file=sys.stderr)
+
+    @staticmethod
+    def _poll(consumer: Consumer) -> Any:
+        msg = consumer.poll(timeout=2.0)
+        if msg and msg.error():
+            raise KafkaException(msg.error())
+        return msg
+
+
 class HarvestState:
     """
     First version of this works with full days (dates)
@@ -51,8 +261,24 @@ class HarvestState:
     - creates an to_process set
     - for each update, pops date from in_progress (if exits)
 
+    When harvesting several dates at once, dates being worked on are tracked
+    as "in flight" (see start_span()), so they aren't handed out twice. Only
+    completed dates are persisted as done: if the harvester restarts, any
+    dates which were in flight get harvested again from the start.
+
+    Persistence is handled by a KafkaStateStore, created by
+    initialize_from_kafka() (or on first complete() with a topic).
+
+    Pending dates are kept in a heap (alongside the to_process set), so
+    next_span() doesn't need to sort everything each call.
+
+    Harvesters which split a date into smaller time windows can record
+    progress within a date with complete_window(); those windows are part of
+    the state snapshot until the whole date is completed. Unlike the rest of
+    this class, complete() and complete_window() may be called from any
+    thread.
+
     NOTE: this thing is sorta over-engineered... but might grow in the future
-    NOTE: should this class manage the state topic as well? Hrm.
     """
 
     def __init__(
@@ -63,14 +289,25 @@ class HarvestState:
     ):
         self.to_process: Set[datetime.date] = set()
         self.completed: Set[datetime.date] = set()
+        self.in_flight: Set[datetime.date] = set()
+        # may contain stale entries (completed or in flight); see next_span()
+        self._pending_heap: List[datetime.date] = []
+        # partially harvested dates -> keys of completed time windows
+        self.completed_windows: Dict[datetime.date, Set[str]] = dict()
+        self.store: Optional[KafkaStateStore] = None
+        # held by every method which reads or changes the date sets, as
+        # harvest threads commit while the main thread picks new spans;
+        # re-entrant, as eg next_span() enqueues periods
+        self._lock = threading.RLock()
 
         if catchup_days or start_date or end_date:
             self.enqueue_period(start_date, end_date, catchup_days)
 
     def __str__(self) -> str:
-        return "<HarvestState to_process={}, completed={}>".format(
-            len(self.to_process), len(self.completed)
-        )
+        with self._lock:
+            return "<HarvestState to_process={}, completed={}, in_flight={}>".format(
+                len(self.to_process), len(self.completed), len(self.in_flight)
+            )
 
     def enqueue_period(
         self,
@@ -93,40 +330,110 @@ class HarvestState:
             # bootstrap to yesterday (don't want to start on today until it's over)
             end_date = today_utc - datetime.timedelta(days=1)
 
-        current = start_date
-        while current <= end_date:
-            if current not in self.completed:
-                self.to_process.add(current)
-            current += datetime.timedelta(days=1)
+        with self._lock:
+            current = start_date
+            while current <= end_date:
+                if current not in self.completed and current not in self.to_process:
+                    self.to_process.add(current)
+                    heapq.heappush(self._pending_heap, current)
+                current += datetime.timedelta(days=1)
 
     def next_span(self, continuous: bool = False) -> Optional[datetime.date]:
         """
         Gets next timespan (date) to be processed, or returns None if completed.
+        Timespans which are in flight are skipped.
 
         If 'continuous' arg is True, will try to enqueue recent possibly valid
         timespans; the idea is to call next_span() repeatedly, and it will return a
         new timespan when it becomes "available".
         """
-        if continuous:
-            # enqueue yesterday
-            self.enqueue_period(
-                start_date=datetime.datetime.utcnow().date() - datetime.timedelta(days=1)
-            )
-        if not self.to_process:
-            return None
-        return sorted(list(self.to_process))[0]
+        with self._lock:
+            if continuous:
+                # enqueue yesterday
+                self.enqueue_period(
+                    start_date=datetime.datetime.utcnow().date() - datetime.timedelta(days=1)
+                )
+            heap = self._pending_heap
+            # in-flight dates are dropped from the heap here, and pushed back if
+            # aborted
+            while heap and (heap[0] not in self.to_process or heap[0] in self.in_flight):
+                heapq.heappop(heap)
+            if not heap:
+                return None
+            return heap[0]
+
+    def start_span(self, date: datetime.date) -> None:
+        """
+        Marks a timespan as being worked on, so next_span() moves on to the
+        following one.
+        """
+        with self._lock:
+            self.in_flight.add(date)
 
-    def update(self, state_json: str) -> None:
+    def abort_span(self, date: datetime.date) -> None:
+        """
+        Returns an in-flight timespan (which failed) to the pending set.
+        """
+        with self._lock:
+            if date in self.in_flight:
+                self.in_flight.discard(date)
+                heapq.heappush(self._pending_heap, date)
+
+    def update(self, state_json: str) -> bool:
         """
         Merges a state JSON object into the current state.
 
         This is expected to be used to "catch-up" on previously serialized
         state stored on disk or in Kafka.
+
+        Returns True if the object was a full snapshot of completed dates.
         """
         state = json.loads(state_json)
-        if "completed-date" in state:
-            date = datetime.datetime.strptime(state["completed-date"], DATE_FMT).date()
-            self.complete(date)
+        with self._lock:
+            if "completed-date" in state:
+                date = datetime.datetime.strptime(state["completed-date"], DATE_FMT).date()
+                self._mark_completed(date)
+            if "completed-ranges" in state:
+                for date in ranges_to_dates(state["completed-ranges"]):
+                    self._mark_completed(date)
+                for date_str, windows in state.get("completed-windows", {}).items():
+                    date = datetime.datetime.strptime(date_str, DATE_FMT).date()
+                    if date not in self.completed:
+                        self.completed_windows.setdefault(date, set()).update(windows)
+                return True
+            return False
+
+    def _mark_completed(self, date: datetime.date) -> None:
+        self.to_process.discard(date)
+        self.in_flight.discard(date)
+        self.completed.add(date)
+        self.completed_windows.pop(date, None)
+
+    def _state_json(self, completed_date: Optional[datetime.date] = None) -> bytes:
+        state: Dict[str, Any] = {
+            "in-progress-dates": [str(d) for d in self.to_process],
+            "in-flight-dates": [str(d) for d in self.in_flight],
+        }
+        if completed_date:
+            state["completed-date"] = str(completed_date)
+        state["completed-ranges"] = dates_to_ranges(self.completed)
+        if self.completed_windows:
+            state["completed-windows"] = {
+                str(d): sorted(w) for d, w in self.completed_windows.items()
+            }
+        return json.dumps(state).encode("utf-8")
+
+    def _commit(
+        self,
+        state_json: bytes,
+        kafka_topic: Optional[str] = None,
+        kafka_config: Optional[Dict] = None,
+    ) -> None:
+        if kafka_topic and not self.store:
+            assert kafka_config
+            self.store = KafkaStateStore(kafka_topic, kafka_config)
+        if self.store:
+            self.store.commit(state_json)
 
     def complete(
         self,
@@ -138,92 +445,111 @@ class HarvestState:
         Records that a date has been processed successfully.
 
         Updates internal state and returns a JSON representation to be
-        serialized. Will publish to a kafka topic if passed as an argument.
+        serialized. Will publish to a kafka topic if passed as an argument (or
+        if initialize_from_kafka() was called); the same producer is re-used
+        for all commits, and commits are batched (see KafkaStateStore). Call
+        flush() to make sure everything has been written.
+        """
+        with self._lock:
+            self._mark_completed(date)
+            state_json = self._state_json(completed_date=date)
+            self._commit(state_json, kafka_topic, kafka_config)
+        return state_json
 
-        kafka_topic should be a string. A producer will be created and destroyed.
+    def complete_window(
+        self,
+        date: datetime.date,
+        window: str,
+        kafka_topic: Optional[str] = None,
+        kafka_config: Optional[Dict] = None,
+    ) -> bytes:
         """
-        try:
-            self.to_process.remove(date)
-        except KeyError:
-            pass
-        self.completed.add(date)
-        state_json = json.dumps(
-            {
-                "in-progress-dates": [str(d) for d in self.to_process],
-                "completed-date": str(date),
-            }
-        ).encode("utf-8")
-        if kafka_topic:
-            assert kafka_config
+        Records that a time window (identified by an opaque string key) within
+        a date has been processed successfully. Publishes like complete().
+        """
+        with self._lock:
+            if date not in self.completed:
+                self.completed_windows.setdefault(date, set()).add(window)
+            state_json = self._state_json()
+            self._commit(state_json, kafka_topic, kafka_config)
+        return state_json
 
-            def fail_fast(err: Any, _msg: Any) -> None:
-                if err:
-                    raise KafkaException(err)
+    def window_completed(self, date: datetime.date, window: str) -> bool:
+        with self._lock:
+            return window in self.completed_windows.get(date, ())
 
-            print("Committing status to Kafka: {}".format(kafka_topic), file=sys.stderr)
-            producer_conf = kafka_config.copy()
-            producer_conf.update(
-                {
-                    "delivery.report.only.error": True,
-                    "default.topic.config": {
-                        "request.required.acks": -1,  # all brokers must confirm
-                    },
-                }
-            )
-            producer = Producer(producer_conf)
-            producer.produce(kafka_topic, state_json, on_delivery=fail_fast)
-            producer.flush()
-        return state_json
+    def flush(self) -> None:
+        """
+        Waits for any batched state commits to be written to Kafka.
+        """
+        with self._lock:
+            if self.store:
+                self.store.flush()
 
     def initialize_from_kafka(self, kafka_topic: str, kafka_config: Dict[str, Any]) -> None:
         """
         kafka_topic should have type str
 
-        TODO: this method does not fail if client can't connect to host.
+        Loads state from the topic, and keeps the store for future commits.
         """
         if not kafka_topic:
             return
 
-        print("Fetching state from kafka topic: {}".format(kafka_topic), file=sys.stderr)
+        self.store = KafkaStateStore(kafka_topic, kafka_config)
+        self.store.load(self)
 
-        def fail_fast(err: Any, _msg: Any) -> None:
-            if err:
-                raise KafkaException(err)
 
-        conf = kafka_config.copy()
-        conf.update(
-            {
-                "group.id": "dummy_init_group",  # should never be committed
-                "enable.auto.commit": False,
-                "auto.offset.reset": "earliest",
-                "session.timeout.ms": 10000,
-            }
-        )
-        consumer = Consumer(conf)
+def harvest_spans(
+    state: HarvestState,
+    fetch_span: Callable[[datetime.date], Any],
+    commit_span: Callable[[datetime.date], Any],
+    concurrency: int = 1,
+    continuous: bool = False,
+) -> int:
+    """
+    Harvests pending timespans from 'state' until there are none left, running
+    fetch_span() for up to 'concurrency' timespans at once (in threads).
 
-        # this watermark fetch is mostly to ensure we are connected to broker and
-        # fail fast if not, but we also confirm that we read to end below.
-        hwm = consumer.get_watermark_offsets(
-            TopicPartition(kafka_topic, 0), timeout=5.0, cached=False
-        )
-        if not hwm:
-            raise Exception(
-                "Kafka consumer timeout, or topic {} doesn't exist".format(kafka_topic)
-            )
+    commit_span() is called (typically HarvestState.complete() with a Kafka
+    topic) from the calling thread only, one at a time, as each timespan
+    finishes; timespans may finish out of order.
 
-        consumer.assign([TopicPartition(kafka_topic, 0, 0)])
-        c = 0
+    If a fetch fails, no new timespans are started, the others in flight are
+    allowed to finish (and are committed), and then the error is re-raised.
+
+    Batched state commits are flushed before returning.
+
+    Returns the number of timespans completed.
+    """
+    count = 0
+    error: Optional[BaseException] = None
+    inflight: Dict[Future, datetime.date] = dict()
+    with ThreadPoolExecutor(
+        max_workers=max(1, concurrency), thread_name_prefix="fatcat-harvest"
+    ) as executor:
         while True:
-            msg = consumer.poll(timeout=2.0)
-            if not msg:
+            while error is None and len(inflight) < max(1, concurrency):
+                current = state.next_span(continuous)
+                if not current:
+                    break
+                print("Fetching updates for {} (UTC)".format(current), file=sys.stderr)
+                state.start_span(current)
+                inflight[executor.submit(fetch_span, current)] = current
+            if not inflight:
                 break
-            if msg.error():
-                raise KafkaException(msg.error())
-            # sys.stdout.write('.')
-            self.update(msg.value().decode("utf-8"))
-            c += 1
-        consumer.close()
-
-        # verify that we got at least to HWM
-        assert c >= hwm[1]
-        print("... got {} state update messages, done".format(c), file=sys.stderr)
+            done, _ = wait(inflight.keys(), return_when=FIRST_COMPLETED)
+            for future in sorted(done, key=lambda f: inflight[f]):
+                span = inflight.pop(future)
+                exc = future.exception()
+                if exc is not None:
+                    state.abort_span(span)
+                    print("Failed fetching {}: {}".format(span, exc), file=sys.stderr)
+                    error = error or exc
+                    continue
+                commit_span(span)
+                count += 1
+    # make sure batched state commits are written before sleeping or exiting
+    state.flush()
+    if error is not None:
+        raise error
+    return count
@@ -4,9 +4,11 @@ import time
 from typing import Any, Optional
 
 import sickle
-from confluent_kafka import KafkaException, Producer
+from confluent_kafka import KafkaException
 
-from .harvest_common import HarvestState
+from fatcat_tools.kafka import kafka_producer
+
+from .harvest_common import HarvestState, RateLimiter, harvest_spans
 
 
 class HarvestOaiPmhWorker:
@@ -33,6 +35,8 @@ class HarvestOaiPmhWorker:
         state_topic: str,
         start_date: Optional[datetime.date] = None,
         end_date: Optional[datetime.date] = None,
+        concurrency: int = 1,
+        rate_limit: Optional[float] = None,
     ):
 
         self.produce_topic = produce_topic
@@ -43,6 +47,10 @@ class HarvestOaiPmhWorker:
         }
 
         self.loop_sleep = 60 * 60  # how long to wait, in seconds, between date checks
+        self.concurrency = concurrency
+        # OAI-PMH paging happens inside sickle, so this limits dates started
+        # per second, not requests
+        self.rate_limiter = RateLimiter(rate_limit)
 
         self.endpoint_url = None  # needs override
         self.metadata_prefix = None  # needs override
@@ -50,6 +58,8 @@ class HarvestOaiPmhWorker:
         self.state = HarvestState(start_date, end_date)
         self.state.initialize_from_kafka(self.state_topic, self.kafka_config)
         print(self.state, file=sys.stderr)
+        # shared by all dates (and threads)
+        self.producer = kafka_producer(self.kafka_config)
 
     def fetch_date(self, date: datetime.date) -> None:
         def fail_fast(err: Any, _msg: Any) -> None:
@@ -59,17 +69,7 @@ class HarvestOaiPmhWorker:
                 # TODO: should it be sys.exit(-1)?
                 raise KafkaException(err)
 
-        producer_conf = self.kafka_config.copy()
-        producer_conf.update(
-            {
-                "delivery.report.only.error": True,
-                "default.topic.config": {
-                    "request.required.acks": -1,  # all brokers must confirm
-                },
-            }
-        )
-        producer = Producer(producer_conf)
-
+        self.rate_limiter.wait()
         api = sickle.Sickle(self.endpoint_url, max_retries=5, retry_status_codes=[503])
         date_str = date.isoformat()
         # this dict kwargs hack is to work around 'from' as a reserved python keyword
@@ -94,25 +94,28 @@ class HarvestOaiPmhWorker:
             count += 1
             if count % 50 == 0:
                 print("... up to {}".format(count), file=sys.stderr)
-            producer.produce(
+            self.producer.produce(
                 self.produce_topic,
                 item.raw.encode("utf-8"),
                 key=item.header.identifier.encode("utf-8"),
                 on_delivery=fail_fast,
             )
-        producer.flush()
+        # all records for the date must be delivered before it is committed
+        self.producer.flush()
+
+    def commit_date(self, date: datetime.date) -> None:
+        self.state.complete(date, kafka_topic=self.state_topic, kafka_config=self.kafka_config)
 
     def run(self, continuous: bool = False) -> None:
 
         while True:
-            current = self.state.next_span(continuous)
-            if current:
-                print("Fetching DOIs updated on {} (UTC)".format(current), file=sys.stderr)
-                self.fetch_date(current)
-                self.state.complete(
-                    current, kafka_topic=self.state_topic, kafka_config=self.kafka_config
-                )
-                continue
+            harvest_spans(
+                self.state,
+                self.fetch_date,
+                self.commit_date,
+                concurrency=self.concurrency,
+                continuous=continuous,
+            )
 
             if continuous:
                 print("Sleeping {} seconds...".format(self.loop_sleep), file=sys.stderr)
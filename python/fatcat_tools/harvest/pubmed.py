@@ -12,25 +12,27 @@ import collections
 import datetime
 import ftplib
 import gzip
+import http.client
 import io
-import os
 import re
-import shutil
 import socket
 import subprocess
 import sys
 import tempfile
 import time
+import urllib.error
+import urllib.request
 import xml.etree.ElementTree as ET
 import zlib
-from typing import Any, Dict, Generator, Optional
+from typing import IO, Any, Dict, Generator, Optional, Union
 from urllib.parse import urlparse
 
 import dateparser
-from bs4 import BeautifulSoup
-from confluent_kafka import KafkaException, Producer
+from confluent_kafka import KafkaException
 
-from .harvest_common import HarvestState
+from fatcat_tools.kafka import TrackedProducer, kafka_producer
+
+from .harvest_common import HarvestState, RateLimiter, harvest_spans
 
 
 class PubmedFTPWorker:
@@ -70,22 +72,37 @@ class PubmedFTPWorker:
         state_topic: str,
         start_date: Optional[datetime.date] = None,
         end_date: Optional[datetime.date] = None,
+        download_base_url: str = "http://159.69.240.245:15201",
+        concurrency: int = 1,
+        rate_limit: Optional[float] = None,
     ):
         self.name = "Pubmed"
         self.host = "ftp.ncbi.nlm.nih.gov"
+        # update files are fetched from here (any of ftp://, http(s)://, or
+        # file:// will do), with the same paths as on the FTP server
+        # TODO: proxy obsolete, when networking issue is resolved
+        self.download_base_url = download_base_url.rstrip("/")
+        self.max_retries = 10
+        self.retry_delay = 10
         self.produce_topic = produce_topic
         self.state_topic = state_topic
         self.kafka_config = {
             "bootstrap.servers": kafka_hosts,
             "message.max.bytes": 20000000,  # ~20 MBytes; broker is ~50 MBytes
         }
+        # articles are produced while the update file is still downloading, so
+        # bound the local producer queue (produce() backs off when it is full)
+        self.producer_queue_kbytes = 256 * 1024
         self.loop_sleep = 60 * 60  # how long to wait, in seconds, between date checks
+        self.concurrency = concurrency
+        # limits update file downloads started per second
+        self.rate_limiter = RateLimiter(rate_limit)
         self.state = HarvestState(start_date, end_date)
         self.state.initialize_from_kafka(self.state_topic, self.kafka_config)
         self.producer = self._kafka_producer()
         self.date_file_map: Optional[Dict[str, Any]] = None
 
-    def _kafka_producer(self) -> Producer:
+    def _kafka_producer(self) -> TrackedProducer:
         def fail_fast(err: Any, _msg: None) -> None:
             if err is not None:
                 print("Kafka producer delivery error: {}".format(err), file=sys.stderr)
@@ -96,15 +113,8 @@ class PubmedFTPWorker:
         self._kafka_fail_fast = fail_fast
 
         producer_conf = self.kafka_config.copy()
-        producer_conf.update(
-            {
-                "delivery.report.only.error": True,
-                "default.topic.config": {
-                    "request.required.acks": -1,  # all brokers must confirm
-                },
-            }
-        )
-        return Producer(producer_conf)
+        producer_conf["queue.buffering.max.kbytes"] = self.producer_queue_kbytes
+        return kafka_producer(producer_conf)
 
     def fetch_date(self, date: datetime.date) -> bool:
         """
@@ -130,47 +140,73 @@ class PubmedFTPWorker:
 
         count = 0
         for path in paths:
-            # Fetch and decompress file.
-            url = "ftp://{}{}".format(self.host, path)
-            filename = ftpretr(
-                url, proxy_hostport="159.69.240.245:15201"
-            )  # TODO: proxy obsolete, when networking issue is resolved
-            with tempfile.NamedTemporaryFile(prefix="fatcat-ftp-tmp-", delete=False) as decomp:
+            url = "{}{}".format(self.download_base_url, path)
+            for i in range(self.max_retries):
                 try:
-                    gzf = gzip.open(filename)
-                    shutil.copyfileobj(gzf, decomp)
-                except zlib.error as exc:
+                    count += self.fetch_file(url)
+                except (zlib.error, gzip.BadGzipFile) as exc:
                     print(
                         "[skip] retrieving {} failed with {} (maybe empty, missing or broken gzip)".format(
                             url, exc
                         ),
                         file=sys.stderr,
                     )
+                except (EOFError, OSError, ftplib.Error, http.client.IncompleteRead) as exc:
+                    if isinstance(exc, urllib.error.HTTPError) and exc.code == 404:
+                        print("[skip] {} not found".format(url), file=sys.stderr)
+                        break
+                    # articles produced before the failure get produced again
+                    # on retry; importers handle duplicates
+                    print(
+                        "fetch {} failed with {} ({}) ({} retries left)".format(
+                            url, exc, type(exc), self.max_retries - (i + 1)
+                        ),
+                        file=sys.stderr,
+                    )
+                    if i + 1 == self.max_retries:
+                        raise
+                    time.sleep(self.retry_delay)
                     continue
+                break
+            self.producer.flush()
+
+        print("produced {} articles for {}".format(count, date_str), file=sys.stderr)
+        return True
+
+    def fetch_file(self, url: str) -> int:
+        """
+        Streams a single gzipped update file, decompressing on the fly, and
+        produces one Kafka message per article (keyed by PMID) as it goes.
+        Nothing is written to disk. Returns the number of articles.
 
-            # Here, blob is the unparsed XML; we peek into it to use PMID as
-            # message key. We need streaming, since some updates would consume
-            # GBs otherwise.
+        If an article does not contain a PMID, an exception is raised.
+        """
+        self.rate_limiter.wait()
+        print("streaming {} ...".format(url), file=sys.stderr)
+        count = 0
+        with open_url_stream(url) as resp, gzip.GzipFile(fileobj=resp) as gzf:
             # WARNING: Parsing foreign XML exposes us at some
             # https://docs.python.org/3/library/xml.html#xml-vulnerabilities
             # here.
-            for blob in xmlstream(decomp.name, "PubmedArticle", encoding="utf-8"):
-                soup = BeautifulSoup(blob, "xml")
-                pmid = soup.find("PMID")
+            for elem in xmlstream_elements(gzf, "PubmedArticle"):
+                pmid = elem.find(".//PMID")
                 if pmid is None:
                     raise ValueError("no PMID found, please adjust identifier extraction")
+                blob = ET.tostring(elem, encoding="utf-8")
                 count += 1
-                if count % 50 == 0:
+                if count % 1000 == 0:
                     print("... up to {}".format(count), file=sys.stderr)
-                self.producer.produce(
-                    self.produce_topic, blob, key=pmid.text, on_delivery=self._kafka_fail_fast
-                )
+                self._produce(blob, pmid.text)
+        return count
 
-            self.producer.flush()
-            os.remove(filename)
-            os.remove(decomp.name)
+    def _produce(self, blob: bytes, key: str) -> None:
+        # the producer polls, and waits when its local queue is full
+        self.producer.produce(
+            self.produce_topic, blob, key=key, on_delivery=self._kafka_fail_fast
+        )
 
-        return True
+    def commit_date(self, date: datetime.date) -> None:
+        self.state.complete(date, kafka_topic=self.state_topic, kafka_config=self.kafka_config)
 
     def run(self, continuous: bool = False) -> None:
         while True:
@@ -190,14 +226,13 @@ class PubmedFTPWorker:
                         "map from dates to files should not be empty, maybe the HTML changed?"
                     )
 
-            current = self.state.next_span(continuous)
-            if current:
-                print("Fetching citations updated on {} (UTC)".format(current), file=sys.stderr)
-                self.fetch_date(current)
-                self.state.complete(
-                    current, kafka_topic=self.state_topic, kafka_config=self.kafka_config
-                )
-                continue
+            harvest_spans(
+                self.state,
+                self.fetch_date,
+                self.commit_date,
+                concurrency=self.concurrency,
+                continuous=continuous,
+            )
 
             if continuous:
                 print("Sleeping {} seconds...".format(self.loop_sleep))
@@ -279,6 +314,14 @@ def generate_date_file_map(host: str = "ftp.ncbi.nlm.nih.gov") -> Dict[str, Any]
     return mapping
 
 
+def open_url_stream(url: str, timeout: float = 120.0) -> Any:
+    """
+    Opens a ftp://, http(s)://, or file:// URL for streaming binary reads,
+    returning a file-like object (to be used as a context manager).
+    """
+    return urllib.request.urlopen(url, timeout=timeout)
+
+
 def ftpretr(
     url: str, max_retries: int = 10, retry_delay: int = 1, proxy_hostport: Optional[str] = None
 ) -> str:
@@ -362,17 +405,15 @@ def ftpretr_via_http_proxy(
     assert False, "Unreachable code branch"
 
 
-def xmlstream(filename: str, tag: str, encoding: str = "utf-8") -> Generator[Any, Any, Any]:
+def xmlstream_elements(source: Union[str, IO[bytes]], tag: str) -> Generator[Any, Any, Any]:
     """
-    Note: This might move into a generic place in the future.
+    Like xmlstream(), but yields the parsed elements (ElementTree) instead of
+    serialized strings, so callers can pull out fields without re-parsing.
+    Source may be a path or a binary file-like object (eg, a stream being
+    decompressed on the fly).
 
-    Given a path to an XML file and a tag name (without namespace), stream
-    through the XML and yield elements denoted by tag as string.
-
-    for snippet in xmlstream("sample.xml", "sometag"):
-        print(len(snippet))
-
-    Known vulnerabilities: https://docs.python.org/3/library/xml.html#xml-vulnerabilities
+    Elements are cleared once the caller moves on to the next one, so don't
+    hold on to them.
     """
 
     def strip_ns(tag: str) -> str:
@@ -383,7 +424,7 @@ def xmlstream(filename: str, tag: str, encoding: str = "utf-8") -> Generator[Any
     # https://stackoverflow.com/a/13261805, http://effbot.org/elementtree/iterparse.htm
     context = iter(
         ET.iterparse(
-            filename,
+            source,
             events=(
                 "start",
                 "end",
@@ -399,5 +440,24 @@ def xmlstream(filename: str, tag: str, encoding: str = "utf-8") -> Generator[Any
         if not strip_ns(elem.tag) == tag or event == "start":
             continue
 
-        yield ET.tostring(elem, encoding=encoding)
+        yield elem
         root.clear()
+
+
+def xmlstream(
+    filename: Union[str, IO[bytes]], tag: str, encoding: str = "utf-8"
+) -> Generator[Any, Any, Any]:
+    """
+    Note: This might move into a generic place in the future.
+
+    Given a path to an XML file (or binary file-like object) and a tag name
+    (without namespace), stream through the XML and yield elements denoted by
+    tag as string.
+
+    for snippet in xmlstream("sample.xml", "sometag"):
+        print(len(snippet))
+
+    Known vulnerabilities: https://docs.python.org/3/library/xml.html#xml-vulnerabilities
+    """
+    for elem in xmlstream_elements(filename, tag):
+        yield ET.tostring(elem, encoding=encoding)
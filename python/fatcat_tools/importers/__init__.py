@@ -24,6 +24,7 @@ from .common import (
     JsonLinePusher,
     KafkaBs4XmlPusher,
     KafkaJsonPusher,
+    KafkaPusher,
     LinePusher,
     SqlitePusher,
 )
@@ -35,6 +36,11 @@ from .doaj_article import DoajArticleImporter
 from .file_meta import FileMetaImporter
 from .fileset_generic import FilesetImporter
 from .grobid_metadata import GrobidMetadataImporter
+from .ident_snapshot import (
+    IdentSnapshot,
+    build_ident_snapshot_from_elasticsearch,
+    build_ident_snapshot_from_json,
+)
 from .ingest import (
     IngestFileResultImporter,
     IngestFilesetFileResultImporter,
@@ -47,6 +53,7 @@ from .ingest import (
 from .jalc import JalcImporter
 from .journal_metadata import JournalMetadataImporter
 from .jstor import JstorImporter
+from .known_dois import BloomFilter, KnownDois, build_known_dois_from_json
 from .matched import MatchedImporter
 from .orcid import OrcidImporter
 from .pubmed import PubmedImporter
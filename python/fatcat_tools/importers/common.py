@@ -1,21 +1,31 @@
+import copy
 import csv
 import datetime
 import json
+import multiprocessing
 import re
+import signal
 import sqlite3
 import subprocess
 import sys
+import threading
+import time
 import xml.etree.ElementTree as ET
 from collections import Counter
-from typing import Any, Dict, List, Optional, Sequence, Tuple
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
 
 import elasticsearch
 import fatcat_openapi_client
-import fuzzycat.common
-import fuzzycat.verify
 import lxml
 from bs4 import BeautifulSoup
-from confluent_kafka import Consumer, KafkaException
+from confluent_kafka import Consumer, KafkaError, KafkaException
 from fatcat_openapi_client import (
     ApiClient,
     ContainerEntity,
@@ -27,10 +37,31 @@ from fatcat_openapi_client import (
 from fatcat_openapi_client.rest import ApiException
 from fuzzycat.matching import match_release_fuzzy
 
+from fatcat_tools.batch_sizing import (
+    AdaptiveBatchSizer,
+    estimate_entity_bytes,
+    make_batch_sizer,
+)
 from fatcat_tools.biblio_lookup_tables import DOMAIN_REL_MAP
+from fatcat_tools.cache import LRUCache
+from fatcat_tools.kafka import process_partitions
 from fatcat_tools.normal import clean_doi
 from fatcat_tools.transforms import entity_to_dict
 
+from .fuzzy_match import (
+    FUZZY_CACHE_SIZE,
+    FUZZY_EXT_ID_TYPES,
+    FUZZY_MATCH_SIZE,
+    FuzzyCandidate,
+    msearch_release_idents,
+    normalize_title_key,
+    pick_closest,
+    verify_candidates,
+    verify_pairs,
+)
+from .ident_snapshot import IdentSnapshot
+from .known_dois import KnownDois
+
 DATE_FMT: str = "%Y-%m-%d"
 SANE_MAX_RELEASES: int = 200
 SANE_MAX_URLS: int = 100
@@ -90,8 +121,50 @@ class EntityImporter:
 
         submit_mode: instead of accepting editgroups, only submits them.
             implementors must write insert_batch appropriately
+        ident_snapshot: optional IdentSnapshot, consulted by the lookup_*()
+            helpers before falling back to the API
+        inflight_batches: if non-zero, insert_batch() and editgroup
+            accept/submit calls are made from a pool of background threads,
+            with up to this many calls in flight at once, while records
+            continue to be parsed. push_record() blocks when the limit is
+            reached, and finish() waits for all calls to complete. Errors
+            from background calls are re-raised from push_record()/finish().
+            Note that insert_batch() implementations run on a worker thread
+            in this mode; counts they make are kept separately and merged
+            into self.counts on the main thread once the call completes.
+            While a batch is in flight, lookup_existing() for any of its
+            entities' precheck_keys() first waits for in-flight calls to
+            complete; importers which look up existing entities some other
+            way need de-duplicated input in this mode.
+        adaptive_batch: instead of a fixed edit_batch_size for insert_batch(),
+            pick batch sizes based on observed API latency (aiming for
+            batch_target_latency seconds per call, between min_batch_size and
+            max_batch_size entities), and cut batches early if the (estimated)
+            serialized entities exceed batch_max_bytes. Sizes and latencies are reported
+            in counts.
+        precheck_batch_size: if non-zero, parsed entities are buffered in
+            groups of this size, and existence lookups for their primary
+            identifiers (see precheck_keys()) are made concurrently (with
+            precheck_workers threads) before try_update() is called on each
+            entity, in order. try_update() implementations pick up the results
+            by calling lookup_existing(). Fuzzy matches for entities where
+            precheck_fuzzy() is true are also made for the whole group at once.
+        known_dois: optional KnownDois filter; importers which never update
+            existing releases can check is_known_doi() in want() to skip
+            records without parsing or API lookups.
+        es_client: elasticsearch client used for fuzzy matching (default:
+            the public search.fatcat.wiki endpoint)
+        fuzzy_verify_workers: if non-zero, fuzzy match candidates are
+            verified in a pool of this many worker processes
+        fuzzy_cache_ttl: if non-zero, fuzzy match candidates are cached by
+            normalized title for this many seconds, and fetched with batched
+            search queries (see match_existing_releases_fuzzy())
     """
 
+    # (importer, counts) for the background submit call running on this
+    # thread, if any; see counts and _counted_call()
+    _submit_counts = threading.local()
+
     def __init__(self, api: ApiClient, **kwargs) -> None:
 
         eg_extra = kwargs.get("editgroup_extra", dict())
@@ -106,6 +179,7 @@ class EntityImporter:
         self.bezerk_mode: bool = kwargs.get("bezerk_mode", False)
         self.submit_mode: bool = kwargs.get("submit_mode", False)
         self.edit_batch_size: int = kwargs.get("edit_batch_size", 100)
+        self.inflight_batches: int = kwargs.get("inflight_batches", 0) or 0
         self.editgroup_description: Optional[str] = kwargs.get("editgroup_description")
         self.editgroup_extra: Optional[Any] = eg_extra
 
@@ -114,12 +188,41 @@ class EntityImporter:
             self.es_client = elasticsearch.Elasticsearch(
                 "https://search.fatcat.wiki", timeout=120
             )
+        # fuzzy match candidates by normalized title. Entries should be
+        # short-lived: a release inserted by the importer only shows up in
+        # search results once it has been indexed
+        self._fuzzy_cache: Optional[LRUCache] = None
+        if kwargs.get("fuzzy_cache_ttl"):
+            self._fuzzy_cache = LRUCache(max_size=FUZZY_CACHE_SIZE, ttl=kwargs["fuzzy_cache_ttl"])
+        self.fuzzy_verify_workers: int = kwargs.get("fuzzy_verify_workers", 0) or 0
+        # started on first use (see _get_fuzzy_verify_pool()), and shut down
+        # by finish()
+        self._fuzzy_verify_pool: Optional[ProcessPoolExecutor] = None
 
         self._issnl_id_map: Dict[str, Any] = dict()
         self._orcid_id_map: Dict[str, Any] = dict()
         self._orcid_regex = re.compile(r"^\d{4}-\d{4}-\d{4}-\d{3}[\dX]$")
         self._doi_id_map: Dict[str, Any] = dict()
         self._pmid_id_map: Dict[str, Any] = dict()
+        self.ident_snapshot: Optional[IdentSnapshot] = kwargs.get("ident_snapshot")
+        self.known_dois: Optional[KnownDois] = kwargs.get("known_dois")
+        self._batch_sizer: Optional[AdaptiveBatchSizer] = make_batch_sizer(
+            self.edit_batch_size, kwargs
+        )
+
+        self.precheck_batch_size: int = kwargs.get("precheck_batch_size", 0) or 0
+        self._precheck_pool: Optional[ThreadPoolExecutor] = None
+        if self.precheck_batch_size > 0:
+            self._precheck_pool = ThreadPoolExecutor(
+                max_workers=kwargs.get("precheck_workers") or 8,
+                thread_name_prefix="fatcat-import-precheck",
+            )
+
+        self._submit_pool: Optional[ThreadPoolExecutor] = None
+        if self.inflight_batches > 0:
+            self._submit_pool = ThreadPoolExecutor(
+                max_workers=self.inflight_batches, thread_name_prefix="fatcat-import-submit"
+            )
 
         self.reset()
 
@@ -128,12 +231,65 @@ class EntityImporter:
         self._edit_count: int = 0
         self._editgroup_id: Optional[str] = None
         self._entity_queue: List[Any] = []
+        self._entity_queue_bytes: int = 0
         self._edits_inflight: List[Any] = []
+        self._submits_inflight: List[Future] = []
+        # precheck_keys() of entities in in-flight insert batches
+        self._submit_keys: Dict[Future, List[Tuple[str, str, str]]] = dict()
+        self._keys_inflight: Counter = Counter()
+        self._precheck_queue: List[Any] = []
+        self._precheck_results: Dict[Tuple[str, str, str], Any] = dict()
+        self._fuzzy_results: Dict[int, Optional[Tuple[str, str, ReleaseEntity]]] = dict()
+
+    @property
+    def counts(self) -> Counter:
+        # background submit calls (eg, insert_batch()) count into their own
+        # Counter, which the main thread merges when reaping the call
+        current = getattr(self._submit_counts, "current", None)
+        if current is not None and current[0] is self:
+            return current[1]
+        return self._counts
+
+    @counts.setter
+    def counts(self, counts: Counter) -> None:
+        self._counts = counts
+
+    def clone(self) -> "EntityImporter":
+        """
+        Returns a copy of this importer, for pushing records from another
+        thread. The copy has its own counts, editgroup and batch queues (see
+        reset()), identifier lookup caches (lookup_issnl(), etc), and fuzzy
+        verify pool.
+
+        Everything else is shared with the original, and is either only read
+        after construction (configuration, and tables like the ISSN-L map,
+        which can be large) or thread-safe:
+
+        - API and elasticsearch clients (urllib3 connection pools)
+        - precheck and submit thread pools
+        - adaptive batch sizer, fuzzy candidate cache, known DOIs, and
+          identifier snapshot, each of which has its own lock
+
+        Subclasses with other mutable state should override this.
+        """
+        importer = copy.copy(self)
+        # not shared, as eg lookup_issnl() caching a miss could overwrite a
+        # container created by another clone
+        importer._issnl_id_map = dict(self._issnl_id_map)
+        importer._orcid_id_map = dict(self._orcid_id_map)
+        importer._doi_id_map = dict(self._doi_id_map)
+        importer._pmid_id_map = dict(self._pmid_id_map)
+        # finish() shuts down the verify pool, so each copy starts its own
+        importer._fuzzy_verify_pool = None
+        importer.reset()
+        return importer
 
     def push_record(self, raw_record: Any) -> None:
         """
         Returns nothing.
         """
+        if self._submits_inflight:
+            self._reap_submits()
         self.counts["total"] += 1
         if (not raw_record) or (not self.want(raw_record)):
             self.counts["skip"] += 1
@@ -145,10 +301,50 @@ class EntityImporter:
         if self.bezerk_mode:
             self.push_entity(entity)
             return
+        if self._precheck_pool:
+            self._precheck_queue.append(entity)
+            if len(self._precheck_queue) >= self.precheck_batch_size:
+                self._flush_precheck_queue()
+            return
         if self.try_update(entity):
             self.push_entity(entity)
         return
 
+    def _flush_precheck_queue(self) -> None:
+        assert self._precheck_pool
+        queue = self._precheck_queue
+        self._precheck_queue = []
+        key_counts: Counter = Counter()
+        for entity in queue:
+            for key in self.precheck_keys(entity):
+                key_counts[key] += 1
+        # identifiers which show up more than once in the same batch are left
+        # for try_update() to look up at the usual time, so that they behave
+        # the same as without pre-checking
+        keys = [k for k, c in key_counts.items() if c == 1]
+        if keys:
+            results = self._precheck_pool.map(lambda k: self._lookup_entity(*k), keys)
+            self._precheck_results = dict(zip(keys, results))
+        try:
+            if self.do_fuzzy_match:
+                fuzzy = [
+                    entity
+                    for entity in queue
+                    if self.precheck_fuzzy(entity)
+                    and not any(
+                        self._precheck_results.get(k) for k in self.precheck_keys(entity)
+                    )
+                ]
+                if fuzzy:
+                    results = self.match_existing_releases_fuzzy(fuzzy)
+                    self._fuzzy_results = {id(e): r for e, r in zip(fuzzy, results)}
+            for entity in queue:
+                if self.try_update(entity):
+                    self.push_entity(entity)
+        finally:
+            self._precheck_results = dict()
+            self._fuzzy_results = dict()
+
     def parse_record(self, raw_record: Any) -> Optional[Any]:
         """
         Returns an entity class type, or None if we should skip this one.
@@ -169,31 +365,113 @@ class EntityImporter:
         no new entities fed in for more than some time period, to ensure that
         entities actually get created within a reasonable time frame.
         """
+        if self._precheck_queue:
+            self._flush_precheck_queue()
+
         if self._edit_count > 0:
-            if self.submit_mode:
-                self.api.submit_editgroup(self._editgroup_id)
-            else:
-                self.api.accept_editgroup(self._editgroup_id)
-            self._editgroup_id = None
-            self._edit_count = 0
-            self._edits_inflight = []
+            self._close_editgroup()
 
         if self._entity_queue:
-            self.insert_batch(self._entity_queue)
-            self.counts["insert"] += len(self._entity_queue)
-            self._entity_queue = []
-
+            self._flush_entity_queue()
+
+        self._reap_submits(drain=True)
+        if self._batch_sizer:
+            for k, v in self._batch_sizer.stats().items():
+                self.counts[k] = v
+        if self.known_dois and self.known_dois.maybe_save():
+            self.counts["known-dois-save"] += 1
+        if self._fuzzy_verify_pool:
+            # worker processes are started again if more records are pushed
+            self._fuzzy_verify_pool.shutdown()
+            self._fuzzy_verify_pool = None
         return self.counts
 
+    def _close_editgroup(self) -> None:
+        """
+        Accepts (or submits, in submit_mode) the current editgroup, and resets
+        editgroup state so that the next edit will create a new editgroup.
+        """
+        if self.submit_mode:
+            self._submit(self.api.submit_editgroup, self._editgroup_id)
+        else:
+            self._submit(self.api.accept_editgroup, self._editgroup_id)
+        self._editgroup_id = None
+        self._edit_count = 0
+        self._edits_inflight = []
+
+    def _submit(
+        self,
+        func: Callable,
+        *args: Any,
+        keys: Optional[List[Tuple[str, str, str]]] = None,
+    ) -> None:
+        """
+        Makes an editgroup or batch API call. Without a submit pool this is
+        just a synchronous call; otherwise the call is handed to a background
+        thread, first blocking (back-pressure) until fewer than
+        inflight_batches calls are outstanding. 'keys' are lookup keys (see
+        precheck_keys()) of entities the call inserts, which lookup_existing()
+        waits on while the call is in flight.
+        """
+        if not self._submit_pool:
+            func(*args)
+            return
+        self._reap_submits()
+        while len(self._submits_inflight) >= self.inflight_batches:
+            wait(self._submits_inflight, return_when=FIRST_COMPLETED)
+            self._reap_submits()
+        future = self._submit_pool.submit(self._counted_call, func, *args)
+        self._submits_inflight.append(future)
+        if keys:
+            self._submit_keys[future] = keys
+            self._keys_inflight.update(keys)
+
+    def _counted_call(self, func: Callable, *args: Any) -> Counter:
+        """
+        Runs a background submit call, returning the counts it made (for the
+        main thread to merge) instead of updating self.counts from this thread.
+        """
+        counts: Counter = Counter()
+        self._submit_counts.current = (self, counts)
+        try:
+            func(*args)
+        finally:
+            self._submit_counts.current = None
+        return counts
+
+    def _reap_submits(self, drain: bool = False) -> None:
+        """
+        Clears completed background calls, merging their counts, and
+        re-raising the first error (if any). If drain is set, first waits for
+        all outstanding calls.
+        """
+        if drain and self._submits_inflight:
+            wait(self._submits_inflight)
+        done = []
+        pending = []
+        for f in self._submits_inflight:
+            if f.done():
+                done.append(f)
+            else:
+                pending.append(f)
+        self._submits_inflight = pending
+        error: Optional[BaseException] = None
+        for f in done:
+            for key in self._submit_keys.pop(f, []):
+                self._keys_inflight[key] -= 1
+                if self._keys_inflight[key] <= 0:
+                    del self._keys_inflight[key]
+            if f.exception() is not None:
+                error = error or f.exception()
+                continue
+            self.counts.update(f.result())
+        if error is not None:
+            # re-raises the exception from the background thread
+            raise error
+
     def get_editgroup_id(self, edits: int = 1) -> str:
         if self._edit_count >= self.edit_batch_size:
-            if self.submit_mode:
-                self.api.submit_editgroup(self._editgroup_id)
-            else:
-                self.api.accept_editgroup(self._editgroup_id)
-            self._editgroup_id = None
-            self._edit_count = 0
-            self._edits_inflight = []
+            self._close_editgroup()
 
         if not self._editgroup_id:
             eg = self.api.create_editgroup(
@@ -230,10 +508,34 @@ class EntityImporter:
 
     def push_entity(self, entity: Any) -> None:
         self._entity_queue.append(entity)
-        if len(self._entity_queue) >= self.edit_batch_size:
-            self.insert_batch(self._entity_queue)
-            self.counts["insert"] += len(self._entity_queue)
-            self._entity_queue = []
+        if self._batch_sizer:
+            if self._batch_sizer.max_bytes:
+                # approximates the auto-batch request body size
+                self._entity_queue_bytes += estimate_entity_bytes(entity)
+            if self._batch_sizer.should_flush(
+                len(self._entity_queue), self._entity_queue_bytes
+            ):
+                self._flush_entity_queue()
+        elif len(self._entity_queue) >= self.edit_batch_size:
+            self._flush_entity_queue()
+
+    def _flush_entity_queue(self) -> None:
+        keys = None
+        if self._submit_pool:
+            keys = [k for e in self._entity_queue for k in self.precheck_keys(e)]
+        if self._batch_sizer:
+            self._submit(self._timed_insert_batch, self._entity_queue, keys=keys)
+        else:
+            self._submit(self.insert_batch, self._entity_queue, keys=keys)
+        self.counts["insert"] += len(self._entity_queue)
+        self._entity_queue = []
+        self._entity_queue_bytes = 0
+
+    def _timed_insert_batch(self, batch: List[Any]) -> None:
+        assert self._batch_sizer
+        start = time.monotonic()
+        self.insert_batch(batch)
+        self._batch_sizer.record(len(batch), time.monotonic() - start)
 
     def want(self, raw_record: Any) -> bool:
         """
@@ -258,6 +560,93 @@ class EntityImporter:
     def insert_batch(self, raw_records: List[Any]) -> None:
         raise NotImplementedError
 
+    def precheck_keys(self, entity: Any) -> List[Tuple[str, str, str]]:
+        """
+        Implementations can override to enable batched existence pre-checks
+        (precheck_batch_size). Passed the output of parse_record(); returns a
+        list of (entity_type, id_type, value) lookups that try_update() will
+        make via lookup_existing(), eg [("release", "doi", "10.123/abc")].
+        """
+        return []
+
+    def precheck_fuzzy(self, entity: Any) -> bool:
+        """
+        Implementations which call match_existing_release_fuzzy() from
+        try_update() can override to return true for (release) entities which
+        will be fuzzy matched if none of their precheck_keys() lookups find an
+        existing entity. Fuzzy matching for those is then done in a batch,
+        before try_update() is called.
+        """
+        return False
+
+    def lookup_existing(self, entity_type: str, id_type: str, value: Any) -> Optional[Any]:
+        """
+        Fetches an existing entity by external identifier (eg,
+        api.lookup_release(doi=...)), returning None if not found. Uses the
+        batched pre-check result, if there is one.
+
+        If an entity with this identifier is in an insert batch which is still
+        in flight (see inflight_batches), waits for in-flight calls to
+        complete first, so the lookup finds it.
+        """
+        key = (entity_type, id_type, value)
+        if self._keys_inflight.get(key):
+            self.counts["inflight-wait"] += 1
+            self._reap_submits(drain=True)
+            # pre-checked before the insert completed
+            self._precheck_results.pop(key, None)
+        if key in self._precheck_results:
+            self.counts["precheck-hit"] += 1
+            return self._precheck_results.pop(key)
+        return self._lookup_entity(entity_type, id_type, value)
+
+    def _lookup_entity(self, entity_type: str, id_type: str, value: Any) -> Optional[Any]:
+        lookup_func = getattr(self.api, "lookup_{}".format(entity_type))
+        try:
+            return lookup_func(**{id_type: value})
+        except ApiException as err:
+            if err.status != 404:
+                raise err
+        return None
+
+    def _lookup_snapshot(self, id_type: str, value: str) -> Optional[str]:
+        """
+        Checks the local identifier snapshot (if any). A miss here doesn't mean
+        the entity doesn't exist, only that it wasn't in the snapshot.
+        """
+        if not self.ident_snapshot:
+            return None
+        ident = self.ident_snapshot.lookup(id_type, value)
+        if ident:
+            self.counts["snapshot-hit.{}".format(id_type)] += 1
+        return ident
+
+    def is_known_doi(self, doi: Optional[str]) -> bool:
+        """
+        For use in want(): returns True if the DOI is (probably) already in the
+        catalog according to the known-DOI filter, if there is one. Also
+        refreshes the filter from the changelog every so often.
+        """
+        if not self.known_dois or self.bezerk_mode:
+            return False
+        refresh_counts = self.known_dois.maybe_refresh(self.api)
+        if refresh_counts is not None:
+            self.counts["known-dois-refresh"] += 1
+            self.counts["known-dois-refresh.doi"] += refresh_counts["doi"]
+        if doi in self.known_dois:
+            self.counts["skip-known-doi"] += 1
+            return True
+        return False
+
+    def add_known_doi(self, doi: Optional[str]) -> None:
+        """
+        Records a DOI as existing in the known-DOI filter, if there is one.
+        Call only for entities found by lookup, or once an insert has
+        succeeded: the filter is saved on refresh.
+        """
+        if self.known_dois:
+            self.known_dois.add(doi)
+
     def is_orcid(self, orcid: str) -> bool:
         # TODO: replace with clean_orcid() from fatcat_tools.normal
         return self._orcid_regex.match(orcid) is not None
@@ -270,6 +659,10 @@ class EntityImporter:
             return None
         if orcid in self._orcid_id_map:
             return self._orcid_id_map[orcid]
+        snapshot_id = self._lookup_snapshot("orcid", orcid)
+        if snapshot_id:
+            self._orcid_id_map[orcid] = snapshot_id
+            return snapshot_id
         creator_id = None
         try:
             rv = self.api.lookup_creator(orcid=orcid)
@@ -292,6 +685,10 @@ class EntityImporter:
         doi = doi.lower()
         if doi in self._doi_id_map:
             return self._doi_id_map[doi]
+        snapshot_id = self._lookup_snapshot("doi", doi)
+        if snapshot_id:
+            self._doi_id_map[doi] = snapshot_id
+            return snapshot_id
         release_id = None
         try:
             rv = self.api.lookup_release(doi=doi, hide="abstracts,refs,contribs")
@@ -309,6 +706,10 @@ class EntityImporter:
         For identifier lookups only (not full object fetches)"""
         if pmid in self._pmid_id_map:
             return self._pmid_id_map[pmid]
+        snapshot_id = self._lookup_snapshot("pmid", pmid)
+        if snapshot_id:
+            self._pmid_id_map[pmid] = snapshot_id
+            return snapshot_id
         release_id = None
         try:
             rv = self.api.lookup_release(pmid=pmid, hide="abstracts,refs,contribs")
@@ -327,6 +728,10 @@ class EntityImporter:
         """Caches calls to the ISSN-L lookup API endpoint in a local dict"""
         if issnl in self._issnl_id_map:
             return self._issnl_id_map[issnl]
+        snapshot_id = self._lookup_snapshot("issnl", issnl)
+        if snapshot_id:
+            self._issnl_id_map[issnl] = snapshot_id
+            return snapshot_id
         container_id = None
         try:
             rv = self.api.lookup_container(issnl=issnl)
@@ -344,7 +749,7 @@ class EntityImporter:
         for line in issn_map_file:
             if line.startswith("ISSN") or len(line) == 0:
                 continue
-            (issn, issnl) = line.split()[0:2]
+            issn, issnl = line.split()[0:2]
             self._issn_issnl_map[issn] = issnl
             # double mapping makes lookups easy
             self._issn_issnl_map[issnl] = issnl
@@ -434,42 +839,160 @@ class EntityImporter:
 
         Eg, if there is any EXACT match that is always returned; an AMBIGUOUS
         result is only returned if all the candidate matches were ambiguous.
+
+        If the release was already matched as part of a pre-check batch (see
+        precheck_fuzzy()), that result is returned. With a candidate cache
+        (fuzzy_cache_ttl), this goes through match_existing_releases_fuzzy().
         """
 
-        # this map used to establish priority order of verified matches
-        STATUS_SORT = {
-            fuzzycat.common.Status.TODO: 0,
-            fuzzycat.common.Status.EXACT: 10,
-            fuzzycat.common.Status.STRONG: 20,
-            fuzzycat.common.Status.WEAK: 30,
-            fuzzycat.common.Status.AMBIGUOUS: 40,
-            fuzzycat.common.Status.DIFFERENT: 60,
-        }
+        if id(release) in self._fuzzy_results:
+            self.counts["fuzzy-precheck-hit"] += 1
+            return self._fuzzy_results.pop(id(release))
+        if self._fuzzy_cache is not None:
+            return self.match_existing_releases_fuzzy([release])[0]
 
         # TODO: the size here is a first guess; what should it really be?
-        candidates = match_release_fuzzy(release, size=10, es=self.es_client)
+        candidates = match_release_fuzzy(release, size=FUZZY_MATCH_SIZE, es=self.es_client)
         if not candidates:
             return None
 
+        # the same candidate may come up more than once
+        candidate_dicts: Dict[int, Dict[str, Any]] = dict()
+        for c in candidates:
+            if id(c) not in candidate_dicts:
+                candidate_dicts[id(c)] = entity_to_dict(c, api_client=self.api.api_client)
         release_dict = entity_to_dict(release, api_client=self.api.api_client)
-        verified = [
-            (
-                fuzzycat.verify.verify(
-                    release_dict, entity_to_dict(c, api_client=self.api.api_client)
-                ),
-                c,
+        return verify_candidates(
+            release_dict,
+            [(c, candidate_dicts[id(c)]) for c in candidates],
+            pool=self._get_fuzzy_verify_pool(),
+        )
+
+    def match_existing_releases_fuzzy(
+        self, releases: Sequence[ReleaseEntity]
+    ) -> List[Optional[Tuple[str, str, ReleaseEntity]]]:
+        """
+        Batch version of match_existing_release_fuzzy(), returning a result
+        for each release, in order.
+
+        Title queries for all releases (with a distinct normalized title, and
+        nothing in the candidate cache) are made in a single elasticsearch
+        _msearch request, and each candidate is fetched from the API (and
+        converted to a dict) only once. As in the single-release version,
+        releases are first looked up by external identifier.
+        """
+        # as in fuzzycat, a release found by external identifier is the only
+        # candidate, and titles are only searched for the others
+        ext_id_matches = self._lookup_fuzzy_ext_ids(releases)
+        keys = [
+            None if match else normalize_title_key(r.title)
+            for r, match in zip(releases, ext_id_matches)
+        ]
+        by_key: Dict[Optional[str], List[FuzzyCandidate]] = {None: []}
+        search_titles: Dict[str, str] = dict()
+        for release, key in zip(releases, keys):
+            if key in by_key or key in search_titles:
+                continue
+            found, cached = (False, None)
+            if self._fuzzy_cache is not None:
+                found, cached = self._fuzzy_cache.get(key)
+            if found:
+                self.counts["fuzzy-cache-hit"] += 1
+                by_key[key] = cached
+            else:
+                search_titles[key] = release.title
+
+        if search_titles:
+            self.counts["fuzzy-search"] += len(search_titles)
+            ident_lists = msearch_release_idents(
+                self.es_client, list(search_titles.values()), size=FUZZY_MATCH_SIZE
             )
-            for c in candidates
+            fetched = self._fetch_fuzzy_candidates(
+                list(dict.fromkeys(i for idents in ident_lists for i in idents))
+            )
+            for key, idents in zip(search_titles.keys(), ident_lists):
+                by_key[key] = [fetched[i] for i in idents if i in fetched]
+                if self._fuzzy_cache is not None:
+                    self._fuzzy_cache.put(key, by_key[key])
+
+        # verify all (release, candidate) pairs in one go
+        candidate_lists = [
+            [match] if match else by_key[key] for match, key in zip(ext_id_matches, keys)
+        ]
+        pairs = []
+        for release, candidates in zip(releases, candidate_lists):
+            if candidates:
+                release_dict = entity_to_dict(release, api_client=self.api.api_client)
+                pairs.extend((release_dict, c[1]) for c in candidates)
+        statuses = iter(verify_pairs(pairs, pool=self._get_fuzzy_verify_pool()))
+        return [
+            pick_closest([(next(statuses), c[0]) for c in candidates])
+            for candidates in candidate_lists
         ]
 
-        # chose the "closest" match
-        closest = sorted(verified, key=lambda v: STATUS_SORT[v[0].status])[0]
-        if closest[0].status == fuzzycat.common.Status.DIFFERENT:
+    def _lookup_fuzzy_ext_ids(
+        self, releases: Sequence[ReleaseEntity]
+    ) -> List[Optional[FuzzyCandidate]]:
+        """
+        Looks up each release by its external identifiers (FUZZY_EXT_ID_TYPES,
+        in order, stopping at the first found), concurrently if there is a
+        precheck pool. Returns a candidate (or None) for each release.
+        """
+
+        def lookup(release: ReleaseEntity) -> Optional[FuzzyCandidate]:
+            for id_type in FUZZY_EXT_ID_TYPES:
+                value = getattr(release.ext_ids, id_type, None) if release.ext_ids else None
+                if not value:
+                    continue
+                try:
+                    found = self.api.lookup_release(
+                        **{id_type: value}, hide="refs,abstracts", expand="container"
+                    )
+                except ApiException as err:
+                    if err.status in (400, 404):
+                        continue
+                    raise err
+                return (found, entity_to_dict(found, api_client=self.api.api_client))
             return None
-        elif closest[0].status == fuzzycat.common.Status.TODO:
-            raise NotImplementedError("fuzzycat verify hit a Status.TODO")
+
+        if self._precheck_pool and len(releases) > 1:
+            results = list(self._precheck_pool.map(lookup, releases))
+        else:
+            results = [lookup(release) for release in releases]
+        self.counts["fuzzy-ext-id-match"] += sum(1 for r in results if r)
+        return results
+
+    def _get_fuzzy_verify_pool(self) -> Optional[ProcessPoolExecutor]:
+        if self._fuzzy_verify_pool is None and self.fuzzy_verify_workers > 0:
+            # spawn, not fork, as importers may already be running threads
+            # (eg, Kafka consumers)
+            self._fuzzy_verify_pool = ProcessPoolExecutor(
+                max_workers=self.fuzzy_verify_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._fuzzy_verify_pool
+
+    def _fetch_fuzzy_candidates(self, idents: List[str]) -> Dict[str, FuzzyCandidate]:
+        """
+        Fetches candidate releases (as fuzzycat does, without refs or
+        abstracts, and with container expanded), concurrently if there is a
+        precheck pool. Missing releases are skipped.
+        """
+
+        def fetch(ident: str) -> Optional[FuzzyCandidate]:
+            try:
+                release = self.api.get_release(ident, hide="refs,abstracts", expand="container")
+            except ApiException as err:
+                if err.status == 404:
+                    return None
+                raise err
+            return (release, entity_to_dict(release, api_client=self.api.api_client))
+
+        if self._precheck_pool and len(idents) > 1:
+            results = list(self._precheck_pool.map(fetch, idents))
         else:
-            return (closest[0].status.name, closest[0].reason.value, closest[1])
+            results = [fetch(ident) for ident in idents]
+        return {ident: r for ident, r in zip(idents, results) if r is not None}
 
 
 class RecordPusher:
@@ -646,7 +1169,7 @@ class Bs4XmlLargeFilePusher(RecordPusher):
         else:
             elem_iter = ET.iterparse(self.xml_file, ["start", "end"])
         root = None
-        for (event, element) in elem_iter:
+        for event, element in elem_iter:
             if (root is not None) and event == "start":
                 root = element
                 continue
@@ -694,11 +1217,31 @@ class Bs4XmlFileListPusher(RecordPusher):
         return counts
 
 
-class KafkaBs4XmlPusher(RecordPusher):
+class KafkaPusher(RecordPusher):
     """
-    Fetch XML for an article from Kafka, parse via Bs4.
+    Common consume loop for Kafka-driven importers; subclasses implement
+    push_message().
+
+    Runs until shutdown() is called or, when run from the main thread, the
+    process gets SIGTERM, SIGINT or SIGHUP (eg, on deploy restarts). On
+    shutdown, the batch in progress is completed, the importer is flushed
+    with finish() (submitting any partial editgroup), and stored offsets are
+    committed synchronously before the consumer is closed. A second signal
+    gets the default handling (eg, exits immediately).
+
+    With partition_workers > 1, the messages from each partition in a
+    consumed batch are pushed from a separate thread, each partition to its
+    own clone() of the importer, and offsets are stored per partition.
+    Records with the same key (which are always in the same partition) are
+    still pushed in order. See clone() for what is shared between clones.
     """
 
+    SHUTDOWN_SIGNALS: Tuple[signal.Signals, ...] = (
+        signal.SIGTERM,
+        signal.SIGINT,
+        signal.SIGHUP,
+    )
+
     def __init__(
         self,
         importer: EntityImporter,
@@ -717,89 +1260,107 @@ class KafkaBs4XmlPusher(RecordPusher):
             kafka_namespace=kwargs.get("kafka_namespace", "fatcat"),
         )
         self.poll_interval = kwargs.get("poll_interval", 5.0)
-        self.consume_batch_size = kwargs.get("consume_batch_size", 25)
-
-    def run(self) -> Counter:
-        count = 0
-        last_push = datetime.datetime.now()
-        while True:
-            # Note: this is batch-oriented, because underlying importer is
-            # often batch-oriented, but this doesn't confirm that entire batch
-            # has been pushed to fatcat before committing offset. Eg, consider
-            # case where there there is one update and thousands of creates;
-            # update would be lingering in importer, and if importer crashed
-            # never created.
-            # This is partially mitigated for the worker case by flushing any
-            # outstanding editgroups every 5 minutes, but there is still that
-            # window when editgroups might be hanging (unsubmitted).
-            batch = self.consumer.consume(
-                num_messages=self.consume_batch_size, timeout=self.poll_interval
-            )
-            print(
-                "... got {} kafka messages ({}sec poll interval) {}".format(
-                    len(batch), self.poll_interval, self.importer.counts
-                )
+        self.consume_batch_size = kwargs.get("consume_batch_size", 100)
+        self.force_flush = kwargs.get("force_flush", False)
+        self._shutdown = threading.Event()
+        self._prev_signal_handlers: Dict[int, Any] = dict()
+        self.partition_workers: int = kwargs.get("partition_workers", 1) or 1
+        self._executor: Optional[ThreadPoolExecutor] = None
+        if self.partition_workers > 1:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.partition_workers, thread_name_prefix="fatcat-import-partition"
             )
-            if not batch:
-                if datetime.datetime.now() - last_push > datetime.timedelta(minutes=5):
-                    # it has been some time, so flush any current editgroup
-                    self.importer.finish()
-                    last_push = datetime.datetime.now()
-                    # print("Flushed any partial import batch: {}".format(self.importer.counts))
-                continue
-            # first check errors on entire batch...
-            for msg in batch:
-                if msg.error():
-                    raise KafkaException(msg.error())
-            # ... then process
-            for msg in batch:
-                soup = BeautifulSoup(msg.value().decode("utf-8"), "xml")
-                self.importer.push_record(soup)
-                soup.decompose()
-                count += 1
-                if count % 500 == 0:
-                    print("Import counts: {}".format(self.importer.counts))
-            last_push = datetime.datetime.now()
-            for msg in batch:
-                # locally store offsets of processed messages; will be
-                # auto-commited by librdkafka from this "stored" value
-                self.consumer.store_offsets(message=msg)
+        self._partition_importers: Dict[Tuple[str, int], EntityImporter] = dict()
 
-        # TODO: should catch UNIX signals (HUP?) to shutdown cleanly, and/or
-        # commit the current batch if it has been lingering
-        counts = self.importer.finish()
-        print(counts)
-        self.consumer.close()
+    def push_message(self, importer: EntityImporter, msg: Any) -> None:
+        raise NotImplementedError
+
+    def _importers(self) -> List[EntityImporter]:
+        return [self.importer] + list(self._partition_importers.values())
+
+    def _counts(self) -> Counter:
+        if not self._partition_importers:
+            return self.importer.counts
+        counts: Counter = Counter()
+        for importer in self._importers():
+            counts.update(importer.counts)
+        if self.importer._batch_sizer:
+            # shared between importers; not additive
+            for k, v in self.importer._batch_sizer.stats().items():
+                counts[k] = v
         return counts
 
+    def _finish_all(self) -> Counter:
+        for importer in self._importers():
+            importer.finish()
+        return self._counts()
+
+    def _push_partition(self, partition: Tuple[str, int], msgs: List[Any]) -> None:
+        importer = self._partition_importers.get(partition)
+        if importer is None:
+            importer = self.importer.clone()
+            self._partition_importers[partition] = importer
+        for msg in msgs:
+            self.push_message(importer, msg)
+        for msg in msgs:
+            self.consumer.store_offsets(message=msg)
+
+    def shutdown(self) -> None:
+        """
+        Requests a clean shutdown, after the current batch. May be called from
+        any thread.
+        """
+        self._shutdown.set()
 
-class KafkaJsonPusher(RecordPusher):
-    def __init__(
-        self,
-        importer: EntityImporter,
-        kafka_hosts: str,
-        kafka_env: str,
-        topic_suffix: str,
-        group: str,
-        **kwargs
-    ) -> None:
-        self.importer = importer
-        self.consumer = make_kafka_consumer(
-            kafka_hosts,
-            kafka_env,
-            topic_suffix,
-            group,
-            kafka_namespace=kwargs.get("kafka_namespace", "fatcat"),
-        )
-        self.poll_interval = kwargs.get("poll_interval", 5.0)
-        self.consume_batch_size = kwargs.get("consume_batch_size", 100)
-        self.force_flush = kwargs.get("force_flush", False)
+    def _handle_signal(self, signum: int, _frame: Any) -> None:
+        print("Got signal {}, shutting down after current batch".format(signum))
+        self.shutdown()
+        self._restore_signal_handlers()
+
+    def _install_signal_handlers(self) -> None:
+        if threading.current_thread() is not threading.main_thread():
+            # signal handlers can only be set from the main thread
+            return
+        for signum in self.SHUTDOWN_SIGNALS:
+            self._prev_signal_handlers[signum] = signal.signal(signum, self._handle_signal)
+
+    def _restore_signal_handlers(self) -> None:
+        for signum, handler in self._prev_signal_handlers.items():
+            signal.signal(signum, handler)
+        self._prev_signal_handlers = dict()
+
+    def commit_offsets(self) -> None:
+        """
+        Synchronously commits stored offsets (of processed messages) for the
+        currently assigned partitions.
+        """
+        try:
+            self.consumer.commit(asynchronous=False)
+        except KafkaException as ke:
+            # nothing stored since the last (auto) commit
+            if ke.args[0].code() != KafkaError._NO_OFFSET:
+                raise
 
     def run(self) -> Counter:
+        self._install_signal_handlers()
+        try:
+            self._consume_loop()
+        finally:
+            self._restore_signal_handlers()
+
+        counts = self._finish_all()
+        print(counts)
+        self.commit_offsets()
+        self.consumer.close()
+        if self._executor:
+            self._executor.shutdown()
+        return counts
+
+    def _consume_loop(self) -> None:
         count = 0
         last_push = datetime.datetime.now()
         last_force_flush = datetime.datetime.now()
-        while True:
+        while not self._shutdown.is_set():
             # Note: this is batch-oriented, because underlying importer is
             # often batch-oriented, but this doesn't confirm that entire batch
             # has been pushed to fatcat before committing offset. Eg, consider
@@ -808,13 +1369,15 @@ class KafkaJsonPusher(RecordPusher):
             # never created.
             # This is partially mitigated for the worker case by flushing any
             # outstanding editgroups every 5 minutes, but there is still that
-            # window when editgroups might be hanging (unsubmitted).
+            # window when editgroups might be hanging (unsubmitted). On clean
+            # shutdown, everything is flushed before final offsets are
+            # committed.
             batch = self.consumer.consume(
                 num_messages=self.consume_batch_size, timeout=self.poll_interval
             )
             print(
                 "... got {} kafka messages ({}sec poll interval) {}".format(
-                    len(batch), self.poll_interval, self.importer.counts
+                    len(batch), self.poll_interval, self._counts()
                 )
             )
             if self.force_flush:
@@ -824,13 +1387,13 @@ class KafkaJsonPusher(RecordPusher):
                 # web/HTML and savepapernow importers get frequent messages,
                 # but rare 'want() == True', so need an extra flush
                 if datetime.datetime.now() - last_force_flush > datetime.timedelta(minutes=5):
-                    self.importer.finish()
+                    self._finish_all()
                     last_push = datetime.datetime.now()
                     last_force_flush = datetime.datetime.now()
             if not batch:
                 if datetime.datetime.now() - last_push > datetime.timedelta(minutes=5):
                     # it has been some time, so flush any current editgroup
-                    self.importer.finish()
+                    self._finish_all()
                     last_push = datetime.datetime.now()
                     last_force_flush = datetime.datetime.now()
                     # print("Flushed any partial import batch: {}".format(self.importer.counts))
@@ -840,24 +1403,48 @@ class KafkaJsonPusher(RecordPusher):
                 if msg.error():
                     raise KafkaException(msg.error())
             # ... then process
-            for msg in batch:
-                record = json.loads(msg.value().decode("utf-8"))
-                self.importer.push_record(record)
-                count += 1
-                if count % 500 == 0:
-                    print("Import counts: {}".format(self.importer.counts))
+            if self._executor is None:
+                for msg in batch:
+                    self.push_message(self.importer, msg)
+                for msg in batch:
+                    # locally store offsets of processed messages; will be
+                    # auto-commited by librdkafka from this "stored" value
+                    self.consumer.store_offsets(message=msg)
+            else:
+                process_partitions(batch, self._push_partition, self._executor)
+            if (count + len(batch)) // 500 > count // 500:
+                print("Import counts: {}".format(self._counts()))
+            count += len(batch)
             last_push = datetime.datetime.now()
-            for msg in batch:
-                # locally store offsets of processed messages; will be
-                # auto-commited by librdkafka from this "stored" value
-                self.consumer.store_offsets(message=msg)
 
-        # TODO: should catch UNIX signals (HUP?) to shutdown cleanly, and/or
-        # commit the current batch if it has been lingering
-        counts = self.importer.finish()
-        print(counts)
-        self.consumer.close()
-        return counts
+
+class KafkaBs4XmlPusher(KafkaPusher):
+    """
+    Fetch XML for an article from Kafka, parse via Bs4.
+    """
+
+    def __init__(
+        self,
+        importer: EntityImporter,
+        kafka_hosts: str,
+        kafka_env: str,
+        topic_suffix: str,
+        group: str,
+        **kwargs
+    ) -> None:
+        super().__init__(importer, kafka_hosts, kafka_env, topic_suffix, group, **kwargs)
+        self.consume_batch_size = kwargs.get("consume_batch_size", 25)
+
+    def push_message(self, importer: EntityImporter, msg: Any) -> None:
+        soup = BeautifulSoup(msg.value().decode("utf-8"), "xml")
+        importer.push_record(soup)
+        soup.decompose()
+
+
+class KafkaJsonPusher(KafkaPusher):
+    def push_message(self, importer: EntityImporter, msg: Any) -> None:
+        record = json.loads(msg.value().decode("utf-8"))
+        importer.push_record(record)
 
 
 def make_kafka_consumer(
@@ -1,5 +1,5 @@
 import datetime
-from typing import Any, Dict, List, Optional, Sequence
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 import fatcat_openapi_client
 from fatcat_openapi_client import ApiClient, ReleaseContrib, ReleaseEntity
@@ -70,6 +70,10 @@ class CrossrefImporter(EntityImporter):
         return CONTAINER_TYPE_MAP.get(crossref_type)
 
     def want(self, obj: Dict[str, Any]) -> bool:
+        # already-imported DOIs are skipped without parsing (if configured)
+        if self.is_known_doi(obj.get("DOI")):
+            return False
+
         if not obj.get("title"):
             self.counts["skip-blank-title"] += 1
             return False
@@ -424,19 +428,18 @@ class CrossrefImporter(EntityImporter):
         )
         return re
 
+    def precheck_keys(self, re: ReleaseEntity) -> List[Tuple[str, str, str]]:
+        return [("release", "doi", re.ext_ids.doi)]
+
     def try_update(self, re: ReleaseEntity) -> bool:
 
         # lookup existing DOI (don't need to try other ext idents for crossref)
-        existing = None
-        try:
-            existing = self.api.lookup_release(doi=re.ext_ids.doi)
-        except fatcat_openapi_client.rest.ApiException as err:
-            if err.status != 404:
-                raise err
+        existing = self.lookup_existing("release", "doi", re.ext_ids.doi)
 
         # eventually we'll want to support "updates", but for now just skip if
         # entity already exists
         if existing:
+            self.add_known_doi(re.ext_ids.doi)
             self.counts["exists"] += 1
             return False
 
@@ -451,3 +454,6 @@ class CrossrefImporter(EntityImporter):
                 entity_list=batch,
             )
         )
+        # only once inserted, so DOIs of failed batches aren't skipped later
+        for re in batch:
+            self.add_known_doi(re.ext_ids.doi)
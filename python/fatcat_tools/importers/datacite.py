@@ -123,6 +123,13 @@ class DataciteImporter(EntityImporter):
 
         print("datacite with debug={}".format(self.debug), file=sys.stderr)
 
+    def want(self, obj: Dict[str, Any]) -> bool:
+        # already-imported DOIs are skipped without parsing (if configured)
+        if self.debug is not True and isinstance(obj, dict):
+            if self.is_known_doi((obj.get("attributes") or {}).get("doi")):
+                return False
+        return True
+
     def parse_record(self, obj: Dict[str, Any]) -> Optional[ReleaseEntity]:
         """
         Mapping datacite JSON to ReleaseEntity.
@@ -682,6 +689,11 @@ class DataciteImporter(EntityImporter):
 
         return re
 
+    def precheck_keys(self, re: ReleaseEntity) -> List[Tuple[str, str, str]]:
+        if self.debug is True:
+            return []
+        return [("release", "doi", re.ext_ids.doi)]
+
     def try_update(self, re: ReleaseEntity) -> bool:
         """
         When debug is true, write the RE to stdout, not to the database. Might
@@ -692,16 +704,12 @@ class DataciteImporter(EntityImporter):
             return False
 
         # lookup existing DOI (don't need to try other ext idents for crossref)
-        existing = None
-        try:
-            existing = self.api.lookup_release(doi=re.ext_ids.doi)
-        except fatcat_openapi_client.rest.ApiException as err:
-            if err.status != 404:
-                raise err
+        existing = self.lookup_existing("release", "doi", re.ext_ids.doi)
 
         # eventually we'll want to support "updates", but for now just skip if
         # entity already exists
         if existing:
+            self.add_known_doi(re.ext_ids.doi)
             self.counts["exists"] += 1
             return False
 
@@ -722,6 +730,9 @@ class DataciteImporter(EntityImporter):
                 entity_list=batch,
             )
         )
+        # only once inserted, so DOIs of failed batches aren't skipped later
+        for re in batch:
+            self.add_known_doi(re.ext_ids.doi)
 
     def parse_datacite_creators(
         self,
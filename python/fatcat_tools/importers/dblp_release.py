@@ -24,7 +24,7 @@ import datetime
 import json
 import sys  # noqa: F401
 import warnings
-from typing import Any, Dict, List, Optional, Sequence
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 import bs4
 import fatcat_openapi_client
@@ -321,15 +321,24 @@ class DblpReleaseImporter(EntityImporter):
         """
         return re
 
+    def precheck_keys(self, re: ReleaseEntity) -> List[Tuple[str, str, str]]:
+        keys = [("release", "dblp", re.ext_ids.dblp)]
+        if re.ext_ids.arxiv:
+            # skipped by try_update() after the dblp lookup
+            return keys
+        for extid_type in ("doi", "wikidata_qid", "isbn13", "arxiv"):
+            extid_val = getattr(re.ext_ids, extid_type)
+            if extid_val:
+                keys.append(("release", extid_type, extid_val))
+        return keys
+
+    def precheck_fuzzy(self, re: ReleaseEntity) -> bool:
+        return not re.ext_ids.arxiv
+
     def try_update(self, re: ReleaseEntity) -> bool:
 
         # lookup existing release by dblp article id
-        existing = None
-        try:
-            existing = self.api.lookup_release(dblp=re.ext_ids.dblp)
-        except fatcat_openapi_client.rest.ApiException as err:
-            if err.status != 404:
-                raise err
+        existing = self.lookup_existing("release", "dblp", re.ext_ids.dblp)
 
         # Just skip all releases with an arxiv_id for now. Have not decided
         # what to do about grouping works and lookup of un-versioned arxiv_id
@@ -347,11 +356,7 @@ class DblpReleaseImporter(EntityImporter):
                 if not extid_val:
                     continue
                 # print(f"  lookup release type: {extid_type} val: {extid_val}")
-                try:
-                    existing = self.api.lookup_release(**{extid_type: extid_val})
-                except fatcat_openapi_client.rest.ApiException as err:
-                    if err.status != 404:
-                        raise err
+                existing = self.lookup_existing("release", extid_type, extid_val)
                 if existing:
                     if existing.ext_ids.dblp:
                         warn_str = f"unexpected dblp ext_id match after lookup failed dblp={re.ext_ids.dblp} ident={existing.ident}"
@@ -6,7 +6,7 @@ DOAJ API schema and docs: https://doaj.org/api/v1/docs
 
 import datetime
 import warnings
-from typing import Any, Dict, List, Optional, Sequence
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 import fatcat_openapi_client
 from fatcat_openapi_client import ApiClient, ReleaseEntity
@@ -205,15 +205,21 @@ class DoajArticleImporter(EntityImporter):
         """
         return re
 
+    def precheck_keys(self, re: ReleaseEntity) -> List[Tuple[str, str, str]]:
+        keys = [("release", "doaj", re.ext_ids.doaj)]
+        for extid_type in ("doi", "pmid", "pmcid"):
+            extid_val = getattr(re.ext_ids, extid_type)
+            if extid_val:
+                keys.append(("release", extid_type, extid_val))
+        return keys
+
+    def precheck_fuzzy(self, re: ReleaseEntity) -> bool:
+        return True
+
     def try_update(self, re: ReleaseEntity) -> bool:
 
         # lookup existing release by DOAJ article id
-        existing = None
-        try:
-            existing = self.api.lookup_release(doaj=re.ext_ids.doaj)
-        except fatcat_openapi_client.rest.ApiException as err:
-            if err.status != 404:
-                raise err
+        existing = self.lookup_existing("release", "doaj", re.ext_ids.doaj)
 
         # then try other ext_id lookups
         if not existing:
@@ -222,11 +228,7 @@ class DoajArticleImporter(EntityImporter):
                 if not extid_val:
                     continue
                 # print(f"  lookup release type: {extid_type} val: {extid_val}")
-                try:
-                    existing = self.api.lookup_release(**{extid_type: extid_val})
-                except fatcat_openapi_client.rest.ApiException as err:
-                    if err.status != 404:
-                        raise err
+                existing = self.lookup_existing("release", extid_type, extid_val)
                 if existing:
                     if existing.ext_ids.doaj:
                         warn_str = f"unexpected DOAJ ext_id match after lookup failed doaj={re.ext_ids.doaj} ident={existing.ident}"
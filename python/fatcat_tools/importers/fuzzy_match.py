@@ -0,0 +1,230 @@
+"""
+Batched fuzzy matching of releases against the release search index.
+
+EntityImporter.match_existing_release_fuzzy() uses fuzzycat to find
+candidates one release at a time: up to two elasticsearch queries (exact
+title, then fuzzy title), an API fetch for every candidate, and a
+fuzzycat.verify.verify() call for every candidate, converting the release to
+a dict again each time. That is the slowest part of DOAJ and dblp imports.
+
+The helpers here do the same work for a batch of releases:
+
+- title queries for the whole batch go in a single elasticsearch _msearch
+  request (and a second one, with fuzziness, for titles with no hits)
+- candidates are fetched (and converted to dicts) once per ident, even if
+  they come up for several releases in the batch
+- verification can be spread over a pool of worker processes
+- candidate lists can be cached for a short time, keyed on normalized title,
+  as batches of metadata often contain many near-identical titles
+
+As in fuzzycat.matching.match_release_fuzzy(), a release found by any of its
+external identifiers (FUZZY_EXT_ID_TYPES, in order) is the only candidate,
+and titles are only searched for releases with no such match.
+"""
+
+import re
+import time
+from concurrent.futures import Executor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import fuzzycat.common
+import fuzzycat.verify
+from fatcat_openapi_client import ReleaseEntity
+
+from fatcat_tools.transforms import entity_to_dict
+
+FUZZY_MATCH_SIZE: int = 10
+FUZZY_MATCH_INDEX: str = "fatcat_release"
+# searches per _msearch request
+FUZZY_MSEARCH_BATCH_SIZE: int = 100
+# external identifiers looked up before title searches, in the same order as
+# fuzzycat.matching.match_release_fuzzy()
+FUZZY_EXT_ID_TYPES: List[str] = [
+    "doi",
+    "wikidata_qid",
+    "isbn13",
+    "pmid",
+    "pmcid",
+    "core",
+    "arxiv",
+    "jstor",
+    "ark",
+    "mag",
+    "doaj",
+    "dblp",
+    "oai",
+]
+# max number of normalized titles in an importer's candidate cache
+FUZZY_CACHE_SIZE: int = 10000
+
+# this map used to establish priority order of verified matches
+FUZZY_STATUS_SORT = {
+    fuzzycat.common.Status.TODO: 0,
+    fuzzycat.common.Status.EXACT: 10,
+    fuzzycat.common.Status.STRONG: 20,
+    fuzzycat.common.Status.WEAK: 30,
+    fuzzycat.common.Status.AMBIGUOUS: 40,
+    fuzzycat.common.Status.DIFFERENT: 60,
+}
+
+# (release entity, same entity as a dict)
+FuzzyCandidate = Tuple[ReleaseEntity, Dict[str, Any]]
+FuzzyResult = Tuple[str, str, ReleaseEntity]
+
+
+def normalize_title_key(title: Optional[str]) -> Optional[str]:
+    """
+    Lower-cased title words, for use as a cache key. Titles which only differ
+    in case or punctuation get the same key (and would get the same results
+    from the elasticsearch title queries anyways).
+    """
+    if not title:
+        return None
+    words = re.findall(r"\w+", title.lower())
+    if not words:
+        return None
+    return " ".join(words)
+
+
+def release_title_query(title: str, size: int = FUZZY_MATCH_SIZE, fuzzy: bool = False) -> dict:
+    """
+    The title query bodies used by fuzzycat.matching.match_release_fuzzy().
+    """
+    match: Dict[str, Any] = {"query": title, "operator": "AND"}
+    if fuzzy:
+        match["fuzziness"] = "AUTO"
+    return {"query": {"match": {"title": match}}, "size": size}
+
+
+def msearch_release_idents(
+    es_client: Any,
+    titles: Sequence[Optional[str]],
+    size: int = FUZZY_MATCH_SIZE,
+    index: str = FUZZY_MATCH_INDEX,
+) -> List[List[str]]:
+    """
+    Runs the exact title query for every title, then the fuzzy title query
+    for titles which had no hits, using _msearch. Returns a list of matching
+    release idents for each title (empty for empty titles).
+    """
+    results: List[List[str]] = [[] for _ in titles]
+    pending = [i for i, t in enumerate(titles) if t]
+    for fuzzy in (False, True):
+        no_hits = []
+        for start in range(0, len(pending), FUZZY_MSEARCH_BATCH_SIZE):
+            chunk = pending[start : start + FUZZY_MSEARCH_BATCH_SIZE]
+            body: List[Dict[str, Any]] = []
+            for i in chunk:
+                body.append({"index": index})
+                body.append(release_title_query(titles[i] or "", size=size, fuzzy=fuzzy))
+            resp = es_client.msearch(body=body, index=index)
+            for i, sub_resp in zip(chunk, resp["responses"]):
+                if "error" in sub_resp:
+                    raise ValueError(
+                        "elasticsearch msearch error: {}".format(sub_resp["error"])
+                    )
+                idents = [hit["_source"]["ident"] for hit in sub_resp["hits"]["hits"]]
+                if idents:
+                    results[i] = idents[:size]
+                else:
+                    no_hits.append(i)
+        pending = no_hits
+    return results
+
+
+def _verify_pair(pair: Tuple[Dict[str, Any], Dict[str, Any]]) -> Any:
+    return fuzzycat.verify.verify(pair[0], pair[1])
+
+
+def verify_pairs(
+    pairs: Sequence[Tuple[Dict[str, Any], Dict[str, Any]]], pool: Optional[Executor] = None
+) -> List[Any]:
+    """
+    Runs fuzzycat.verify.verify() on (release dict, candidate dict) pairs,
+    returning results in order. With a pool, calls are made there, in chunks
+    (verification is CPU-bound, so this should be a process pool).
+    """
+    if pool is None or len(pairs) <= 1:
+        return [_verify_pair(p) for p in pairs]
+    chunksize = max(1, len(pairs) // 32)
+    return list(pool.map(_verify_pair, pairs, chunksize=chunksize))
+
+
+def pick_closest(verified: Sequence[Tuple[Any, ReleaseEntity]]) -> Optional[FuzzyResult]:
+    """
+    Picks the "closest" of (verify result, candidate) pairs, in the form
+    EntityImporter.match_existing_release_fuzzy() returns.
+    """
+    if not verified:
+        return None
+    closest = sorted(verified, key=lambda v: FUZZY_STATUS_SORT[v[0].status])[0]
+    if closest[0].status == fuzzycat.common.Status.DIFFERENT:
+        return None
+    elif closest[0].status == fuzzycat.common.Status.TODO:
+        raise NotImplementedError("fuzzycat verify hit a Status.TODO")
+    else:
+        return (closest[0].status.name, closest[0].reason.value, closest[1])
+
+
+def verify_candidates(
+    release_dict: Dict[str, Any],
+    candidates: Sequence[FuzzyCandidate],
+    pool: Optional[Executor] = None,
+) -> Optional[FuzzyResult]:
+    """
+    Verifies a release (as a dict) against fuzzy match candidates, and picks
+    the closest match.
+    """
+    statuses = verify_pairs([(release_dict, c[1]) for c in candidates], pool=pool)
+    return pick_closest([(status, c[0]) for status, c in zip(statuses, candidates)])
+
+
+def benchmark_fuzzy_verify(
+    releases: Sequence[ReleaseEntity],
+    api_client: Any,
+    pool: Optional[Executor] = None,
+    rounds: int = 10,
+) -> Dict[str, Any]:
+    """
+    Verifies every release against all the others (as if they were each
+    other's fuzzy match candidates), both the old way (a dict conversion for
+    every verify() call, serially) and the batched way (one dict conversion
+    per release, and the pool, if any). Returns timings.
+    """
+    assert releases
+
+    def timed(func: Callable[[], Any]) -> float:
+        start = time.monotonic()
+        for _ in range(rounds):
+            func()
+        return time.monotonic() - start
+
+    def per_call() -> None:
+        for release in releases:
+            release_dict = entity_to_dict(release, api_client=api_client)
+            for c in releases:
+                fuzzycat.verify.verify(release_dict, entity_to_dict(c, api_client=api_client))
+
+    def batched() -> None:
+        dicts = [entity_to_dict(r, api_client=api_client) for r in releases]
+        statuses = verify_pairs([(a, b) for a in dicts for b in dicts], pool=pool)
+        for i in range(len(releases)):
+            row = statuses[i * len(releases) : (i + 1) * len(releases)]
+            pick_closest(list(zip(row, releases)))
+
+    per_call_sec = timed(per_call)
+    batched_sec = timed(batched)
+    verifications = rounds * len(releases) ** 2
+    return {
+        "releases": len(releases),
+        "verifications": verifications,
+        "per_call_seconds": round(per_call_sec, 3),
+        "batched_seconds": round(batched_sec, 3),
+        "per_call_verify_per_sec": int(verifications / per_call_sec) if per_call_sec else None,
+        "batched_verify_per_sec": int(verifications / batched_sec) if batched_sec else None,
+    }
+
+
+def test_normalize_title_key() -> None:
+    assert normalize_title_key("Example Title: Novel Work?") == "example title novel work"
+    assert normalize_title_key(" ?! ") is None
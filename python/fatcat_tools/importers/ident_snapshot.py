@@ -0,0 +1,224 @@
+"""
+Local on-disk snapshot of external identifier to fatcat ident mappings
+(ISSN-L to container, ORCID to creator, DOI/PMID to release).
+
+Importers do a lot of "first touch" lookups (lookup_issnl(), lookup_orcid(),
+lookup_doi()) which each cost an API round-trip. During a bulk or baseline
+import nearly every identifier is seen for the first time, so the in-memory
+caches don't help much. A snapshot built ahead of time from a bulk entity dump
+(or an elasticsearch scroll) lets those lookups resolve locally; the API is
+only hit for identifiers which are not in the snapshot.
+
+The snapshot is a point-in-time copy, so a miss does *not* mean that the
+entity doesn't exist (it may have been created since). Importers always fall
+back to the API on a miss.
+
+Storage is a single sqlite3 file, with one WITHOUT ROWID table per identifier
+type, and idents stored as raw 16-byte UUIDs to keep the file compact.
+"""
+
+import json
+import sqlite3
+import sys
+import threading
+import uuid
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from elasticsearch_dsl import Search
+
+from fatcat_tools.fcid import fcid2uuid, uuid2fcid
+
+# identifier type -> entity type which that identifier resolves to
+IDENT_SNAPSHOT_TYPES: Dict[str, str] = {
+    "issnl": "container",
+    "orcid": "creator",
+    "doi": "release",
+    "pmid": "release",
+}
+
+SNAPSHOT_INSERT_BATCH_SIZE: int = 10000
+
+
+def _ident_to_blob(ident: str) -> bytes:
+    return uuid.UUID(fcid2uuid(ident)).bytes
+
+
+def _blob_to_ident(blob: bytes) -> str:
+    return uuid2fcid(str(uuid.UUID(bytes=bytes(blob))))
+
+
+def _normalize_key(id_type: str, value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    value = str(value).strip()
+    if not value:
+        return None
+    if id_type == "doi":
+        value = value.lower()
+    return value
+
+
+def ident_snapshot_rows(entity_type: str, obj: Dict[str, Any]) -> List[Tuple[str, str, str]]:
+    """
+    Takes an entity (as a dict, eg from a JSON dump, or an elasticsearch
+    document of the same entity type) and returns a list of (id_type, value,
+    ident) tuples to insert in to a snapshot.
+
+    Non-active entities (redirects, deletions, etc) are skipped.
+    """
+    ident = obj.get("ident")
+    if not ident or obj.get("state", "active") != "active":
+        return []
+    rows = []
+    for id_type, id_entity_type in IDENT_SNAPSHOT_TYPES.items():
+        if id_entity_type != entity_type:
+            continue
+        if entity_type == "release" and obj.get("ext_ids") is not None:
+            value = obj["ext_ids"].get(id_type)
+        else:
+            value = obj.get(id_type)
+        key = _normalize_key(id_type, value)
+        if key:
+            rows.append((id_type, key, ident))
+    return rows
+
+
+class IdentSnapshot:
+    """
+    Wraps a sqlite3 snapshot file. Open read-only (the default) for use in
+    importers, or with writable=True to build or update a snapshot.
+
+    A snapshot, and its sqlite3 connection, can be shared between threads
+    (eg, by importer clone()s); calls are serialized with a lock.
+    """
+
+    def __init__(self, db_file: str, writable: bool = False) -> None:
+        self.db_file = db_file
+        self.writable = writable
+        self._lock = threading.Lock()
+        if writable:
+            self.db = sqlite3.connect(db_file, check_same_thread=False)
+            # snapshots are always re-buildable from source, so favor speed
+            self.db.execute("PRAGMA journal_mode=OFF;")
+            self.db.execute("PRAGMA synchronous=OFF;")
+            for id_type in IDENT_SNAPSHOT_TYPES.keys():
+                self.db.execute(
+                    "CREATE TABLE IF NOT EXISTS {} ".format(id_type)
+                    + "(key TEXT PRIMARY KEY NOT NULL, ident BLOB NOT NULL) WITHOUT ROWID;"
+                )
+            self.db.commit()
+        else:
+            self.db = sqlite3.connect(
+                "file:{}?mode=ro".format(db_file), uri=True, check_same_thread=False
+            )
+
+    def lookup(self, id_type: str, value: str) -> Optional[str]:
+        """
+        Returns a fatcat ident if the identifier is in the snapshot, else None.
+        """
+        assert id_type in IDENT_SNAPSHOT_TYPES
+        key = _normalize_key(id_type, value)
+        if not key:
+            return None
+        with self._lock:
+            row = self.db.execute(
+                "SELECT ident FROM {} WHERE key = ? LIMIT 1;".format(id_type), (key,)
+            ).fetchone()
+        if not row:
+            return None
+        return _blob_to_ident(row[0])
+
+    def insert_rows(self, rows: Iterable[Tuple[str, str, str]]) -> int:
+        """
+        Inserts (id_type, value, ident) tuples, replacing any existing mapping
+        for the same identifier. Returns the number of rows inserted.
+        """
+        assert self.writable
+        by_type: Dict[str, List[Tuple[str, bytes]]] = dict()
+        count = 0
+        for id_type, value, ident in rows:
+            key = _normalize_key(id_type, value)
+            if not key:
+                continue
+            by_type.setdefault(id_type, []).append((key, _ident_to_blob(ident)))
+            count += 1
+        with self._lock:
+            for id_type, pairs in by_type.items():
+                assert id_type in IDENT_SNAPSHOT_TYPES
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO {} (key, ident) VALUES (?, ?);".format(id_type),
+                    pairs,
+                )
+            self.db.commit()
+        return count
+
+    def counts(self) -> Counter:
+        counts: Counter = Counter()
+        for id_type in IDENT_SNAPSHOT_TYPES.keys():
+            counts[id_type] = self.db.execute(
+                "SELECT COUNT(*) FROM {};".format(id_type)
+            ).fetchone()[0]
+        return counts
+
+    def close(self) -> None:
+        self.db.close()
+
+
+def _insert_batched(
+    snapshot: IdentSnapshot, entity_type: str, objs: Iterable[Dict[str, Any]]
+) -> Counter:
+    counts: Counter = Counter()
+    batch: List[Tuple[str, str, str]] = []
+    for obj in objs:
+        counts["total"] += 1
+        rows = ident_snapshot_rows(entity_type, obj)
+        if not rows:
+            counts["skip"] += 1
+            continue
+        batch.extend(rows)
+        if len(batch) >= SNAPSHOT_INSERT_BATCH_SIZE:
+            counts["insert"] += snapshot.insert_rows(batch)
+            counts["batches"] += 1
+            batch = []
+            if counts["batches"] % 100 == 0:
+                print("... {}".format(counts), file=sys.stderr)
+    if batch:
+        counts["insert"] += snapshot.insert_rows(batch)
+    return counts
+
+
+def build_ident_snapshot_from_json(
+    snapshot: IdentSnapshot, entity_type: str, json_file: Sequence
+) -> Counter:
+    """
+    Populates a snapshot from a JSON-per-line bulk dump of entities (eg,
+    container_export.json or creator_export.json from the bulk exports).
+    """
+
+    def parse_lines() -> Iterable[Dict[str, Any]]:
+        for line in json_file:
+            line = line.strip()
+            if not line:
+                continue
+            yield json.loads(line)
+
+    return _insert_batched(snapshot, entity_type, parse_lines())
+
+
+def build_ident_snapshot_from_elasticsearch(
+    snapshot: IdentSnapshot, entity_type: str, es_client: Any, es_index: str
+) -> Counter:
+    """
+    Populates a snapshot by scrolling through an elasticsearch index. Only
+    release and container indices are supported (there is no creator index).
+    """
+    assert entity_type in ("container", "release")
+    fields = ["ident"] + [k for k, v in IDENT_SNAPSHOT_TYPES.items() if v == entity_type]
+    search = Search(using=es_client, index=es_index).source(fields).params(size=5000)
+
+    def scroll_docs() -> Iterable[Dict[str, Any]]:
+        for hit in search.scan():
+            yield hit.to_dict()
+
+    return _insert_batched(snapshot, entity_type, scroll_docs())
@@ -1,5 +1,5 @@
 import datetime
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import fatcat_openapi_client
 from fatcat_openapi_client import (
@@ -319,14 +319,15 @@ class IngestFileResultImporter(EntityImporter):
             fe.edit_extra = edit_extra
         return fe
 
+    def precheck_keys(self, fe: FileEntity) -> List[Tuple[str, str, str]]:
+        # webcapture and fileset subclasses have their own try_update()
+        if not isinstance(fe, FileEntity):
+            return []
+        return [("file", "sha1", fe.sha1)]
+
     def try_update(self, fe: FileEntity) -> bool:
         # lookup sha1, or create new entity
-        existing = None
-        try:
-            existing = self.api.lookup_file(sha1=fe.sha1)
-        except fatcat_openapi_client.rest.ApiException as err:
-            if err.status != 404:
-                raise err
+        existing = self.lookup_existing("file", "sha1", fe.sha1)
 
         # check for existing edits-in-progress with same file hash
         for other in self._entity_queue:
@@ -1,6 +1,6 @@
 import datetime
 import sys
-from typing import Any, Dict, List, Optional, Sequence
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 import fatcat_openapi_client
 from bs4 import BeautifulSoup
@@ -323,17 +323,13 @@ class JalcImporter(EntityImporter):
         )
         return re
 
+    def precheck_keys(self, re: ReleaseEntity) -> List[Tuple[str, str, str]]:
+        return [("release", "doi", re.ext_ids.doi)]
+
     def try_update(self, re: ReleaseEntity) -> bool:
 
         # lookup existing DOI
-        existing = None
-        try:
-            existing = self.api.lookup_release(doi=re.ext_ids.doi)
-        except fatcat_openapi_client.rest.ApiException as err:
-            if err.status != 404:
-                raise err
-            # doesn't exist, need to insert
-            return True
+        existing = self.lookup_existing("release", "doi", re.ext_ids.doi)
 
         # eventually we'll want to support "updates", but for now just skip if
         # entity already exists
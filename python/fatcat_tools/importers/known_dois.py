@@ -0,0 +1,302 @@
+"""
+Compact in-memory "known DOIs" set (a Bloom filter) for harvest-driven
+importers.
+
+The crossref and datacite harvesters re-publish every DOI which was updated
+upstream, so the Kafka-driven importers see the same DOIs over and over. Those
+importers never update existing releases, so a record for a DOI which already
+exists in the catalog is always going to end up as "exists", after a full
+parse_record() and a lookup_release() API call. With a known-DOI filter,
+want() can drop those records up front.
+
+The filter is built ahead of time from a release export (see
+`fatcat_transform.py known-dois`), and kept current by walking the changelog
+from the index the export was made at. Importers also add DOIs they find to
+exist, and DOIs they insert once the insert succeeds, as they go.
+
+Being probabilistic, a small fraction (the configured error rate) of new DOIs
+will be reported as known and skipped. Size the filter accordingly; the
+default error rate is one in a million.
+"""
+
+import hashlib
+import json
+import math
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Any, Iterable, Optional, Sequence
+
+from fatcat_tools.normal import clean_doi
+
+KNOWN_DOIS_MAGIC: bytes = b"FCBLOOM1"
+# magic, number of bits, number of hashes, number of items added, changelog index (-1 if unset)
+KNOWN_DOIS_HEADER = struct.Struct("<8sQIQq")
+# bound the time spent in a single periodic refresh (which runs in importer
+# want() calls), so Kafka consumers don't miss their poll deadline: a refresh
+# makes at most this many API calls (changelog entries, plus one release
+# revision fetch per release edit). The rest is picked up by the next refresh,
+# which comes sooner (REFRESH_CATCHUP_INTERVAL) while behind
+REFRESH_MAX_API_CALLS: int = 200
+REFRESH_CATCHUP_INTERVAL: float = 10.0
+# re-writing the filter file is slow for large filters (hundreds of MB), so
+# importers only persist it this often (from finish()), and at exit
+SAVE_INTERVAL: float = 6 * 3600.0
+
+
+class BloomFilter:
+    """
+    Plain Bloom filter over strings, using double hashing of a single blake2b
+    digest.
+    """
+
+    def __init__(self, num_bits: int, num_hashes: int) -> None:
+        assert num_bits > 0 and num_hashes > 0
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.count = 0
+        self.bits = bytearray((num_bits + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity: int, error_rate: float = 1e-6) -> "BloomFilter":
+        assert capacity > 0 and 0 < error_rate < 1
+        num_bits = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        num_hashes = max(1, int(round(num_bits / capacity * math.log(2))))
+        return cls(num_bits, num_hashes)
+
+    def _positions(self, key: str) -> Iterable[int]:
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1, h2 = struct.unpack("<QQ", digest)
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, key: str) -> None:
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        for pos in self._positions(key):
+            if not self.bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+
+class KnownDois:
+    """
+    Wraps a BloomFilter of (normalized) DOIs, along with the changelog index it
+    is current as of, and an optional file path to persist to.
+    """
+
+    def __init__(
+        self,
+        bloom: BloomFilter,
+        changelog_index: Optional[int] = None,
+        path: Optional[str] = None,
+        refresh_interval: float = 3600.0,
+        save_interval: float = SAVE_INTERVAL,
+    ) -> None:
+        self.bloom = bloom
+        self.changelog_index = changelog_index
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.save_interval = save_interval
+        self._last_refresh = time.monotonic()
+        self._next_refresh = self._last_refresh + refresh_interval
+        self._next_save = self._last_refresh + save_interval
+        self._dirty = False
+        # the filter may be shared by importers in several threads (eg,
+        # partition clones, batch insert threads): _lock guards the bits,
+        # _refresh_lock makes refreshes and saves one at a time
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def add(self, doi: Optional[str]) -> None:
+        key = clean_doi(doi)
+        if key:
+            with self._lock:
+                self.bloom.add(key)
+                self._dirty = True
+
+    def __contains__(self, doi: Optional[str]) -> bool:
+        key = clean_doi(doi)
+        if not key:
+            return False
+        return key in self.bloom
+
+    def save(self, path: Optional[str] = None) -> None:
+        """
+        Writes to a (uniquely named) temporary file and renames, so a
+        concurrent load() never sees a partial file. Adds wait while the bits
+        are written.
+        """
+        path = path or self.path
+        assert path
+        with self._refresh_lock:
+            self._save(path)
+
+    def _save(self, path: str) -> None:
+        # caller holds self._refresh_lock
+        with tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(os.path.abspath(path)),
+            prefix=os.path.basename(path) + ".",
+            suffix=".tmp",
+            delete=False,
+        ) as f:
+            try:
+                with self._lock:
+                    f.write(
+                        KNOWN_DOIS_HEADER.pack(
+                            KNOWN_DOIS_MAGIC,
+                            self.bloom.num_bits,
+                            self.bloom.num_hashes,
+                            self.bloom.count,
+                            -1 if self.changelog_index is None else self.changelog_index,
+                        )
+                    )
+                    f.write(self.bloom.bits)
+                    self._dirty = False
+            except BaseException:
+                os.unlink(f.name)
+                raise
+        os.replace(f.name, path)
+
+    def maybe_save(self, force: bool = False) -> bool:
+        """
+        Saves to the file the filter was loaded from, if there are changes
+        and save_interval seconds have passed since the last save (or if
+        'force' is set). Returns True if saved.
+        """
+        if not self.path or not self._dirty:
+            return False
+        if not force and time.monotonic() < self._next_save:
+            return False
+        with self._refresh_lock:
+            if not self._dirty:
+                return False
+            self._save(self.path)
+            self._next_save = time.monotonic() + self.save_interval
+        return True
+
+    @classmethod
+    def load(
+        cls, path: str, refresh_interval: float = 3600.0, save_interval: float = SAVE_INTERVAL
+    ) -> "KnownDois":
+        with open(path, "rb") as f:
+            header = f.read(KNOWN_DOIS_HEADER.size)
+            magic, num_bits, num_hashes, count, changelog_index = KNOWN_DOIS_HEADER.unpack(
+                header
+            )
+            if magic != KNOWN_DOIS_MAGIC:
+                raise ValueError("not a known-DOIs file: {}".format(path))
+            bloom = BloomFilter(num_bits, num_hashes)
+            f.readinto(bloom.bits)
+        bloom.count = count
+        return cls(
+            bloom,
+            changelog_index=None if changelog_index < 0 else changelog_index,
+            path=path,
+            refresh_interval=refresh_interval,
+            save_interval=save_interval,
+        )
+
+    def refresh_from_changelog(self, api: Any, max_api_calls: Optional[int] = None) -> Counter:
+        """
+        Adds the DOIs of releases created or updated in changelog entries since
+        the last refresh. If the starting index is unknown, just records the
+        current head of the changelog.
+
+        With max_api_calls, stops early (after a whole changelog entry) once
+        that many API calls have been made; counts["behind"] is set if entries
+        were left for the next refresh.
+        """
+        with self._refresh_lock:
+            return self._refresh_from_changelog(api, max_api_calls)
+
+    def _refresh_from_changelog(self, api: Any, max_api_calls: Optional[int]) -> Counter:
+        # caller holds self._refresh_lock
+        counts: Counter = Counter()
+        latest = api.get_changelog(limit=1)[0].index
+        if self.changelog_index is None:
+            self.changelog_index = latest
+            self._dirty = True
+            return counts
+        calls = 0
+        for index in range(self.changelog_index + 1, latest + 1):
+            if max_api_calls and calls >= max_api_calls:
+                counts["behind"] = latest - self.changelog_index
+                break
+            entry = api.get_changelog_entry(index=index)
+            calls += 1
+            counts["changelog-entries"] += 1
+            for edit in entry.editgroup.edits.releases or []:
+                if not edit.revision:
+                    # deletion
+                    continue
+                rev = api.get_release_revision(edit.revision)
+                calls += 1
+                if rev.ext_ids and rev.ext_ids.doi:
+                    self.add(rev.ext_ids.doi)
+                    counts["doi"] += 1
+            self.changelog_index = index
+            self._dirty = True
+        return counts
+
+    def maybe_refresh(self, api: Any) -> Optional[Counter]:
+        """
+        Called periodically by importers; refreshes if refresh_interval
+        seconds have passed since the last refresh, or sooner if the last
+        refresh didn't catch up with the changelog. Doesn't save (see
+        maybe_save()), and returns None without waiting if another thread is
+        already refreshing or saving.
+        """
+        if not self.refresh_interval or time.monotonic() < self._next_refresh:
+            return None
+        if not self._refresh_lock.acquire(blocking=False):
+            return None
+        try:
+            counts = self._refresh_from_changelog(api, REFRESH_MAX_API_CALLS)
+            self._last_refresh = time.monotonic()
+            if counts["behind"]:
+                self._next_refresh = self._last_refresh + min(
+                    REFRESH_CATCHUP_INTERVAL, self.refresh_interval
+                )
+            else:
+                self._next_refresh = self._last_refresh + self.refresh_interval
+        finally:
+            self._refresh_lock.release()
+        return counts
+
+
+def build_known_dois_from_json(
+    json_file: Sequence,
+    capacity: int,
+    error_rate: float = 1e-6,
+    changelog_index: Optional[int] = None,
+) -> KnownDois:
+    """
+    Builds a filter from a JSON-per-line release export. 'capacity' should be
+    at least the number of DOIs expected over the lifetime of the filter
+    (including growth from refreshes), or the error rate will be exceeded.
+    """
+    known = KnownDois(
+        BloomFilter.for_capacity(capacity, error_rate), changelog_index=changelog_index
+    )
+    lines = 0
+    for line in json_file:
+        line = line.strip()
+        if not line:
+            continue
+        release = json.loads(line)
+        lines += 1
+        if release.get("state", "active") != "active":
+            continue
+        doi = (release.get("ext_ids") or {}).get("doi") or release.get("doi")
+        known.add(doi)
+        if lines % 1000000 == 0:
+            print("... {} lines, {} DOIs".format(lines, known.bloom.count), file=sys.stderr)
+    return known
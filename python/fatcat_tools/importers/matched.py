@@ -1,4 +1,4 @@
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import fatcat_openapi_client
 from fatcat_openapi_client import ApiClient, FileEntity
@@ -143,14 +143,12 @@ class MatchedImporter(EntityImporter):
         )
         return fe
 
+    def precheck_keys(self, fe: FileEntity) -> List[Tuple[str, str, str]]:
+        return [("file", "sha1", fe.sha1)]
+
     def try_update(self, fe: FileEntity) -> bool:
         # lookup sha1, or create new entity
-        existing = None
-        try:
-            existing = self.api.lookup_file(sha1=fe.sha1)
-        except fatcat_openapi_client.rest.ApiException as err:
-            if err.status != 404:
-                raise err
+        existing = self.lookup_existing("file", "sha1", fe.sha1)
 
         if not existing:
             return True
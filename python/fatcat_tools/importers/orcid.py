@@ -1,5 +1,5 @@
 import sys
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import fatcat_openapi_client
 from fatcat_openapi_client import ApiClient, CreatorEntity
@@ -80,13 +80,11 @@ class OrcidImporter(EntityImporter):
         )
         return ce
 
+    def precheck_keys(self, ce: CreatorEntity) -> List[Tuple[str, str, str]]:
+        return [("creator", "orcid", ce.orcid)]
+
     def try_update(self, ce: CreatorEntity) -> bool:
-        existing = None
-        try:
-            existing = self.api.lookup_creator(orcid=ce.orcid)
-        except fatcat_openapi_client.rest.ApiException as err:
-            if err.status != 404:
-                raise err
+        existing = self.lookup_existing("creator", "orcid", ce.orcid)
 
         # eventually we'll want to support "updates", but for now just skip if
         # entity already exists
@@ -2,7 +2,7 @@ import datetime
 import json
 import sys
 import warnings
-from typing import Any, Dict, List, Optional, Sequence
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 import fatcat_openapi_client
 from bs4 import BeautifulSoup
@@ -435,23 +435,18 @@ class PubmedImporter(EntityImporter):
         )
         return re
 
+    def precheck_keys(self, re: ReleaseEntity) -> List[Tuple[str, str, str]]:
+        # the DOI lookup is only a fallback, so isn't pre-checked
+        return [("release", "pmid", re.ext_ids.pmid)]
+
     def try_update(self, re: ReleaseEntity) -> bool:
 
         # first, lookup existing by PMID (which must be defined)
-        existing = None
-        try:
-            existing = self.api.lookup_release(pmid=re.ext_ids.pmid)
-        except fatcat_openapi_client.rest.ApiException as err:
-            if err.status != 404:
-                raise err
+        existing = self.lookup_existing("release", "pmid", re.ext_ids.pmid)
 
         # then try DOI lookup if there is one
         if not existing and re.ext_ids.doi:
-            try:
-                existing = self.api.lookup_release(doi=re.ext_ids.doi)
-            except fatcat_openapi_client.rest.ApiException as err:
-                if err.status != 404:
-                    raise err
+            existing = self.lookup_existing("release", "doi", re.ext_ids.doi)
             if existing and existing.ext_ids.pmid and existing.ext_ids.pmid != re.ext_ids.pmid:
                 warn_str = "PMID/DOI mismatch: release {}, pmid {} != {}".format(
                     existing.ident, existing.ext_ids.pmid, re.ext_ids.pmid
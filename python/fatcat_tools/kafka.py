@@ -1,7 +1,28 @@
-from typing import Any, Optional
+"""
+Shared Kafka producer configuration and helpers.
+
+Producers should be created with kafka_producer() (or simple_kafka_producer()),
+which enables compression and batching (linger) suitable for the large JSON
+documents (eg, expanded releases) which fatcat pushes around. The returned
+TrackedProducer counts delivery callbacks, so callers can wait for
+outstanding messages, or find out which units of work have been fully
+delivered (see checkpoint()), instead of calling flush() after every unit of
+work.
+"""
+
+import heapq
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Set, Tuple
 
 from confluent_kafka import KafkaException, Producer
 
+DEFAULT_KAFKA_COMPRESSION: str = "zstd"
+DEFAULT_KAFKA_LINGER_MS: int = 50
+DEFAULT_KAFKA_BATCH_BYTES: int = 4 * 1024 * 1024
+
 
 def kafka_fail_fast(err: Optional[Any], _msg: Any) -> None:
     if err is not None:
@@ -11,7 +32,184 @@ def kafka_fail_fast(err: Optional[Any], _msg: Any) -> None:
         raise KafkaException(err)
 
 
-def simple_kafka_producer(kafka_hosts: str) -> Producer:
+def kafka_producer_config(
+    kafka_config: Dict[str, Any],
+    compression: str = DEFAULT_KAFKA_COMPRESSION,
+    linger_ms: int = DEFAULT_KAFKA_LINGER_MS,
+    batch_bytes: int = DEFAULT_KAFKA_BATCH_BYTES,
+) -> Dict[str, Any]:
+    """
+    Returns a copy of a base kafka config (eg, with "bootstrap.servers") with
+    the shared producer settings applied.
+
+    Note that delivery reports are *not* restricted to errors, as
+    TrackedProducer counts every delivery.
+    """
+    producer_conf = kafka_config.copy()
+    producer_conf.update(
+        {
+            "compression.type": compression,
+            "linger.ms": linger_ms,
+            "batch.size": batch_bytes,
+            "batch.num.messages": 10000,
+            "default.topic.config": {
+                "request.required.acks": -1,  # all brokers must confirm
+            },
+        }
+    )
+    return producer_conf
+
+
+class TrackedProducer:
+    """
+    Wraps a confluent_kafka Producer, with a compatible subset of methods
+    (produce(), poll(), flush(), len()).
+
+    Every message is produced with a delivery callback which counts it as
+    delivered (and calls the caller's on_delivery callback, or fails fast on
+    errors). This allows:
+
+    - backpressure: produce() blocks (polling) while more than max_pending
+      messages are outstanding, and retries when the local queue is full
+    - wait(): waiting for outstanding messages to drop below a threshold,
+      without forcing out partial batches like flush() does
+    - checkpoint(): marking a unit of work (eg, a consumed message), which is
+      returned by completed_checkpoints() once every message produced before
+      it has been delivered. This is exact even if deliveries come back out
+      of order.
+
+    Methods may be called from multiple threads.
+    """
+
+    def __init__(self, producer_config: Dict[str, Any], max_pending: int = 100000) -> None:
+        self.producer = Producer(producer_config)
+        self.max_pending = max_pending
+        self.produced = 0
+        self.delivered = 0
+        self._lock = threading.Lock()
+        # sequence numbers of produced but not delivered messages; the heap
+        # (for the lowest outstanding number) is pruned of delivered entries
+        # from the top as deliveries come in, so it only holds the range
+        # between the lowest and highest outstanding numbers
+        self._outstanding: Set[int] = set()
+        self._outstanding_heap: List[int] = []
+        self._checkpoints: Deque[Tuple[int, Any]] = deque()
+
+    def produce(
+        self,
+        topic: str,
+        value: Optional[bytes] = None,
+        key: Optional[Any] = None,
+        on_delivery: Optional[Callable[[Any, Any], None]] = None,
+        **kwargs: Any,
+    ) -> None:
+        with self._lock:
+            seq = self.produced
+            self.produced += 1
+            self._outstanding.add(seq)
+            heapq.heappush(self._outstanding_heap, seq)
+
+        def delivery_callback(err: Any, msg: Any) -> None:
+            with self._lock:
+                self._outstanding.discard(seq)
+                self._prune_heap()
+                self.delivered += 1
+            (on_delivery or kafka_fail_fast)(err, msg)
+
+        try:
+            while True:
+                try:
+                    self.producer.produce(
+                        topic, value, key=key, on_delivery=delivery_callback, **kwargs
+                    )
+                    break
+                except BufferError:
+                    # local queue is full; wait for some deliveries
+                    self.producer.poll(0.5)
+        except Exception:
+            with self._lock:
+                self._outstanding.discard(seq)
+                self._prune_heap()
+            raise
+
+        if self.max_pending and self.pending() > self.max_pending:
+            self.wait(self.max_pending // 2)
+        else:
+            self.producer.poll(0)
+
+    def _prune_heap(self) -> None:
+        # caller holds self._lock
+        heap = self._outstanding_heap
+        while heap and heap[0] not in self._outstanding:
+            heapq.heappop(heap)
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._outstanding)
+
+    def poll(self, timeout: float = 0) -> int:
+        return self.producer.poll(timeout)
+
+    def flush(self, timeout: Optional[float] = None) -> int:
+        if timeout is None:
+            return self.producer.flush()
+        return self.producer.flush(timeout)
+
+    def __len__(self) -> int:
+        return len(self.producer)
+
+    def wait(self, max_pending: int = 0, timeout: Optional[float] = None) -> bool:
+        """
+        Polls until no more than max_pending messages are outstanding. Returns
+        False if timeout (in seconds) ran out first.
+        """
+        start = time.monotonic()
+        while self.pending() > max_pending:
+            if timeout is not None and time.monotonic() - start >= timeout:
+                return False
+            self.producer.poll(0.1)
+        return True
+
+    def checkpoint(self, obj: Any) -> None:
+        """
+        Records 'obj' as complete once all messages produced so far have been
+        delivered.
+        """
+        with self._lock:
+            self._checkpoints.append((self.produced, obj))
+
+    def completed_checkpoints(self) -> List[Any]:
+        """
+        Polls for deliveries, then pops and returns (in order) all checkpoint
+        objects whose messages have been delivered.
+        """
+        self.producer.poll(0)
+        done = []
+        with self._lock:
+            self._prune_heap()
+            heap = self._outstanding_heap
+            low_watermark = heap[0] if heap else self.produced
+            while self._checkpoints and self._checkpoints[0][0] <= low_watermark:
+                done.append(self._checkpoints.popleft()[1])
+        return done
+
+
+def kafka_producer(
+    kafka_config: Dict[str, Any],
+    compression: str = DEFAULT_KAFKA_COMPRESSION,
+    linger_ms: int = DEFAULT_KAFKA_LINGER_MS,
+    batch_bytes: int = DEFAULT_KAFKA_BATCH_BYTES,
+    max_pending: int = 100000,
+) -> TrackedProducer:
+    return TrackedProducer(
+        kafka_producer_config(
+            kafka_config, compression=compression, linger_ms=linger_ms, batch_bytes=batch_bytes
+        ),
+        max_pending=max_pending,
+    )
+
+
+def simple_kafka_producer(kafka_hosts: str) -> TrackedProducer:
     """
     kafka_hosts should be a string with hostnames separated by ',', not a list
     of hostnames
@@ -20,9 +218,148 @@ def simple_kafka_producer(kafka_hosts: str) -> Producer:
     kafka_config = {
         "bootstrap.servers": kafka_hosts,
         "message.max.bytes": 20000000,  # ~20 MBytes; broker-side max is ~50 MBytes
-        "delivery.report.only.error": True,
-        "default.topic.config": {
-            "request.required.acks": -1,
-        },
     }
-    return Producer(kafka_config)
+    return kafka_producer(kafka_config)
+
+
+def group_by_partition(batch: Sequence[Any]) -> Dict[Tuple[str, int], List[Any]]:
+    """
+    Groups a batch of consumed messages by (topic, partition), keeping
+    message order within each partition (and so for any given key).
+    """
+    partitions: Dict[Tuple[str, int], List[Any]] = dict()
+    for msg in batch:
+        partitions.setdefault((msg.topic(), msg.partition()), []).append(msg)
+    return partitions
+
+
+def process_partitions(
+    batch: Sequence[Any],
+    process: Callable[[Tuple[str, int], List[Any]], None],
+    executor: Optional[Executor] = None,
+) -> None:
+    """
+    Calls process(partition, msgs) once for each (topic, partition) in a
+    consumed batch. With an executor, partitions are processed concurrently;
+    messages within a partition are always processed in order by a single
+    call, so per-key ordering is kept.
+
+    Waits for all partitions to finish; if any failed, the first error is
+    raised. process() should store offsets for the messages it handled, so
+    that partitions which succeeded keep their progress.
+    """
+    partitions = group_by_partition(batch)
+    if executor is None or len(partitions) <= 1:
+        for partition, msgs in partitions.items():
+            process(partition, msgs)
+        return
+    futures = [
+        executor.submit(process, partition, msgs) for partition, msgs in partitions.items()
+    ]
+    errors = [f.exception() for f in futures]
+    for err in errors:
+        if err is not None:
+            raise err
+
+
+def benchmark_kafka_producer(
+    kafka_config: Dict[str, Any],
+    topic: str,
+    messages: Sequence[bytes],
+    num_messages: int,
+    compression: str = DEFAULT_KAFKA_COMPRESSION,
+    linger_ms: int = DEFAULT_KAFKA_LINGER_MS,
+    batch_bytes: int = DEFAULT_KAFKA_BATCH_BYTES,
+    flush_every: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Produces num_messages (cycling through sample 'messages') and waits for
+    delivery, returning throughput numbers.
+
+    If kafka_config has no "bootstrap.servers", an in-process librdkafka mock
+    cluster is used as a stand-in broker; useful for comparing client-side
+    settings (compression, batching, flush policy), but not absolute
+    numbers. flush_every simulates the old behavior of flushing after every
+    unit of work.
+    """
+    assert messages
+    kafka_config = kafka_config.copy()
+    if not kafka_config.get("bootstrap.servers"):
+        kafka_config["test.mock.num.brokers"] = 1
+        kafka_config["log_level"] = 3
+    producer = kafka_producer(
+        kafka_config, compression=compression, linger_ms=linger_ms, batch_bytes=batch_bytes
+    )
+    raw_bytes = 0
+    start = time.monotonic()
+    for i in range(num_messages):
+        msg = messages[i % len(messages)]
+        raw_bytes += len(msg)
+        producer.produce(topic, msg, key=str(i).encode("utf-8"))
+        if flush_every and (i + 1) % flush_every == 0:
+            producer.flush()
+    producer.flush()
+    elapsed = time.monotonic() - start
+    assert producer.delivered == num_messages
+    return {
+        "compression": compression,
+        "linger_ms": linger_ms,
+        "flush_every": flush_every,
+        "messages": num_messages,
+        "raw_mbytes": round(raw_bytes / 1024 / 1024, 1),
+        "seconds": round(elapsed, 3),
+        "messages_per_sec": int(num_messages / elapsed) if elapsed else None,
+        "raw_mbytes_per_sec": round(raw_bytes / 1024 / 1024 / elapsed, 1) if elapsed else None,
+    }
+
+
+def test_tracked_producer_checkpoints() -> None:
+    producer = kafka_producer({"test.mock.num.brokers": 1, "log_level": 3}, linger_ms=5)
+    producer.checkpoint("empty")
+    assert producer.completed_checkpoints() == ["empty"]
+
+    for i in range(100):
+        producer.produce("test-topic", b"hello", key=str(i).encode("utf-8"))
+    producer.checkpoint("first")
+    producer.produce("test-topic", b"world")
+    producer.checkpoint("second")
+    assert producer.produced == 101
+    assert producer.wait(0, timeout=30.0)
+    assert producer.delivered == 101
+    assert producer.completed_checkpoints() == ["first", "second"]
+    assert producer.completed_checkpoints() == []
+
+    stats = benchmark_kafka_producer(dict(), "bench-topic", [b"x" * 1000], 1000)
+    assert stats["messages"] == 1000
+
+
+def test_process_partitions() -> None:
+    class FakeMessage:
+        def __init__(self, partition: int, value: int) -> None:
+            self._partition = partition
+            self.value = value
+
+        def topic(self) -> str:
+            return "topic"
+
+        def partition(self) -> int:
+            return self._partition
+
+    batch = [FakeMessage(i % 3, i) for i in range(12)]
+    assert [m.value for m in group_by_partition(batch)[("topic", 1)]] == [1, 4, 7, 10]
+
+    seen: Dict[int, List[int]] = dict()
+
+    def process(partition: Tuple[str, int], msgs: List[Any]) -> None:
+        if partition[1] == 2:
+            raise ValueError("broken partition")
+        seen[partition[1]] = [m.value for m in msgs]
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        try:
+            process_partitions(batch, process, executor)
+            assert False, "expected error"
+        except ValueError:
+            pass
+    # the other partitions were still processed, in order
+    assert seen == {0: [0, 3, 6, 9], 1: [1, 4, 7, 10]}
@@ -11,13 +11,24 @@ Tools for merging entities in various ways.
 """
 
 import subprocess
-from collections import Counter
-from typing import Any, Dict, List, Optional
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import fatcat_openapi_client
 
+from fatcat_tools.batch_sizing import AdaptiveBatchSizer, make_batch_sizer
 from fatcat_tools.importers import EntityImporter
 
+# (fetch method name, ident, sorted keyword arguments)
+FetchKey = Tuple[str, str, Tuple[Tuple[str, Any], ...]]
+
+# fetch methods with results which are cached for the whole run (until the
+# entity is edited), not just for the prefetch window
+RUN_CACHED_FETCH_SUFFIXES = ("_redirects", "_history")
+RUN_CACHE_MAX_IDENTS: int = 100000
+
 
 class EntityMerger(EntityImporter):
     """
@@ -34,6 +45,24 @@ class EntityMerger(EntityImporter):
 
         # implemented per-task
         try_merge(dupe_ids: List[str], primary_id: Optional[str] = None, evidence: Optional[Dict[str, Any]] = None) -> None
+
+        # optional, per-task
+        prefetch_keys(all_ids: List[str], evidence: Optional[Dict[str, Any]]) -> List[FetchKey]
+
+    try_merge() implementations should read entities with fetch() and make
+    edits with submit_update(), which allows for:
+
+    - prefetch_groups: if non-zero, merge groups are buffered, and all the
+      fetches (see prefetch_keys()) for this many groups are made concurrently
+      (with prefetch_workers threads) before try_merge() is called on each
+      group, in order. Redirect and history lookups are also cached for the
+      whole run, until the entity is edited.
+    - inflight_updates: if non-zero, update calls are made from a pool of
+      background threads, with up to this many calls in flight at once. All
+      update calls for an editgroup complete before it is accepted.
+
+    Merge groups with idents which are already part of the current editgroup
+    are rejected (with a ValueError) either way.
     """
 
     def __init__(self, api: fatcat_openapi_client.ApiClient, **kwargs) -> None:
@@ -49,6 +78,27 @@ class EntityMerger(EntityImporter):
         self.edit_batch_size = kwargs.get("edit_batch_size", 50)
         self.editgroup_description = kwargs.get("editgroup_description")
         self.editgroup_extra = eg_extra
+        # optional; sizes editgroups based on accept_editgroup() latency
+        self._batch_sizer: Optional[AdaptiveBatchSizer] = make_batch_sizer(
+            self.edit_batch_size, kwargs
+        )
+
+        self.prefetch_groups: int = kwargs.get("prefetch_groups", 0) or 0
+        self._prefetch_pool: Optional[ThreadPoolExecutor] = None
+        if self.prefetch_groups > 0:
+            self._prefetch_pool = ThreadPoolExecutor(
+                max_workers=kwargs.get("prefetch_workers") or 8,
+                thread_name_prefix="fatcat-merge-prefetch",
+            )
+        # EntityImporter._submit() is re-used for update calls
+        self.inflight_batches: int = kwargs.get("inflight_updates", 0) or 0
+        self._submit_pool: Optional[ThreadPoolExecutor] = None
+        if self.inflight_batches > 0:
+            self._submit_pool = ThreadPoolExecutor(
+                max_workers=self.inflight_batches, thread_name_prefix="fatcat-merge-update"
+            )
+        # ident -> {fetch key -> result}
+        self._run_cache: "OrderedDict[str, Dict[FetchKey, Any]]" = OrderedDict()
         self.reset()
         self.entity_type_name = "common"
 
@@ -60,6 +110,11 @@ class EntityMerger(EntityImporter):
         self._edit_count = 0
         self._editgroup_id: Optional[str] = None
         self._idents_inflight: List[str] = []
+        self._submits_inflight: List[Future] = []
+        self._submit_keys: Dict[Future, List[Tuple[str, str, str]]] = dict()
+        self._keys_inflight: Counter = Counter()
+        self._merge_queue: List[Tuple[List[str], Optional[str], Optional[Dict[str, Any]]]] = []
+        self._prefetched: Dict[FetchKey, Any] = dict()
 
     def push_record(self, record: Dict[str, Any]) -> None:
         """
@@ -92,7 +147,20 @@ class EntityMerger(EntityImporter):
         if not duplicate_ids or (len(duplicate_ids) <= 1 and not primary_id):
             self.counts["skip-no-dupes"] += 1
             return
-        all_ids = duplicate_ids
+        if self._prefetch_pool:
+            self._merge_queue.append((duplicate_ids, primary_id, record.get("evidence")))
+            if len(self._merge_queue) >= self.prefetch_groups:
+                self._flush_merge_queue()
+            return
+        self._merge_group(duplicate_ids, primary_id, record.get("evidence"))
+
+    def _merge_group(
+        self,
+        duplicate_ids: List[str],
+        primary_id: Optional[str],
+        evidence: Optional[Dict[str, Any]],
+    ) -> None:
+        all_ids = duplicate_ids.copy()
         if primary_id:
             all_ids.append(primary_id)
         for i in all_ids:
@@ -101,22 +169,116 @@ class EntityMerger(EntityImporter):
                     "Entity already part of in-process merge operation: {}".format(i)
                 )
             self._idents_inflight.append(i)
-        count = self.try_merge(
-            duplicate_ids, primary_id=primary_id, evidence=record.get("evidence")
-        )
+        count = self.try_merge(duplicate_ids, primary_id=primary_id, evidence=evidence)
         if count:
             self.counts["merged"] += 1
             self.counts["updated-entities"] += count
             self._edit_count += count
         else:
             self.counts["skip"] += 1
-        if self._edit_count >= self.edit_batch_size:
-            if not self.dry_run_mode:
-                self.api.accept_editgroup(self._editgroup_id)
-            self._editgroup_id = None
-            self._edit_count = 0
-            self._idents_inflight = []
-        return
+        batch_size = self._batch_sizer.size if self._batch_sizer else self.edit_batch_size
+        if self._edit_count >= batch_size:
+            self._accept_editgroup()
+
+    def _flush_merge_queue(self) -> None:
+        assert self._prefetch_pool
+        queue = self._merge_queue
+        self._merge_queue = []
+        keys: Dict[FetchKey, None] = dict()
+        for duplicate_ids, primary_id, evidence in queue:
+            all_ids = duplicate_ids + ([primary_id] if primary_id else [])
+            for key in self.prefetch_keys(all_ids, evidence):
+                if key not in self._run_cache.get(key[1], {}):
+                    keys[key] = None
+        if keys:
+            results = self._prefetch_pool.map(self._fetch_key, keys)
+            self._prefetched = dict(zip(keys, results))
+            self.counts["prefetch"] += len(keys)
+        try:
+            for duplicate_ids, primary_id, evidence in queue:
+                self._merge_group(duplicate_ids, primary_id, evidence)
+        finally:
+            self._prefetched = dict()
+
+    def prefetch_keys(
+        self, all_ids: List[str], evidence: Optional[Dict[str, Any]]
+    ) -> List[FetchKey]:
+        """
+        Implementations can override to enable concurrent pre-fetching
+        (prefetch_groups). Passed all the idents of a merge group (primary
+        last, if there is one); returns a list of fetch() calls that
+        try_merge() will make for the group, as built by fetch_key().
+        """
+        return []
+
+    @staticmethod
+    def fetch_key(method: str, ident: str, **kwargs: Any) -> FetchKey:
+        return (method, ident, tuple(sorted(kwargs.items())))
+
+    def fetch(self, method: str, ident: str, **kwargs: Any) -> Any:
+        """
+        Fetches something about an entity: 'method' is the name of a method
+        on this merger (eg, for non-API lookups) or on the API client (eg,
+        "get_container" or "get_container_redirects"), called with the ident
+        and kwargs. Uses the pre-fetched or cached result, if there is one.
+        API errors (including 404s) are raised as usual.
+        """
+        key = self.fetch_key(method, ident, **kwargs)
+        cached = self._run_cache.get(ident)
+        if cached is not None and key in cached:
+            self._run_cache.move_to_end(ident)
+            self.counts["fetch-cache-hit"] += 1
+            return cached[key]
+        if key in self._prefetched:
+            self.counts["prefetch-hit"] += 1
+            result = self._prefetched.pop(key)
+        else:
+            result = self._fetch_key(key)
+        if isinstance(result, fatcat_openapi_client.ApiException):
+            raise result
+        if method.endswith(RUN_CACHED_FETCH_SUFFIXES):
+            self._run_cache.setdefault(ident, dict())[key] = result
+            self._run_cache.move_to_end(ident)
+            while len(self._run_cache) > RUN_CACHE_MAX_IDENTS:
+                self._run_cache.popitem(last=False)
+        return result
+
+    def _fetch_key(self, key: FetchKey) -> Any:
+        """
+        Makes a fetch call. 404 errors are returned (so they can be
+        pre-fetched and raised later); other errors are raised.
+        """
+        method, ident, kwargs = key
+        func = getattr(self, method, None) or getattr(self.api, method)
+        try:
+            return func(ident, **dict(kwargs))
+        except fatcat_openapi_client.ApiException as ae:
+            if ae.status == 404:
+                return ae
+            raise
+
+    def submit_update(self, func: Callable, editgroup_id: str, ident: str, entity: Any) -> None:
+        """
+        Makes an update_* API call for an entity (in the background, with
+        inflight_updates), and drops any cached lookups for the entity and (if
+        this is a redirect) for the redirect target.
+        """
+        self._run_cache.pop(ident, None)
+        if getattr(entity, "redirect", None):
+            self._run_cache.pop(entity.redirect, None)
+        self._submit(func, editgroup_id, ident, entity)
+
+    def _accept_editgroup(self) -> None:
+        # all updates for the editgroup must complete first
+        self._reap_submits(drain=True)
+        if not self.dry_run_mode:
+            start = time.monotonic()
+            self.api.accept_editgroup(self._editgroup_id)
+            if self._batch_sizer:
+                self._batch_sizer.record(self._edit_count, time.monotonic() - start)
+        self._editgroup_id = None
+        self._edit_count = 0
+        self._idents_inflight = []
 
     def try_merge(
         self,
@@ -128,13 +290,16 @@ class EntityMerger(EntityImporter):
         raise NotImplementedError
 
     def finish(self) -> Counter:
+        if self._merge_queue:
+            self._flush_merge_queue()
+
         if self._edit_count > 0:
-            if not self.dry_run_mode:
-                self.api.accept_editgroup(self._editgroup_id)
-            self._editgroup_id = None
-            self._edit_count = 0
-            self._idents_inflight = []
+            self._accept_editgroup()
+        self._reap_submits(drain=True)
 
+        if self._batch_sizer:
+            for k, v in self._batch_sizer.stats(prefix="editgroup").items():
+                self.counts[k] = v
         return self.counts
 
     def get_editgroup_id(self, _edits: int = 1) -> str:
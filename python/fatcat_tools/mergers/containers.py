@@ -10,7 +10,7 @@ from fatcat_tools import authenticated_api
 from fatcat_tools.harvest.harvest_common import requests_retry_session
 from fatcat_tools.importers import JsonLinePusher
 
-from .common import EntityMerger
+from .common import EntityMerger, FetchKey
 
 
 class ContainerMerger(EntityMerger):
@@ -77,6 +77,19 @@ class ContainerMerger(EntityMerger):
         )
         return entities[0].ident
 
+    def get_container_stats(self, ident: str) -> Dict[str, Any]:
+        resp = self.http_session.get(f"https://fatcat.wiki/container/{ident}/stats.json")
+        resp.raise_for_status()
+        return resp.json()
+
+    def prefetch_keys(
+        self, all_ids: List[str], evidence: Optional[Dict[str, Any]]
+    ) -> List[FetchKey]:
+        methods = ["get_container", "get_container_redirects", "get_container_stats"]
+        if not self.clobber_human_edited:
+            methods.append("get_container_history")
+        return [self.fetch_key(m, ident) for ident in all_ids for m in methods]
+
     def try_merge(
         self,
         dupe_ids: List[str],
@@ -99,8 +112,8 @@ class ContainerMerger(EntityMerger):
             all_ids.append(primary_id)
         for ident in all_ids:
             try:
-                entities[ident] = self.api.get_container(ident)
-                redirects[ident] = self.api.get_container_redirects(ident)
+                entities[ident] = self.fetch("get_container", ident)
+                redirects[ident] = self.fetch("get_container_redirects", ident)
             except fatcat_openapi_client.ApiException as ae:
                 if ae.status == 404:
                     self.counts["skip-entity-not-found"] += 1
@@ -113,10 +126,7 @@ class ContainerMerger(EntityMerger):
             if getattr(entities[ident], evidence["extid_type"]) != evidence["extid"]:
                 self.counts["skip-extid-mismatch"] += 1
                 return 0
-            resp = self.http_session.get(f"https://fatcat.wiki/container/{ident}/stats.json")
-            resp.raise_for_status()
-            stats = resp.json()
-            release_counts[ident] = stats["total"]
+            release_counts[ident] = self.fetch("get_container_stats", ident)["total"]
 
         if not primary_id:
             primary_id = self.choose_primary_container(
@@ -128,7 +138,7 @@ class ContainerMerger(EntityMerger):
 
         for ident in dupe_ids:
             if not self.clobber_human_edited:
-                edit_history = self.api.get_container_history(ident)
+                edit_history = self.fetch("get_container_history", ident)
                 for edit in edit_history:
                     if edit.editgroup.editor.is_bot is not True:
                         print(f"skipping container_{ident}: human edited", file=sys.stderr)
@@ -152,7 +162,8 @@ class ContainerMerger(EntityMerger):
         for other_id in dupe_ids:
             other = entities[other_id]
             if not self.dry_run_mode:
-                self.api.update_container(
+                self.submit_update(
+                    self.api.update_container,
                     eg_id,
                     other.ident,
                     ContainerEntity(
@@ -169,6 +180,10 @@ def run_merge_containers(args: argparse.Namespace) -> None:
     em = ContainerMerger(
         args.api,
         edit_batch_size=args.batch_size,
+        adaptive_batch=args.adaptive_batch,
+        prefetch_groups=args.prefetch_groups,
+        prefetch_workers=args.prefetch_workers,
+        inflight_updates=args.inflight_updates,
         dry_run_mode=args.dry_run,
         max_container_releases=args.max_container_releases,
         clobber_human_edited=args.clobber_human_edited,
@@ -188,6 +203,29 @@ def main() -> None:
         "--host-url", default="http://localhost:9411/v0", help="connect to this host/port"
     )
     parser.add_argument("--batch-size", help="size of batch to send", default=50, type=int)
+    parser.add_argument(
+        "--adaptive-batch",
+        action="store_true",
+        help="pick batch sizes based on API latency (starting from --batch-size)",
+    )
+    parser.add_argument(
+        "--prefetch-groups",
+        help="number of merge groups to fetch entities for concurrently, ahead of merging (0 to disable)",
+        default=0,
+        type=int,
+    )
+    parser.add_argument(
+        "--prefetch-workers",
+        help="number of threads to pre-fetch entities with",
+        default=8,
+        type=int,
+    )
+    parser.add_argument(
+        "--inflight-updates",
+        help="number of entity update API calls to keep in flight in the background (0 for synchronous)",
+        default=0,
+        type=int,
+    )
     parser.add_argument(
         "--editgroup-description-override",
         help="editgroup description override",
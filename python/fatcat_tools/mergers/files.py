@@ -9,7 +9,7 @@ from fatcat_openapi_client.models import FileEntity
 from fatcat_tools import authenticated_api
 from fatcat_tools.importers import JsonLinePusher
 
-from .common import EntityMerger
+from .common import EntityMerger, FetchKey
 
 
 class FileMerger(EntityMerger):
@@ -102,6 +102,11 @@ class FileMerger(EntityMerger):
 
         return updated
 
+    def prefetch_keys(
+        self, all_ids: List[str], evidence: Optional[Dict[str, Any]]
+    ) -> List[FetchKey]:
+        return [self.fetch_key("get_file", ident) for ident in all_ids]
+
     def try_merge(
         self,
         dupe_ids: List[str],
@@ -122,7 +127,7 @@ class FileMerger(EntityMerger):
             all_ids.append(primary_id)
         for ident in all_ids:
             try:
-                entities[ident] = self.api.get_file(ident)
+                entities[ident] = self.fetch("get_file", ident)
             except fatcat_openapi_client.ApiException as ae:
                 if ae.status == 404:
                     self.counts["skip-entity-not-found"] += 1
@@ -153,7 +158,8 @@ class FileMerger(EntityMerger):
             other = entities[other_id]
             primary_updated = self.merge_file_metadata_from(primary, other) or primary_updated
             if not self.dry_run_mode:
-                self.api.update_file(
+                self.submit_update(
+                    self.api.update_file,
                     eg_id,
                     other.ident,
                     FileEntity(
@@ -165,7 +171,7 @@ class FileMerger(EntityMerger):
 
         if primary_updated:
             if not self.dry_run_mode:
-                self.api.update_file(eg_id, primary.ident, primary)
+                self.submit_update(self.api.update_file, eg_id, primary.ident, primary)
             updated_entities += 1
 
         return updated_entities
@@ -175,6 +181,10 @@ def run_merge_files(args: argparse.Namespace) -> None:
     em = FileMerger(
         args.api,
         edit_batch_size=args.batch_size,
+        adaptive_batch=args.adaptive_batch,
+        prefetch_groups=args.prefetch_groups,
+        prefetch_workers=args.prefetch_workers,
+        inflight_updates=args.inflight_updates,
         dry_run_mode=args.dry_run,
         editgroup_description=args.editgroup_description_override,
     )
@@ -192,6 +202,29 @@ def main() -> None:
         "--host-url", default="http://localhost:9411/v0", help="connect to this host/port"
     )
     parser.add_argument("--batch-size", help="size of batch to send", default=50, type=int)
+    parser.add_argument(
+        "--adaptive-batch",
+        action="store_true",
+        help="pick batch sizes based on API latency (starting from --batch-size)",
+    )
+    parser.add_argument(
+        "--prefetch-groups",
+        help="number of merge groups to fetch entities for concurrently, ahead of merging (0 to disable)",
+        default=0,
+        type=int,
+    )
+    parser.add_argument(
+        "--prefetch-workers",
+        help="number of threads to pre-fetch entities with",
+        default=8,
+        type=int,
+    )
+    parser.add_argument(
+        "--inflight-updates",
+        help="number of entity update API calls to keep in flight in the background (0 for synchronous)",
+        default=0,
+        type=int,
+    )
     parser.add_argument(
         "--editgroup-description-override",
         help="editgroup description override",
@@ -9,7 +9,7 @@ from fatcat_openapi_client.models import ReleaseEntity, WorkEntity
 from fatcat_tools import authenticated_api
 from fatcat_tools.importers import JsonLinePusher
 
-from .common import EntityMerger
+from .common import EntityMerger, FetchKey
 
 
 class ReleaseMerger(EntityMerger):
@@ -78,6 +78,17 @@ class ReleaseMerger(EntityMerger):
         )
         return entities[0].ident
 
+    def prefetch_keys(
+        self, all_ids: List[str], evidence: Optional[Dict[str, Any]]
+    ) -> List[FetchKey]:
+        keys = []
+        for ident in all_ids:
+            keys.append(
+                self.fetch_key("get_release", ident, expand="files,filesets,webcaptures")
+            )
+            keys.append(self.fetch_key("get_release_redirects", ident))
+        return keys
+
     def try_merge(
         self,
         dupe_ids: List[str],
@@ -97,8 +108,10 @@ class ReleaseMerger(EntityMerger):
         if primary_id:
             all_ids.append(primary_id)
         for ident in all_ids:
-            releases[ident] = self.api.get_release(ident, expand="files,filesets,webcaptures")
-            existing_redirects[ident] = self.api.get_release_redirects(ident)
+            releases[ident] = self.fetch(
+                "get_release", ident, expand="files,filesets,webcaptures"
+            )
+            existing_redirects[ident] = self.fetch("get_release_redirects", ident)
 
         if not primary_id:
             primary_id = self.choose_primary_release(
@@ -129,7 +142,7 @@ class ReleaseMerger(EntityMerger):
                 if primary_id not in e.release_ids:
                     e.release_ids.append(primary_id)
                 if not self.dry_run_mode:
-                    self.api.update_file(eg_id, e.ident, e)
+                    self.submit_update(self.api.update_file, eg_id, e.ident, e)
                 updated_entities += 1
                 self.counts["updated-files"] += 1
 
@@ -140,7 +153,7 @@ class ReleaseMerger(EntityMerger):
                 if primary_id not in e.release_ids:
                     e.release_ids.append(primary_id)
                 if not self.dry_run_mode:
-                    self.api.update_fileset(eg_id, e.ident, e)
+                    self.submit_update(self.api.update_fileset, eg_id, e.ident, e)
                 updated_entities += 1
                 self.counts["updated-filesets"] += 1
 
@@ -151,7 +164,7 @@ class ReleaseMerger(EntityMerger):
                 if primary_id not in e.release_ids:
                     e.release_ids.append(primary_id)
                 if not self.dry_run_mode:
-                    self.api.update_webcapture(eg_id, e.ident, e)
+                    self.submit_update(self.api.update_webcapture, eg_id, e.ident, e)
                 updated_entities += 1
                 self.counts["updated-webcaptures"] += 1
 
@@ -159,7 +172,8 @@ class ReleaseMerger(EntityMerger):
             updated_work_ids.append(release.work_id)
             redirected_release_ids.append(release.ident)
             if not self.dry_run_mode:
-                self.api.update_release(
+                self.submit_update(
+                    self.api.update_release,
                     eg_id,
                     release.ident,
                     ReleaseEntity(redirect=primary_id, edit_extra=evidence),
@@ -181,7 +195,12 @@ class ReleaseMerger(EntityMerger):
                 assert work_id not in self._idents_inflight
                 self._idents_inflight.append(work_id)
                 if not self.dry_run_mode:
-                    self.api.update_work(eg_id, work_id, WorkEntity(redirect=primary_work_id))
+                    self.submit_update(
+                        self.api.update_work,
+                        eg_id,
+                        work_id,
+                        WorkEntity(redirect=primary_work_id),
+                    )
                 updated_entities += 1
                 self.counts["updated-works"] += 1
 
@@ -189,7 +208,15 @@ class ReleaseMerger(EntityMerger):
 
 
 def run_merge_releases(args: argparse.Namespace) -> None:
-    em = ReleaseMerger(args.api, edit_batch_size=args.batch_size, dry_run_mode=args.dry_run)
+    em = ReleaseMerger(
+        args.api,
+        edit_batch_size=args.batch_size,
+        adaptive_batch=args.adaptive_batch,
+        prefetch_groups=args.prefetch_groups,
+        prefetch_workers=args.prefetch_workers,
+        inflight_updates=args.inflight_updates,
+        dry_run_mode=args.dry_run,
+    )
     JsonLinePusher(em, args.json_file).run()
 
 
@@ -204,6 +231,29 @@ def main() -> None:
         "--host-url", default="http://localhost:9411/v0", help="connect to this host/port"
     )
     parser.add_argument("--batch-size", help="size of batch to send", default=50, type=int)
+    parser.add_argument(
+        "--adaptive-batch",
+        action="store_true",
+        help="pick batch sizes based on API latency (starting from --batch-size)",
+    )
+    parser.add_argument(
+        "--prefetch-groups",
+        help="number of merge groups to fetch entities for concurrently, ahead of merging (0 to disable)",
+        default=0,
+        type=int,
+    )
+    parser.add_argument(
+        "--prefetch-workers",
+        help="number of threads to pre-fetch entities with",
+        default=8,
+        type=int,
+    )
+    parser.add_argument(
+        "--inflight-updates",
+        help="number of entity update API calls to keep in flight in the background (0 for synchronous)",
+        default=0,
+        type=int,
+    )
     parser.add_argument(
         "--editgroup-description-override",
         help="editgroup description override",
@@ -8,6 +8,7 @@ See bulk citation and citation API proposals for design documentation.
 import argparse
 import datetime
 import sys
+from concurrent.futures import Executor
 from typing import Any, Dict, List, Optional
 
 import elasticsearch
@@ -315,20 +316,43 @@ def count_inbound_refs(
 
 
 # run fatcat API fetches for each ref and return "enriched" refs
+def _fetch_releases(
+    idents: List[Optional[str]],
+    fatcat_api_client: Any,
+    hide: Optional[str],
+    expand: Optional[str],
+    pool: Optional[Executor] = None,
+) -> Dict[str, ReleaseEntity]:
+    """
+    Fetches releases by ident (once per ident), concurrently if a pool is
+    given.
+    """
+    todo = list(dict.fromkeys(i for i in idents if i))
+
+    def fetch(ident: str) -> ReleaseEntity:
+        return fatcat_api_client.get_release(ident, hide=hide, expand=expand)
+
+    if pool is None or len(todo) <= 1:
+        return dict(zip(todo, map(fetch, todo)))
+    return dict(zip(todo, pool.map(fetch, todo)))
+
+
 def enrich_inbound_refs(
     refs: List[BiblioRef],
     fatcat_api_client: Any,
     hide: Optional[str] = "refs",
     expand: Optional[str] = "container,files,webcaptures,filesets",
+    pool: Optional[Executor] = None,
 ) -> List[EnrichedBiblioRef]:
+    releases = _fetch_releases(
+        [ref.source_release_ident for ref in refs], fatcat_api_client, hide, expand, pool=pool
+    )
     enriched = []
     for ref in refs:
         release = None
         access = []
         if ref.source_release_ident:
-            release = fatcat_api_client.get_release(
-                ref.source_release_ident, hide=hide, expand=expand
-            )
+            release = releases[ref.source_release_ident]
             access = release_access_options(release)
         if ref.source_wikipedia_article:
             wiki_lang = ref.source_wikipedia_article.split(":")[0]
@@ -359,15 +383,17 @@ def enrich_outbound_refs(
     fatcat_api_client: Any,
     hide: Optional[str] = "refs",
     expand: Optional[str] = "container,files,webcaptures,filesets",
+    pool: Optional[Executor] = None,
 ) -> List[EnrichedBiblioRef]:
+    releases = _fetch_releases(
+        [ref.target_release_ident for ref in refs], fatcat_api_client, hide, expand, pool=pool
+    )
     enriched = []
     for ref in refs:
         release = None
         access = []
         if ref.target_release_ident:
-            release = fatcat_api_client.get_release(
-                ref.target_release_ident, hide=hide, expand=expand
-            )
+            release = releases[ref.target_release_ident]
             access = release_access_options(release)
         if ref.target_openlibrary_work:
             access.append(
@@ -0,0 +1,193 @@
+"""
+Bulk resolution of release external identifiers (DOI, PMID, arXiv, etc) to
+fatcat release idents.
+
+The fatcat API (and the /release/lookup web route) resolve one identifier per
+request. ReleaseLookupResolver resolves a batch of mixed identifiers
+concurrently, with a shared cache of recent results; the web interface uses
+it to serve /release/lookup.json, which takes up to RELEASE_LOOKUP_BATCH_MAX
+identifiers per request. bulk_lookup_release_idents() is the matching client
+helper.
+
+Identifiers are given either as (id_type, value) tuples, or as strings with
+an id_type prefix, like "doi:10.123/abc" or "pmid:1234". Values are
+normalized (see fatcat_tools.normal) before lookup, so the same identifier in
+different forms is only looked up once.
+"""
+
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import requests
+from fatcat_openapi_client.rest import ApiException
+
+from fatcat_tools.cache import LRUCache
+from fatcat_tools.normal import (
+    clean_arxiv_id,
+    clean_doi,
+    clean_hdl,
+    clean_isbn13,
+    clean_pmcid,
+    clean_pmid,
+    clean_wikidata_qid,
+)
+
+# same set of identifiers as the /release/lookup web route
+RELEASE_LOOKUP_ID_TYPES: List[str] = [
+    "doi",
+    "wikidata_qid",
+    "pmid",
+    "pmcid",
+    "isbn13",
+    "jstor",
+    "arxiv",
+    "core",
+    "ark",
+    "mag",
+    "oai",
+    "hdl",
+]
+RELEASE_LOOKUP_CLEANERS: Dict[str, Callable[[Optional[str]], Optional[str]]] = {
+    "doi": clean_doi,
+    "wikidata_qid": clean_wikidata_qid,
+    "pmid": clean_pmid,
+    "pmcid": clean_pmcid,
+    "isbn13": clean_isbn13,
+    "arxiv": clean_arxiv_id,
+    "hdl": clean_hdl,
+}
+RELEASE_LOOKUP_BATCH_MAX: int = 1000
+
+LookupKey = Tuple[str, str]
+
+
+def parse_release_lookup_key(raw: Union[str, Sequence[str]]) -> Optional[LookupKey]:
+    """
+    Parses and normalizes a single identifier, either a "type:value" string or
+    a (type, value) pair. Returns None if the type is unknown or the value
+    isn't valid for the type.
+    """
+    if isinstance(raw, str):
+        if ":" not in raw:
+            return None
+        id_type, value = raw.split(":", 1)
+    else:
+        if len(raw) != 2:
+            return None
+        id_type, value = raw[0], raw[1]
+    if not isinstance(id_type, str) or not isinstance(value, str):
+        return None
+    id_type = id_type.strip().lower()
+    if id_type not in RELEASE_LOOKUP_ID_TYPES:
+        return None
+    cleaner = RELEASE_LOOKUP_CLEANERS.get(id_type)
+    clean_value: Optional[str] = value.strip()
+    if cleaner:
+        clean_value = cleaner(clean_value)
+    if not clean_value:
+        return None
+    return (id_type, clean_value)
+
+
+class ReleaseLookupResolver:
+    """
+    Resolves (id_type, value) keys to release idents, using the API's
+    lookup_release() in a thread pool (its own, or one passed as 'pool'). Results, including "not found", are
+    cached for cache_ttl seconds (LRU, up to cache_size keys); a release
+    created after a "not found" lookup will be found once that expires.
+
+    Thread-safe; a single resolver can be shared by web request handlers.
+    """
+
+    def __init__(
+        self,
+        api: Any,
+        workers: int = 16,
+        cache_size: int = 200000,
+        cache_ttl: float = 3600.0,
+        pool: Optional[Executor] = None,
+    ) -> None:
+        self.api = api
+        self.cache = LRUCache(max_size=cache_size, ttl=cache_ttl)
+        self._pool = pool or ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="fatcat-release-lookup"
+        )
+
+    def _lookup(self, key: LookupKey) -> Optional[str]:
+        try:
+            release = self.api.lookup_release(
+                **{key[0]: key[1]}, hide="abstracts,refs,contribs"
+            )
+        except ApiException as ae:
+            # 400 is returned for (cleaned, but still) malformed identifiers
+            if ae.status in (400, 404):
+                return None
+            raise ae
+        return release.ident
+
+    def resolve(self, keys: Iterable[LookupKey]) -> Dict[LookupKey, Optional[str]]:
+        """
+        Returns a dict of release ident (or None, if not found) for each
+        (normalized) key. Keys not in the cache are looked up concurrently.
+        """
+        results: Dict[LookupKey, Optional[str]] = dict()
+        todo: List[LookupKey] = []
+        for key in dict.fromkeys(keys):
+            found, ident = self.cache.get(key)
+            if found:
+                results[key] = ident
+            else:
+                todo.append(key)
+        for key, ident in zip(todo, self._pool.map(self._lookup, todo)):
+            self.cache.put(key, ident)
+            results[key] = ident
+        return results
+
+
+def bulk_lookup_release_idents(
+    ids: Iterable[str],
+    host: str = "https://fatcat.wiki",
+    batch_size: int = RELEASE_LOOKUP_BATCH_MAX,
+    session: Optional[requests.Session] = None,
+    timeout: float = 120.0,
+) -> Iterable[Dict[str, Any]]:
+    """
+    Client helper for the /release/lookup.json web endpoint: resolves
+    "type:value" identifier strings in batches of up to batch_size per
+    request. Yields one result dict per identifier, in order, with keys:
+
+        id: the identifier, as passed
+        id_type, value: the parsed and normalized identifier (if valid)
+        ident: release ident, or None if not found (or not valid)
+    """
+    assert 0 < batch_size <= RELEASE_LOOKUP_BATCH_MAX
+    session = session or requests.Session()
+    endpoint = host.rstrip("/") + "/release/lookup.json"
+
+    def post_batch(batch: List[str]) -> List[Dict[str, Any]]:
+        resp = session.post(endpoint, json=batch, timeout=timeout)
+        resp.raise_for_status()
+        return resp.json()
+
+    batch: List[str] = []
+    for raw in ids:
+        batch.append(raw)
+        if len(batch) >= batch_size:
+            yield from post_batch(batch)
+            batch = []
+    if batch:
+        yield from post_batch(batch)
+
+
+def test_parse_release_lookup_key() -> None:
+    assert parse_release_lookup_key("doi:10.1234/ASDF ") == ("doi", "10.1234/asdf")
+    assert parse_release_lookup_key("DOI:https://doi.org/10.1234/asdf") == (
+        "doi",
+        "10.1234/asdf",
+    )
+    assert parse_release_lookup_key(("pmid", "1234")) == ("pmid", "1234")
+    assert parse_release_lookup_key("pmid:abc") is None
+    assert parse_release_lookup_key("jstor:12345") == ("jstor", "12345")
+    assert parse_release_lookup_key("issn:1234-5678") is None
+    assert parse_release_lookup_key("10.1234/asdf") is None
+    assert parse_release_lookup_key(("doi",)) is None
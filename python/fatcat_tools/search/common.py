@@ -5,6 +5,65 @@ import elasticsearch
 import elasticsearch_dsl.response
 from elasticsearch_dsl import Search
 
+# release and container fields rendered in web search result rows (the
+# release_search_result_row and container_search_result_row macros in
+# entity_macros.html, and the container browse table of contents); searches
+# which only display result rows should fetch just these, with _source
+# filtering. Keep these in sync with the templates!
+RELEASE_RESULT_ROW_FIELDS: List[str] = [
+    "ident",
+    "title",
+    "original_title",
+    "release_type",
+    "release_stage",
+    "release_year",
+    "release_date",
+    "withdrawn_status",
+    "version",
+    "container_id",
+    "container_name",
+    "container_is_oa",
+    "contrib_names",
+    "volume",
+    "issue",
+    "pages",
+    "first_page",
+    "doi",
+    "pmid",
+    "pmcid",
+    "arxiv_id",
+    "jstor_id",
+    "dblp_id",
+    "doaj_id",
+    "hdl",
+    "wikidata_qid",
+    "best_pdf_url",
+    "preservation",
+]
+CONTAINER_RESULT_ROW_FIELDS: List[str] = [
+    "ident",
+    "name",
+    "original_name",
+    "publisher",
+    "container_type",
+    "publication_status",
+    "issnl",
+    "wikidata_qid",
+    "dblp_prefix",
+    "sim_pubid",
+    "ia_sim_collection",
+    "country_code",
+    "languages",
+    "is_oa",
+    "in_doaj",
+    "in_road",
+    "any_kbart",
+    "releases_total",
+    "preservation_bright",
+    "preservation_dark",
+    "preservation_none",
+]
+
 
 class FatcatSearchError(Exception):
     def __init__(self, status_code: Union[int, str], name: str, description: str = None):
@@ -31,25 +90,44 @@ def _hits_total_int(val: Any) -> int:
         return int(val["value"])
 
 
+def hits_total(response: elasticsearch_dsl.response.Response) -> int:
+    """
+    Total hit count of a search response. Reads the raw response, instead of
+    response.hits, which wraps every hit in a Hit object.
+    """
+    return _hits_total_int(response._d_["hits"]["total"])
+
+
+def _clean_surrogates(val: str) -> str:
+    if val.isascii():
+        return val
+    return val.encode("utf8", "ignore").decode("utf8")
+
+
 def results_to_dict(response: elasticsearch_dsl.response.Response) -> List[dict]:
     """
     Takes a response returns all the hits as JSON objects.
 
+    The '_source' dicts of the raw response are returned as-is (not copied,
+    and not wrapped in Hit objects first); use _source filtering on the search
+    to keep them small.
+
     Also handles surrogate strings that elasticsearch returns sometimes,
     probably due to mangled data processing in some pipeline. "Crimes against
-    Unicode"; production workaround
+    Unicode"; production workaround. Only non-ASCII strings, at the top level
+    or in lists, need any work.
     """
 
-    results = []
-    for h in response:
-        r = h._d_
-        # print(h.meta._d_)
-        results.append(r)
+    results = [h.get("_source", {}) for h in response._d_["hits"]["hits"]]
 
     for h in results:
-        for key in h:
-            if type(h[key]) is str:
-                h[key] = h[key].encode("utf8", "ignore").decode("utf8")
+        for key, val in h.items():
+            if type(val) is str:
+                if not val.isascii():
+                    h[key] = _clean_surrogates(val)
+            elif type(val) is list:
+                if any(type(v) is str and not v.isascii() for v in val):
+                    h[key] = [_clean_surrogates(v) if type(v) is str else v for v in val]
     return results
 
 
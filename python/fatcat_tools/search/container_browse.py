@@ -0,0 +1,353 @@
+"""
+Precomputed container browse index.
+
+The container "browse" pages show a year/volume/issue tree for a container,
+and a table of contents for a single issue. Computed on demand, the tree is a
+composite aggregation over every release of the container, and a table of
+contents is a (sorted) search, both against the full release index, on every
+page view.
+
+The helpers here compute the same things ahead of time, and store them in a
+small side index (one document per container, and one per issue) which the
+web interface reads with a single GET. Documents are kept current by
+ContainerBrowseWorker, which rebuilds the documents for containers (and
+issues) touched by release updates, and are only "stored", not indexed (see
+extra/elasticsearch/container_browse_schema.json).
+
+A table of contents document records how many releases it was built from,
+and is only used if that matches the count for the issue in the container's
+tree document, so a stale (or partially rebuilt) document falls back to a
+live search instead of showing the wrong releases.
+"""
+
+import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import elasticsearch
+from elasticsearch_dsl import Q, Search
+
+from fatcat_tools.search.common import (
+    RELEASE_RESULT_ROW_FIELDS,
+    hits_total,
+    results_to_dict,
+    wrap_es_execution,
+)
+
+# same limit as the web interface uses for live table of contents searches
+CONTAINER_TOC_LIMIT: int = 300
+
+
+def _sort_vol_key(val: Optional[Any]) -> Tuple[bool, bool, int, str]:
+    """
+    Helper for sorting volume and issue strings. Defined order is:
+
+    - None values first
+    - any non-integers next, in non-integer order
+    - any integers next, in integer sorted order (ascending)
+
+    Note that the actual sort used/displayed is reversed.
+
+    TODO: 'val' should actually be Optional[str], but getting a mypy error I
+    don't know how to hack around quickly right now.
+    """
+    if val is None:
+        return (False, False, 0, "")
+    if val.isdigit():
+        return (True, True, int(val), "")
+    else:
+        return (True, False, 0, val)
+
+
+def container_toc_id(ident: str, year: int, volume: Optional[str], issue: Optional[str]) -> str:
+    """
+    Document _id of a table of contents in the browse index. The container
+    tree document just uses the container ident.
+    """
+    return "{}-toc:{}:{}:{}".format(ident, year, volume or "", issue or "")
+
+
+def browse_buckets_to_tree(buckets: List[Any]) -> List[Dict[str, Any]]:
+    """
+    Transforms year/volume/issue composite aggregation buckets into nested
+    dicts/lists:
+
+        [
+          { year: int,
+            volumes: [
+              { volume: str|None
+                issues: [
+                  { issue: str|None
+                    count: int
+                  }
+                ] }
+            ] }
+        ]
+    """
+    buckets = [h for h in buckets if h["key"]["year"]]
+    year_nums = set([int(h["key"]["year"]) for h in buckets])
+    year_dicts: Dict[int, Dict[str, Any]] = dict()
+    if year_nums:
+        for year in year_nums:
+            year_dicts[year] = {}
+        for row in buckets:
+            year = int(row["key"]["year"])
+            volume = row["key"]["volume"] or ""
+            issue = row["key"]["issue"] or ""
+            if volume not in year_dicts[year]:
+                year_dicts[year][volume] = {}
+            year_dicts[year][volume][issue] = int(row["doc_count"])
+
+    # transform to lists-of-dicts
+    year_list = []
+    for year in year_dicts.keys():
+        volume_list = []
+        for volume in year_dicts[year].keys():
+            issue_list = []
+            for issue in year_dicts[year][volume].keys():
+                issue_list.append(
+                    dict(issue=issue or None, count=year_dicts[year][volume][issue])
+                )
+            issue_list = sorted(
+                issue_list, key=lambda x: _sort_vol_key(x["issue"]), reverse=True
+            )
+            volume_list.append(dict(volume=volume or None, issues=issue_list))
+        volume_list = sorted(
+            volume_list, key=lambda x: _sort_vol_key(x["volume"]), reverse=True
+        )
+        year_list.append(dict(year=year, volumes=volume_list))
+    return sorted(year_list, key=lambda x: x["year"], reverse=True)
+
+
+def tree_issue_count(
+    tree: List[Dict[str, Any]], year: int, volume: Optional[str], issue: Optional[str]
+) -> Optional[int]:
+    """
+    Looks up the release count of a single issue in a browse tree; None if
+    the issue isn't in the tree.
+    """
+    for y in tree:
+        if y["year"] != year:
+            continue
+        for v in y["volumes"]:
+            if v["volume"] != (volume or None):
+                continue
+            for i in v["issues"]:
+                if i["issue"] == (issue or None):
+                    return i["count"]
+    return None
+
+
+def query_es_container_browse(
+    ident: str,
+    es_client: elasticsearch.Elasticsearch,
+    es_index: str = "fatcat_release",
+) -> List[Dict[str, Any]]:
+    """
+    Returns the year/volume/issue browse tree of a container (see
+    browse_buckets_to_tree()), from a composite aggregation over the release
+    index. Stubs are not counted.
+    """
+
+    search = Search(using=es_client, index=es_index)
+    search = search.query(
+        "bool",
+        filter=[Q("bool", must_not=[Q("match", release_type="stub")])],
+    )
+    search = search.filter("term", container_id=ident)
+    search.aggs.bucket(
+        "year_volume",
+        "composite",
+        size=1500,
+        sources=[
+            {
+                "year": {
+                    "histogram": {
+                        "field": "release_year",
+                        "interval": 1,
+                        "missing_bucket": True,
+                    },
+                }
+            },
+            {
+                "volume": {
+                    "terms": {
+                        "field": "volume",
+                        "missing_bucket": True,
+                    },
+                }
+            },
+            {
+                "issue": {
+                    "terms": {
+                        "field": "issue",
+                        "missing_bucket": True,
+                    },
+                }
+            },
+        ],
+    )
+    search = search[:0]
+    search = search.params(request_cache=True)
+    resp = wrap_es_execution(search)
+    return browse_buckets_to_tree(resp.aggregations.year_volume.buckets)
+
+
+def sort_toc_releases(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Re-sorts table of contents release docs by first page *numerically*
+    (elasticsearch sorts the keyword field as strings). Converts digit-only
+    first_page values to integers in-place.
+    """
+    for doc in results:
+        if doc.get("first_page") and str(doc["first_page"]).isdigit():
+            doc["first_page"] = int(doc["first_page"])
+    return sorted(
+        results,
+        key=lambda d: d.get("first_page") if isinstance(d.get("first_page"), int) else 99999999,
+    )
+
+
+def query_es_container_toc(
+    ident: str,
+    year: int,
+    volume: Optional[str],
+    issue: Optional[str],
+    es_client: elasticsearch.Elasticsearch,
+    es_index: str = "fatcat_release",
+    limit: int = CONTAINER_TOC_LIMIT,
+) -> Tuple[int, List[Dict[str, Any]]]:
+    """
+    Fetches the (non-stub) releases of a single container issue, sorted for
+    display as a table of contents. An empty volume or issue matches releases
+    with no volume or issue.
+
+    Returns a tuple of (total count, release docs).
+    """
+
+    search = Search(using=es_client, index=es_index)
+    search = search.query(
+        "bool",
+        filter=[Q("bool", must_not=[Q("match", release_type="stub")])],
+    )
+    search = search.filter("term", container_id=ident)
+    search = search.filter("term", release_year=year)
+    if volume:
+        search = search.filter("term", volume=volume)
+    else:
+        search = search.exclude("exists", field="volume")
+    if issue:
+        search = search.filter("term", issue=issue)
+    else:
+        search = search.exclude("exists", field="issue")
+    search = search.sort("first_page", "pages", "release_date")
+    search = search.source(RELEASE_RESULT_ROW_FIELDS)
+    search = search[:limit]
+    search = search.params(track_total_hits=True)
+    resp = wrap_es_execution(search)
+    results = results_to_dict(resp)
+
+    for h in results:
+        # Ensure 'contrib_names' is a list, not a single string
+        if type(h.get("contrib_names")) is not list:
+            h["contrib_names"] = [h["contrib_names"]] if h.get("contrib_names") else []
+    return (hits_total(resp), sort_toc_releases(results))
+
+
+def container_browse_docs(
+    ident: str,
+    es_client: elasticsearch.Elasticsearch,
+    es_index: str = "fatcat_release",
+    issues: Optional[List[Tuple[int, Optional[str], Optional[str]]]] = None,
+) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    Builds browse index documents for a container, as (_id, doc) tuples: the
+    container tree document, and table of contents documents for the given
+    (year, volume, issue) tuples. With 'issues' None, table of contents
+    documents are built for every issue in the tree.
+
+    Issues which aren't (or are no longer) in the tree get no document.
+    """
+    updated = datetime.datetime.utcnow().isoformat() + "Z"
+    tree = query_es_container_browse(ident, es_client=es_client, es_index=es_index)
+    docs: List[Tuple[str, Dict[str, Any]]] = [
+        (
+            ident,
+            dict(
+                ident=ident,
+                doc_type="tree",
+                updated=updated,
+                year_volume_issue=tree,
+            ),
+        )
+    ]
+    if issues is None:
+        issues = [
+            (y["year"], v["volume"], i["issue"])
+            for y in tree
+            for v in y["volumes"]
+            for i in v["issues"]
+        ]
+    for year, volume, issue in sorted(set(issues), key=str):
+        if tree_issue_count(tree, year, volume, issue) is None:
+            continue
+        total, releases = query_es_container_toc(
+            ident, year, volume, issue, es_client=es_client, es_index=es_index
+        )
+        docs.append(
+            (
+                container_toc_id(ident, year, volume, issue),
+                dict(
+                    ident=ident,
+                    doc_type="toc",
+                    updated=updated,
+                    year=year,
+                    volume=volume or None,
+                    issue=issue or None,
+                    count_found=total,
+                    releases=releases,
+                ),
+            )
+        )
+    return docs
+
+
+def get_container_browse_doc(
+    es_client: elasticsearch.Elasticsearch, es_index: str, doc_id: str
+) -> Optional[Dict[str, Any]]:
+    """
+    Fetches a single browse index document; None if it (or the index) doesn't
+    exist.
+    """
+    try:
+        resp = es_client.get(index=es_index, id=doc_id)
+    except elasticsearch.exceptions.NotFoundError:
+        return None
+    if not resp.get("found"):
+        return None
+    return resp["_source"]
+
+
+def test_browse_buckets_to_tree() -> None:
+    buckets = [
+        {"key": {"year": 2020.0, "volume": "9", "issue": "2"}, "doc_count": 3},
+        {"key": {"year": 2020.0, "volume": "10", "issue": None}, "doc_count": 1},
+        {"key": {"year": 2020.0, "volume": "10", "issue": "1"}, "doc_count": 5},
+        {"key": {"year": 2019.0, "volume": None, "issue": None}, "doc_count": 2},
+        {"key": {"year": None, "volume": "1", "issue": "1"}, "doc_count": 7},
+    ]
+    tree = browse_buckets_to_tree(buckets)
+    assert [y["year"] for y in tree] == [2020, 2019]
+    assert [v["volume"] for v in tree[0]["volumes"]] == ["10", "9"]
+    assert [i["issue"] for i in tree[0]["volumes"][0]["issues"]] == ["1", None]
+    assert tree_issue_count(tree, 2020, "10", "1") == 5
+    assert tree_issue_count(tree, 2020, "10", "") == 1
+    assert tree_issue_count(tree, 2019, None, None) == 2
+    assert tree_issue_count(tree, 2019, "1", None) is None
+
+    assert container_toc_id("aaaaaaaaaaaaaeiraaaaaaaaai", 2019, None, "3") == (
+        "aaaaaaaaaaaaaeiraaaaaaaaai-toc:2019::3"
+    )
+    releases = sort_toc_releases(
+        [{"first_page": "10"}, {"first_page": "9"}, {"first_page": "e1"}, {}]
+    )
+    assert [r.get("first_page") for r in releases] == [9, 10, "e1", None]
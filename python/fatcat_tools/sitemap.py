@@ -0,0 +1,389 @@
+"""
+Sharded, pre-rendered sitemaps of container and release landing pages.
+
+Sitemap files are gzip-compressed text sitemaps (one URL per line), plus one
+XML sitemap index per entity type pointing at them, all in a single directory
+which is served as static files (see the /sitemap-* route of the web
+interface, or an equivalent nginx rule):
+
+    sitemap-index-releases.xml
+    sitemap-releases-<prefix>.txt.gz
+    sitemap-index-containers.xml
+    sitemap-containers-<prefix>.txt.gz
+
+An entity goes in the shard named by the first few characters of its ident.
+Idents are random, so shards are evenly sized, and any single entity has a
+known shard: an update from the changelog only rewrites the shards it touches,
+instead of re-generating hundreds of millions of URLs. The prefix length
+should keep shards under the per-file URL limit of crawlers (20k URLs, for
+Google Scholar); the defaults allow for about 600k containers and 600 million
+releases.
+
+A full build streams idents (from a bulk export, or an elasticsearch scroll)
+into per-shard spool files on disk, a batch at a time, so memory use is
+bounded by the batch size and the size of a single shard, not the number of
+entities. The prefix length and changelog index of a build are recorded in a
+state file (sitemap_state.json), which incremental updates pick up from.
+"""
+
+import datetime
+import glob
+import gzip
+import json
+import os
+import shutil
+import sys
+import tempfile
+from collections import Counter
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+from elasticsearch_dsl import Search
+
+SITEMAP_ENTITY_TYPES: Dict[str, str] = {
+    "container": "containers",
+    "release": "releases",
+}
+SITEMAP_PREFIX_LEN: Dict[str, int] = {
+    "container": 1,
+    "release": 3,
+}
+SITEMAP_HOST: str = "https://fatcat.wiki"
+# Google Scholar limit; Google allows 50k
+SITEMAP_MAX_URLS_PER_SHARD: int = 20000
+# idents buffered in memory before being appended to shard spool files
+SITEMAP_SPOOL_BATCH: int = 1000000
+SITEMAP_STATE_FILE: str = "sitemap_state.json"
+
+
+def sitemap_shard_filename(entity_type: str, prefix: str) -> str:
+    return "sitemap-{}-{}.txt.gz".format(SITEMAP_ENTITY_TYPES[entity_type], prefix)
+
+
+def sitemap_index_filename(entity_type: str) -> str:
+    return "sitemap-index-{}.xml".format(SITEMAP_ENTITY_TYPES[entity_type])
+
+
+def sitemap_entity_url(host: str, entity_type: str, ident: str) -> str:
+    return "{}/{}/{}".format(host.rstrip("/"), entity_type, ident)
+
+
+def want_sitemap_entity(entity_type: str, doc: Dict[str, Any]) -> bool:
+    """
+    Whether an entity (as a dict, eg from a bulk export) should be listed:
+    only active entities, and no stub releases.
+    """
+    if not doc.get("ident") or doc.get("state", "active") != "active":
+        return False
+    if entity_type == "release" and doc.get("release_type") == "stub":
+        return False
+    return True
+
+
+def sitemap_idents_from_json(entity_type: str, json_lines: Iterable[str]) -> Iterator[str]:
+    """
+    Yields the idents of entities to list from a JSON-per-line export.
+    """
+    for line in json_lines:
+        if not line.strip():
+            continue
+        doc = json.loads(line)
+        if want_sitemap_entity(entity_type, doc):
+            yield doc["ident"]
+
+
+def sitemap_idents_from_elasticsearch(
+    entity_type: str, es_client: Any, es_index: str
+) -> Iterator[str]:
+    """
+    Yields the idents of entities to list by scrolling through an elasticsearch
+    index (which only contains active entities).
+    """
+    search = Search(using=es_client, index=es_index).source(["ident"]).params(size=5000)
+    if entity_type == "release":
+        search = search.exclude("term", release_type="stub")
+    for hit in search.scan():
+        yield hit.ident
+
+
+def _write_shard(path: str, urls: List[str]) -> None:
+    tmp_path = path + ".tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        for url in urls:
+            f.write(url + "\n")
+    os.replace(tmp_path, path)
+
+
+def _read_shard_idents(path: str) -> Set[str]:
+    if not os.path.exists(path):
+        return set()
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return set(line.strip().rsplit("/", 1)[-1] for line in f if line.strip())
+
+
+def write_sitemap_index(output_dir: str, entity_type: str, host: str = SITEMAP_HOST) -> int:
+    """
+    (Re-)writes the sitemap index for an entity type, listing all shard files
+    in the directory, with their modification date. Returns the number of
+    shards.
+    """
+    pattern = sitemap_shard_filename(entity_type, "*")
+    shards = sorted(glob.glob(os.path.join(output_dir, pattern)))
+    path = os.path.join(output_dir, sitemap_index_filename(entity_type))
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write("""<?xml version="1.0" encoding="UTF-8"?>\n""")
+        f.write("""<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n""")
+        for shard in shards:
+            lastmod = datetime.datetime.utcfromtimestamp(os.path.getmtime(shard))
+            f.write("  <sitemap>\n")
+            f.write("    <loc>{}/{}</loc>\n".format(host.rstrip("/"), os.path.basename(shard)))
+            f.write("    <lastmod>{}</lastmod>\n".format(lastmod.date().isoformat()))
+            f.write("  </sitemap>\n")
+        f.write("</sitemapindex>\n")
+    os.replace(tmp_path, path)
+    return len(shards)
+
+
+def load_sitemap_state(output_dir: str) -> Dict[str, Any]:
+    path = os.path.join(output_dir, SITEMAP_STATE_FILE)
+    if not os.path.exists(path):
+        return dict()
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_sitemap_state(output_dir: str, state: Dict[str, Any]) -> None:
+    path = os.path.join(output_dir, SITEMAP_STATE_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def build_sitemap(
+    entity_type: str,
+    idents: Iterable[str],
+    output_dir: str,
+    host: str = SITEMAP_HOST,
+    prefix_len: Optional[int] = None,
+    changelog_index: Optional[int] = None,
+    spool_batch: int = SITEMAP_SPOOL_BATCH,
+) -> Counter:
+    """
+    Builds a full set of sitemap shards, and the index, for an entity type.
+    Shards of the same entity type from a previous build which are no longer
+    needed are removed. 'changelog_index' is the changelog index the idents
+    are current as of; incremental updates start from there.
+    """
+    assert entity_type in SITEMAP_ENTITY_TYPES
+    prefix_len = prefix_len or SITEMAP_PREFIX_LEN[entity_type]
+    counts: Counter = Counter()
+    os.makedirs(output_dir, exist_ok=True)
+    spool_dir = tempfile.mkdtemp(prefix=".sitemap-spool-", dir=output_dir)
+    try:
+        batch: Dict[str, List[str]] = dict()
+        batch_size = 0
+
+        def spool() -> None:
+            for prefix, prefix_idents in batch.items():
+                with open(os.path.join(spool_dir, prefix), "a") as f:
+                    f.write("\n".join(prefix_idents) + "\n")
+            batch.clear()
+
+        for ident in idents:
+            batch.setdefault(ident[:prefix_len], []).append(ident)
+            batch_size += 1
+            counts["idents"] += 1
+            if batch_size >= spool_batch:
+                spool()
+                batch_size = 0
+        spool()
+
+        written = set()
+        for prefix in sorted(os.listdir(spool_dir)):
+            with open(os.path.join(spool_dir, prefix), "r") as f:
+                shard_idents = sorted(set(line.strip() for line in f if line.strip()))
+            filename = sitemap_shard_filename(entity_type, prefix)
+            _write_shard(
+                os.path.join(output_dir, filename),
+                [sitemap_entity_url(host, entity_type, i) for i in shard_idents],
+            )
+            written.add(filename)
+            counts["urls"] += len(shard_idents)
+            counts["shards"] += 1
+            if len(shard_idents) > SITEMAP_MAX_URLS_PER_SHARD:
+                counts["oversize-shards"] += 1
+    finally:
+        shutil.rmtree(spool_dir)
+
+    for path in glob.glob(os.path.join(output_dir, sitemap_shard_filename(entity_type, "*"))):
+        if os.path.basename(path) not in written:
+            os.remove(path)
+            counts["removed-shards"] += 1
+    write_sitemap_index(output_dir, entity_type, host=host)
+
+    state = load_sitemap_state(output_dir)
+    state[entity_type] = dict(
+        prefix_len=prefix_len,
+        host=host,
+        changelog_index=changelog_index,
+    )
+    save_sitemap_state(output_dir, state)
+    if counts["oversize-shards"]:
+        print(
+            "WARNING: {} shards have more than {} URLs; use a longer prefix".format(
+                counts["oversize-shards"], SITEMAP_MAX_URLS_PER_SHARD
+            ),
+            file=sys.stderr,
+        )
+    return counts
+
+
+def update_sitemap_shards(
+    entity_type: str,
+    changes: Dict[str, bool],
+    output_dir: str,
+    host: str = SITEMAP_HOST,
+    prefix_len: Optional[int] = None,
+) -> Counter:
+    """
+    Adds (True) or removes (False) idents, rewriting only the affected shards
+    (and the index, if any were rewritten). Shards left empty are removed.
+    """
+    assert entity_type in SITEMAP_ENTITY_TYPES
+    prefix_len = prefix_len or SITEMAP_PREFIX_LEN[entity_type]
+    counts: Counter = Counter()
+    by_prefix: Dict[str, Dict[str, bool]] = dict()
+    for ident, listed in changes.items():
+        by_prefix.setdefault(ident[:prefix_len], dict())[ident] = listed
+
+    for prefix, prefix_changes in sorted(by_prefix.items()):
+        path = os.path.join(output_dir, sitemap_shard_filename(entity_type, prefix))
+        shard_idents = _read_shard_idents(path)
+        before = len(shard_idents)
+        added = set(i for i, listed in prefix_changes.items() if listed)
+        updated = (shard_idents | added) - set(prefix_changes.keys() - added)
+        if updated == shard_idents:
+            counts["unchanged-shards"] += 1
+            continue
+        counts["added"] += len(updated - shard_idents)
+        counts["removed"] += len(shard_idents - updated)
+        if updated:
+            _write_shard(
+                path, [sitemap_entity_url(host, entity_type, i) for i in sorted(updated)]
+            )
+        elif before:
+            os.remove(path)
+        counts["updated-shards"] += 1
+
+    if counts["updated-shards"]:
+        write_sitemap_index(output_dir, entity_type, host=host)
+    return counts
+
+
+def sitemap_changes_from_changelog(
+    api: Any, entity_type: str, start: int, end: int
+) -> Dict[str, bool]:
+    """
+    Collects whether each entity edited in changelog entries 'start' through
+    'end' (inclusive) should now be listed (True) or not (False). Deleted and
+    redirected entities are not listed; for releases, the current revision is
+    fetched to check for stubs.
+    """
+    changes: Dict[str, bool] = dict()
+    for index in range(start, end + 1):
+        entry = api.get_changelog_entry(index=index)
+        for edit in getattr(entry.editgroup.edits, SITEMAP_ENTITY_TYPES[entity_type]) or []:
+            if not edit.revision or edit.redirect_ident:
+                changes[edit.ident] = False
+            elif entity_type == "release":
+                rev = api.get_release_revision(edit.revision, hide="abstracts,refs,contribs")
+                changes[edit.ident] = rev.release_type != "stub"
+            else:
+                changes[edit.ident] = True
+    return changes
+
+
+def update_sitemap_from_changelog(
+    api: Any, entity_type: str, output_dir: str, max_entries: Optional[int] = None
+) -> Counter:
+    """
+    Applies changelog entries since the last build (or update) recorded in
+    the state file to the sitemap shards of an entity type, and records the
+    new changelog index. If no index was recorded, just records the current
+    head of the changelog.
+    """
+    state = load_sitemap_state(output_dir)
+    if entity_type not in state:
+        raise ValueError("no sitemap build found for {}".format(entity_type))
+    entity_state = state[entity_type]
+    counts: Counter = Counter()
+    latest = api.get_changelog(limit=1)[0].index
+    if entity_state.get("changelog_index") is None:
+        entity_state["changelog_index"] = latest
+        save_sitemap_state(output_dir, state)
+        return counts
+    end = latest
+    if max_entries:
+        end = min(latest, entity_state["changelog_index"] + max_entries)
+    if end <= entity_state["changelog_index"]:
+        return counts
+    changes = sitemap_changes_from_changelog(
+        api, entity_type, entity_state["changelog_index"] + 1, end
+    )
+    counts["changelog-entries"] = end - entity_state["changelog_index"]
+    counts.update(
+        update_sitemap_shards(
+            entity_type,
+            changes,
+            output_dir,
+            host=entity_state["host"],
+            prefix_len=entity_state["prefix_len"],
+        )
+    )
+    entity_state["changelog_index"] = end
+    save_sitemap_state(output_dir, state)
+    return counts
+
+
+def test_sitemap_shards() -> None:
+    idents = [
+        "aaaaaaaaaaaaarceaaaaaaaaai",
+        "aaaaaaaaaaaaarceaaaaaaaaam",
+        "baaaaaaaaaaaaaaaaaaaaaaaai",
+    ]
+    with tempfile.TemporaryDirectory() as output_dir:
+        counts = build_sitemap("container", iter(idents), output_dir, spool_batch=2)
+        assert (counts["idents"], counts["urls"], counts["shards"]) == (3, 3, 2)
+        shard_a = os.path.join(output_dir, "sitemap-containers-a.txt.gz")
+        with gzip.open(shard_a, "rt") as f:
+            assert f.read().split() == [
+                "https://fatcat.wiki/container/aaaaaaaaaaaaarceaaaaaaaaai",
+                "https://fatcat.wiki/container/aaaaaaaaaaaaarceaaaaaaaaam",
+            ]
+        with open(os.path.join(output_dir, "sitemap-index-containers.xml")) as f:
+            index = f.read()
+        assert "<loc>https://fatcat.wiki/sitemap-containers-b.txt.gz</loc>" in index
+        assert load_sitemap_state(output_dir)["container"]["prefix_len"] == 1
+
+        counts = update_sitemap_shards(
+            "container",
+            {
+                "aaaaaaaaaaaaarceaaaaaaaaai": False,
+                "baaaaaaaaaaaaaaaaaaaaaaaai": False,
+                "caaaaaaaaaaaaaaaaaaaaaaaai": True,
+                "daaaaaaaaaaaaaaaaaaaaaaaai": False,
+            },
+            output_dir,
+        )
+        assert (counts["added"], counts["removed"], counts["updated-shards"]) == (1, 2, 3)
+        assert _read_shard_idents(shard_a) == set(["aaaaaaaaaaaaarceaaaaaaaaam"])
+        assert sorted(os.listdir(output_dir)) == [
+            "sitemap-containers-a.txt.gz",
+            "sitemap-containers-c.txt.gz",
+            "sitemap-index-containers.xml",
+            SITEMAP_STATE_FILE,
+        ]
+
+    assert not want_sitemap_entity("release", dict(ident="x", release_type="stub"))
+    assert not want_sitemap_entity("container", dict(ident="x", state="deleted"))
+    assert want_sitemap_entity("release", dict(ident="x", release_type="article-journal"))
@@ -1,4 +1,4 @@
-from .csl import citeproc_csl, release_to_csl
+from .csl import citeproc_csl, citeproc_csl_batch, release_to_csl
 from .elasticsearch import (
     changelog_to_elasticsearch,
     container_to_elasticsearch,
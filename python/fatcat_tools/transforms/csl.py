@@ -1,5 +1,6 @@
 import json
-from typing import Any, Dict, List
+import threading
+from typing import Any, Dict, List, Tuple
 
 from citeproc import (
     Citation,
@@ -209,6 +210,44 @@ def refs_to_csl(entity: ReleaseEntity) -> List[Dict[str, Any]]:
     return ret
 
 
+# Parsing a CSL style (and its locale) is far more expensive than rendering a
+# single citation, so parsed styles are kept for the life of the process.
+# Rendering mutates the parsed style (eg, the formatter is set on the style
+# root), so each style has a lock which is held while rendering.
+_CSL_STYLE_CACHE: Dict[str, Tuple[CitationStylesStyle, threading.Lock]] = dict()
+_CSL_STYLE_CACHE_LOCK = threading.Lock()
+
+
+def get_csl_style(style: str) -> Tuple[CitationStylesStyle, threading.Lock]:
+    """
+    Returns a parsed CSL style (and the lock to hold while rendering with it),
+    from the process-wide cache.
+    """
+    with _CSL_STYLE_CACHE_LOCK:
+        if style not in _CSL_STYLE_CACHE:
+            style_path = get_style_filepath(style)
+            _CSL_STYLE_CACHE[style] = (
+                CitationStylesStyle(style_path, validate=False),
+                threading.Lock(),
+            )
+        return _CSL_STYLE_CACHE[style]
+
+
+def _format_bib_entry(lines: Any, style: str) -> str:
+    if style == "bibtex":
+        out = ""
+        for line in lines:
+            if line.startswith(" @"):
+                out += "@"
+            elif line.startswith(" "):
+                out += "\n " + line
+            else:
+                out += line
+        return "".join(out)
+    else:
+        return "".join(lines)
+
+
 def citeproc_csl(csl_json: Dict[str, Any], style: str, html: bool = False) -> str:
     """
     Renders a release entity to a styled citation.
@@ -221,28 +260,37 @@ def citeproc_csl(csl_json: Dict[str, Any], style: str, html: bool = False) -> st
     Returns a string; if the html flag is set, and the style isn't 'csl-json'
     or 'bibtex', it will be HTML. Otherwise plain text.
     """
-    if not csl_json.get("id"):
-        csl_json["id"] = "unknown"
+    return citeproc_csl_batch([csl_json], style, html=html)[0]
+
+
+def citeproc_csl_batch(
+    csl_items: List[Dict[str, Any]], style: str, html: bool = False
+) -> List[str]:
+    """
+    Like citeproc_csl(), but renders a list of CSL objects, returning a list of
+    strings in the same order. The style is looked up (and its lock taken)
+    once for the whole batch, which is faster than one call per item.
+
+    Each item gets its own bibliography, so the result for an item doesn't
+    depend on the rest of the batch (eg, citation numbers in numeric styles
+    like 'ieee', or year suffixes in author-date styles).
+    """
+    for csl_json in csl_items:
+        if not csl_json.get("id"):
+            csl_json["id"] = "unknown"
     if style == "csl-json":
-        return json.dumps(csl_json)
-    bib_src = CiteProcJSON([csl_json])
+        return [json.dumps(csl_json) for csl_json in csl_items]
     form = formatter.plain
     if html:
         form = formatter.html
-    style_path = get_style_filepath(style)
-    bib_style = CitationStylesStyle(style_path, validate=False)
-    bib = CitationStylesBibliography(bib_style, bib_src, form)
-    bib.register(Citation([CitationItem(csl_json["id"])]))
-    lines = bib.bibliography()[0]
-    if style == "bibtex":
-        out = ""
-        for line in lines:
-            if line.startswith(" @"):
-                out += "@"
-            elif line.startswith(" "):
-                out += "\n " + line
-            else:
-                out += line
-        return "".join(out)
-    else:
-        return "".join(lines)
+    bib_style, style_lock = get_csl_style(style)
+
+    results: List[str] = []
+    with style_lock:
+        for csl_json in csl_items:
+            bib_src = CiteProcJSON([csl_json])
+            bib = CitationStylesBibliography(bib_style, bib_src, form)
+            bib.register(Citation([CitationItem(csl_json["id"])]))
+            lines = bib.bibliography()[0]
+            results.append(_format_bib_entry(lines, style))
+    return results
@@ -1,4 +1,6 @@
 import datetime
+import functools
+import urllib.parse
 from typing import Any, Dict, Optional
 
 import tldextract
@@ -11,6 +13,28 @@ from fatcat_openapi_client import (
     ReleaseEntity,
 )
 
+# tldextract results, by URL host (files from the same few hosts are very
+# common, and the suffix list lookups are relatively slow)
+TLDEXTRACT_CACHE_SIZE: int = 50000
+
+
+@functools.lru_cache(maxsize=TLDEXTRACT_CACHE_SIZE)
+def _tldextract_netloc(netloc: str) -> Any:
+    return tldextract.extract(netloc)
+
+
+def tldextract_url(url: str) -> Any:
+    """
+    Memoized tldextract.extract() of a URL (by network location)
+    """
+    try:
+        netloc = urllib.parse.urlsplit(url).netloc
+    except ValueError:
+        netloc = ""
+    if not netloc:
+        return tldextract.extract(url)
+    return _tldextract_netloc(netloc)
+
 
 def check_kbart(year: int, archive: dict) -> Optional[bool]:
     if not archive or not archive.get("year_spans"):
@@ -21,6 +45,18 @@ def check_kbart(year: int, archive: dict) -> Optional[bool]:
     return False
 
 
+def test_tldextract_url() -> None:
+
+    for url in (
+        "https://web.archive.org/web/2020/https://example.com/a.pdf",
+        "http://user@www.Example.co.uk:8080/a.pdf",
+        "ftp://ftp.example.com/",
+        "example.com/a.pdf",
+        "http://[::1/bad",
+    ):
+        assert tldextract_url(url) == tldextract.extract(url)
+
+
 def test_check_kbart() -> None:
 
     assert check_kbart(1990, dict()) is None
@@ -642,7 +678,7 @@ def file_to_elasticsearch(entity: FileEntity) -> Dict[str, Any]:
         md5=entity.md5,
     )
 
-    parsed_urls = [tldextract.extract(u.url) for u in entity.urls]
+    parsed_urls = [tldextract_url(u.url) for u in entity.urls]
     t["hosts"] = list(set([".".join([seg for seg in pu if seg]) for pu in parsed_urls]))
     t["domains"] = list(set([pu.registered_domain for pu in parsed_urls]))
     t["rels"] = list(set([u.rel for u in entity.urls]))
@@ -1,5 +1,6 @@
 from .changelog import ChangelogWorker, EntityUpdatesWorker
 from .elasticsearch import (
+    ContainerBrowseWorker,
     ElasticsearchChangelogWorker,
     ElasticsearchContainerWorker,
     ElasticsearchFileWorker,
@@ -2,9 +2,10 @@ import json
 import time
 from typing import Any, Dict, List, Optional
 
-from confluent_kafka import Consumer, KafkaException, Producer
+from confluent_kafka import Consumer, KafkaException
 from fatcat_openapi_client import ApiClient, ReleaseEntity
 
+from fatcat_tools.kafka import kafka_producer
 from fatcat_tools.transforms import release_ingest_request, release_to_elasticsearch
 
 from .worker_common import FatcatWorker, most_recent_message
@@ -50,16 +51,7 @@ class ChangelogWorker(FatcatWorker):
                 # TODO: should it be sys.exit(-1)?
                 raise KafkaException(err)
 
-        producer_conf = self.kafka_config.copy()
-        producer_conf.update(
-            {
-                "delivery.report.only.error": True,
-                "default.topic.config": {
-                    "request.required.acks": -1,  # all brokers must confirm
-                },
-            }
-        )
-        producer = Producer(producer_conf)
+        producer = kafka_producer(self.kafka_config)
 
         while True:
             latest = int(self.api.get_changelog(limit=1)[0].index)
@@ -321,26 +313,29 @@ class EntityUpdatesWorker(FatcatWorker):
         )
         consumer = Consumer(consumer_conf)
 
-        producer_conf = self.kafka_config.copy()
-        producer_conf.update(
-            {
-                "delivery.report.only.error": True,
-                "default.topic.config": {
-                    "request.required.acks": -1,  # all brokers must confirm
-                },
-            }
-        )
-        producer = Producer(producer_conf)
+        producer = kafka_producer(self.kafka_config)
+
+        def store_delivered_offsets() -> None:
+            # changelog messages are only marked as processed once everything
+            # published for them (and for all earlier messages) was delivered
+            for done_msg in producer.completed_checkpoints():
+                consumer.store_offsets(message=done_msg)
+
+        def on_revoke(consumer: Consumer, partitions: List[Any]) -> None:
+            producer.flush()
+            store_delivered_offsets()
+            on_rebalance(consumer, partitions)
 
         consumer.subscribe(
             [self.consume_topic],
             on_assign=on_rebalance,
-            on_revoke=on_rebalance,
+            on_revoke=on_revoke,
         )
         print("Kafka consuming {}".format(self.consume_topic))
 
         while True:
             msg = consumer.poll(self.poll_interval)
+            store_delivered_offsets()
             if not msg:
                 print(
                     "nothing new from kafka (poll_interval: {} sec)".format(self.poll_interval)
@@ -462,6 +457,6 @@ class EntityUpdatesWorker(FatcatWorker):
                     on_delivery=fail_fast,
                 )
 
-            producer.flush()
             # TODO: publish updated 'work' entities to a topic
-            consumer.store_offsets(message=msg)
+            producer.checkpoint(msg)
+            store_delivered_offsets()
@@ -1,10 +1,13 @@
 import json
 import sys
-from typing import Any, Callable, List, Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
 
 import elasticsearch
 import requests
-from confluent_kafka import Consumer, KafkaException
+from confluent_kafka import Consumer, KafkaException, TopicPartition
 from fatcat_openapi_client import (
     ApiClient,
     ChangelogEntry,
@@ -14,6 +17,8 @@ from fatcat_openapi_client import (
 )
 
 from fatcat_tools import entity_from_json, public_api
+from fatcat_tools.kafka import process_partitions
+from fatcat_tools.search.container_browse import container_browse_docs
 from fatcat_tools.search.stats import query_es_container_stats
 from fatcat_tools.transforms import (
     changelog_to_elasticsearch,
@@ -31,6 +36,11 @@ class ElasticsearchReleaseWorker(FatcatWorker):
     elasticsearch.
 
     Uses a consumer group to manage offset.
+
+    With partition_workers > 1, the messages from each partition in a
+    consumed batch are transformed and indexed in a separate thread, with
+    offsets stored per partition. Ordering within a partition (and so for
+    any given entity) is kept.
     """
 
     def __init__(
@@ -45,6 +55,7 @@ class ElasticsearchReleaseWorker(FatcatWorker):
         batch_size: int = 200,
         api_host: str = "https://api.fatcat.wiki/v0",
         query_stats: bool = False,
+        partition_workers: int = 1,
     ) -> None:
         super().__init__(kafka_hosts=kafka_hosts, consume_topic=consume_topic)
         self.consumer_group = "elasticsearch-updates3"
@@ -57,6 +68,7 @@ class ElasticsearchReleaseWorker(FatcatWorker):
         self.transform_func: Callable = release_to_elasticsearch
         self.api_host = api_host
         self.query_stats = query_stats
+        self.partition_workers = partition_workers
 
     def run(self) -> None:
         ac = ApiClient()
@@ -114,6 +126,21 @@ class ElasticsearchReleaseWorker(FatcatWorker):
             on_revoke=on_rebalance,
         )
 
+        executor = None
+        if self.partition_workers > 1:
+            # one thread per partition of each batch; transforms and
+            # elasticsearch requests for different partitions overlap
+            executor = ThreadPoolExecutor(
+                max_workers=self.partition_workers, thread_name_prefix="fatcat-es-partition"
+            )
+
+        def process_partition(_partition: Tuple[str, int], msgs: List[Any]) -> None:
+            self.index_messages(msgs, ac, api, es_client)
+            for msg in msgs:
+                # offsets are *committed* (to brokers) automatically, but need
+                # to be marked as processed here
+                consumer.store_offsets(message=msg)
+
         while True:
             batch = consumer.consume(num_messages=self.batch_size, timeout=self.poll_interval)
             if not batch:
@@ -132,82 +159,91 @@ class ElasticsearchReleaseWorker(FatcatWorker):
                 if msg.error():
                     raise KafkaException(msg.error())
             # ... then process
-            bulk_actions = []
-            for msg in batch:
-                json_str = msg.value().decode("utf-8")
-                entity = entity_from_json(json_str, self.entity_type, api_client=ac)
-                assert isinstance(entity, self.entity_type)
-                if self.entity_type == ChangelogEntry:
-                    key = entity.index
-                    # might need to fetch from API
-                    if not (
-                        entity.editgroup  # pylint: disable=no-member # (TODO)
-                        and entity.editgroup.editor  # pylint: disable=no-member # (TODO)
-                    ):
-                        entity = api.get_changelog_entry(entity.index)
-                else:
-                    key = entity.ident  # pylint: disable=no-member # (TODO)
-
-                if self.entity_type != ChangelogEntry and entity.state == "wip":
-                    print(
-                        f"WARNING: skipping state=wip entity: {self.entity_type.__name__} {entity.ident}",
-                        file=sys.stderr,
-                    )
-                    continue
-
-                if self.entity_type == ContainerEntity and self.query_stats:
-                    stats = query_es_container_stats(
-                        entity.ident,
-                        es_client=es_client,
-                        es_index=self.elasticsearch_release_index,
-                        merge_shadows=True,
-                    )
-                    doc_dict = container_to_elasticsearch(entity, stats=stats)
-                else:
-                    doc_dict = self.transform_func(entity)
-
-                # TODO: handle deletions from index
-                bulk_actions.append(
-                    json.dumps(
-                        {
-                            "index": {
-                                "_id": key,
-                            },
-                        }
-                    )
-                )
-                bulk_actions.append(json.dumps(doc_dict))
-
-            # if only WIP entities, then skip
-            if not bulk_actions:
+            if executor is None:
+                self.index_messages(batch, ac, api, es_client)
                 for msg in batch:
                     consumer.store_offsets(message=msg)
+            else:
+                process_partitions(batch, process_partition, executor)
+
+    def index_messages(
+        self, msgs: List[Any], ac: ApiClient, api: Any, es_client: elasticsearch.Elasticsearch
+    ) -> None:
+        """
+        Transforms a list of Kafka messages and bulk-upserts them to
+        elasticsearch. May be called from several threads at once (for
+        different partitions).
+        """
+        bulk_actions = []
+        for msg in msgs:
+            json_str = msg.value().decode("utf-8")
+            entity = entity_from_json(json_str, self.entity_type, api_client=ac)
+            assert isinstance(entity, self.entity_type)
+            if self.entity_type == ChangelogEntry:
+                key = entity.index
+                # might need to fetch from API
+                if not (
+                    entity.editgroup  # pylint: disable=no-member # (TODO)
+                    and entity.editgroup.editor  # pylint: disable=no-member # (TODO)
+                ):
+                    entity = api.get_changelog_entry(entity.index)
+            else:
+                key = entity.ident  # pylint: disable=no-member # (TODO)
+
+            if self.entity_type != ChangelogEntry and entity.state == "wip":
+                print(
+                    f"WARNING: skipping state=wip entity: {self.entity_type.__name__} {entity.ident}",
+                    file=sys.stderr,
+                )
                 continue
 
-            print(
-                "Upserting, eg, {} (of {} {} in elasticsearch)".format(
-                    key, len(batch), self.entity_type.__name__
-                ),
-                file=sys.stderr,
-            )
-            elasticsearch_endpoint = "{}/{}/_bulk".format(
-                self.elasticsearch_backend, self.elasticsearch_index
-            )
-            resp = requests.post(
-                elasticsearch_endpoint,
-                headers={"Content-Type": "application/x-ndjson"},
-                data="\n".join(bulk_actions) + "\n",
+            if self.entity_type == ContainerEntity and self.query_stats:
+                stats = query_es_container_stats(
+                    entity.ident,
+                    es_client=es_client,
+                    es_index=self.elasticsearch_release_index,
+                    merge_shadows=True,
+                )
+                doc_dict = container_to_elasticsearch(entity, stats=stats)
+            else:
+                doc_dict = self.transform_func(entity)
+
+            # TODO: handle deletions from index
+            bulk_actions.append(
+                json.dumps(
+                    {
+                        "index": {
+                            "_id": key,
+                        },
+                    }
+                )
             )
-            resp.raise_for_status()
-            if resp.json()["errors"]:
-                desc = "Elasticsearch errors from post to {}:".format(elasticsearch_endpoint)
-                print(desc, file=sys.stderr)
-                print(resp.content, file=sys.stderr)
-                raise Exception(desc)
-            for msg in batch:
-                # offsets are *committed* (to brokers) automatically, but need
-                # to be marked as processed here
-                consumer.store_offsets(message=msg)
+            bulk_actions.append(json.dumps(doc_dict))
+
+        # if only WIP entities, then skip
+        if not bulk_actions:
+            return
+
+        print(
+            "Upserting, eg, {} (of {} {} in elasticsearch)".format(
+                key, len(msgs), self.entity_type.__name__
+            ),
+            file=sys.stderr,
+        )
+        elasticsearch_endpoint = "{}/{}/_bulk".format(
+            self.elasticsearch_backend, self.elasticsearch_index
+        )
+        resp = requests.post(
+            elasticsearch_endpoint,
+            headers={"Content-Type": "application/x-ndjson"},
+            data="\n".join(bulk_actions) + "\n",
+        )
+        resp.raise_for_status()
+        if resp.json()["errors"]:
+            desc = "Elasticsearch errors from post to {}:".format(elasticsearch_endpoint)
+            print(desc, file=sys.stderr)
+            print(resp.content, file=sys.stderr)
+            raise Exception(desc)
 
 
 class ElasticsearchContainerWorker(ElasticsearchReleaseWorker):
@@ -222,6 +258,7 @@ class ElasticsearchContainerWorker(ElasticsearchReleaseWorker):
         elasticsearch_backend: str = "http://localhost:9200",
         elasticsearch_index: str = "fatcat_container",
         batch_size: int = 200,
+        partition_workers: int = 1,
     ):
         super().__init__(
             kafka_hosts=kafka_hosts,
@@ -233,6 +270,7 @@ class ElasticsearchContainerWorker(ElasticsearchReleaseWorker):
             elasticsearch_release_index=elasticsearch_release_index,
             query_stats=query_stats,
             batch_size=batch_size,
+            partition_workers=partition_workers,
         )
         # previous group got corrupted (by pykafka library?)
         self.consumer_group = "elasticsearch-updates3"
@@ -250,6 +288,7 @@ class ElasticsearchFileWorker(ElasticsearchReleaseWorker):
         elasticsearch_backend: str = "http://localhost:9200",
         elasticsearch_index: str = "fatcat_file",
         batch_size: int = 200,
+        partition_workers: int = 1,
     ):
         super().__init__(
             kafka_hosts=kafka_hosts,
@@ -259,6 +298,7 @@ class ElasticsearchFileWorker(ElasticsearchReleaseWorker):
             elasticsearch_backend=elasticsearch_backend,
             elasticsearch_index=elasticsearch_index,
             batch_size=batch_size,
+            partition_workers=partition_workers,
         )
         # previous group got corrupted (by pykafka library?)
         self.consumer_group = "elasticsearch-updates3"
@@ -283,8 +323,13 @@ class ElasticsearchChangelogWorker(ElasticsearchReleaseWorker):
         elasticsearch_backend: str = "http://localhost:9200",
         elasticsearch_index: str = "fatcat_changelog",
         batch_size: int = 200,
+        partition_workers: int = 1,
     ):
-        super().__init__(kafka_hosts=kafka_hosts, consume_topic=consume_topic)
+        super().__init__(
+            kafka_hosts=kafka_hosts,
+            consume_topic=consume_topic,
+            partition_workers=partition_workers,
+        )
         self.consumer_group = "elasticsearch-updates3"
         self.batch_size = batch_size
         self.poll_interval = poll_interval
@@ -292,3 +337,183 @@ class ElasticsearchChangelogWorker(ElasticsearchReleaseWorker):
         self.elasticsearch_index = elasticsearch_index
         self.entity_type = ChangelogEntry
         self.transform_func = changelog_to_elasticsearch
+
+
+class ContainerBrowseWorker(ElasticsearchReleaseWorker):
+    """
+    Consumes from the release-updates topic and keeps the precomputed
+    container browse index (see fatcat_tools.search.container_browse)
+    current: for every container with updated releases in a batch, the
+    container tree document, and the table of contents documents of the
+    affected issues, are rebuilt from the release index.
+
+    Documents are built from the release index, so this runs alongside the
+    release elasticsearch worker (with its own consumer group), and before
+    rebuilding waits until that worker's consumer group has committed
+    offsets past the batch (release_consumer_group; it only stores offsets
+    once releases are indexed), then refreshes the release index. If that
+    takes longer than release_wait_timeout seconds, the batch fails.
+
+    Containers which had no updates since this worker started have no
+    documents; see backfill().
+    """
+
+    def __init__(
+        self,
+        kafka_hosts: str,
+        consume_topic: str,
+        poll_interval: float = 10.0,
+        offset: Optional[int] = None,
+        elasticsearch_backend: str = "http://localhost:9200",
+        elasticsearch_index: str = "fatcat_container_browse",
+        elasticsearch_release_index: str = "fatcat_release",
+        batch_size: int = 200,
+        partition_workers: int = 1,
+        refresh_release_index: bool = True,
+        release_consumer_group: Optional[str] = "elasticsearch-updates3",
+        release_wait_timeout: float = 45.0,
+    ):
+        super().__init__(
+            kafka_hosts=kafka_hosts,
+            consume_topic=consume_topic,
+            poll_interval=poll_interval,
+            offset=offset,
+            elasticsearch_backend=elasticsearch_backend,
+            elasticsearch_index=elasticsearch_index,
+            elasticsearch_release_index=elasticsearch_release_index,
+            batch_size=batch_size,
+            partition_workers=partition_workers,
+        )
+        self.consumer_group = "container-browse-updates"
+        self.refresh_release_index = refresh_release_index
+        self.release_consumer_group = release_consumer_group
+        # kept below the consumer's max.poll.interval.ms
+        self.release_wait_timeout = release_wait_timeout
+        self._release_offsets: Optional[Consumer] = None
+        self._release_offsets_lock = threading.Lock()
+
+    def wait_for_release_worker(self, msgs: List[Any]) -> None:
+        """
+        Blocks until the release worker's consumer group has committed offsets
+        past all of 'msgs' (so those releases are in the release index).
+        """
+        if not self.release_consumer_group:
+            return
+        needed: Dict[Tuple[str, int], int] = dict()
+        for msg in msgs:
+            key = (msg.topic(), msg.partition())
+            needed[key] = max(needed.get(key, 0), msg.offset() + 1)
+        with self._release_offsets_lock:
+            if self._release_offsets is None:
+                # never subscribes, so doesn't join (or commit for) the group;
+                # only used to look up its committed offsets
+                conf = self.kafka_config.copy()
+                conf.update(
+                    {"group.id": self.release_consumer_group, "enable.auto.commit": False}
+                )
+                self._release_offsets = Consumer(conf)
+            watcher = self._release_offsets
+        deadline = time.monotonic() + self.release_wait_timeout
+        while True:
+            committed = watcher.committed(
+                [TopicPartition(t, p) for (t, p) in needed.keys()], timeout=10.0
+            )
+            behind = [tp for tp in committed if tp.offset < needed[(tp.topic, tp.partition)]]
+            if not behind:
+                return
+            if time.monotonic() >= deadline:
+                raise Exception(
+                    "release worker (consumer group {}) hasn't caught up: {}".format(
+                        self.release_consumer_group, behind
+                    )
+                )
+            time.sleep(1.0)
+
+    def index_messages(
+        self, msgs: List[Any], ac: ApiClient, api: Any, es_client: elasticsearch.Elasticsearch
+    ) -> None:
+        """
+        Rebuilds browse documents for all containers touched by a list of
+        release update messages, and bulk-upserts them.
+        """
+        touched: Dict[str, Set[Tuple[int, Optional[str], Optional[str]]]] = dict()
+        for msg in msgs:
+            json_str = msg.value().decode("utf-8")
+            release = entity_from_json(json_str, ReleaseEntity, api_client=ac)
+            assert isinstance(release, ReleaseEntity)
+            if release.state == "wip" or not release.container_id:
+                continue
+            issues = touched.setdefault(release.container_id, set())
+            if release.release_year:
+                issues.add(
+                    (release.release_year, release.volume or None, release.issue or None)
+                )
+
+        if not touched:
+            return
+
+        self.wait_for_release_worker(msgs)
+        if self.refresh_release_index:
+            es_client.indices.refresh(index=self.elasticsearch_release_index)
+
+        bulk_actions = []
+        for container_id, issues in touched.items():
+            for doc_id, doc in container_browse_docs(
+                container_id,
+                es_client=es_client,
+                es_index=self.elasticsearch_release_index,
+                issues=list(issues),
+            ):
+                bulk_actions.append(json.dumps({"index": {"_id": doc_id}}))
+                bulk_actions.append(json.dumps(doc))
+
+        print(
+            "Upserting {} browse docs for {} containers (of {} releases)".format(
+                len(bulk_actions) // 2, len(touched), len(msgs)
+            ),
+            file=sys.stderr,
+        )
+        self.bulk_upsert(bulk_actions)
+
+    def bulk_upsert(self, bulk_actions: List[str]) -> None:
+        elasticsearch_endpoint = "{}/{}/_bulk".format(
+            self.elasticsearch_backend, self.elasticsearch_index
+        )
+        resp = requests.post(
+            elasticsearch_endpoint,
+            headers={"Content-Type": "application/x-ndjson"},
+            data="\n".join(bulk_actions) + "\n",
+        )
+        resp.raise_for_status()
+        if resp.json()["errors"]:
+            desc = "Elasticsearch errors from post to {}:".format(elasticsearch_endpoint)
+            print(desc, file=sys.stderr)
+            print(resp.content, file=sys.stderr)
+            raise Exception(desc)
+
+    def backfill(self, idents: Iterable[str], batch_size: int = 50) -> int:
+        """
+        Builds complete browse documents (tree, and every issue's table of
+        contents) for the given containers, eg for all containers when first
+        setting up the browse index. Returns the number of containers.
+        """
+        es_client = elasticsearch.Elasticsearch(self.elasticsearch_backend)
+        count = 0
+        bulk_actions: List[str] = []
+        for ident in idents:
+            ident = ident.strip()
+            if not ident:
+                continue
+            for doc_id, doc in container_browse_docs(
+                ident, es_client=es_client, es_index=self.elasticsearch_release_index
+            ):
+                bulk_actions.append(json.dumps({"index": {"_id": doc_id}}))
+                bulk_actions.append(json.dumps(doc))
+            count += 1
+            if count % batch_size == 0:
+                self.bulk_upsert(bulk_actions)
+                bulk_actions = []
+                print("... {} containers".format(count), file=sys.stderr)
+        if bulk_actions:
+            self.bulk_upsert(bulk_actions)
+        return count
@@ -13,10 +13,23 @@ import elasticsearch
 from fatcat_openapi_client import ChangelogEntry, ContainerEntity, FileEntity, ReleaseEntity
 
 from fatcat_tools import public_api
+from fatcat_tools.importers import (
+    IdentSnapshot,
+    build_ident_snapshot_from_elasticsearch,
+    build_ident_snapshot_from_json,
+    build_known_dois_from_json,
+)
 from fatcat_tools.search.stats import query_es_container_stats
+from fatcat_tools.sitemap import (
+    SITEMAP_HOST,
+    build_sitemap,
+    sitemap_idents_from_elasticsearch,
+    sitemap_idents_from_json,
+    update_sitemap_from_changelog,
+)
 from fatcat_tools.transforms import (
     changelog_to_elasticsearch,
-    citeproc_csl,
+    citeproc_csl_batch,
     container_to_elasticsearch,
     entity_from_json,
     file_to_elasticsearch,
@@ -84,6 +97,13 @@ def run_elasticsearch_changelogs(args: argparse.Namespace) -> None:
 
 
 def run_citeproc_releases(args: argparse.Namespace) -> None:
+    batch = []
+
+    def flush() -> None:
+        for out in citeproc_csl_batch(batch, args.style, args.html):
+            args.json_output.write(out + "\n")
+        batch.clear()
+
     for line in args.json_input:
         line = line.strip()
         if not line:
@@ -93,8 +113,76 @@ def run_citeproc_releases(args: argparse.Namespace) -> None:
             continue
         csl_json = release_to_csl(entity)
         csl_json["id"] = "release:" + (entity.ident or "unknown")
-        out = citeproc_csl(csl_json, args.style, args.html)
-        args.json_output.write(out + "\n")
+        batch.append(csl_json)
+        if len(batch) >= 500:
+            flush()
+    if batch:
+        flush()
+
+
+def run_ident_snapshot(args: argparse.Namespace) -> None:
+    snapshot = IdentSnapshot(args.snapshot_file, writable=True)
+    if args.from_elasticsearch:
+        es_client = elasticsearch.Elasticsearch(args.fatcat_elasticsearch_url, timeout=120.0)
+        counts = build_ident_snapshot_from_elasticsearch(
+            snapshot,
+            args.entity_type,
+            es_client,
+            args.elasticsearch_index or "fatcat_{}".format(args.entity_type),
+        )
+    else:
+        counts = build_ident_snapshot_from_json(snapshot, args.entity_type, args.json_input)
+    print(counts, file=sys.stderr)
+    print("Snapshot contents: {}".format(snapshot.counts()), file=sys.stderr)
+    snapshot.close()
+
+
+def run_known_dois(args: argparse.Namespace) -> None:
+    known = build_known_dois_from_json(
+        args.json_input,
+        args.capacity,
+        error_rate=args.error_rate,
+        changelog_index=args.changelog_index,
+    )
+    known.save(args.output_file)
+    print(
+        "Added {} DOIs ({} bits, {} hashes)".format(
+            known.bloom.count, known.bloom.num_bits, known.bloom.num_hashes
+        ),
+        file=sys.stderr,
+    )
+
+
+def run_sitemap(args: argparse.Namespace) -> None:
+    changelog_index = args.changelog_index
+    if args.from_elasticsearch:
+        if changelog_index is None:
+            # the index is (at most) this far along
+            changelog_index = args.api.get_changelog(limit=1)[0].index
+        es_client = elasticsearch.Elasticsearch(args.fatcat_elasticsearch_url, timeout=120.0)
+        idents = sitemap_idents_from_elasticsearch(
+            args.entity_type,
+            es_client,
+            args.elasticsearch_index or "fatcat_{}".format(args.entity_type),
+        )
+    else:
+        idents = sitemap_idents_from_json(args.entity_type, args.json_input)
+    counts = build_sitemap(
+        args.entity_type,
+        idents,
+        args.output_dir,
+        host=args.host,
+        prefix_len=args.prefix_len,
+        changelog_index=changelog_index,
+    )
+    print(counts, file=sys.stderr)
+
+
+def run_sitemap_update(args: argparse.Namespace) -> None:
+    counts = update_sitemap_from_changelog(
+        args.api, args.entity_type, args.output_dir, max_entries=args.max_entries
+    )
+    print(counts, file=sys.stderr)
 
 
 def main() -> None:
@@ -210,6 +298,147 @@ def main() -> None:
         "--html", action="store_true", help="output HTML, not plain text"
     )
 
+    sub_ident_snapshot = subparsers.add_parser(
+        "ident-snapshot",
+        help="build (or extend) a local identifier-to-ident snapshot file, for use by importers",
+    )
+    sub_ident_snapshot.set_defaults(func=run_ident_snapshot)
+    sub_ident_snapshot.add_argument(
+        "entity_type",
+        help="type of entities being read",
+        choices=["container", "creator", "release"],
+    )
+    sub_ident_snapshot.add_argument(
+        "snapshot_file",
+        help="sqlite3 snapshot file to create or update",
+        type=str,
+    )
+    sub_ident_snapshot.add_argument(
+        "--json-input",
+        help="JSON-per-line of entities (eg, bulk export)",
+        default=sys.stdin,
+        type=argparse.FileType("r"),
+    )
+    sub_ident_snapshot.add_argument(
+        "--from-elasticsearch",
+        action="store_true",
+        help="scroll through the elasticsearch index instead of reading JSON",
+    )
+    sub_ident_snapshot.add_argument(
+        "--elasticsearch-index",
+        help="elasticsearch index to scroll (default: fatcat_<entity_type>)",
+        default=None,
+        type=str,
+    )
+
+    sub_known_dois = subparsers.add_parser(
+        "known-dois",
+        help="build a known-DOI filter file from a release export, for use by crossref/datacite importers",
+    )
+    sub_known_dois.set_defaults(func=run_known_dois)
+    sub_known_dois.add_argument(
+        "output_file",
+        help="filter file to write",
+        type=str,
+    )
+    sub_known_dois.add_argument(
+        "--json-input",
+        help="JSON-per-line of release entities (eg, bulk export)",
+        default=sys.stdin,
+        type=argparse.FileType("r"),
+    )
+    sub_known_dois.add_argument(
+        "--capacity",
+        help="expected number of DOIs, including future growth",
+        default=250000000,
+        type=int,
+    )
+    sub_known_dois.add_argument(
+        "--error-rate",
+        help="false-positive rate at capacity (new DOIs which will be wrongly skipped)",
+        default=1e-6,
+        type=float,
+    )
+    sub_known_dois.add_argument(
+        "--changelog-index",
+        help="changelog index the export was made at; importers refresh from here (default: head of changelog at first refresh)",
+        default=None,
+        type=int,
+    )
+
+    sub_sitemap = subparsers.add_parser(
+        "sitemap",
+        help="build sharded, gzipped sitemap URL lists (and a sitemap index) for all containers or releases",
+    )
+    sub_sitemap.set_defaults(func=run_sitemap)
+    sub_sitemap.add_argument(
+        "entity_type",
+        help="type of entities being read",
+        choices=["container", "release"],
+    )
+    sub_sitemap.add_argument(
+        "output_dir",
+        help="directory to write sitemap files to (and which is served to crawlers)",
+        type=str,
+    )
+    sub_sitemap.add_argument(
+        "--json-input",
+        help="JSON-per-line of entities (eg, bulk export)",
+        default=sys.stdin,
+        type=argparse.FileType("r"),
+    )
+    sub_sitemap.add_argument(
+        "--from-elasticsearch",
+        action="store_true",
+        help="scroll through the elasticsearch index instead of reading JSON",
+    )
+    sub_sitemap.add_argument(
+        "--elasticsearch-index",
+        help="elasticsearch index to scroll (default: fatcat_<entity_type>)",
+        default=None,
+        type=str,
+    )
+    sub_sitemap.add_argument(
+        "--host",
+        help="base URL of sitemap and entity URLs",
+        default=SITEMAP_HOST,
+        type=str,
+    )
+    sub_sitemap.add_argument(
+        "--prefix-len",
+        help="ident characters per shard name (default: 1 for containers, 3 for releases)",
+        default=None,
+        type=int,
+    )
+    sub_sitemap.add_argument(
+        "--changelog-index",
+        help="changelog index the input is current as of; sitemap-update continues from here (default: head of changelog, for elasticsearch)",
+        default=None,
+        type=int,
+    )
+
+    sub_sitemap_update = subparsers.add_parser(
+        "sitemap-update",
+        help="update sitemap URL lists built by 'sitemap' with changes from the changelog",
+    )
+    sub_sitemap_update.set_defaults(func=run_sitemap_update)
+    sub_sitemap_update.add_argument(
+        "entity_type",
+        help="type of entities to update",
+        choices=["container", "release"],
+    )
+    sub_sitemap_update.add_argument(
+        "output_dir",
+        help="directory of sitemap files to update",
+        type=str,
+    )
+    sub_sitemap_update.add_argument(
+        "--max-entries",
+        help="max changelog entries to process in this run (default: all)",
+        default=None,
+        type=int,
+    )
+
     args = parser.parse_args()
     if not args.__dict__.get("func"):
         print("tell me what to do!")
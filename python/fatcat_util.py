@@ -8,9 +8,17 @@ TODO:
 """
 
 import argparse
+import json
+import multiprocessing
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
 
-from fatcat_tools import authenticated_api, fcid2uuid, uuid2fcid
+from fatcat_openapi_client import ApiClient, ReleaseEntity
+
+from fatcat_tools import authenticated_api, entity_from_json, fcid2uuid, uuid2fcid
+from fatcat_tools.importers.fuzzy_match import benchmark_fuzzy_verify
+from fatcat_tools.kafka import benchmark_kafka_producer
 
 
 def run_uuid2fcid(args: argparse.Namespace) -> None:
@@ -30,6 +38,45 @@ def run_editgroup_submit(args: argparse.Namespace) -> None:
     args.api.update_editgroup(args.editgroup_id, eg, submit=True)
 
 
+def run_kafka_benchmark(args: argparse.Namespace) -> None:
+    messages = [line.strip().encode("utf-8") for line in args.json_file if line.strip()]
+    kafka_config: Dict[str, Any] = dict()
+    if args.kafka_hosts:
+        kafka_config["bootstrap.servers"] = args.kafka_hosts
+    flush_policies: List[Optional[int]] = [None]
+    if args.flush_every:
+        flush_policies.insert(0, args.flush_every)
+    for compression in args.compression.split(","):
+        for flush_every in flush_policies:
+            stats = benchmark_kafka_producer(
+                kafka_config,
+                args.topic,
+                messages,
+                args.num_messages,
+                compression=compression,
+                linger_ms=args.linger_ms,
+                flush_every=flush_every,
+            )
+            print(json.dumps(stats))
+
+
+def run_fuzzy_benchmark(args: argparse.Namespace) -> None:
+    api_client = ApiClient()
+    releases = [
+        entity_from_json(line, ReleaseEntity, api_client=api_client)
+        for line in args.json_file
+        if line.strip()
+    ]
+    print(json.dumps(benchmark_fuzzy_verify(releases, api_client, rounds=args.rounds)))
+    if args.workers:
+        with ProcessPoolExecutor(
+            max_workers=args.workers, mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            stats = benchmark_fuzzy_verify(releases, api_client, pool=pool, rounds=args.rounds)
+        stats["workers"] = args.workers
+        print(json.dumps(stats))
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument(
@@ -61,12 +108,69 @@ def main() -> None:
     sub_editgroup_submit.set_defaults(func=run_editgroup_submit)
     sub_editgroup_submit.add_argument("editgroup_id", help="editgroup to submit")
 
+    sub_kafka_benchmark = subparsers.add_parser(
+        "kafka-benchmark",
+        help="measure Kafka producer throughput for sample JSON messages, with and without compression and per-unit flushes",
+    )
+    sub_kafka_benchmark.set_defaults(func=run_kafka_benchmark, no_api=True)
+    sub_kafka_benchmark.add_argument(
+        "json_file",
+        help="sample messages (eg, expanded release entities), as JSON lines",
+        type=argparse.FileType("r"),
+    )
+    sub_kafka_benchmark.add_argument(
+        "--kafka-hosts",
+        default=None,
+        help="Kafka brokers to benchmark against (default: in-process mock broker)",
+    )
+    sub_kafka_benchmark.add_argument(
+        "--topic", default="fatcat-benchmark", help="Kafka topic to produce to"
+    )
+    sub_kafka_benchmark.add_argument(
+        "--num-messages", default=100000, type=int, help="number of messages to produce"
+    )
+    sub_kafka_benchmark.add_argument(
+        "--compression",
+        default="none,lz4,zstd",
+        help="comma-separated compression types to compare",
+    )
+    sub_kafka_benchmark.add_argument(
+        "--linger-ms", default=50, type=int, help="producer linger.ms setting"
+    )
+    sub_kafka_benchmark.add_argument(
+        "--flush-every",
+        default=20,
+        type=int,
+        help="also run with a flush after this many messages (the old per-unit-of-work behavior)",
+    )
+
+    sub_fuzzy_benchmark = subparsers.add_parser(
+        "fuzzy-benchmark",
+        help="measure fuzzy match verification throughput, verifying sample releases against each other",
+    )
+    sub_fuzzy_benchmark.set_defaults(func=run_fuzzy_benchmark, no_api=True)
+    sub_fuzzy_benchmark.add_argument(
+        "json_file",
+        help="sample release entities, as JSON lines (eg, tests/files/example_releases_pubmed19n0972.json)",
+        type=argparse.FileType("r"),
+    )
+    sub_fuzzy_benchmark.add_argument(
+        "--rounds", default=10, type=int, help="number of times to verify every pair"
+    )
+    sub_fuzzy_benchmark.add_argument(
+        "--workers",
+        default=4,
+        type=int,
+        help="also run with a pool of this many verify processes (0 to skip)",
+    )
+
     args = parser.parse_args()
     if not args.__dict__.get("func"):
         print("tell me what to do!")
         sys.exit(-1)
 
-    args.api = authenticated_api(args.fatcat_api_url)
+    if not args.__dict__.get("no_api"):
+        args.api = authenticated_api(args.fatcat_api_url)
     args.func(args)
 
 
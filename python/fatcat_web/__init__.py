@@ -15,6 +15,7 @@ from flask_uuid import FlaskUUID
 from flask_wtf.csrf import CSRFProtect
 from loginpass import GitHub, Gitlab, ORCiD, create_flask_blueprint
 from sentry_sdk.integrations.flask import FlaskIntegration
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 from fatcat_web.types import AnyResponse
 from fatcat_web.web_config import Config  # type: ignore
@@ -25,6 +26,9 @@ toolbar = DebugToolbarExtension()
 # csrf). Should refactor to make this separate globals and not inject them
 app: Any = Flask(__name__, static_url_path="/static")
 app.config.from_object(Config)
+if Config.PROXY_FIX_X_FOR:
+    # trust X-Forwarded-For from exactly this many proxy hops, for remote_addr
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=Config.PROXY_FIX_X_FOR)
 toolbar = DebugToolbarExtension(app)
 FlaskUUID(app)
 app.csrf = CSRFProtect(app)
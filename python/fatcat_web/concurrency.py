@@ -0,0 +1,69 @@
+"""
+Concurrent upstream calls for web views, and gevent support.
+
+Most views are a handful of blocking calls to the fatcat API and
+elasticsearch. fan_out() makes independent calls concurrently, from a shared
+pool, so the slowest call (not the sum of all calls) sets the response time.
+Calls run in a copy of the current request context, so they can use flask
+globals (like current_user) as they would in the view itself.
+
+Views which make the same call for a list of things (eg, editgroup diffs,
+batch reference matching, bulk release lookups) use view_pool.map() directly.
+Code which may itself be running in view_pool (inside a fan_out() call) uses
+nested_pool instead. Both pools are sized by VIEW_FANOUT_WORKERS config.
+
+With the default uwsgi configuration (processes and threads), every in-flight
+request holds a thread for as long as its upstream calls take. For more
+in-flight requests per process, the web interface can instead be run with
+gevent (see fatcat_web_gevent and uwsgi_gevent.ini): the standard
+library is monkey-patched before anything else is imported, so the API,
+elasticsearch and kafka-pixy HTTP clients yield to other requests while
+waiting on the network. The fan_out() pool then runs greenlets instead of OS
+threads.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List
+
+from flask import copy_current_request_context, has_request_context
+
+from fatcat_web.web_config import Config  # type: ignore
+
+VIEW_FANOUT_WORKERS: int = Config.VIEW_FANOUT_WORKERS
+view_pool = ThreadPoolExecutor(
+    max_workers=VIEW_FANOUT_WORKERS, thread_name_prefix="fatcat-web-view"
+)
+# waiting on view_pool from inside it can deadlock under load (all workers
+# waiting on queued calls), so nested fan-out gets its own pool
+nested_pool = ThreadPoolExecutor(
+    max_workers=VIEW_FANOUT_WORKERS, thread_name_prefix="fatcat-web-nested"
+)
+
+
+def gevent_patched() -> bool:
+    """
+    Whether the process has been monkey-patched by gevent.
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("socket")
+
+
+def fan_out(*calls: Callable[[], Any]) -> List[Any]:
+    """
+    Runs the given no-argument callables concurrently, and returns their
+    results in order. If any call raises an exception, the first (in order)
+    is re-raised, once all calls have finished.
+
+    Calls must not use fan_out() or view_pool themselves (see nested_pool).
+    """
+    if len(calls) <= 1:
+        return [c() for c in calls]
+    if has_request_context():
+        calls = tuple(copy_current_request_context(c) for c in calls)
+    futures = [view_pool.submit(c) for c in calls]
+    for f in futures:
+        f.exception()
+    return [f.result() for f in futures]
@@ -1,5 +1,5 @@
 import difflib
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 from fatcat_openapi_client import (
     ContainerEntity,
@@ -16,6 +16,7 @@ from fatcat_openapi_client import (
 from fatcat_openapi_client.rest import ApiException, ApiValueError
 from flask import abort
 
+from fatcat_tools.cache import LRUCache
 from fatcat_tools.transforms import (
     container_to_elasticsearch,
     entity_to_toml,
@@ -23,14 +24,84 @@ from fatcat_tools.transforms import (
     release_to_elasticsearch,
 )
 from fatcat_web import api
+from fatcat_web.concurrency import view_pool
 from fatcat_web.hacks import strip_extlink_xml, wayback_suffix
 
+# revisions are immutable, so TOML serializations of revisions, and diffs
+# between them, can be cached for the life of the process. Release revisions
+# with refs can be very large, so memory use is bounded by the total length
+# (in characters) of cached lines, not just by count, and single revisions or
+# diffs longer than REVISION_CACHE_MAX_ITEM_CHARS aren't cached at all
+REVISION_TOML_CACHE_SIZE: int = 500
+REVISION_TOML_CACHE_MAX_CHARS: int = 50_000_000
+REVISION_DIFF_CACHE_SIZE: int = 1000
+REVISION_DIFF_CACHE_MAX_CHARS: int = 20_000_000
+REVISION_CACHE_MAX_ITEM_CHARS: int = 500_000
+# elasticsearch-style docs computed for release and container views (entity
+# '_es' fields) are cached by the revisions they were computed from
+ENTITY_ES_CACHE_SIZE: int = 5000
+
+
+# cached docs are shared between requests, and must not be modified
+entity_es_cache = LRUCache(max_size=ENTITY_ES_CACHE_SIZE)
+
+
+def _lines_length(lines: Tuple[str, ...]) -> int:
+    return sum(len(line) for line in lines)
+
+
+revision_toml_cache = LRUCache(
+    max_size=REVISION_TOML_CACHE_SIZE,
+    weigh=_lines_length,
+    max_weight=REVISION_TOML_CACHE_MAX_CHARS,
+    max_item_weight=REVISION_CACHE_MAX_ITEM_CHARS,
+)
+revision_diff_cache = LRUCache(
+    max_size=REVISION_DIFF_CACHE_SIZE,
+    weigh=_lines_length,
+    max_weight=REVISION_DIFF_CACHE_MAX_CHARS,
+    max_item_weight=REVISION_CACHE_MAX_ITEM_CHARS,
+)
+
+
+def _revisions_key(entities: Optional[List[Any]]) -> Tuple[Any, ...]:
+    return tuple((e.ident, e.revision, e.state) for e in entities or [])
+
+
+def _release_es_key(entity: ReleaseEntity) -> Optional[Tuple[Any, ...]]:
+    """
+    The release elasticsearch doc also depends on expanded sub-entities
+    (container, files, etc, and creators), which can change without the
+    release revision changing. None if the release has no revision.
+    """
+    if not entity.revision:
+        return None
+    return (
+        "release",
+        entity.ident,
+        entity.revision,
+        _revisions_key([entity.container] if entity.container else []),
+        _revisions_key(entity.files),
+        _revisions_key(entity.filesets),
+        _revisions_key(entity.webcaptures),
+        _revisions_key([c.creator for c in entity.contribs or [] if c.creator]),
+    )
+
+
+def _container_es_doc(entity: ContainerEntity) -> Dict[str, Any]:
+    if not entity.revision:
+        return container_to_elasticsearch(entity, force_bool=False)
+    return entity_es_cache.get_or_compute(
+        ("container", entity.ident, entity.revision),
+        lambda: container_to_elasticsearch(entity, force_bool=False),
+    )
+
 
 def enrich_container_entity(entity: ContainerEntity) -> ContainerEntity:
     if entity.state in ("redirect", "deleted"):
         return entity
     if entity.state == "active":
-        entity._es = container_to_elasticsearch(entity, force_bool=False)
+        entity._es = _container_es_doc(entity)
     return entity
 
 
@@ -69,9 +140,15 @@ def enrich_release_entity(entity: ReleaseEntity) -> ReleaseEntity:
     if entity.state in ("redirect", "deleted"):
         return entity
     if entity.state == "active":
-        entity._es = release_to_elasticsearch(entity, force_bool=False)
+        es_key = _release_es_key(entity)
+        if es_key:
+            entity._es = entity_es_cache.get_or_compute(
+                es_key, lambda: release_to_elasticsearch(entity, force_bool=False)
+            )
+        else:
+            entity._es = release_to_elasticsearch(entity, force_bool=False)
     if entity.container and entity.container.state == "active":
-        entity.container._es = container_to_elasticsearch(entity.container, force_bool=False)
+        entity.container._es = _container_es_doc(entity.container)
     if entity.files:
         # remove shadows-only files with no URLs
         entity.files = [
@@ -304,42 +381,67 @@ def generic_get_editgroup_entity(
     return entity, edit
 
 
-def _entity_edit_diff(entity_type: str, entity_edit: EntityEdit) -> List[str]:
-    """
-    Helper to generate diff lines for a single entity edit.
+def _revision_toml_lines(entity_type: str, revision_id: str) -> Tuple[str, ...]:
+    return revision_toml_cache.get_or_compute(
+        (entity_type, revision_id),
+        lambda: _compute_revision_toml_lines(entity_type, revision_id),
+    )
 
-    Schema of entity_edit (as a reminder):
 
-        entity_edit
-            ident
-            revision
-            prev_revision
-            redirect_ident
-    """
+def _compute_revision_toml_lines(entity_type: str, revision_id: str) -> Tuple[str, ...]:
     pop_fields = ["ident", "revision", "state"]
-    new_rev = generic_get_entity_revision(entity_type, entity_edit.revision, enrich=False)
-    new_toml = entity_to_toml(new_rev, pop_fields=pop_fields).strip().split("\n")
-    if len(new_toml) == 1 and not new_toml[0].strip():
-        new_toml = []
-    if entity_edit.prev_revision:
-        old_rev = generic_get_entity_revision(
-            entity_type, entity_edit.prev_revision, enrich=False
-        )
-        old_toml = entity_to_toml(old_rev, pop_fields=pop_fields).strip().split("\n")
-        fromdesc = f"/{entity_type}/rev/{entity_edit.prev_revision}.toml"
+    rev = generic_get_entity_revision(entity_type, revision_id, enrich=False)
+    toml_lines = entity_to_toml(rev, pop_fields=pop_fields).strip().split("\n")
+    if len(toml_lines) == 1 and not toml_lines[0].strip():
+        return ()
+    return tuple(toml_lines)
+
+
+def _revision_diff(
+    entity_type: str, prev_revision: Optional[str], revision: str
+) -> Tuple[str, ...]:
+    return revision_diff_cache.get_or_compute(
+        (entity_type, prev_revision, revision),
+        lambda: _compute_revision_diff(entity_type, prev_revision, revision),
+    )
+
+
+def _compute_revision_diff(
+    entity_type: str, prev_revision: Optional[str], revision: str
+) -> Tuple[str, ...]:
+    new_toml = _revision_toml_lines(entity_type, revision)
+    if prev_revision:
+        old_toml = _revision_toml_lines(entity_type, prev_revision)
+        fromdesc = f"/{entity_type}/rev/{prev_revision}.toml"
     else:
-        old_toml = []
+        old_toml = ()
         fromdesc = "(created)"
 
-    diff_lines = list(
+    return tuple(
         difflib.unified_diff(
             old_toml,
             new_toml,
             fromfile=fromdesc,
-            tofile=f"/{entity_type}/rev/{entity_edit.revision}.toml",
+            tofile=f"/{entity_type}/rev/{revision}.toml",
         )
     )
-    return diff_lines
+
+
+def _entity_edit_diff(entity_type: str, entity_edit: EntityEdit) -> List[str]:
+    """
+    Helper to generate diff lines for a single entity edit.
+
+    Schema of entity_edit (as a reminder):
+
+        entity_edit
+            ident
+            revision
+            prev_revision
+            redirect_ident
+
+    Diffs (and the TOML of each revision) are cached by revision.
+    """
+    return list(_revision_diff(entity_type, entity_edit.prev_revision, entity_edit.revision))
 
 
 def editgroup_get_diffs(editgroup: Editgroup) -> Dict[str, Any]:
@@ -351,8 +453,11 @@ def editgroup_get_diffs(editgroup: Editgroup) -> Dict[str, Any]:
     strings, one per line of the "unified diff" format. If there is no diff for
     an edited entity (eg, it was or redirected), instead `None` is returned for
     that entity.
+
+    Revisions are fetched (and diffs computed) concurrently.
     """
     diffs: Dict[str, Any] = {}
+    todo: List[Tuple[str, EntityEdit]] = []
 
     for entity_type in [
         "container",
@@ -368,7 +473,10 @@ def editgroup_get_diffs(editgroup: Editgroup) -> Dict[str, Any]:
         for ed in edits:
             # only for creation and update
             if ed.revision and not ed.redirect_ident:
-                diffs[entity_type][ed.ident] = _entity_edit_diff(entity_type, ed)
-            else:
-                diffs[entity_type][ed.ident] = None
+                todo.append((entity_type, ed))
+            diffs[entity_type][ed.ident] = None
+
+    results = view_pool.map(lambda t: _entity_edit_diff(*t), todo)
+    for (entity_type, ed), diff_lines in zip(todo, results):
+        diffs[entity_type][ed.ident] = diff_lines
     return diffs
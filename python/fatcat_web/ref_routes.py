@@ -3,9 +3,13 @@ Flask endpoints for reference (citation) endpoints. Eg, listing references
 "inbound" and "outbound" from a specific release or work.
 """
 
+import copy
+import functools
 import json
-from typing import Optional
+from typing import Any, Dict, List, Optional, Tuple
 
+import elasticsearch
+import requests
 from flask import Response, jsonify, render_template, request
 from fuzzycat.grobid_unstructured import (
     grobid_api_process_citation,
@@ -24,10 +28,18 @@ from fatcat_tools.references import (
 from fatcat_tools.transforms.access import release_access_options
 from fatcat_tools.transforms.entities import entity_to_dict
 from fatcat_web import AnyResponse, api, app
+from fatcat_web.concurrency import fan_out, nested_pool, view_pool
 from fatcat_web.cors import crossdomain
 from fatcat_web.entity_helpers import generic_get_entity
 from fatcat_web.forms import ReferenceMatchForm
 
+# GROBID parses of raw citation strings are deterministic (for a given GROBID
+# version), and the same citations get submitted over and over
+GROBID_CITATION_CACHE_SIZE: int = 4000
+REFERENCE_MATCH_LIMIT: int = 10
+# max citations in a single reference_match_json() request
+REFERENCE_MATCH_BATCH_MAX: int = 100
+
 
 def _refs_web(
     direction: str,
@@ -54,6 +66,8 @@ def _refs_web(
                 hits.result_refs,
                 fatcat_api_client=api,
                 expand="container,files,webcaptures",
+                # _refs_web() may be running in a fan_out() call
+                pool=nested_pool,
             )
         )
     elif direction == "out":
@@ -70,6 +84,7 @@ def _refs_web(
                 hits.result_refs,
                 fatcat_api_client=api,
                 expand="container,files,webcaptures",
+                pool=nested_pool,
             )
         )
     else:
@@ -82,8 +97,10 @@ def release_view_refs_inbound(ident: str) -> AnyResponse:
     if request.accept_mimetypes.best == "application/json":
         return release_view_refs_inbound_json(ident)
 
-    release = generic_get_entity("release", ident)
-    hits = _refs_web("in", release_ident=ident)
+    release, hits = fan_out(
+        lambda: generic_get_entity("release", ident),
+        lambda: _refs_web("in", release_ident=ident),
+    )
     return (
         render_template(
             "release_view_fuzzy_refs.html", direction="in", entity=release, hits=hits
@@ -97,8 +114,10 @@ def release_view_refs_outbound(ident: str) -> AnyResponse:
     if request.accept_mimetypes.best == "application/json":
         return release_view_refs_outbound_json(ident)
 
-    release = generic_get_entity("release", ident)
-    hits = _refs_web("out", release_ident=ident)
+    release, hits = fan_out(
+        lambda: generic_get_entity("release", ident),
+        lambda: _refs_web("out", release_ident=ident),
+    )
     return (
         render_template(
             "release_view_fuzzy_refs.html", direction="out", entity=release, hits=hits
@@ -149,6 +168,65 @@ def wikipedia_view_refs_outbound(wiki_lang: str, wiki_article: str) -> AnyRespon
     )
 
 
+def normalize_raw_citation(raw_citation: str) -> str:
+    """
+    Collapses whitespace (including newlines from copy/paste), for use as a
+    cache key. GROBID itself ignores these differences.
+    """
+    return " ".join(raw_citation.split())
+
+
+@functools.lru_cache(maxsize=GROBID_CITATION_CACHE_SIZE)
+def _grobid_parse_citation(raw_citation: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+    resp_xml = grobid_api_process_citation(raw_citation)
+    if not resp_xml:
+        return ("failed", None)
+    grobid_dict = transform_grobid_ref_xml(resp_xml)
+    if not grobid_dict:
+        return ("empty", None)
+    return ("success", grobid_dict)
+
+
+def grobid_parse_citation(raw_citation: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """
+    Parses a raw citation string with GROBID, returning a (status, parsed
+    dict) tuple, where status is one of "success", "empty" (no fields
+    parsed), or "failed" (no response).
+
+    Results are cached by normalized citation string; GROBID errors
+    (timeouts, etc) are raised, and not cached.
+    """
+    status, grobid_dict = _grobid_parse_citation(normalize_raw_citation(raw_citation))
+    # callers may modify the dict; don't let that leak into the cache
+    return (status, copy.deepcopy(grobid_dict))
+
+
+def _expand_matches(matches: List[Any]) -> None:
+    """
+    Expands the (partial) release of each fuzzy match, and adds access
+    options, in-place. Releases are fetched in parallel, once per ident.
+    """
+    idents = list(dict.fromkeys(m.release.ident for m in matches))
+    releases = dict(
+        zip(
+            idents,
+            view_pool.map(
+                lambda ident: api.get_release(
+                    ident,
+                    expand="container,files,filesets,webcaptures",
+                    hide="abstract,refs",
+                ),
+                idents,
+            ),
+        )
+    )
+    for m in matches:
+        # expand releases more completely
+        m.release = releases[m.release.ident]
+        # hack in access options
+        m.access_options = release_access_options(m.release)
+
+
 @app.route("/reference/match", methods=["GET", "POST"])
 def reference_match() -> AnyResponse:
 
@@ -162,55 +240,48 @@ def reference_match() -> AnyResponse:
     if form.is_submitted() or request.args.get("title"):
         if form.validate():
             if form.submit_type.data == "parse":
-                resp_xml = grobid_api_process_citation(form.raw_citation.data)
-                if not resp_xml:
-                    grobid_status = "failed"
+                grobid_status, grobid_dict = grobid_parse_citation(form.raw_citation.data)
+                if grobid_status == "failed":
                     return (
                         render_template(
                             "reference_match.html", form=form, grobid_status=grobid_status
                         ),
                         400,
                     )
-                grobid_dict = transform_grobid_ref_xml(resp_xml)
-                if not grobid_dict:
-                    grobid_status = "empty"
+                elif grobid_status == "empty":
                     return (
                         render_template(
                             "reference_match.html", form=form, grobid_status=grobid_status
                         ),
                         200,
                     )
+                assert grobid_dict
                 # print(grobid_dict)
                 release_stub = grobid_ref_to_release(grobid_dict)
                 # remove empty values from GROBID parsed dict
                 grobid_dict = {k: v for k, v in grobid_dict.items() if v is not None}
                 form = ReferenceMatchForm.from_grobid_parse(grobid_dict, form.raw_citation.data)
-                grobid_status = "success"
                 matches = (
                     close_fuzzy_release_matches(
-                        es_client=app.es_client, release=release_stub, match_limit=10
+                        es_client=app.es_client,
+                        release=release_stub,
+                        match_limit=REFERENCE_MATCH_LIMIT,
                     )
                     or []
                 )
             elif form.submit_type.data == "match":
                 matches = (
                     close_fuzzy_biblio_matches(
-                        es_client=app.es_client, biblio=form.data, match_limit=10
+                        es_client=app.es_client,
+                        biblio=form.data,
+                        match_limit=REFERENCE_MATCH_LIMIT,
                     )
                     or []
                 )
             else:
                 raise NotImplementedError()
 
-            for m in matches:
-                # expand releases more completely
-                m.release = api.get_release(
-                    m.release.ident,
-                    expand="container,files,filesets,webcaptures",
-                    hide="abstract,refs",
-                )
-                # hack in access options
-                m.access_options = release_access_options(m.release)
+            _expand_matches(matches)
 
             return (
                 render_template(
@@ -266,38 +337,125 @@ def wikipedia_view_refs_outbound_json(wiki_lang: str, wiki_article: str) -> AnyR
     return Response(hits.json(exclude_unset=True), mimetype="application/json")
 
 
-@app.route("/reference/match.json", methods=["GET", "OPTIONS"])
+def _match_citation(form: ReferenceMatchForm) -> List[Any]:
+    """
+    Fuzzy matches a single (validated) citation form, either by biblio
+    fields ("match") or by GROBID parse of the raw citation ("parse").
+    Matches are not expanded.
+    """
+    if form.submit_type.data == "match":
+        return (
+            close_fuzzy_biblio_matches(
+                es_client=app.es_client, biblio=form.data, match_limit=REFERENCE_MATCH_LIMIT
+            )
+            or []
+        )
+    elif form.submit_type.data == "parse":
+        grobid_status, grobid_dict = grobid_parse_citation(form.raw_citation.data or "")
+        if grobid_status != "success" or not grobid_dict:
+            return []
+        return (
+            close_fuzzy_release_matches(
+                es_client=app.es_client,
+                release=grobid_ref_to_release(grobid_dict),
+                match_limit=REFERENCE_MATCH_LIMIT,
+            )
+            or []
+        )
+    else:
+        raise NotImplementedError()
+
+
+def _try_match_citation(form: ReferenceMatchForm) -> Tuple[List[Any], Optional[str]]:
+    """
+    Like _match_citation(), but catches GROBID and elasticsearch errors (eg,
+    timeouts), returning (matches, error message), so that one failing
+    citation in a batch doesn't fail the others.
+    """
+    try:
+        return (_match_citation(form), None)
+    except (
+        requests.exceptions.RequestException,
+        elasticsearch.exceptions.TransportError,
+    ) as e:
+        app.log.warning("reference match failed: {}".format(e))
+        return ([], "matching failed: {}".format(type(e).__name__))
+
+
+def _match_to_dict(m: Any) -> Dict[str, Any]:
+    # manually convert to dict (for jsonify)
+    info = dict(m.__dict__)
+    info["release"] = entity_to_dict(m.release)
+    info["access_options"] = [o.dict() for o in m.access_options]
+    return info
+
+
+@app.route("/reference/match.json", methods=["GET", "POST", "OPTIONS"])
 @crossdomain(origin="*", headers=["access-control-allow-origin", "Content-Type"])
 def reference_match_json() -> AnyResponse:
+    """
+    With GET, matches a single citation (form fields as query parameters),
+    and returns a list of matches.
+
+    With POST, takes a JSON list of citations (objects with the same fields;
+    'submit_type' defaults to "match", or "parse" if only 'raw_citation' is
+    given), up to REFERENCE_MATCH_BATCH_MAX, and returns a list of result
+    objects in the same order, each with either 'matches', 'errors' (invalid
+    citation), or 'error' (matching failed, eg a GROBID timeout). Citations
+    are matched in parallel.
+    """
+    if request.method == "POST":
+        return reference_match_batch_json()
+
     form = ReferenceMatchForm(request.args)
     if form.validate():
-        if form.submit_type.data == "match":
-            matches = (
-                close_fuzzy_biblio_matches(
-                    es_client=app.es_client, biblio=form.data, match_limit=10
-                )
-                or []
-            )
-        else:
-            raise NotImplementedError()
-        resp = []
-        for m in matches:
-            # expand releases more completely
-            m.release = api.get_release(
-                m.release.ident,
-                expand="container,files,filesets,webcaptures",
-                hide="abstract,refs",
-            )
-            # hack in access options
-            m.access_options = release_access_options(m.release)
-
-            # and manually convert to dict (for jsonify)
-            info = m.__dict__
-            info["release"] = entity_to_dict(m.release)
-            info["access_options"] = [o.dict() for o in m.access_options]
-            resp.append(info)
-        return jsonify(resp), 200
+        matches = _match_citation(form)
+        _expand_matches(matches)
+        return jsonify([_match_to_dict(m) for m in matches]), 200
     else:
         return Response(
             json.dumps(dict(errors=form.errors)), mimetype="application/json", status=400
         )
+
+
+def reference_match_batch_json() -> AnyResponse:
+    citations = request.get_json(silent=True)
+    if not isinstance(citations, list) or not all(isinstance(c, dict) for c in citations):
+        return Response(
+            json.dumps(dict(errors=["expected a JSON list of citation objects"])),
+            mimetype="application/json",
+            status=400,
+        )
+    if len(citations) > REFERENCE_MATCH_BATCH_MAX:
+        return Response(
+            json.dumps(dict(errors=[f"too many citations (max {REFERENCE_MATCH_BATCH_MAX})"])),
+            mimetype="application/json",
+            status=400,
+        )
+
+    forms: List[Optional[ReferenceMatchForm]] = []
+    results: List[Dict[str, Any]] = []
+    for citation in citations:
+        citation = {k: v for k, v in citation.items() if v is not None}
+        if "submit_type" not in citation:
+            only_raw = set(citation.keys()) == {"raw_citation"}
+            citation["submit_type"] = "parse" if only_raw else "match"
+        form = ReferenceMatchForm(data=citation, formdata=None)
+        if form.validate():
+            forms.append(form)
+            results.append(dict())
+        else:
+            forms.append(None)
+            results.append(dict(errors=form.errors))
+
+    todo = [(i, f) for i, f in enumerate(forms) if f is not None]
+    all_results = list(view_pool.map(lambda t: _try_match_citation(t[1]), todo))
+    # expand all matches together, so releases matched by several citations
+    # are only fetched once
+    _expand_matches([m for matches, _ in all_results for m in matches])
+    for (i, _), (matches, error) in zip(todo, all_results):
+        if error:
+            results[i]["error"] = error
+        else:
+            results[i]["matches"] = [_match_to_dict(m) for m in matches]
+    return jsonify(results), 200
@@ -31,7 +31,13 @@ from fatcat_tools.normal import (
     clean_sha1,
     clean_sha256,
 )
+from fatcat_tools.release_lookup import (
+    RELEASE_LOOKUP_BATCH_MAX,
+    ReleaseLookupResolver,
+    parse_release_lookup_key,
+)
 from fatcat_tools.search.common import FatcatSearchError
+from fatcat_tools.search.container_browse import sort_toc_releases
 from fatcat_tools.transforms import citeproc_csl, release_to_csl
 from fatcat_web import AnyResponse, Config, api, app, auth_api, mwoauth, priv_api
 from fatcat_web.auth import (
@@ -41,6 +47,7 @@ from fatcat_web.auth import (
     handle_wmoauth,
     load_user,
 )
+from fatcat_web.concurrency import fan_out, gevent_patched, view_pool
 from fatcat_web.cors import crossdomain
 from fatcat_web.entity_helpers import (
     editgroup_get_diffs,
@@ -57,10 +64,15 @@ from fatcat_web.graphics import (
 )
 from fatcat_web.kafka import kafka_pixy_produce
 from fatcat_web.search import (
+    CONTAINER_EXPORT_FIELDS,
+    RELEASE_EXPORT_FIELDS,
     GenericQuery,
     ReleaseQuery,
     do_container_search,
+    do_container_search_export,
     do_release_search,
+    do_release_search_export,
+    get_elastic_container_browse_toc,
     get_elastic_container_browse_year_volume_issue,
     get_elastic_container_histogram_legacy,
     get_elastic_container_preservation_by_volume,
@@ -71,7 +83,9 @@ from fatcat_web.search import (
     get_elastic_preservation_by_type,
     get_elastic_preservation_by_year,
     get_elastic_search_coverage,
+    search_cache,
 )
+from fatcat_web.search_export import search_export_response
 
 ### Generic Entity Views ####################################################
 
@@ -79,8 +93,9 @@ from fatcat_web.search import (
 @app.route("/container/<string(length=26):ident>/history", methods=["GET"])
 def container_history(ident: str) -> AnyResponse:
     try:
-        entity = api.get_container(ident)
-        history = api.get_container_history(ident)
+        entity, history = fan_out(
+            lambda: api.get_container(ident), lambda: api.get_container_history(ident)
+        )
     except ApiException as ae:
         app.log.info(ae)
         abort(ae.status)
@@ -92,8 +107,9 @@ def container_history(ident: str) -> AnyResponse:
 @app.route("/creator/<string(length=26):ident>/history", methods=["GET"])
 def creator_history(ident: str) -> AnyResponse:
     try:
-        entity = api.get_creator(ident)
-        history = api.get_creator_history(ident)
+        entity, history = fan_out(
+            lambda: api.get_creator(ident), lambda: api.get_creator_history(ident)
+        )
     except ApiException as ae:
         abort(ae.status)
     return render_template(
@@ -104,8 +120,9 @@ def creator_history(ident: str) -> AnyResponse:
 @app.route("/file/<string(length=26):ident>/history", methods=["GET"])
 def file_history(ident: str) -> AnyResponse:
     try:
-        entity = api.get_file(ident)
-        history = api.get_file_history(ident)
+        entity, history = fan_out(
+            lambda: api.get_file(ident), lambda: api.get_file_history(ident)
+        )
     except ApiException as ae:
         abort(ae.status)
     return render_template(
@@ -116,8 +133,9 @@ def file_history(ident: str) -> AnyResponse:
 @app.route("/fileset/<string(length=26):ident>/history", methods=["GET"])
 def fileset_history(ident: str) -> AnyResponse:
     try:
-        entity = api.get_fileset(ident)
-        history = api.get_fileset_history(ident)
+        entity, history = fan_out(
+            lambda: api.get_fileset(ident), lambda: api.get_fileset_history(ident)
+        )
     except ApiException as ae:
         abort(ae.status)
     return render_template(
@@ -128,8 +146,9 @@ def fileset_history(ident: str) -> AnyResponse:
 @app.route("/webcapture/<string(length=26):ident>/history", methods=["GET"])
 def webcapture_history(ident: str) -> AnyResponse:
     try:
-        entity = api.get_webcapture(ident)
-        history = api.get_webcapture_history(ident)
+        entity, history = fan_out(
+            lambda: api.get_webcapture(ident), lambda: api.get_webcapture_history(ident)
+        )
     except ApiException as ae:
         abort(ae.status)
     return render_template(
@@ -140,8 +159,9 @@ def webcapture_history(ident: str) -> AnyResponse:
 @app.route("/release/<string(length=26):ident>/history", methods=["GET"])
 def release_history(ident: str) -> AnyResponse:
     try:
-        entity = api.get_release(ident)
-        history = api.get_release_history(ident)
+        entity, history = fan_out(
+            lambda: api.get_release(ident), lambda: api.get_release_history(ident)
+        )
     except ApiException as ae:
         abort(ae.status)
     return render_template(
@@ -152,8 +172,9 @@ def release_history(ident: str) -> AnyResponse:
 @app.route("/work/<string(length=26):ident>/history", methods=["GET"])
 def work_history(ident: str) -> AnyResponse:
     try:
-        entity = api.get_work(ident)
-        history = api.get_work_history(ident)
+        entity, history = fan_out(
+            lambda: api.get_work(ident), lambda: api.get_work_history(ident)
+        )
     except ApiException as ae:
         abort(ae.status)
     return render_template(
@@ -284,12 +305,14 @@ def generic_entity_view(entity_type: str, ident: str, view_template: str) -> Any
     entity._metadata = metadata
 
     if view_template == "container_view.html":
-        entity._stats = get_elastic_container_stats(entity.ident, issnl=entity.issnl)
-        entity._random_releases = get_elastic_container_random_releases(entity.ident)
+        entity._stats, entity._random_releases = fan_out(
+            lambda: get_elastic_container_stats(entity.ident, issnl=entity.issnl),
+            lambda: get_elastic_container_random_releases(entity.ident),
+        )
     if view_template == "container_view_coverage.html":
-        entity._stats = get_elastic_container_stats(entity.ident, issnl=entity.issnl)
-        entity._type_preservation = get_elastic_preservation_by_type(
-            ReleaseQuery(container_id=ident),
+        entity._stats, entity._type_preservation = fan_out(
+            lambda: get_elastic_container_stats(entity.ident, issnl=entity.issnl),
+            lambda: get_elastic_preservation_by_type(ReleaseQuery(container_id=ident)),
         )
 
     return render_template(
@@ -422,7 +445,16 @@ def container_view_browse(ident: str) -> AnyResponse:
     )
 
     try:
-        found = do_release_search(query)
+        found = None
+        if request.args.get("year") and "volume" in request.args and "issue" in request.args:
+            found = get_elastic_container_browse_toc(
+                ident,
+                int(request.args["year"]),
+                request.args.get("volume") or None,
+                request.args.get("issue") or None,
+            )
+        if found is None:
+            found = do_release_search(query)
     except FatcatSearchError as fse:
         return (
             render_template(
@@ -438,10 +470,7 @@ def container_view_browse(ident: str) -> AnyResponse:
 
     # HACK: re-sort by first page *numerically*
     if found.results and query_sort and "first_page" in query_sort:
-        for doc in found.results:
-            if doc.get("first_page") and doc["first_page"].isdigit():
-                doc["first_page"] = int(doc["first_page"])
-        found.results = sorted(found.results, key=lambda d: d.get("first_page") or 99999999)
+        found.results = sort_toc_releases(found.results)
 
     return render_template(
         "container_view_browse.html",
@@ -1091,6 +1120,15 @@ def release_search() -> AnyResponse:
     if "q" not in request.args.keys():
         return render_template("release_search.html", query=ReleaseQuery(), found=None)
 
+    if request.args.get("export"):
+        return search_export_response(
+            do_release_search_export,
+            ReleaseQuery.from_args(request.args),
+            RELEASE_EXPORT_FIELDS,
+            request.args["export"],
+            "fatcat_releases",
+        )
+
     # if this is a "generic" query (eg, from front page or top-of page bar),
     # and the query is not all filters/paramters (aka, there is an actual
     # term/phrase in the query), then also try querying containers, and display
@@ -1128,6 +1166,15 @@ def container_search() -> AnyResponse:
     if "q" not in request.args.keys():
         return render_template("container_search.html", query=GenericQuery(), found=None)
 
+    if request.args.get("export"):
+        return search_export_response(
+            do_container_search_export,
+            GenericQuery.from_args(request.args),
+            CONTAINER_EXPORT_FIELDS,
+            request.args["export"],
+            "fatcat_containers",
+        )
+
     query = GenericQuery.from_args(request.args)
     try:
         found = do_container_search(query)
@@ -1172,15 +1219,22 @@ def coverage_search() -> AnyResponse:
     date_histogram_svg = None
     coverage_type_preservation = None
     if coverage_stats["total"] > 1:
-        coverage_type_preservation = get_elastic_preservation_by_type(query)
+        coverage_type_preservation, histogram = fan_out(
+            lambda: get_elastic_preservation_by_type(query),
+            lambda: (
+                get_elastic_preservation_by_date(query)
+                if query.recent
+                else get_elastic_preservation_by_year(query)
+            ),
+        )
         if query.recent:
-            date_histogram = get_elastic_preservation_by_date(query)
+            date_histogram = histogram
             date_histogram_svg = preservation_by_date_histogram(
                 date_histogram,
                 merge_shadows=Config.FATCAT_MERGE_SHADOW_PRESERVATION,
             ).render_data_uri()
         else:
-            year_histogram = get_elastic_preservation_by_year(query)
+            year_histogram = histogram
             year_histogram_svg = preservation_by_year_histogram(
                 year_histogram,
                 merge_shadows=Config.FATCAT_MERGE_SHADOW_PRESERVATION,
@@ -1216,6 +1270,16 @@ def container_view_search(ident: str) -> AnyResponse:
 
     query = ReleaseQuery.from_args(request.args)
     query.container_id = ident
+
+    if request.args.get("export"):
+        return search_export_response(
+            do_release_search_export,
+            query,
+            RELEASE_EXPORT_FIELDS,
+            request.args["export"],
+            f"fatcat_container_{ident}_releases",
+        )
+
     try:
         found = do_release_search(query)
     except FatcatSearchError as fse:
@@ -1256,8 +1320,8 @@ def get_changelog_stats() -> Dict[str, Any]:
 @app.route("/stats", methods=["GET"])
 def stats_page() -> AnyResponse:
     try:
-        stats = get_elastic_entity_stats()
-        stats.update(get_changelog_stats())
+        stats, changelog_stats = fan_out(get_elastic_entity_stats, get_changelog_stats)
+        stats.update(changelog_stats)
     except Exception as ae:
         app.log.error(ae)
         abort(503)
@@ -1266,13 +1330,41 @@ def stats_page() -> AnyResponse:
 
 ### Pseudo-APIs #############################################################
 
+# shared by all requests; caches recent lookups (including misses)
+release_lookup_resolver = ReleaseLookupResolver(api, pool=view_pool)
+
+
+@app.route("/release/lookup.json", methods=["POST", "OPTIONS"])
+@crossdomain(origin="*", headers=["access-control-allow-origin", "Content-Type"])
+def release_lookup_bulk_json() -> AnyResponse:
+    """
+    Takes a JSON list of up to RELEASE_LOOKUP_BATCH_MAX release identifiers
+    as "type:value" strings (eg, "doi:10.123/abc", "pmid:1234"), and returns
+    a list of results in the same order, each with the normalized 'id_type'
+    and 'value', and the release 'ident' (null if not found or not valid).
+    """
+    ids = request.get_json(silent=True)
+    if not isinstance(ids, list) or not all(isinstance(i, str) for i in ids):
+        abort(400, "expected a JSON list of identifier strings")
+    if len(ids) > RELEASE_LOOKUP_BATCH_MAX:
+        abort(400, f"too many identifiers (max {RELEASE_LOOKUP_BATCH_MAX})")
+    keys = [parse_release_lookup_key(i) for i in ids]
+    idents = release_lookup_resolver.resolve(k for k in keys if k)
+    resp = []
+    for raw, key in zip(ids, keys):
+        if key:
+            resp.append(dict(id=raw, id_type=key[0], value=key[1], ident=idents[key]))
+        else:
+            resp.append(dict(id=raw, id_type=None, value=None, ident=None))
+    return jsonify(resp)
+
 
 @app.route("/stats.json", methods=["GET", "OPTIONS"])
 @crossdomain(origin="*", headers=["access-control-allow-origin", "Content-Type"])
 def stats_json() -> AnyResponse:
     try:
-        stats = get_elastic_entity_stats()
-        stats.update(get_changelog_stats())
+        stats, changelog_stats = fan_out(get_elastic_entity_stats, get_changelog_stats)
+        stats.update(changelog_stats)
     except Exception as ae:
         app.log.error(ae)
         abort(503)
@@ -1499,7 +1591,9 @@ def release_citeproc(ident: str) -> AnyResponse:
 @app.route("/health.json", methods=["GET", "OPTIONS"])
 @crossdomain(origin="*", headers=["access-control-allow-origin", "Content-Type"])
 def health_json() -> AnyResponse:
-    return jsonify({"ok": True})
+    return jsonify(
+        {"ok": True, "gevent": gevent_patched(), "search_cache": search_cache.stats()}
+    )
 
 
 ### Auth ####################################################################
@@ -1737,3 +1831,20 @@ def page_sitemap_xml() -> AnyResponse:
     return send_from_directory(
         os.path.join(app.root_path, "static"), "sitemap.xml", mimetype="text/xml"
     )
+
+
+@app.route("/sitemap-<string:name>", methods=["GET"])
+def page_sitemap_shard(name: str) -> AnyResponse:
+    """
+    Pre-rendered sitemap indices and (gzipped) URL list shards, served from
+    SITEMAP_DIR as-is.
+    """
+    if not app.config["SITEMAP_DIR"]:
+        abort(404)
+    if name.endswith(".xml"):
+        mimetype = "text/xml"
+    elif name.endswith(".txt.gz"):
+        mimetype = "application/gzip"
+    else:
+        abort(404)
+    return send_from_directory(app.config["SITEMAP_DIR"], "sitemap-" + name, mimetype=mimetype)
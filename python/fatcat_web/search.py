@@ -3,22 +3,152 @@ Helpers for doing elasticsearch queries (used in the web interface; not part of
 the formal API)
 """
 
+import copy
+import dataclasses
 import datetime
+import functools
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Tuple
 
 import elasticsearch
 from elasticsearch_dsl import Q, Search
+from flask import has_request_context
+from flask_login import current_user
 
+from fatcat_tools.cache import LRUCache
 from fatcat_tools.search.common import (
+    CONTAINER_RESULT_ROW_FIELDS,
+    RELEASE_RESULT_ROW_FIELDS,
+    FatcatSearchError,
     _hits_total_int,
     agg_to_dict,
+    hits_total,
     results_to_dict,
     wrap_es_execution,
 )
+from fatcat_tools.search.container_browse import (
+    CONTAINER_TOC_LIMIT,
+    container_toc_id,
+    get_container_browse_doc,
+    query_es_container_browse,
+    tree_issue_count,
+)
 from fatcat_tools.search.stats import query_es_container_stats
 from fatcat_web import app
 
+# hits per scroll request when exporting full search results
+SEARCH_EXPORT_PAGE_SIZE: int = 1000
+# default field projections for search exports
+RELEASE_EXPORT_FIELDS: List[str] = [
+    "ident",
+    "title",
+    "release_type",
+    "release_stage",
+    "release_year",
+    "release_date",
+    "container_id",
+    "container_name",
+    "container_issnl",
+    "volume",
+    "issue",
+    "pages",
+    "doi",
+    "pmid",
+    "pmcid",
+    "arxiv_id",
+    "contrib_names",
+    "is_oa",
+    "is_preserved",
+    "in_ia",
+    "best_pdf_url",
+]
+CONTAINER_EXPORT_FIELDS: List[str] = [
+    "ident",
+    "name",
+    "publisher",
+    "container_type",
+    "issnl",
+    "issns",
+    "wikidata_qid",
+    "country_code",
+    "first_year",
+    "last_year",
+    "is_oa",
+    "in_doaj",
+    "any_kbart",
+    "releases_total",
+    "preservation_bright",
+    "preservation_dark",
+    "preservation_shadows_only",
+    "preservation_none",
+]
+
+
+# search helper results (see cached_search())
+search_cache = LRUCache(
+    max_size=app.config["SEARCH_CACHE_SIZE"], ttl=app.config["SEARCH_CACHE_TTL"] or None
+)
+
+
+def _search_cache_key(val: Any) -> Hashable:
+    """
+    Normalizes helper arguments (including ReleaseQuery and GenericQuery
+    dataclasses) into a hashable cache key. Whitespace in query strings is
+    collapsed, as it makes no difference to results.
+    """
+    if dataclasses.is_dataclass(val) and not isinstance(val, type):
+        return (type(val).__name__,) + tuple(
+            (f.name, _search_cache_key(getattr(val, f.name))) for f in dataclasses.fields(val)
+        )
+    elif isinstance(val, str):
+        return " ".join(val.split())
+    elif isinstance(val, (list, tuple)):
+        return tuple(_search_cache_key(v) for v in val)
+    elif isinstance(val, dict):
+        return tuple(sorted((k, _search_cache_key(v)) for k, v in val.items()))
+    elif val is None or isinstance(val, (int, float, bool)):
+        return val
+    raise TypeError("can't use as search cache key: {}".format(type(val)))
+
+
+def _use_search_cache() -> bool:
+    """
+    The cache is bypassed for logged-in editors, who expect to see their
+    edits (once indexed) right away.
+    """
+    if not (app.config["SEARCH_CACHE_SIZE"] and app.config["SEARCH_CACHE_TTL"]):
+        return False
+    if has_request_context() and current_user.is_authenticated:
+        return False
+    return True
+
+
+def cached_search(func: Callable) -> Callable:
+    """
+    Decorator which caches results of a search helper in search_cache, keyed
+    by function and (normalized) arguments. Errors are not cached.
+
+    Callers get a shallow copy of a cached result (dataclass, dict or list),
+    so they can (re)assign fields, but must not modify nested values.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        if not _use_search_cache():
+            return func(*args, **kwargs)
+        key = (func.__name__, _search_cache_key(args), _search_cache_key(kwargs))
+        found, result = search_cache.get(key)
+        if not found:
+            result = func(*args, **kwargs)
+            search_cache.put(key, result)
+        if dataclasses.is_dataclass(result):
+            return dataclasses.replace(result)
+        elif isinstance(result, (dict, list)):
+            return copy.copy(result)
+        return result
+
+    return wrapper
+
 
 @dataclass
 class ReleaseQuery:
@@ -81,7 +211,10 @@ class SearchHits:
     results: List[Any]
 
 
-def do_container_search(query: GenericQuery, deep_page_limit: int = 2000) -> SearchHits:
+def _container_search(query: GenericQuery) -> Search:
+    """
+    Builds the container search query (without paging).
+    """
 
     search = Search(using=app.es_client, index=app.config["ELASTICSEARCH_CONTAINER_INDEX"])
 
@@ -108,6 +241,25 @@ def do_container_search(query: GenericQuery, deep_page_limit: int = 2000) -> Sea
         negative=Q("term", releases_total=0),
         negative_boost=0.5,
     )
+    return search
+
+
+@cached_search
+def do_container_search(
+    query: GenericQuery,
+    deep_page_limit: int = 2000,
+    source_includes: Optional[List[str]] = CONTAINER_RESULT_ROW_FIELDS,
+    source_excludes: Optional[List[str]] = None,
+) -> SearchHits:
+    """
+    Runs a container search for display as result rows. source_includes and
+    source_excludes control which document fields are fetched (None for no
+    filtering).
+    """
+
+    search = _container_search(query)
+    if source_includes or source_excludes:
+        search = search.source(includes=source_includes or [], excludes=source_excludes or [])
 
     # Sanity checks
     limit = min((int(query.limit or 25), 300))
@@ -124,7 +276,7 @@ def do_container_search(query: GenericQuery, deep_page_limit: int = 2000) -> Sea
 
     return SearchHits(
         count_returned=len(results),
-        count_found=_hits_total_int(resp.hits.total),
+        count_found=hits_total(resp),
         offset=offset,
         limit=limit,
         deep_page_limit=deep_page_limit,
@@ -133,7 +285,10 @@ def do_container_search(query: GenericQuery, deep_page_limit: int = 2000) -> Sea
     )
 
 
-def do_release_search(query: ReleaseQuery, deep_page_limit: int = 2000) -> SearchHits:
+def _release_search(query: ReleaseQuery) -> Search:
+    """
+    Builds the release search query (without sorting or paging).
+    """
 
     search = Search(using=app.es_client, index=app.config["ELASTICSEARCH_RELEASE_INDEX"])
 
@@ -183,6 +338,26 @@ def do_release_search(query: ReleaseQuery, deep_page_limit: int = 2000) -> Searc
         negative=poor_metadata,
         negative_boost=0.5,
     )
+    return search
+
+
+@cached_search
+def do_release_search(
+    query: ReleaseQuery,
+    deep_page_limit: int = 2000,
+    source_includes: Optional[List[str]] = RELEASE_RESULT_ROW_FIELDS,
+    source_excludes: Optional[List[str]] = None,
+) -> SearchHits:
+    """
+    Runs a release search for display as result rows. source_includes and
+    source_excludes control which document fields are fetched (None for no
+    filtering); full release documents are large (reference idents,
+    preservation details, etc), and result rows only show a few fields.
+    """
+
+    search = _release_search(query)
+    if source_includes or source_excludes:
+        search = search.source(includes=source_includes or [], excludes=source_excludes or [])
 
     if query.sort:
         search = search.sort(*query.sort)
@@ -202,17 +377,13 @@ def do_release_search(query: ReleaseQuery, deep_page_limit: int = 2000) -> Searc
 
     for h in results:
         # Ensure 'contrib_names' is a list, not a single string
-        if type(h["contrib_names"]) is not list:
-            h["contrib_names"] = [
-                h["contrib_names"],
-            ]
-        h["contrib_names"] = [
-            name.encode("utf8", "ignore").decode("utf8") for name in h["contrib_names"]
-        ]
+        # (results_to_dict() already cleaned up the strings)
+        if type(h.get("contrib_names")) is not list:
+            h["contrib_names"] = [h["contrib_names"]] if h.get("contrib_names") else []
 
     return SearchHits(
         count_returned=len(results),
-        count_found=_hits_total_int(resp.hits.total),
+        count_found=hits_total(resp),
         offset=offset,
         limit=limit,
         deep_page_limit=deep_page_limit,
@@ -221,6 +392,45 @@ def do_release_search(query: ReleaseQuery, deep_page_limit: int = 2000) -> Searc
     )
 
 
+def iter_search_export(
+    search: Search, fields: List[str], max_results: Optional[int] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    Iterates over all the hits of a search (not just the first page), as
+    dicts with only the given fields, using the scroll API. Memory use is
+    bounded by the scroll page size. Results are in index order, not by
+    relevance.
+
+    The scroll is cleared when the iterator is exhausted or closed.
+    """
+    search = search.source(fields)
+    search = search.params(size=SEARCH_EXPORT_PAGE_SIZE, scroll="2m", preserve_order=False)
+    count = 0
+    for hit in search.scan():
+        if max_results is not None and count >= max_results:
+            break
+        doc = hit.to_dict()
+        yield {f: doc.get(f) for f in fields}
+        count += 1
+
+
+def do_release_search_export(
+    query: ReleaseQuery, fields: Optional[List[str]] = None, max_results: Optional[int] = None
+) -> Iterator[Dict[str, Any]]:
+    return iter_search_export(
+        _release_search(query), fields or RELEASE_EXPORT_FIELDS, max_results=max_results
+    )
+
+
+def do_container_search_export(
+    query: GenericQuery, fields: Optional[List[str]] = None, max_results: Optional[int] = None
+) -> Iterator[Dict[str, Any]]:
+    return iter_search_export(
+        _container_search(query), fields or CONTAINER_EXPORT_FIELDS, max_results=max_results
+    )
+
+
+@cached_search
 def get_elastic_container_random_releases(ident: str, limit: int = 5) -> List[Dict[str, Any]]:
     """
     Returns a list of releases from the container.
@@ -237,6 +447,7 @@ def get_elastic_container_random_releases(ident: str, limit: int = 5) -> List[Di
         ],
     )
     search = search.sort("-in_web", "-release_date")
+    search = search.source(RELEASE_RESULT_ROW_FIELDS)
     search = search[: int(limit)]
 
     search = search.params(request_cache=True)
@@ -247,27 +458,6 @@ def get_elastic_container_random_releases(ident: str, limit: int = 5) -> List[Di
     return results
 
 
-def _sort_vol_key(val: Optional[Any]) -> Tuple[bool, bool, int, str]:
-    """
-    Helper for sorting volume and issue strings. Defined order is:
-
-    - None values first
-    - any non-integers next, in non-integer order
-    - any integers next, in integer sorted order (ascending)
-
-    Note that the actual sort used/displayed is reversed.
-
-    TODO: 'val' should actually be Optional[str], but getting a mypy error I
-    don't know how to hack around quickly right now.
-    """
-    if val is None:
-        return (False, False, 0, "")
-    if val.isdigit():
-        return (True, True, int(val), "")
-    else:
-        return (True, False, 0, val)
-
-
 def get_elastic_container_browse_year_volume_issue(ident: str) -> List[Dict[str, Any]]:
     """
     Returns a set of histogram buckets, as nested dicts/lists:
@@ -283,86 +473,64 @@ def get_elastic_container_browse_year_volume_issue(ident: str) -> List[Dict[str,
                 ] }
             ] }
         ]
+
+    Uses the precomputed browse index, if configured and the container has a
+    document there, otherwise runs the aggregation against the release index.
     """
 
-    search = Search(using=app.es_client, index=app.config["ELASTICSEARCH_RELEASE_INDEX"])
-    search = search.query(
-        "bool",
-        filter=[Q("bool", must_not=[Q("match", release_type="stub")])],
-    )
-    search = search.filter("term", container_id=ident)
-    search.aggs.bucket(
-        "year_volume",
-        "composite",
-        size=1500,
-        sources=[
-            {
-                "year": {
-                    "histogram": {
-                        "field": "release_year",
-                        "interval": 1,
-                        "missing_bucket": True,
-                    },
-                }
-            },
-            {
-                "volume": {
-                    "terms": {
-                        "field": "volume",
-                        "missing_bucket": True,
-                    },
-                }
-            },
-            {
-                "issue": {
-                    "terms": {
-                        "field": "issue",
-                        "missing_bucket": True,
-                    },
-                }
-            },
-        ],
+    if app.config["ELASTICSEARCH_CONTAINER_BROWSE_INDEX"]:
+        doc = get_container_browse_doc(
+            app.es_client, app.config["ELASTICSEARCH_CONTAINER_BROWSE_INDEX"], ident
+        )
+        if doc is not None:
+            return doc["year_volume_issue"]
+
+    return query_es_container_browse(
+        ident,
+        es_client=app.es_client,
+        es_index=app.config["ELASTICSEARCH_RELEASE_INDEX"],
     )
-    search = search[:0]
-    search = search.params(request_cache=True)
-    resp = wrap_es_execution(search)
-    buckets = resp.aggregations.year_volume.buckets
-    # print(buckets)
-    buckets = [h for h in buckets if h["key"]["year"]]
-    year_nums = set([int(h["key"]["year"]) for h in buckets])
-    year_dicts: Dict[int, Dict[str, Any]] = dict()
-    if year_nums:
-        for year in year_nums:
-            year_dicts[year] = {}
-        for row in buckets:
-            year = int(row["key"]["year"])
-            volume = row["key"]["volume"] or ""
-            issue = row["key"]["issue"] or ""
-            if volume not in year_dicts[year]:
-                year_dicts[year][volume] = {}
-            year_dicts[year][volume][issue] = int(row["doc_count"])
-
-    # transform to lists-of-dicts
-    year_list = []
-    for year in year_dicts.keys():
-        volume_list = []
-        for volume in year_dicts[year].keys():
-            issue_list = []
-            for issue in year_dicts[year][volume].keys():
-                issue_list.append(
-                    dict(issue=issue or None, count=year_dicts[year][volume][issue])
-                )
-            issue_list = sorted(
-                issue_list, key=lambda x: _sort_vol_key(x["issue"]), reverse=True
-            )
-            volume_list.append(dict(volume=volume or None, issues=issue_list))
-        volume_list = sorted(
-            volume_list, key=lambda x: _sort_vol_key(x["volume"]), reverse=True
+
+
+def get_elastic_container_browse_toc(
+    ident: str, year: int, volume: Optional[str], issue: Optional[str]
+) -> Optional[SearchHits]:
+    """
+    Returns the table of contents of a single container issue from the
+    precomputed browse index, or None if the index isn't configured, or has
+    no (current) document for the issue; callers should fall back to a
+    search in that case. Raises FatcatSearchError on elasticsearch errors.
+    """
+
+    es_index = app.config["ELASTICSEARCH_CONTAINER_BROWSE_INDEX"]
+    if not es_index:
+        return None
+    try:
+        tree_doc = get_container_browse_doc(app.es_client, es_index, ident)
+        if tree_doc is None:
+            return None
+        count = tree_issue_count(tree_doc["year_volume_issue"], year, volume, issue)
+        toc_doc = get_container_browse_doc(
+            app.es_client, es_index, container_toc_id(ident, year, volume, issue)
         )
-        year_list.append(dict(year=year, volumes=volume_list))
-    return sorted(year_list, key=lambda x: x["year"], reverse=True)
+    except elasticsearch.exceptions.TransportError as e:
+        # includes connection errors
+        raise FatcatSearchError(e.status_code, str(e.error))
+    if toc_doc is None or count is None or toc_doc["count_found"] != count:
+        return None
+    results = toc_doc["releases"]
+    return SearchHits(
+        count_returned=len(results),
+        count_found=toc_doc["count_found"],
+        offset=0,
+        limit=CONTAINER_TOC_LIMIT,
+        deep_page_limit=0,
+        query_time_ms=0,
+        results=results,
+    )
 
 
+@cached_search
 def get_elastic_entity_stats() -> dict:
     """
     TODO: files, filesets, webcaptures (no schema yet)
@@ -454,6 +622,7 @@ def get_elastic_entity_stats() -> dict:
     return stats
 
 
+@cached_search
 def get_elastic_search_coverage(query: ReleaseQuery) -> dict:
 
     search = Search(using=app.es_client, index=app.config["ELASTICSEARCH_RELEASE_INDEX"])
@@ -541,6 +710,7 @@ def get_elastic_container_stats(
     return stats
 
 
+@cached_search
 def get_elastic_container_histogram_legacy(ident: str) -> List[Tuple[int, bool, int]]:
     """
     Fetches a stacked histogram of {year, in_ia}. This is for the older style
@@ -609,6 +779,7 @@ def get_elastic_container_histogram_legacy(ident: str) -> List[Tuple[int, bool,
     return vals
 
 
+@cached_search
 def get_elastic_preservation_by_year(query: ReleaseQuery) -> List[Dict[str, Any]]:
     """
     Fetches a stacked histogram of {year, preservation}.
@@ -702,6 +873,7 @@ def get_elastic_preservation_by_year(query: ReleaseQuery) -> List[Dict[str, Any]
     return sorted(year_dicts.values(), key=lambda x: x["year"])
 
 
+@cached_search
 def get_elastic_preservation_by_date(query: ReleaseQuery) -> List[dict]:
     """
     Fetches a stacked histogram of {date, preservation}.
@@ -787,6 +959,7 @@ def get_elastic_preservation_by_date(query: ReleaseQuery) -> List[dict]:
     return sorted(date_dicts.values(), key=lambda x: x["date"])
 
 
+@cached_search
 def get_elastic_container_preservation_by_volume(query: ReleaseQuery) -> List[dict]:
     """
     Fetches a stacked histogram of {volume, preservation}.
@@ -876,6 +1049,7 @@ def get_elastic_container_preservation_by_volume(query: ReleaseQuery) -> List[di
     return sorted(volume_dicts.values(), key=lambda x: x["volume"])
 
 
+@cached_search
 def get_elastic_preservation_by_type(query: ReleaseQuery) -> List[dict]:
     """
     Fetches preservation coverage by release type
@@ -0,0 +1,181 @@
+"""
+Streaming export of full search result sets (release and container search),
+as NDJSON or CSV.
+
+Results are fetched from elasticsearch page by page (see
+fatcat_web.search.iter_search_export()) and written out as a chunked
+response as they come in, so memory use doesn't depend on the size of the
+result set. Exports are long-running requests which hold an elasticsearch
+scroll context open, so the number of concurrent exports per client (IP
+address) is limited (SEARCH_EXPORT_MAX_PER_CLIENT). The count is kept per
+worker process, so with several uwsgi processes a client can run up to that
+many times the limit.
+"""
+
+import csv
+import io
+import json
+import re
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import elasticsearch
+from flask import Response, request
+
+from fatcat_web import app
+
+SEARCH_EXPORT_FORMATS: Dict[str, str] = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+# rows per chunk of the streamed response
+SEARCH_EXPORT_CHUNK_ROWS: int = 500
+FIELD_NAME_REGEX = re.compile(r"^[a-z][a-z0-9_]*$")
+
+
+class ClientSlots:
+    """
+    Counts in-flight requests per client key, up to a limit. Thread-safe.
+    """
+
+    def __init__(self, max_per_client: int) -> None:
+        self.max_per_client = max_per_client
+        self._lock = threading.Lock()
+        self._active: Dict[str, int] = dict()
+
+    def acquire(self, client: str) -> bool:
+        with self._lock:
+            if self.max_per_client and self._active.get(client, 0) >= self.max_per_client:
+                return False
+            self._active[client] = self._active.get(client, 0) + 1
+            return True
+
+    def release(self, client: str) -> None:
+        with self._lock:
+            self._active[client] -= 1
+            if self._active[client] <= 0:
+                del self._active[client]
+
+    def active(self, client: str) -> int:
+        with self._lock:
+            return self._active.get(client, 0)
+
+
+export_slots = ClientSlots(app.config["SEARCH_EXPORT_MAX_PER_CLIENT"])
+
+
+def parse_export_fields(raw: Optional[str], default: List[str]) -> Optional[List[str]]:
+    """
+    Parses a comma-separated field list (the 'fields' query parameter).
+    Returns None if any field name isn't valid.
+    """
+    if not raw:
+        return default
+    fields = [f.strip() for f in raw.split(",") if f.strip()]
+    if not fields or not all(FIELD_NAME_REGEX.match(f) for f in fields):
+        return None
+    return list(dict.fromkeys(fields))
+
+
+def _csv_value(val: Any) -> Any:
+    if val is None:
+        return ""
+    if isinstance(val, (list, dict)):
+        return json.dumps(val, sort_keys=True)
+    return val
+
+
+def format_export_rows(
+    rows: Iterator[Dict[str, Any]], fields: List[str], fmt: str
+) -> Iterator[str]:
+    """
+    Serializes rows (dicts) as NDJSON lines or CSV (with a header row), in
+    chunks of SEARCH_EXPORT_CHUNK_ROWS rows.
+    """
+    buf = io.StringIO()
+    writer = None
+    if fmt == "csv":
+        writer = csv.writer(buf)
+        writer.writerow(fields)
+    count = 0
+    for row in rows:
+        if writer is not None:
+            writer.writerow([_csv_value(row.get(f)) for f in fields])
+        else:
+            buf.write(json.dumps(row, sort_keys=False) + "\n")
+        count += 1
+        if count % SEARCH_EXPORT_CHUNK_ROWS == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def _error_response(status: int, message: str) -> Response:
+    return Response(json.dumps(dict(error=message)), mimetype="application/json", status=status)
+
+
+def search_export_response(
+    do_export: Callable[..., Iterator[Dict[str, Any]]],
+    query: Any,
+    default_fields: List[str],
+    fmt: str,
+    filename: str,
+) -> Response:
+    """
+    Runs a search export (do_export(query, fields=..., max_results=...)) and
+    returns a streaming response, or an error response if the format or
+    fields are invalid, the client already has too many exports running, or
+    the search fails up front.
+    """
+    if fmt not in SEARCH_EXPORT_FORMATS:
+        return _error_response(400, "unsupported export format: {}".format(fmt))
+    fields = parse_export_fields(request.args.get("fields"), default_fields)
+    if fields is None:
+        return _error_response(400, "invalid 'fields' list")
+    max_results = app.config["SEARCH_EXPORT_MAX_RESULTS"] or None
+    limit_arg = request.args.get("limit", "")
+    if limit_arg.isdigit():
+        max_results = min(int(limit_arg), max_results or int(limit_arg))
+
+    # not access_route, which starts with whatever X-Forwarded-For the client
+    # sends; see PROXY_FIX_X_FOR
+    client = request.remote_addr or "unknown"
+    if not export_slots.acquire(client):
+        return _error_response(429, "too many concurrent exports from this client")
+
+    def all_rows() -> Iterator[Dict[str, Any]]:
+        if first is not None:
+            yield first
+            yield from rows
+
+    # until the response (and its close callbacks) takes over, the slot must
+    # be released on any error
+    try:
+        rows = do_export(query, fields=fields, max_results=max_results)
+        # fetch the first page before starting the response, so that query
+        # errors get an error status code
+        first = next(rows, None)
+        resp = Response(
+            format_export_rows(all_rows(), fields, fmt),
+            mimetype=SEARCH_EXPORT_FORMATS[fmt],
+            headers={
+                "Content-Disposition": 'attachment; filename="{}.{}"'.format(filename, fmt),
+            },
+        )
+    except elasticsearch.exceptions.TransportError as e:
+        export_slots.release(client)
+        app.log.warning("search export failed: {}".format(e))
+        # eg, 400 for query syntax errors; "N/A" for connection errors
+        status = e.status_code if isinstance(e.status_code, int) else 503
+        return _error_response(status, "search failed: {}".format(e.error))
+    except BaseException:
+        export_slots.release(client)
+        raise
+
+    # called by the WSGI server when the response is done (or the client
+    # disconnects), even if the body was never iterated
+    resp.call_on_close(lambda: export_slots.release(client))
+    resp.call_on_close(getattr(rows, "close", lambda: None))
+    return resp
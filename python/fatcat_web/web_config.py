@@ -88,6 +88,37 @@ class Config(object):
     ELASTICSEARCH_CONTAINER_INDEX = os.environ.get(
         "ELASTICSEARCH_CONTAINER_INDEX", default="fatcat_container"
     )
+    # in-process cache of search results (per worker process): max entries,
+    # and time-to-live in seconds. Either 0 to disable
+    SEARCH_CACHE_SIZE = int(os.environ.get("SEARCH_CACHE_SIZE", default="5000"))
+    SEARCH_CACHE_TTL = float(os.environ.get("SEARCH_CACHE_TTL", default="60"))
+
+    # streaming search result exports (NDJSON/CSV): max concurrent exports per
+    # client IP (counted per worker process, so the effective limit is this
+    # times the number of uwsgi processes), and max results per export (0 for
+    # no limit)
+    SEARCH_EXPORT_MAX_PER_CLIENT = int(
+        os.environ.get("SEARCH_EXPORT_MAX_PER_CLIENT", default="2")
+    )
+    SEARCH_EXPORT_MAX_RESULTS = int(
+        os.environ.get("SEARCH_EXPORT_MAX_RESULTS", default="1000000")
+    )
+    # max concurrent upstream calls (API, elasticsearch, etc) made on behalf of
+    # views, per worker process (see fatcat_web/concurrency.py). Sizes both
+    # the shared view pool, and the pool for calls nested inside it
+    VIEW_FANOUT_WORKERS = int(os.environ.get("VIEW_FANOUT_WORKERS", default="32"))
+    # number of reverse proxies (eg, nginx) in front of the web interface
+    # which set X-Forwarded-For; the client IP (request.remote_addr) is taken
+    # from that many hops back. 0 to ignore the header
+    PROXY_FIX_X_FOR = int(os.environ.get("PROXY_FIX_X_FOR", default="0"))
+    # precomputed container browse trees and tables of contents (maintained by
+    # the container-browse worker); empty to always query the release index
+    ELASTICSEARCH_CONTAINER_BROWSE_INDEX = os.environ.get(
+        "ELASTICSEARCH_CONTAINER_BROWSE_INDEX", default=""
+    )
+    # directory of pre-rendered sitemap shards and indices (see
+    # fatcat_tools.sitemap); empty if they are served some other way (eg, nginx)
+    SITEMAP_DIR = os.environ.get("SITEMAP_DIR", default="")
 
     # for save-paper-now. set to None if not configured, so we don't display forms/links
     KAFKA_PIXY_ENDPOINT = os.environ.get("KAFKA_PIXY_ENDPOINT", default=None) or None
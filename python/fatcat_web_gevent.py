@@ -0,0 +1,18 @@
+"""
+WSGI entry point for running the web interface with gevent (see
+fatcat_web/concurrency.py, and uwsgi_gevent.ini).
+
+gevent has to monkey-patch the standard library before anything else (ssl,
+socket, threading) is imported, so this module must be what the WSGI server
+loads, instead of fatcat_web itself. For the same reason, it can't be part of
+the fatcat_web package: importing it would import fatcat_web/__init__.py
+(and everything else) first.
+"""
+
+from gevent import monkey
+
+monkey.patch_all()
+
+from fatcat_web import app  # noqa: E402
+
+__all__ = ["app"]
@@ -2,8 +2,6 @@
 
 import argparse
 
-from fatcat_web import app
-
 
 def main() -> None:
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -14,8 +12,25 @@ def main() -> None:
     )
     parser.add_argument("--host", default="127.0.0.1", help="listen on this host/IP")
     parser.add_argument("--port", type=int, default=9810, help="listen on this port")
+    parser.add_argument(
+        "--gevent",
+        action="store_true",
+        help="serve with gevent (many concurrent requests; no debugging or reloading)",
+    )
     args = parser.parse_args()
 
+    # the app is imported here, not at the top of the file, because gevent
+    # needs to monkey-patch the standard library first
+    if args.gevent:
+        from gevent.pywsgi import WSGIServer
+
+        from fatcat_web_gevent import app as gevent_app
+
+        WSGIServer((args.host, args.port), gevent_app).serve_forever()
+        return
+
+    from fatcat_web import app
+
     app.run(debug=args.debug, host=args.host, port=args.port)
 
 
@@ -8,6 +8,7 @@ import sentry_sdk
 from fatcat_tools import public_api
 from fatcat_tools.workers import (
     ChangelogWorker,
+    ContainerBrowseWorker,
     ElasticsearchChangelogWorker,
     ElasticsearchContainerWorker,
     ElasticsearchFileWorker,
@@ -51,6 +52,7 @@ def run_elasticsearch_release(args: argparse.Namespace) -> None:
         consume_topic,
         elasticsearch_backend=args.elasticsearch_backend,
         elasticsearch_index=args.elasticsearch_index,
+        partition_workers=args.partition_workers,
     )
     worker.run()
 
@@ -64,6 +66,7 @@ def run_elasticsearch_container(args: argparse.Namespace) -> None:
         elasticsearch_release_index="fatcat_release",
         elasticsearch_backend=args.elasticsearch_backend,
         elasticsearch_index=args.elasticsearch_index,
+        partition_workers=args.partition_workers,
     )
     worker.run()
 
@@ -75,6 +78,7 @@ def run_elasticsearch_file(args: argparse.Namespace) -> None:
         consume_topic,
         elasticsearch_backend=args.elasticsearch_backend,
         elasticsearch_index=args.elasticsearch_index,
+        partition_workers=args.partition_workers,
     )
     worker.run()
 
@@ -86,10 +90,37 @@ def run_elasticsearch_changelog(args: argparse.Namespace) -> None:
         consume_topic,
         elasticsearch_backend=args.elasticsearch_backend,
         elasticsearch_index=args.elasticsearch_index,
+        partition_workers=args.partition_workers,
     )
     worker.run()
 
 
+def run_container_browse(args: argparse.Namespace) -> None:
+    consume_topic = "fatcat-{}.release-updates-v03".format(args.env)
+    worker = ContainerBrowseWorker(
+        args.kafka_hosts,
+        consume_topic,
+        elasticsearch_backend=args.elasticsearch_backend,
+        elasticsearch_index=args.elasticsearch_index,
+        elasticsearch_release_index=args.elasticsearch_release_index,
+        partition_workers=args.partition_workers,
+    )
+    worker.run()
+
+
+def run_container_browse_backfill(args: argparse.Namespace) -> None:
+    consume_topic = "fatcat-{}.release-updates-v03".format(args.env)
+    worker = ContainerBrowseWorker(
+        args.kafka_hosts,
+        consume_topic,
+        elasticsearch_backend=args.elasticsearch_backend,
+        elasticsearch_index=args.elasticsearch_index,
+        elasticsearch_release_index=args.elasticsearch_release_index,
+    )
+    count = worker.backfill(args.idents_file)
+    print("Built browse docs for {} containers".format(count), file=sys.stderr)
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument(
@@ -103,6 +134,12 @@ def main() -> None:
     parser.add_argument(
         "--env", default="dev", help="Kafka topic namespace to use (eg, prod, qa, dev)"
     )
+    parser.add_argument(
+        "--partition-workers",
+        default=1,
+        type=int,
+        help="for elasticsearch workers, number of Kafka partitions to process concurrently (threads)",
+    )
     subparsers = parser.add_subparsers()
 
     sub_changelog = subparsers.add_parser(
@@ -191,6 +228,53 @@ def main() -> None:
         default="fatcat_changelog",
     )
 
+    sub_container_browse = subparsers.add_parser(
+        "container-browse",
+        help="consume kafka feed of new/updated releases, rebuild precomputed container browse docs",
+    )
+    sub_container_browse.set_defaults(func=run_container_browse)
+    sub_container_browse.add_argument(
+        "--elasticsearch-backend",
+        help="elasticsearch backend to connect to",
+        default="http://localhost:9200",
+    )
+    sub_container_browse.add_argument(
+        "--elasticsearch-index",
+        help="elasticsearch index to push into",
+        default="fatcat_container_browse",
+    )
+    sub_container_browse.add_argument(
+        "--elasticsearch-release-index",
+        help="elasticsearch release index to build browse docs from",
+        default="fatcat_release",
+    )
+
+    sub_container_browse_backfill = subparsers.add_parser(
+        "container-browse-backfill",
+        help="build precomputed container browse docs for a list of containers (eg, all of them, when setting up the index)",
+    )
+    sub_container_browse_backfill.set_defaults(func=run_container_browse_backfill)
+    sub_container_browse_backfill.add_argument(
+        "idents_file",
+        help="container idents, one per line (use '-' for stdin)",
+        type=argparse.FileType("r"),
+    )
+    sub_container_browse_backfill.add_argument(
+        "--elasticsearch-backend",
+        help="elasticsearch backend to connect to",
+        default="http://localhost:9200",
+    )
+    sub_container_browse_backfill.add_argument(
+        "--elasticsearch-index",
+        help="elasticsearch index to push into",
+        default="fatcat_container_browse",
+    )
+    sub_container_browse_backfill.add_argument(
+        "--elasticsearch-release-index",
+        help="elasticsearch release index to build browse docs from",
+        default="fatcat_release",
+    )
+
     args = parser.parse_args()
     if not args.__dict__.get("func"):
         print("tell me what to do!")
@@ -5,6 +5,7 @@ from dotenv import load_dotenv
 from fatcat_openapi_client import *
 
 import fatcat_web
+import fatcat_web.search
 from fatcat_tools import authenticated_api
 
 ES_CONTAINER_STATS_RESP = {
@@ -63,6 +64,8 @@ def full_app(mocker):
     # mock out ES client requests, so they at least fail fast
     fatcat_web.app.es_client = elasticsearch.Elasticsearch("mockbackend")
     mocker.patch("elasticsearch.connection.Urllib3HttpConnection.perform_request")
+    # don't carry cached search results over between tests
+    fatcat_web.search.search_cache.clear()
     return fatcat_web.app
 
 
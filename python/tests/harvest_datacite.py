@@ -1,5 +1,6 @@
 import datetime
 import json
+from urllib.parse import parse_qs, urlparse
 
 import responses
 
@@ -45,3 +46,61 @@ def test_datacite_harvest_date(mocker):
     assert harvester.producer.produce.call_count == 1
     assert harvester.producer.flush.call_count == 1
     assert harvester.producer.poll.called_once_with(0)
+
+
+@responses.activate
+def test_datacite_harvest_windows(mocker):
+
+    mocker.patch("fatcat_tools.harvest.harvest_common.HarvestState.initialize_from_kafka")
+
+    with open("tests/files/datacite_api.json", "r") as f:
+        resp = json.loads(f.readline())
+
+    def api_callback(request):
+        params = parse_qs(urlparse(request.url).query)
+        body = dict(resp)
+        if params["page[size]"] == ["0"]:
+            body["data"] = []
+            body["meta"] = dict(total=5)
+        return (200, {}, json.dumps(body))
+
+    responses.add_callback(
+        responses.GET, "https://api.datacite.org/dois", callback=api_callback
+    )
+
+    harvester = HarvestDataciteWorker(
+        kafka_hosts="dummy",
+        produce_topic="dummy-produce-topic",
+        state_topic="dummy-state-topic",
+        contact_email="test@fatcat.wiki",
+        page_size=100,
+        window_max_records=1,
+        window_min_seconds=12 * 60 * 60,
+        window_concurrency=2,
+    )
+    harvester.producer = mocker.Mock()
+
+    # one count request for the day, then one request for each half of the day
+    harvester.fetch_date(datetime.date(2019, 2, 3))
+    assert len(responses.calls) == 3
+    assert "page%5Bsize%5D=100" in responses.calls[1].request.url
+    window_queries = sorted(
+        parse_qs(urlparse(call.request.url).query)["query"][0] for call in responses.calls[1:]
+    )
+    assert window_queries == [
+        "updated:[2019-02-03T00:00:00.000Z TO 2019-02-03T11:59:59.999Z]",
+        "updated:[2019-02-03T12:00:00.000Z TO 2019-02-03T23:59:59.999Z]",
+    ]
+    assert harvester.producer.produce.call_count == 2
+    assert len(harvester.state.completed_windows[datetime.date(2019, 2, 3)]) == 2
+
+    # after a restart, only windows which were not completed are fetched
+    state_json = harvester.state.complete_window(
+        datetime.date(2019, 2, 4), "2019-02-04T00:00:00/2019-02-04T12:00:00"
+    )
+    harvester.state = HarvestState(catchup_days=0)
+    harvester.state.update(state_json)
+    responses.calls.reset()
+    harvester.fetch_date(datetime.date(2019, 2, 4))
+    assert len(responses.calls) == 2
+    assert "T12%3A00%3A00.000Z" in responses.calls[1].request.url
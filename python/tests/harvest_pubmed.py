@@ -3,7 +3,11 @@ Test pubmed FTP harvest.
 """
 
 import datetime
+import functools
+import http.client
+import http.server
 import os
+import threading
 
 import pytest
 
@@ -20,8 +24,8 @@ def test_pubmed_harvest_date(mocker):
     # $ zcat tests/files/pubmedsample_2019.xml.gz | grep -c '<PubmedArticle>'
     # 176
     file_to_retrieve = os.path.join(os.path.dirname(__file__), "files/pubmedsample_2019.xml.gz")
-    ftpretr = mocker.patch("fatcat_tools.harvest.pubmed.ftpretr")
-    ftpretr.return_value = file_to_retrieve
+    open_url_stream = mocker.patch("fatcat_tools.harvest.pubmed.open_url_stream")
+    open_url_stream.side_effect = lambda url: open(file_to_retrieve, "rb")
 
     test_date = "2020-02-20"
 
@@ -29,9 +33,6 @@ def test_pubmed_harvest_date(mocker):
     generate_date_file_map = mocker.patch("fatcat_tools.harvest.pubmed.generate_date_file_map")
     generate_date_file_map.return_value = {test_date: set(["dummy"])}
 
-    # For cleanup.
-    os.remove = mocker.Mock()
-
     harvester = PubmedFTPWorker(
         kafka_hosts="dummy",
         produce_topic="dummy-produce-topic",
@@ -47,7 +48,10 @@ def test_pubmed_harvest_date(mocker):
     # to the (mock) kafka topic
     assert harvester.producer.produce.call_count == 176
     assert harvester.producer.flush.call_count == 1
-    assert os.remove.call_count == 2
+    # messages are keyed by PMID
+    first_call = harvester.producer.produce.call_args_list[0]
+    assert first_call[1]["key"].isdigit()
+    assert first_call[0][1].startswith(b"<PubmedArticle>")
 
 
 def test_pubmed_harvest_date_no_pmid(mocker):
@@ -58,8 +62,8 @@ def test_pubmed_harvest_date_no_pmid(mocker):
     file_to_retrieve = os.path.join(
         os.path.dirname(__file__), "files/pubmedsample_no_pmid_2019.xml.gz"
     )
-    ftpretr = mocker.patch("fatcat_tools.harvest.pubmed.ftpretr")
-    ftpretr.return_value = file_to_retrieve
+    open_url_stream = mocker.patch("fatcat_tools.harvest.pubmed.open_url_stream")
+    open_url_stream.side_effect = lambda url: open(file_to_retrieve, "rb")
 
     test_date = "2020-02-20"
 
@@ -74,7 +78,74 @@ def test_pubmed_harvest_date_no_pmid(mocker):
     )
 
     harvester.producer = mocker.Mock()
+    harvester.date_file_map = generate_date_file_map()
 
     # The file has not PMID, not importable.
     with pytest.raises(ValueError):
         harvester.fetch_date(datetime.datetime.strptime(test_date, "%Y-%m-%d"))
+
+
+@pytest.fixture
+def local_http_mirror():
+    """
+    Serves the tests directory over HTTP, as a stand-in for the NCBI mirror.
+    """
+    handler = functools.partial(
+        http.server.SimpleHTTPRequestHandler, directory=os.path.dirname(__file__)
+    )
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{}".format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def test_pubmed_harvest_stream(mocker, local_http_mirror):
+    mocker.patch("fatcat_tools.harvest.harvest_common.HarvestState.initialize_from_kafka")
+
+    test_date = "2020-02-20"
+    harvester = PubmedFTPWorker(
+        kafka_hosts="dummy",
+        produce_topic="dummy-produce-topic",
+        state_topic="dummy-state-topic",
+        download_base_url=local_http_mirror,
+    )
+    harvester.producer = mocker.Mock()
+    harvester.date_file_map = {
+        test_date: set(["/files/pubmedsample_2019.xml.gz", "/files/missing.xml.gz"])
+    }
+    harvester.fetch_date(datetime.datetime.strptime(test_date, "%Y-%m-%d"))
+
+    # missing files are skipped (not retried)
+    assert harvester.producer.produce.call_count == 176
+    assert harvester.producer.flush.call_count == 2
+
+
+def test_pubmed_harvest_retry(mocker):
+    mocker.patch("fatcat_tools.harvest.harvest_common.HarvestState.initialize_from_kafka")
+    file_to_retrieve = os.path.join(os.path.dirname(__file__), "files/pubmedsample_2019.xml.gz")
+    attempts = []
+
+    def open_url_stream(url):
+        attempts.append(url)
+        if len(attempts) == 1:
+            # eg, connection dropped part way through the download
+            raise http.client.IncompleteRead(b"")
+        return open(file_to_retrieve, "rb")
+
+    mocker.patch("fatcat_tools.harvest.pubmed.open_url_stream", side_effect=open_url_stream)
+
+    test_date = "2020-02-20"
+    harvester = PubmedFTPWorker(
+        kafka_hosts="dummy",
+        produce_topic="dummy-produce-topic",
+        state_topic="dummy-state-topic",
+    )
+    harvester.retry_delay = 0
+    harvester.producer = mocker.Mock()
+    harvester.date_file_map = {test_date: set(["dummy"])}
+    harvester.fetch_date(datetime.datetime.strptime(test_date, "%Y-%m-%d"))
+
+    assert len(attempts) == 2
+    assert harvester.producer.produce.call_count == 176
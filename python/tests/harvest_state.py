@@ -1,6 +1,16 @@
 import datetime
+import json
+import threading
+import time
+
+import pytest
 
 from fatcat_tools.harvest import *
+from fatcat_tools.harvest.harvest_common import (
+    dates_to_ranges,
+    harvest_spans,
+    ranges_to_dates,
+)
 
 
 def test_harvest_state():
@@ -36,3 +46,175 @@ def test_harvest_state():
     assert len(hs.to_process) == 3
     hs.update('{"completed-date": "2000-01-02"}')
     assert len(hs.to_process) == 2
+
+
+def test_harvest_state_in_flight():
+
+    hs = HarvestState(
+        start_date=datetime.date(2000, 1, 1),
+        end_date=datetime.date(2000, 1, 3),
+    )
+    assert hs.next_span() == datetime.date(2000, 1, 1)
+    hs.start_span(datetime.date(2000, 1, 1))
+    assert hs.next_span() == datetime.date(2000, 1, 2)
+    hs.start_span(datetime.date(2000, 1, 2))
+
+    # later date completes first; only completed dates are recorded as done
+    state = json.loads(hs.complete(datetime.date(2000, 1, 2)))
+    assert state["completed-date"] == "2000-01-02"
+    assert state["in-flight-dates"] == ["2000-01-01"]
+
+    # aborted dates go back to pending
+    hs.abort_span(datetime.date(2000, 1, 1))
+    assert hs.next_span() == datetime.date(2000, 1, 1)
+
+    # restart from the serialized state
+    hs2 = HarvestState(
+        start_date=datetime.date(2000, 1, 1),
+        end_date=datetime.date(2000, 1, 3),
+    )
+    hs2.update(json.dumps(state))
+    assert hs2.to_process == set([datetime.date(2000, 1, 1), datetime.date(2000, 1, 3)])
+
+
+def test_harvest_spans():
+
+    hs = HarvestState(
+        start_date=datetime.date(2000, 1, 1),
+        end_date=datetime.date(2000, 1, 10),
+    )
+    fetched = []
+    committed = []
+    fetch_lock = threading.Lock()
+
+    def fetch(span):
+        time.sleep(0.01 * (span.day % 3))
+        with fetch_lock:
+            fetched.append(span)
+
+    def commit(span):
+        committed.append(span)
+        hs.complete(span)
+
+    count = harvest_spans(hs, fetch, commit, concurrency=4)
+    assert count == 10
+    assert sorted(fetched) == sorted(committed)
+    assert len(set(committed)) == 10
+    assert hs.next_span() is None
+    assert not hs.in_flight
+
+    # a failure stops new dates from being started, and is re-raised
+    hs = HarvestState(
+        start_date=datetime.date(2000, 1, 1),
+        end_date=datetime.date(2000, 1, 10),
+    )
+
+    def fetch_fail(span):
+        if span == datetime.date(2000, 1, 2):
+            raise ValueError("broken")
+
+    with pytest.raises(ValueError):
+        harvest_spans(hs, fetch_fail, hs.complete, concurrency=2)
+    assert datetime.date(2000, 1, 2) in hs.to_process
+    assert datetime.date(2000, 1, 10) in hs.to_process
+    assert not hs.in_flight
+
+
+def test_harvest_state_snapshot():
+
+    hs = HarvestState(
+        start_date=datetime.date(2000, 1, 1),
+        end_date=datetime.date(2000, 1, 10),
+    )
+    for d in (1, 2, 3, 5, 9):
+        state_json = hs.complete(datetime.date(2000, 1, d))
+    state = json.loads(state_json)
+    assert state["completed-ranges"] == [
+        ["2000-01-01", "2000-01-03"],
+        ["2000-01-05", "2000-01-05"],
+        ["2000-01-09", "2000-01-09"],
+    ]
+    assert ranges_to_dates(dates_to_ranges(hs.completed)) == hs.completed
+
+    # a single snapshot message is enough to restore all completed dates
+    hs2 = HarvestState(
+        start_date=datetime.date(2000, 1, 1),
+        end_date=datetime.date(2000, 1, 10),
+    )
+    assert hs2.update(state_json)
+    assert hs2.to_process == hs.to_process
+    assert not hs2.update('{"completed-date": "2000-01-04"}')
+
+    # pending dates come out in order, regardless of what was already handed out
+    assert hs2.next_span() == datetime.date(2000, 1, 6)
+    hs2.start_span(datetime.date(2000, 1, 6))
+    hs2.start_span(datetime.date(2000, 1, 7))
+    assert hs2.next_span() == datetime.date(2000, 1, 8)
+    hs2.abort_span(datetime.date(2000, 1, 6))
+    assert hs2.next_span() == datetime.date(2000, 1, 6)
+    hs2.enqueue_period(
+        start_date=datetime.date(1999, 12, 31),
+        end_date=datetime.date(1999, 12, 31),
+    )
+    assert hs2.next_span() == datetime.date(1999, 12, 31)
+
+
+def test_kafka_state_store(mocker):
+
+    producer = mocker.patch("fatcat_tools.harvest.harvest_common.Producer")
+    hs = HarvestState(
+        start_date=datetime.date(2000, 1, 1),
+        end_date=datetime.date(2000, 1, 20),
+    )
+    for d in range(1, 16):
+        hs.complete(
+            datetime.date(2000, 1, d),
+            kafka_topic="state-topic",
+            kafka_config={"bootstrap.servers": "localhost"},
+        )
+    # one producer for all commits, flushed in batches
+    assert producer.call_count == 1
+    assert producer.return_value.produce.call_count == 15
+    assert producer.return_value.flush.call_count == 1
+    hs.flush()
+    assert producer.return_value.flush.call_count == 2
+    hs.flush()
+    assert producer.return_value.flush.call_count == 2
+    last_state = producer.return_value.produce.call_args[0][1]
+
+    # loading only reads the latest message, if it is a snapshot
+    consumer = mocker.patch("fatcat_tools.harvest.harvest_common.Consumer")
+    consumer.return_value.get_watermark_offsets.return_value = (0, 15)
+    message = mocker.Mock()
+    message.error.return_value = None
+    message.value.return_value = last_state
+    message.offset.return_value = 14
+    consumer.return_value.poll.return_value = message
+    hs2 = HarvestState(
+        start_date=datetime.date(2000, 1, 1),
+        end_date=datetime.date(2000, 1, 20),
+    )
+    hs2.initialize_from_kafka("state-topic", {"bootstrap.servers": "localhost"})
+    assert consumer.return_value.poll.call_count == 1
+    assert hs2.next_span() == datetime.date(2000, 1, 16)
+    assert isinstance(hs2.store, KafkaStateStore)
+
+
+def test_harvest_state_windows():
+
+    hs = HarvestState(
+        start_date=datetime.date(2000, 1, 1),
+        end_date=datetime.date(2000, 1, 2),
+    )
+    state_json = hs.complete_window(datetime.date(2000, 1, 1), "a")
+    assert json.loads(state_json)["completed-windows"] == {"2000-01-01": ["a"]}
+
+    hs2 = HarvestState(catchup_days=0)
+    assert hs2.update(state_json)
+    assert hs2.window_completed(datetime.date(2000, 1, 1), "a")
+    assert not hs2.window_completed(datetime.date(2000, 1, 1), "b")
+
+    # windows are dropped once the whole date is completed
+    state_json = hs2.complete(datetime.date(2000, 1, 1))
+    assert "completed-windows" not in json.loads(state_json)
+    assert not hs2.window_completed(datetime.date(2000, 1, 1), "a")
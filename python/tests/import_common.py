@@ -1,15 +1,20 @@
 import datetime
 import json
-from typing import Any
+import os
+import signal
+import time
+from typing import Any, Dict, List, Tuple
 
 import elasticsearch
 import fatcat_openapi_client
 import fuzzycat.matching
 import pytest
 from fatcat_openapi_client import ReleaseContrib, ReleaseEntity, ReleaseExtIds
+from fatcat_openapi_client.rest import ApiException
 from fixtures import *
 
-from fatcat_tools.importers import EntityImporter
+from fatcat_tools.batch_sizing import ENTITY_BASE_BYTES
+from fatcat_tools.importers import EntityImporter, KafkaJsonPusher
 from fatcat_tools.transforms import entity_to_dict
 
 
@@ -77,3 +82,325 @@ def test_fuzzy_match_different(entity_importer, mocker) -> None:
     match_raw.side_effect = [[]]
     resp = entity_importer.match_existing_release_fuzzy(r1)
     assert resp is None
+
+
+class BatchRecordingImporter(EntityImporter):
+    def __init__(self, api, **kwargs) -> None:
+        super().__init__(api, es_client=elasticsearch.Elasticsearch("mockbackend"), **kwargs)
+        self.batches = []
+
+    def parse_record(self, raw_record: Any) -> Any:
+        return raw_record
+
+    def try_update(self, entity: Any) -> bool:
+        return True
+
+    def insert_batch(self, batch: Any) -> None:
+        if "fail" in batch:
+            raise ValueError("insert failed")
+        self.batches.append(batch)
+        self.counts["insert-batch"] += 1
+
+
+def test_pipelined_insert_batch(mocker) -> None:
+    """
+    Background submission should insert the same batches as synchronous mode,
+    with finish() draining everything in flight.
+    """
+    for inflight in (0, 2):
+        importer = BatchRecordingImporter(
+            mocker.Mock(), edit_batch_size=3, inflight_batches=inflight
+        )
+        for i in range(1, 11):
+            importer.push_record(i)
+        counts = importer.finish()
+        assert counts["insert"] == 10
+        # counts made by background insert_batch() calls are merged
+        assert counts["insert-batch"] == 4
+        assert sorted(importer.batches) == [[1, 2, 3], [4, 5, 6], [7, 8, 9], [10]]
+        assert importer._submits_inflight == []
+
+
+def test_pipelined_insert_batch_error(mocker) -> None:
+    importer = BatchRecordingImporter(mocker.Mock(), edit_batch_size=2, inflight_batches=2)
+    importer.push_record("fail")
+    importer.push_record("other")
+    with pytest.raises(ValueError):
+        importer.finish()
+
+
+def test_adaptive_insert_batch(mocker) -> None:
+    api = mocker.Mock()
+    api.api_client = fatcat_openapi_client.ApiClient()
+    importer = BatchRecordingImporter(
+        api,
+        edit_batch_size=4,
+        adaptive_batch=True,
+        min_batch_size=2,
+        batch_max_bytes=2 * ENTITY_BASE_BYTES,
+    )
+    for i in range(1, 11):
+        importer.push_record("abc{}".format(i))
+    counts = importer.finish()
+    assert counts["insert"] == 10
+    # each record is estimated at ENTITY_BASE_BYTES, so payload limit cuts batches at two
+    assert [len(b) for b in importer.batches] == [2, 2, 2, 2, 2]
+    assert counts["batch-adaptive.count"] == 5
+    assert counts["batch-adaptive.size-max"] == 2
+
+
+class PrecheckImporter(BatchRecordingImporter):
+    def precheck_keys(self, entity: Any) -> List[Tuple[str, str, str]]:
+        return [("release", "doi", entity)]
+
+    def try_update(self, entity: Any) -> bool:
+        existing = self.lookup_existing("release", "doi", entity)
+        if existing:
+            self.counts["exists"] += 1
+            return False
+        return True
+
+
+def test_precheck_lookups(mocker) -> None:
+    def lookup_release(doi=None):
+        if doi.startswith("10.123/exists"):
+            return ReleaseEntity(ext_ids=ReleaseExtIds(doi=doi))
+        raise ApiException(status=404)
+
+    api = mocker.Mock()
+    api.lookup_release.side_effect = lookup_release
+    importer = PrecheckImporter(api, edit_batch_size=10, precheck_batch_size=4)
+    for doi in ("10.123/a", "10.123/exists1", "10.123/a", "10.123/b", "10.123/exists2"):
+        importer.push_record(doi)
+    counts = importer.finish()
+    assert counts["exists"] == 2
+    assert counts["insert"] == 3
+    # the duplicate DOI in the first window is looked up at try_update() time
+    assert counts["precheck-hit"] == 3
+    assert api.lookup_release.call_count == 5
+    assert importer.batches == [["10.123/a", "10.123/a", "10.123/b"]]
+
+
+def test_inflight_batch_lookups(mocker) -> None:
+    """
+    Lookups for entities in insert batches which are still in flight wait for
+    the insert, instead of inserting them again.
+    """
+    inserted = set()
+
+    def lookup_release(doi=None):
+        if doi in inserted:
+            return ReleaseEntity(ext_ids=ReleaseExtIds(doi=doi))
+        raise ApiException(status=404)
+
+    class SlowInsertImporter(PrecheckImporter):
+        def insert_batch(self, batch: Any) -> None:
+            time.sleep(0.2)
+            super().insert_batch(batch)
+            inserted.update(batch)
+
+    api = mocker.Mock()
+    api.lookup_release.side_effect = lookup_release
+    importer = SlowInsertImporter(api, edit_batch_size=2, inflight_batches=2)
+    for doi in ("10.123/a", "10.123/b", "10.123/a", "10.123/c"):
+        importer.push_record(doi)
+    counts = importer.finish()
+    assert counts["inflight-wait"] == 1
+    assert counts["exists"] == 1
+    assert importer.batches == [["10.123/a", "10.123/b"], ["10.123/c"]]
+    assert not importer._keys_inflight
+
+
+def es_msearch_resp(*ident_lists: List[str]) -> Dict[str, Any]:
+    return {
+        "responses": [
+            {"hits": {"hits": [{"_source": {"ident": i}} for i in idents]}}
+            for idents in ident_lists
+        ]
+    }
+
+
+def test_fuzzy_match_batch(mocker) -> None:
+    r1 = ReleaseEntity(
+        title="example title: novel work",
+        contribs=[ReleaseContrib(raw_name="robin hood")],
+        ext_ids=ReleaseExtIds(doi="10.1234/abcdefg"),
+    )
+    r1_again = ReleaseEntity(
+        title="Example Title, Novel Work",
+        contribs=[ReleaseContrib(raw_name="robin hood")],
+        ext_ids=ReleaseExtIds(),
+    )
+    r2 = ReleaseEntity(
+        title="Example Title: Novel Work?",
+        contribs=[ReleaseContrib(raw_name="robin hood")],
+        ext_ids=ReleaseExtIds(),
+    )
+    r3 = ReleaseEntity(
+        title="entirely different",
+        contribs=[ReleaseContrib(raw_name="king tut")],
+        ext_ids=ReleaseExtIds(),
+    )
+    other = ReleaseEntity(title="nothing like it at all", ext_ids=ReleaseExtIds())
+    existing = {"aaaaaaaaaaaaarceaaaaaaaaai": r2, "aaaaaaaaaaaaarceaaaaaaaaaq": r3}
+
+    api = mocker.Mock()
+    api.api_client = fatcat_openapi_client.ApiClient()
+    api.get_release.side_effect = lambda ident, **kwargs: existing[ident]
+    api.lookup_release.side_effect = ApiException(status=404)
+    es_client = mocker.Mock()
+    es_client.msearch.side_effect = [
+        # exact title queries, then fuzzy title query for the title with no hits
+        es_msearch_resp(["aaaaaaaaaaaaarceaaaaaaaaaq", "aaaaaaaaaaaaarceaaaaaaaaai"], []),
+        es_msearch_resp([]),
+    ]
+    importer = EntityImporter(api, es_client=es_client, fuzzy_cache_ttl=60.0)
+
+    results = importer.match_existing_releases_fuzzy([r1, other, r1_again])
+    assert (results[0][0], results[0][2]) == ("STRONG", r2)
+    assert results[1] is None
+    assert results[2][2] == r2
+    assert es_client.msearch.call_count == 2
+    assert api.get_release.call_count == 2
+    assert importer.counts["fuzzy-search"] == 2
+
+    # cached candidates are re-used for the same (normalized) title
+    resp = importer.match_existing_release_fuzzy(r1_again)
+    assert (resp[0], resp[2]) == ("STRONG", r2)
+    assert es_client.msearch.call_count == 2
+    assert importer.counts["fuzzy-cache-hit"] == 1
+
+
+def test_fuzzy_match_batch_ext_ids(mocker) -> None:
+    r1 = ReleaseEntity(
+        title="example title: novel work",
+        contribs=[ReleaseContrib(raw_name="robin hood")],
+        ext_ids=ReleaseExtIds(doi="10.123/abc"),
+    )
+    existing = ReleaseEntity(
+        ident="aaaaaaaaaaaaarceaaaaaaaaai",
+        title="Example Title: Novel Work?",
+        contribs=[ReleaseContrib(raw_name="robin hood")],
+        ext_ids=ReleaseExtIds(doi="10.123/abc"),
+    )
+    other = ReleaseEntity(title="nothing like it at all", ext_ids=ReleaseExtIds(pmid="1234"))
+
+    def lookup_release(**kwargs):
+        if kwargs.get("doi") == "10.123/abc":
+            return existing
+        raise ApiException(status=404)
+
+    api = mocker.Mock()
+    api.api_client = fatcat_openapi_client.ApiClient()
+    api.lookup_release.side_effect = lookup_release
+    es_client = mocker.Mock()
+    es_client.msearch.side_effect = [es_msearch_resp([]), es_msearch_resp([])]
+    importer = EntityImporter(api, es_client=es_client, fuzzy_cache_ttl=60.0)
+
+    # as with fuzzycat, a release found by identifier is the only candidate
+    results = importer.match_existing_releases_fuzzy([r1, other])
+    assert (results[0][0], results[0][2]) == ("EXACT", existing)
+    assert results[1] is None
+    assert api.lookup_release.call_count == 2
+    assert es_client.msearch.call_count == 2
+    assert importer.counts["fuzzy-ext-id-match"] == 1
+    assert importer.counts["fuzzy-search"] == 1
+
+
+def test_fuzzy_verify_pool_shutdown(mocker) -> None:
+    importer = EntityImporter(mocker.Mock(), es_client=mocker.Mock(), fuzzy_verify_workers=2)
+    assert importer._fuzzy_verify_pool is None
+    pool = importer._get_fuzzy_verify_pool()
+    assert pool and importer._get_fuzzy_verify_pool() is pool
+    assert importer.clone()._fuzzy_verify_pool is None
+
+    importer.finish()
+    assert importer._fuzzy_verify_pool is None
+    # started again if the importer is used after finish()
+    new_pool = importer._get_fuzzy_verify_pool()
+    assert new_pool and new_pool is not pool
+    importer.finish()
+
+
+def test_importer_clone(mocker) -> None:
+    api = mocker.Mock()
+    api.lookup_container.side_effect = ApiException(status=404)
+    importer = EntityImporter(api, es_client=mocker.Mock(), edit_batch_size=10)
+    assert importer.lookup_issnl("1234-5678") is None
+    clone = importer.clone()
+    assert clone.api is importer.api
+    assert clone.counts is not importer.counts
+
+    # lookup caches are copied, not shared
+    clone._issnl_id_map["1234-5678"] = "aaaaaaaaaaaaaeiraaaaaaaaai"
+    assert clone.lookup_issnl("1234-5678") == "aaaaaaaaaaaaaeiraaaaaaaaai"
+    assert importer.lookup_issnl("1234-5678") is None
+    assert api.lookup_container.call_count == 1
+
+
+def kafka_msg(mocker, value: Any, partition: int = 0) -> Any:
+    msg = mocker.Mock()
+    msg.error.return_value = None
+    msg.value.return_value = json.dumps(value).encode("utf-8")
+    msg.topic.return_value = "topic"
+    msg.partition.return_value = partition
+    return msg
+
+
+def test_kafka_pusher_graceful_shutdown(mocker) -> None:
+    """
+    A signal stops consuming after the current batch; then the importer is
+    flushed and stored offsets are committed before the consumer is closed.
+    """
+    consumer = mocker.patch("fatcat_tools.importers.common.make_kafka_consumer").return_value
+    importer = BatchRecordingImporter(mocker.Mock(), edit_batch_size=100)
+
+    batches = [[kafka_msg(mocker, 1), kafka_msg(mocker, 2)], [kafka_msg(mocker, 3)]]
+
+    def consume(**kwargs) -> List[Any]:
+        batch = batches.pop(0)
+        if not batches:
+            # eg, deploy restart in the middle of a batch
+            os.kill(os.getpid(), signal.SIGTERM)
+        return batch
+
+    consumer.consume.side_effect = consume
+    pusher = KafkaJsonPusher(importer, "localhost:9092", "dev", "topic", "group")
+    prev_handler = signal.getsignal(signal.SIGTERM)
+    counts = pusher.run()
+
+    assert counts["insert"] == 3
+    assert importer.batches == [[1, 2, 3]]
+    assert consumer.store_offsets.call_count == 3
+    consumer.commit.assert_called_once_with(asynchronous=False)
+    consumer.close.assert_called_once()
+    assert signal.getsignal(signal.SIGTERM) == prev_handler
+
+
+def test_kafka_pusher_partition_workers(mocker) -> None:
+    consumer = mocker.patch("fatcat_tools.importers.common.make_kafka_consumer").return_value
+    importer = BatchRecordingImporter(mocker.Mock(), edit_batch_size=100)
+    batches = [
+        [kafka_msg(mocker, i, partition=i % 3) for i in range(1, 10)],
+        [kafka_msg(mocker, i, partition=i % 3) for i in range(10, 13)],
+    ]
+
+    def consume(**kwargs) -> List[Any]:
+        if not batches:
+            pusher.shutdown()
+            return []
+        return batches.pop(0)
+
+    consumer.consume.side_effect = consume
+    pusher = KafkaJsonPusher(
+        importer, "localhost:9092", "dev", "topic", "group", partition_workers=3
+    )
+    counts = pusher.run()
+
+    assert counts["insert"] == 12
+    assert counts["total"] == 12
+    # one importer per partition, which gets its records in order (the
+    # recorded batches list is shared between clones)
+    assert len(pusher._partition_importers) == 3
+    assert sorted(importer.batches) == [[1, 4, 7, 10], [2, 5, 8, 11], [3, 6, 9, 12]]
+    assert consumer.store_offsets.call_count == 12
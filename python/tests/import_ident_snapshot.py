@@ -0,0 +1,59 @@
+import json
+
+from fatcat_tools.importers import (
+    IdentSnapshot,
+    build_ident_snapshot_from_json,
+)
+from fatcat_tools.importers.ident_snapshot import ident_snapshot_rows
+
+
+def test_ident_snapshot_rows():
+    with open("tests/files/container_jxqqgho7bncrvgfyfznramju3q.json", "r") as f:
+        container = json.loads(f.read())
+    assert ident_snapshot_rows("container", container) == [
+        ("issnl", "0362-1642", "jxqqgho7bncrvgfyfznramju3q"),
+    ]
+
+    with open("tests/files/release_etodop5banbndg3faecnfm6ozi.json", "r") as f:
+        release = json.loads(f.read())
+    assert ident_snapshot_rows("release", release) == [
+        ("doi", "10.1111/j.1471-0528.2011.03098.x", "etodop5banbndg3faecnfm6ozi"),
+    ]
+
+    # elasticsearch docs have identifiers at the top level
+    assert ident_snapshot_rows(
+        "release", dict(ident="etodop5banbndg3faecnfm6ozi", doi="10.123/ABC", pmid=1234)
+    ) == [
+        ("doi", "10.123/abc", "etodop5banbndg3faecnfm6ozi"),
+        ("pmid", "1234", "etodop5banbndg3faecnfm6ozi"),
+    ]
+
+    release["state"] = "redirect"
+    assert ident_snapshot_rows("release", release) == []
+    assert ident_snapshot_rows("creator", dict(orcid="0000-0003-3118-6591")) == []
+
+
+def test_ident_snapshot_build(tmp_path):
+    db_path = str(tmp_path / "snapshot.sqlite3")
+    snapshot = IdentSnapshot(db_path, writable=True)
+
+    with open("tests/files/container_jxqqgho7bncrvgfyfznramju3q.json", "r") as f:
+        counts = build_ident_snapshot_from_json(snapshot, "container", f)
+    assert counts["insert"] == 1
+    release_lines = []
+    for ident in ("3mssw2qnlnblbk7oqyv2dafgey", "etodop5banbndg3faecnfm6ozi"):
+        with open("tests/files/release_{}.json".format(ident), "r") as f:
+            release_lines.append(json.dumps(json.loads(f.read())))
+    counts = build_ident_snapshot_from_json(snapshot, "release", release_lines + [""])
+    assert counts["total"] == 2
+    assert counts["insert"] == 2
+    snapshot.close()
+
+    snapshot = IdentSnapshot(db_path)
+    assert snapshot.counts()["issnl"] == 1
+    assert snapshot.counts()["doi"] == 2
+    assert snapshot.lookup("issnl", "0362-1642") == "jxqqgho7bncrvgfyfznramju3q"
+    assert snapshot.lookup("issnl", "9999-9999") is None
+    assert snapshot.lookup("doi", "10.7280/D1J37Z") == "3mssw2qnlnblbk7oqyv2dafgey"
+    assert snapshot.lookup("orcid", "0000-0003-3118-6591") is None
+    snapshot.close()
@@ -0,0 +1,162 @@
+import json
+import os
+
+import fatcat_openapi_client
+import pytest
+from fatcat_openapi_client import (
+    Editgroup,
+    EditgroupEdits,
+    EntityEdit,
+    ReleaseEntity,
+    ReleaseExtIds,
+)
+
+from fatcat_tools.importers import (
+    BloomFilter,
+    CrossrefImporter,
+    KnownDois,
+    build_known_dois_from_json,
+)
+
+
+def test_bloom_filter():
+    bloom = BloomFilter.for_capacity(1000, error_rate=0.001)
+    for i in range(1000):
+        bloom.add("10.123/{}".format(i))
+    assert bloom.count == 1000
+    for i in range(1000):
+        assert "10.123/{}".format(i) in bloom
+    false_positives = sum(1 for i in range(10000) if "10.999/{}".format(i) in bloom)
+    assert false_positives < 50
+
+
+def test_known_dois_build(tmp_path):
+    release_lines = []
+    for ident in ("3mssw2qnlnblbk7oqyv2dafgey", "etodop5banbndg3faecnfm6ozi"):
+        with open("tests/files/release_{}.json".format(ident), "r") as f:
+            release_lines.append(json.dumps(json.loads(f.read())))
+    known = build_known_dois_from_json(release_lines + [""], 100, changelog_index=1234)
+    assert known.bloom.count == 2
+    assert "10.7280/D1J37Z" in known
+    assert "doi:10.1111/j.1471-0528.2011.03098.x" in known
+    assert "10.123/new" not in known
+    assert None not in known
+
+    path = str(tmp_path / "known_dois.bloom")
+    known.save(path)
+    loaded = KnownDois.load(path)
+    assert loaded.changelog_index == 1234
+    assert loaded.bloom.count == 2
+    assert "10.7280/d1j37z" in loaded
+    assert "10.123/new" not in loaded
+
+    # only re-written on the save interval (or when forced), if changed
+    loaded.save_interval = 3600.0
+    assert not loaded.maybe_save(force=True)
+    loaded.add("10.123/new")
+    assert not loaded.maybe_save()
+    assert loaded.maybe_save(force=True)
+    assert "10.123/new" in KnownDois.load(path)
+    loaded.add("10.123/other")
+    loaded.save_interval = 0
+    loaded._next_save = 0
+    assert loaded.maybe_save()
+    assert "10.123/other" in KnownDois.load(path)
+    # temporary files are renamed into place
+    assert os.listdir(str(tmp_path)) == ["known_dois.bloom"]
+
+
+def test_known_dois_refresh(mocker):
+    api = mocker.Mock()
+    api.get_changelog.return_value = [mocker.Mock(index=12)]
+    api.get_changelog_entry.side_effect = lambda index: mocker.Mock(
+        index=index,
+        editgroup=Editgroup(
+            edits=EditgroupEdits(
+                releases=[
+                    EntityEdit(
+                        edit_id="00000000-0000-0000-0000-{:012d}".format(index),
+                        ident="aaaaaaaaaaaaarceaaaaaaaaai",
+                        revision="00000000-0000-0000-1111-{:012d}".format(index),
+                        editgroup_id="aaaaaaaaaaaabo53aaaaaaaaae",
+                    ),
+                    # deletion
+                    EntityEdit(
+                        edit_id="00000000-0000-0000-2222-{:012d}".format(index),
+                        ident="aaaaaaaaaaaaarceaaaaaaaaaq",
+                        editgroup_id="aaaaaaaaaaaabo53aaaaaaaaae",
+                    ),
+                ]
+            )
+        ),
+    )
+    api.get_release_revision.side_effect = lambda rev: ReleaseEntity(
+        ext_ids=ReleaseExtIds(doi="10.123/{}".format(rev[-2:]))
+    )
+
+    known = KnownDois(BloomFilter.for_capacity(100))
+    counts = known.refresh_from_changelog(api)
+    assert known.changelog_index == 12
+    assert counts["doi"] == 0
+
+    known.changelog_index = 10
+    counts = known.refresh_from_changelog(api)
+    assert counts["changelog-entries"] == 2
+    assert known.changelog_index == 12
+    assert "10.123/11" in known
+    assert "10.123/12" in known
+    assert "10.123/10" not in known
+
+    # capped by API calls (one per entry, plus one per release revision), only
+    # advancing over whole entries
+    known.changelog_index = 9
+    counts = known.refresh_from_changelog(api, max_api_calls=3)
+    assert counts["changelog-entries"] == 2
+    assert counts["behind"] == 1
+    assert known.changelog_index == 11
+    assert "10.123/10" in known
+    counts = known.refresh_from_changelog(api, max_api_calls=3)
+    assert counts["changelog-entries"] == 1
+    assert counts["behind"] == 0
+    assert known.changelog_index == 12
+
+
+def test_crossref_known_dois(mocker):
+    with open("tests/files/crossref-works.single.json", "r") as f:
+        raw = json.loads(f.read())
+    known = KnownDois(BloomFilter.for_capacity(100), refresh_interval=0)
+    with open("tests/files/ISSN-to-ISSN-L.snip.txt", "r") as issn_file:
+        importer = CrossrefImporter(mocker.Mock(), issn_file, known_dois=known)
+    assert importer.want(raw)
+    known.add(raw["DOI"])
+    assert not importer.want(raw)
+    assert importer.counts["skip-known-doi"] == 1
+
+    # bezerk mode always imports
+    importer.bezerk_mode = True
+    assert importer.want(raw)
+
+
+def test_crossref_known_dois_insert(mocker):
+    with open("tests/files/crossref-works.single.json", "r") as f:
+        raw = json.loads(f.read())
+    known = KnownDois(BloomFilter.for_capacity(100), refresh_interval=0)
+    api = mocker.Mock()
+    api.lookup_release.side_effect = fatcat_openapi_client.rest.ApiException(status=404)
+    with open("tests/files/ISSN-to-ISSN-L.snip.txt", "r") as issn_file:
+        importer = CrossrefImporter(api, issn_file, known_dois=known)
+    re = importer.parse_record(raw)
+    assert importer.try_update(re)
+    assert raw["DOI"] not in known
+
+    # failed inserts don't mark DOIs as known
+    api.create_release_auto_batch.side_effect = fatcat_openapi_client.rest.ApiException(
+        status=500
+    )
+    with pytest.raises(fatcat_openapi_client.rest.ApiException):
+        importer.insert_batch([re])
+    assert raw["DOI"] not in known
+
+    api.create_release_auto_batch.side_effect = None
+    importer.insert_batch([re])
+    assert raw["DOI"] in known
@@ -114,3 +114,29 @@ def test_choose_primary_container(api) -> None:
         )
         == ce_complete_big.ident
     )
+
+
+def test_container_merger_fetch_cache(mocker) -> None:
+    api = mocker.Mock()
+    api.get_container_redirects.return_value = []
+    cm = ContainerMerger(api, dry_run_mode=False)
+
+    # redirect lookups are cached for the run, entity lookups are not
+    assert cm.fetch("get_container_redirects", "aaaaaaaaaaaaaeiraaaaaaaaai") == []
+    assert cm.fetch("get_container_redirects", "aaaaaaaaaaaaaeiraaaaaaaaai") == []
+    cm.fetch("get_container", "aaaaaaaaaaaaaeiraaaaaaaaai")
+    cm.fetch("get_container", "aaaaaaaaaaaaaeiraaaaaaaaai")
+    assert api.get_container_redirects.call_count == 1
+    assert api.get_container.call_count == 2
+    assert cm.counts["fetch-cache-hit"] == 1
+
+    # redirecting another container to this one invalidates the cache
+    cm.submit_update(
+        api.update_container,
+        "aaaaaaaaaaaabo53aaaaaaaaae",
+        "aaaaaaaaaaaaaeiraaaaaaaaaq",
+        ContainerEntity(redirect="aaaaaaaaaaaaaeiraaaaaaaaai"),
+    )
+    cm.fetch("get_container_redirects", "aaaaaaaaaaaaaeiraaaaaaaaai")
+    assert api.get_container_redirects.call_count == 2
+    assert api.update_container.call_count == 1
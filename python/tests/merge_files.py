@@ -1,4 +1,5 @@
-from fatcat_openapi_client import FileEntity, FileUrl
+import pytest
+from fatcat_openapi_client import ApiException, FileEntity, FileUrl
 from fixtures import api
 
 from fatcat_tools.mergers.files import FileMerger
@@ -158,3 +159,69 @@ def test_merge_file_metadata_from(api) -> None:
     assert fm.merge_file_metadata_from(fe_partial, fe_another_url) is True
     assert fe_partial.urls[-1].url == "http://someuni.edu/repo/file.pdf"
     assert fm.merge_file_metadata_from(fe_partial, fe_another_url) is False
+
+
+def test_file_merger_prefetch(mocker) -> None:
+    files = {
+        "aaaasb5apzfhbbxxc7rgu2yw6m": FileEntity(
+            sha1="1" * 40, state="active", mimetype="application/pdf"
+        ),
+        # primary of its group (has a release), whatever order ids come in
+        "bbbbsb5apzfhbbxxc7rgu2yw6m": FileEntity(
+            sha1="1" * 40, state="active", size=123, release_ids=["aaaaaaaaaaaaarceaaaaaaaaai"]
+        ),
+        "ccccsb5apzfhbbxxc7rgu2yw6m": FileEntity(sha1="2" * 40, state="active"),
+        "ddddsb5apzfhbbxxc7rgu2yw6m": FileEntity(sha1="2" * 40, state="active"),
+    }
+    for ident, fe in files.items():
+        fe.ident = ident
+
+    def get_file(ident):
+        if ident not in files:
+            raise ApiException(status=404)
+        return files[ident]
+
+    api = mocker.Mock()
+    api.get_file.side_effect = get_file
+    api.create_editgroup.return_value = mocker.Mock(editgroup_id="aaaaaaaaaaaabo53aaaaaaaaae")
+    fm = FileMerger(api, dry_run_mode=False, prefetch_groups=3, inflight_updates=2)
+
+    def group(ids, sha1):
+        return dict(
+            entity_type="file",
+            duplicate_ids=ids,
+            evidence=dict(extid_type="sha1", extid=sha1),
+        )
+
+    fm.push_record(
+        group(["aaaasb5apzfhbbxxc7rgu2yw6m", "bbbbsb5apzfhbbxxc7rgu2yw6m"], "1" * 40)
+    )
+    fm.push_record(
+        group(["ccccsb5apzfhbbxxc7rgu2yw6m", "ddddsb5apzfhbbxxc7rgu2yw6m"], "2" * 40)
+    )
+    assert api.get_file.call_count == 0
+    # the third group overlaps with the second, in the same editgroup
+    with pytest.raises(ValueError):
+        fm.push_record(
+            group(["ccccsb5apzfhbbxxc7rgu2yw6m", "eeeesb5apzfhbbxxc7rgu2yw6m"], "2" * 40)
+        )
+    # fetched once each, concurrently, before merging
+    assert api.get_file.call_count == 5
+    fm._reap_submits(drain=True)
+    assert fm.counts["merged"] == 2
+    assert fm.counts["prefetch-hit"] == 4
+    # one redirect per group, and one primary update (the mimetype)
+    assert api.update_file.call_count == 3
+    assert api.accept_editgroup.call_count == 0
+
+    fm = FileMerger(api, dry_run_mode=False, prefetch_groups=3, inflight_updates=2)
+    fm.push_record(
+        group(["aaaasb5apzfhbbxxc7rgu2yw6m", "bbbbsb5apzfhbbxxc7rgu2yw6m"], "1" * 40)
+    )
+    fm.push_record(
+        group(["ccccsb5apzfhbbxxc7rgu2yw6m", "eeeesb5apzfhbbxxc7rgu2yw6m"], "2" * 40)
+    )
+    counts = fm.finish()
+    assert counts["merged"] == 1
+    assert counts["skip-entity-not-found"] == 1
+    assert api.accept_editgroup.call_count == 1
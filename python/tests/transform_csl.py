@@ -6,7 +6,12 @@ from fatcat_openapi_client import ReleaseEntity
 from fixtures import api
 from import_crossref import crossref_importer
 
-from fatcat_tools.transforms import citeproc_csl, entity_from_json, release_to_csl
+from fatcat_tools.transforms import (
+    citeproc_csl,
+    citeproc_csl_batch,
+    entity_from_json,
+    release_to_csl,
+)
 
 
 def test_csl_crossref(crossref_importer: Any) -> None:
@@ -71,3 +76,26 @@ def test_csl_pubmed_bibtex(crossref_importer: Any) -> None:
     Mędrela-Kuder and Szymura (2018) ‘Selected anti-health behaviours among women with osteoporosis’, <i>Roczniki Panstwowego Zakladu Higieny</i>, 69`(4). doi: 10.32394/rpzh.2018.0046.
     """.strip()
     )
+
+
+def test_csl_batch() -> None:
+    with open("tests/files/example_releases_pubmed19n0972.json", "r") as f:
+        csl_items = [release_to_csl(entity_from_json(line, ReleaseEntity)) for line in f]
+    # repeated ids get rendered, in order, same as unique ones
+    csl_items.append(dict(csl_items[0]))
+    for style in ("csl-json", "bibtex", "harvard-cite-them-right"):
+        expected = [citeproc_csl(dict(csl), style) for csl in csl_items]
+        assert citeproc_csl_batch(csl_items, style) == expected
+
+
+def test_csl_batch_numeric_style() -> None:
+    with open("tests/files/example_releases_pubmed19n0972.json", "r") as f:
+        csl_items = [release_to_csl(entity_from_json(line, ReleaseEntity)) for line in f]
+    # another work by the same authors
+    other = dict(csl_items[0], id="other", title="Another title")
+    csl_items.insert(1, other)
+    # numeric styles don't number citations across the batch
+    results = citeproc_csl_batch(csl_items, "ieee")
+    for csl, result in zip(csl_items, results):
+        assert result.startswith("[1]")
+        assert result == citeproc_csl(dict(csl), "ieee")
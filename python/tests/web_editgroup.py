@@ -66,3 +66,73 @@ def test_editgroup_annotations_login(app_admin):
     assert rv.status_code == 200
     assert b"Signup" not in rv.data
     assert b"Add Comment" in rv.data
+
+
+def test_editgroup_get_diffs_cached(mocker):
+    from fatcat_openapi_client import ContainerEntity, Editgroup, EditgroupEdits, EntityEdit
+
+    from fatcat_web.entity_helpers import editgroup_get_diffs
+
+    get_rev = mocker.patch("fatcat_web.entity_helpers.generic_get_entity_revision")
+    get_rev.side_effect = lambda entity_type, rev_id, enrich=True: ContainerEntity(
+        name=f"container {rev_id[-2:]}"
+    )
+
+    def edit(ident_suffix, revision=None, prev_revision=None, redirect_ident=None):
+        return EntityEdit(
+            edit_id="00000000-0000-0000-0000-0000000000{:02x}".format(ord(ident_suffix[1])),
+            ident="aaaaaaaaaaaaaeiraaaaaaaa" + ident_suffix,
+            revision=revision,
+            prev_revision=prev_revision,
+            redirect_ident=redirect_ident,
+            editgroup_id="aaaaaaaaaaaabo53aaaaaaaaae",
+        )
+
+    eg = Editgroup(
+        edits=EditgroupEdits(
+            containers=[
+                edit(
+                    "ai",
+                    revision="00000000-0000-0000-1111-fff000000002",
+                    prev_revision="00000000-0000-0000-1111-fff000000001",
+                ),
+                edit("aq", revision="00000000-0000-0000-1111-fff000000003"),
+                edit(
+                    "ay",
+                    revision="00000000-0000-0000-1111-fff000000001",
+                    redirect_ident="aaaaaaaaaaaaaeiraaaaaaaaai",
+                ),
+            ]
+        )
+    )
+    diffs = editgroup_get_diffs(eg)
+    assert diffs["container"]["aaaaaaaaaaaaaeiraaaaaaaaay"] is None
+    assert '-name = "container 01"' in diffs["container"]["aaaaaaaaaaaaaeiraaaaaaaaai"]
+    assert '+name = "container 02"' in diffs["container"]["aaaaaaaaaaaaaeiraaaaaaaaai"]
+    assert diffs["container"]["aaaaaaaaaaaaaeiraaaaaaaaaq"][0].strip() == "--- (created)"
+    assert get_rev.call_count == 3
+
+    # revisions are immutable, so a second render comes from the cache
+    assert editgroup_get_diffs(eg) == diffs
+    assert get_rev.call_count == 3
+
+
+def test_editgroup_get_diffs_cache_limit(mocker):
+    from fatcat_openapi_client import ContainerEntity
+
+    from fatcat_web import entity_helpers
+
+    get_rev = mocker.patch("fatcat_web.entity_helpers.generic_get_entity_revision")
+    get_rev.side_effect = lambda entity_type, rev_id, enrich=True: ContainerEntity(
+        name="container " + "x" * 100
+    )
+    mocker.patch.object(entity_helpers.revision_toml_cache, "max_item_weight", 50)
+    mocker.patch.object(entity_helpers.revision_diff_cache, "max_item_weight", 50)
+
+    # revisions and diffs longer than the limit aren't cached
+    rev = "00000000-0000-0000-1111-fff0000000ff"
+    diff = entity_helpers._revision_diff("container", None, rev)
+    assert '+name = "container xxx' in "".join(diff)
+    assert entity_helpers._revision_diff("container", None, rev) == diff
+    assert get_rev.call_count == 2
+    assert ("container", rev) not in entity_helpers.revision_toml_cache._entries
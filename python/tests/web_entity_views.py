@@ -1,7 +1,12 @@
 import json
 
+from fatcat_openapi_client import FileEntity, FileUrl, ReleaseEntity, ReleaseExtIds
+from fatcat_openapi_client.rest import ApiException
 from fixtures import *
 
+from fatcat_tools.release_lookup import ReleaseLookupResolver, bulk_lookup_release_idents
+from fatcat_tools.transforms import entity_from_json
+from fatcat_web.entity_helpers import enrich_release_entity, entity_es_cache
 from fatcat_web.forms import ContainerEntityForm, FileEntityForm, ReleaseEntityForm
 
 DUMMY_DEMO_ENTITIES = {
@@ -145,6 +150,58 @@ def test_lookups(app):
     assert rv.status_code == 404
 
 
+def test_web_release_lookup_bulk(app, mocker):
+    def lookup_release(**kwargs):
+        if kwargs.get("doi") == "10.123/abc" or kwargs.get("pmid") == "1234":
+            return ReleaseEntity(ident="aaaaaaaaaaaaarceaaaaaaaaai", ext_ids=ReleaseExtIds())
+        raise ApiException(status=404)
+
+    api = mocker.Mock()
+    api.lookup_release.side_effect = lookup_release
+    resolver = ReleaseLookupResolver(api, workers=4)
+    mocker.patch("fatcat_web.routes.release_lookup_resolver", resolver)
+
+    ids = ["doi:10.123/ABC", "pmid:1234", "doi:10.123/abc", "doi:10.123/nope", "bogus", "x:1"]
+    rv = app.post("/release/lookup.json", json=ids)
+    assert rv.status_code == 200
+    assert [r["ident"] for r in rv.json] == [
+        "aaaaaaaaaaaaarceaaaaaaaaai",
+        "aaaaaaaaaaaaarceaaaaaaaaai",
+        "aaaaaaaaaaaaarceaaaaaaaaai",
+        None,
+        None,
+        None,
+    ]
+    assert rv.json[0]["value"] == "10.123/abc"
+    assert rv.json[4]["id_type"] is None
+    # normalized duplicates are only looked up once
+    assert api.lookup_release.call_count == 3
+
+    # cached, including misses
+    rv = app.post("/release/lookup.json", json=ids[:4])
+    assert rv.status_code == 200
+    assert api.lookup_release.call_count == 3
+    assert resolver.cache.hits == 3
+
+    rv = app.post("/release/lookup.json", json=dict(doi="10.123/abc"))
+    assert rv.status_code == 400
+    rv = app.post("/release/lookup.json", json=["doi:10.123/abc"] * 1001)
+    assert rv.status_code == 400
+
+    # client helper, in small batches against the test client
+    session = mocker.Mock()
+    session.post.side_effect = lambda url, json, timeout: mocker.Mock(
+        json=lambda: app.post("/release/lookup.json", json=json).json
+    )
+    results = list(
+        bulk_lookup_release_idents(ids, host="http://localhost/", batch_size=4, session=session)
+    )
+    assert session.post.call_count == 2
+    assert session.post.call_args[0][0] == "http://localhost/release/lookup.json"
+    assert [r["id"] for r in results] == ids
+    assert results[1]["ident"] == "aaaaaaaaaaaaarceaaaaaaaaai"
+
+
 def test_web_container(app, mocker):
 
     es_raw = mocker.patch("elasticsearch.connection.Urllib3HttpConnection.perform_request")
@@ -397,3 +454,37 @@ def test_web_work(app):
     assert rv.status_code == 302
     rv = app.get("/work/create")
     assert rv.status_code == 302
+
+
+def test_enrich_release_entity_cache(app):
+
+    with open("./tests/files/release_etodop5banbndg3faecnfm6ozi.json", "r") as f:
+        release_json = f.read()
+
+    r1 = enrich_release_entity(entity_from_json(release_json, ReleaseEntity))
+    hits = entity_es_cache.hits
+    r2 = enrich_release_entity(entity_from_json(release_json, ReleaseEntity))
+    # both the release and container docs come from the cache
+    assert entity_es_cache.hits == hits + 2
+    assert r2._es is r1._es
+    assert r2.container._es is r1.container._es
+
+    # a newly linked file (same release revision) changes the release doc
+    r3 = entity_from_json(release_json, ReleaseEntity)
+    r3.files = [
+        FileEntity(
+            ident="aaaaaaaaaaaaamztaaaaaaaaai",
+            revision="00000000-0000-0000-3333-fff000000002",
+            state="active",
+            release_ids=[r3.ident],
+            urls=[
+                FileUrl(
+                    url="https://web.archive.org/web/1/http://example.com", rel="webarchive"
+                )
+            ],
+        )
+    ]
+    r3 = enrich_release_entity(r3)
+    assert r3._es is not r1._es
+    assert r3._es["preservation"] == "bright"
+    assert r1._es["preservation"] != "bright"
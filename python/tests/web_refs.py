@@ -1,9 +1,13 @@
 import json
 
 import pytest
+import requests
+from fatcat_openapi_client import ReleaseEntity, ReleaseExtIds
 from fatcat_openapi_client.rest import ApiException
 from fixtures import *
+from fuzzycat.simple import FuzzyReleaseMatchResult
 
+from fatcat_web import ref_routes
 from fatcat_web.search import get_elastic_container_random_releases
 
 
@@ -51,3 +55,63 @@ def test_basic_refs(app, mocker):
     rv = app.get("/release/aaaaaaaaaaaaarceaaaaaaaaai/refs-out")
     assert rv.status_code == 200
     assert b"No References Found" in rv.data
+
+
+def test_reference_match_json_batch(app, mocker):
+    release = ReleaseEntity(
+        ident="aaaaaaaaaaaaarceaaaaaaaaai",
+        title="Example Release",
+        ext_ids=ReleaseExtIds(),
+    )
+    match_func = mocker.patch("fatcat_web.ref_routes.close_fuzzy_biblio_matches")
+    match_func.side_effect = lambda biblio, **kwargs: [
+        FuzzyReleaseMatchResult("STRONG", "TITLE_AUTHORS", release)
+    ]
+    release_match_func = mocker.patch("fatcat_web.ref_routes.close_fuzzy_release_matches")
+    release_match_func.side_effect = lambda release, **kwargs: []
+    grobid_func = mocker.patch("fatcat_web.ref_routes.grobid_api_process_citation")
+    grobid_func.return_value = "<biblStruct/>"
+    mocker.patch(
+        "fatcat_web.ref_routes.transform_grobid_ref_xml", return_value=dict(title="Example")
+    )
+    api_func = mocker.patch("fatcat_web.ref_routes.api")
+    api_func.get_release.return_value = release
+    ref_routes._grobid_parse_citation.cache_clear()
+
+    rv = app.post(
+        "/reference/match.json",
+        json=[
+            dict(title="Example Release", first_author="Jones"),
+            dict(title="Example Release", year="2020"),
+            dict(submit_type="bogus"),
+            dict(raw_citation="Jones. Example  Release.\n2020."),
+            dict(raw_citation="Jones. Example Release. 2020."),
+        ],
+    )
+    assert rv.status_code == 200
+    assert len(rv.json) == 5
+    assert rv.json[0]["matches"][0]["release"]["ident"] == release.ident
+    assert rv.json[1]["matches"][0]["status"] == "STRONG"
+    assert "errors" in rv.json[2]
+    assert rv.json[3]["matches"] == []
+    # the same release is only fetched once for the whole batch
+    assert api_func.get_release.call_count == 1
+    # both raw citations normalize to the same string; GROBID only called once
+    assert grobid_func.call_count == 1
+
+    # a GROBID error only fails that citation
+    grobid_func.side_effect = requests.exceptions.Timeout("slow")
+    rv = app.post(
+        "/reference/match.json",
+        json=[
+            dict(raw_citation="Smith. Other Release. 2021."),
+            dict(title="Example Release", first_author="Jones"),
+        ],
+    )
+    assert rv.status_code == 200
+    assert "Timeout" in rv.json[0]["error"]
+    assert "matches" not in rv.json[0]
+    assert rv.json[1]["matches"][0]["release"]["ident"] == release.ident
+
+    rv = app.post("/reference/match.json", json=dict(title="not a list"))
+    assert rv.status_code == 400
@@ -1,4 +1,14 @@
+import subprocess
+import sys
+import time
+
+import pytest
 from fixtures import *
+from flask import request
+
+import fatcat_web
+from fatcat_tools.sitemap import build_sitemap
+from fatcat_web.concurrency import fan_out, gevent_patched
 
 
 def test_static_routes(app):
@@ -8,3 +18,62 @@ def test_static_routes(app):
 
     assert app.get("/search").status_code == 302
     assert app.get("/static/bogus/route").status_code == 404
+
+
+def test_sitemap_shards(app, mocker, tmp_path):
+    assert app.get("/sitemap-index-containers.xml").status_code == 404
+
+    build_sitemap("container", ["aaaaaaaaaaaaarceaaaaaaaaai"], str(tmp_path))
+    mocker.patch.dict(fatcat_web.app.config, {"SITEMAP_DIR": str(tmp_path)})
+
+    rv = app.get("/sitemap-index-containers.xml")
+    assert rv.status_code == 200
+    assert rv.mimetype == "text/xml"
+    assert b"https://fatcat.wiki/sitemap-containers-a.txt.gz" in rv.data
+    rv = app.get("/sitemap-containers-a.txt.gz")
+    assert rv.status_code == 200
+    assert rv.mimetype == "application/gzip"
+    rv.close()
+
+    assert app.get("/sitemap-containers-b.txt.gz").status_code == 404
+    assert app.get("/sitemap_state.json").status_code == 404
+    assert app.get("/sitemap-state.json").status_code == 404
+
+
+def test_fan_out(app, mocker):
+    calls = [lambda: time.sleep(0.3) or "a", lambda: time.sleep(0.3) or "b", lambda: "c"]
+    start = time.monotonic()
+    assert fan_out(*calls) == ["a", "b", "c"]
+    assert time.monotonic() - start < 0.55
+    assert fan_out() == []
+
+    def fail() -> None:
+        raise ValueError("upstream error")
+
+    with pytest.raises(ValueError):
+        fan_out(lambda: "a", fail)
+
+    # calls run in a copy of the request context
+    with fatcat_web.app.test_request_context("/stats?q=blood"):
+        assert fan_out(lambda: request.args["q"], lambda: request.path) == ["blood", "/stats"]
+
+
+def test_gevent_wsgi():
+    pytest.importorskip("gevent")
+    assert not gevent_patched()
+    # monkey-patching is process-wide, so check in a separate process
+    proc = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "from fatcat_web_gevent import app; "
+            "from fatcat_web.concurrency import fan_out, gevent_patched; "
+            "assert gevent_patched(); "
+            "assert fan_out(lambda: 1, lambda: 2) == [1, 2]; "
+            "print(app.test_client().get('/health.json').json['gevent'])",
+        ],
+        capture_output=True,
+        timeout=120,
+    )
+    assert proc.returncode == 0, proc.stderr
+    assert proc.stdout.strip().endswith(b"True")
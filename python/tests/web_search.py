@@ -1,10 +1,26 @@
 import json
 
+import elasticsearch
 import pytest
 from fatcat_openapi_client.rest import ApiException
 from fixtures import *
 
-from fatcat_web.search import get_elastic_container_random_releases
+from fatcat_tools.search.common import (
+    CONTAINER_RESULT_ROW_FIELDS,
+    RELEASE_RESULT_ROW_FIELDS,
+    FatcatSearchError,
+)
+from fatcat_tools.search.container_browse import container_browse_docs, container_toc_id
+from fatcat_web import app as flask_app
+from fatcat_web.search import (
+    ReleaseQuery,
+    do_release_search,
+    get_elastic_container_browse_toc,
+    get_elastic_container_browse_year_volume_issue,
+    get_elastic_container_random_releases,
+    search_cache,
+)
+from fatcat_web.search_export import export_slots
 
 
 def test_generic_search(app):
@@ -200,3 +216,244 @@ def test_container_stats(app, mocker):
     stats = rv.json
     assert isinstance(stats["total"], int)
     assert stats["ident"] == "aaaaaaaaaaaaaeiraaaaaaaaam"
+
+
+def test_container_browse_index(mocker):
+
+    ident = "aaaaaaaaaaaaaeiraaaaaaaaai"
+    with open("tests/files/elastic_release_search.json") as f:
+        elastic_search = json.loads(f.read())
+    elastic_agg = {
+        "timed_out": False,
+        "aggregations": {
+            "year_volume": {
+                "buckets": [
+                    {"key": {"year": 2020.0, "volume": "12", "issue": "3"}, "doc_count": 1},
+                ]
+            }
+        },
+        "hits": {"total": 1, "hits": [], "max_score": 0.0},
+        "took": 0,
+    }
+    elastic_search["hits"]["total"] = 1
+    elastic_search["hits"]["hits"] = elastic_search["hits"]["hits"][:1]
+
+    es_raw = mocker.patch("elasticsearch.connection.Urllib3HttpConnection.perform_request")
+    es_raw.side_effect = [
+        (200, {}, json.dumps(elastic_agg)),
+        (200, {}, json.dumps(elastic_search)),
+    ]
+    docs = container_browse_docs(ident, flask_app.es_client, issues=[(2020, "12", "3")])
+    assert [d[0] for d in docs] == [ident, container_toc_id(ident, 2020, "12", "3")]
+    tree_doc, toc_doc = docs[0][1], docs[1][1]
+    assert tree_doc["year_volume_issue"][0]["volumes"][0]["issues"][0]["count"] == 1
+    assert toc_doc["count_found"] == 1
+    assert len(toc_doc["releases"]) == 1
+
+    def get_resp(doc):
+        return (200, {}, json.dumps({"found": True, "_source": doc}))
+
+    mocker.patch.dict(flask_app.config, {"ELASTICSEARCH_CONTAINER_BROWSE_INDEX": "browse"})
+    es_raw.side_effect = [
+        get_resp(tree_doc),
+        get_resp(tree_doc),
+        get_resp(toc_doc),
+    ]
+    assert (
+        get_elastic_container_browse_year_volume_issue(ident) == tree_doc["year_volume_issue"]
+    )
+    found = get_elastic_container_browse_toc(ident, 2020, "12", "3")
+    assert found.count_found == 1
+    assert found.results == toc_doc["releases"]
+
+    # stale table of contents (count doesn't match tree); caller falls back to search
+    stale_doc = dict(toc_doc, count_found=2)
+    es_raw.side_effect = [get_resp(tree_doc), get_resp(stale_doc)]
+    assert get_elastic_container_browse_toc(ident, 2020, "12", "3") is None
+
+    # not in index at all
+    es_raw.side_effect = [(404, {}, json.dumps({"found": False}))]
+    assert get_elastic_container_browse_toc(ident, 2020, "12", "3") is None
+
+    # elasticsearch errors are reported like search errors
+    es_raw.side_effect = elasticsearch.exceptions.TransportError(500, "broken")
+    with pytest.raises(FatcatSearchError):
+        get_elastic_container_browse_toc(ident, 2020, "12", "3")
+
+
+def test_release_search_export(app, mocker):
+
+    hits = [
+        {
+            "_index": "fatcat_release",
+            "_id": "aaaaaaaaaaaaarceaaaaaaaaa{}".format(i),
+            "_source": {
+                "ident": "aaaaaaaaaaaaarceaaaaaaaaa{}".format(i),
+                "title": "Example, Title {}".format(i),
+                "contrib_names": ["A", "B"],
+            },
+        }
+        for i in range(3)
+    ]
+    scroll_resp = {
+        "_scroll_id": "scroll123",
+        "timed_out": False,
+        "took": 1,
+        "_shards": {"successful": 1, "total": 1, "skipped": 0, "failed": 0},
+        "hits": {"total": {"value": 3}, "hits": hits[:2]},
+    }
+    scroll_resp2 = dict(scroll_resp, hits={"total": {"value": 3}, "hits": hits[2:]})
+    scroll_empty = dict(scroll_resp, hits={"total": {"value": 3}, "hits": []})
+
+    es_raw = mocker.patch("elasticsearch.connection.Urllib3HttpConnection.perform_request")
+    es_raw.side_effect = [
+        (200, {}, json.dumps(scroll_resp)),
+        (200, {}, json.dumps(scroll_resp2)),
+        (200, {}, json.dumps(scroll_empty)),
+        (200, {}, json.dumps({"succeeded": True})),
+    ]
+    rv = app.get("/release/search?q=title&export=ndjson&fields=ident,title")
+    assert rv.status_code == 200
+    assert rv.mimetype == "application/x-ndjson"
+    lines = [json.loads(l) for l in rv.data.decode("utf-8").splitlines()]
+    assert len(lines) == 3
+    assert lines[2] == {"ident": "aaaaaaaaaaaaarceaaaaaaaaa2", "title": "Example, Title 2"}
+    # field projection was passed through
+    assert json.loads(es_raw.call_args_list[0][0][3])["_source"] == ["ident", "title"]
+    # releases the per-client export slot (the WSGI server does this)
+    rv.close()
+
+    es_raw.side_effect = [
+        (200, {}, json.dumps(dict(scroll_resp, hits={"total": 2, "hits": hits[:2]}))),
+        (200, {}, json.dumps(scroll_empty)),
+        (200, {}, json.dumps({"succeeded": True})),
+    ]
+    rv = app.get("/release/search?q=title&export=csv&fields=ident,title,contrib_names")
+    assert rv.status_code == 200
+    rows = rv.data.decode("utf-8").splitlines()
+    assert rows[0] == "ident,title,contrib_names"
+    assert rows[1] == 'aaaaaaaaaaaaarceaaaaaaaaa0,"Example, Title 0","[""A"", ""B""]"'
+    rv.close()
+
+    rv = app.get("/release/search?q=title&export=xml")
+    assert rv.status_code == 400
+    rv = app.get("/release/search?q=title&export=csv&fields=title,bad-field")
+    assert rv.status_code == 400
+
+    # per-client concurrency limit
+    client = "127.0.0.1"
+    for _ in range(export_slots.max_per_client):
+        assert export_slots.acquire(client)
+    rv = app.get("/container/search?q=journal&export=ndjson")
+    assert rv.status_code == 429
+    # a client-supplied X-Forwarded-For doesn't get around the limit
+    rv = app.get(
+        "/container/search?q=journal&export=ndjson",
+        headers={"X-Forwarded-For": "10.1.2.3"},
+    )
+    assert rv.status_code == 429
+    for _ in range(export_slots.max_per_client):
+        export_slots.release(client)
+    assert export_slots.active(client) == 0
+
+    # unexpected errors also release the slot
+    es_raw.side_effect = ValueError("unexpected")
+    with pytest.raises(ValueError):
+        app.get("/container/search?q=journal&export=ndjson")
+    assert export_slots.active(client) == 0
+
+
+def test_release_search_projection(app, mocker):
+
+    with open("tests/files/elastic_release_search.json") as f:
+        elastic_resp = json.loads(f.read())
+    elastic_resp["hits"]["hits"][0]["_source"]["title"] = "Bad \udc80 Unicode"
+    elastic_resp["hits"]["hits"][0]["_source"]["contrib_names"] = "Single \udc80 Name"
+
+    es_raw = mocker.patch("elasticsearch.connection.Urllib3HttpConnection.perform_request")
+    es_raw.side_effect = [
+        (200, {}, json.dumps(elastic_resp)),
+    ]
+
+    found = do_release_search(ReleaseQuery(q="blood"))
+    request_body = json.loads(es_raw.call_args[0][3])
+    assert request_body["_source"]["includes"] == RELEASE_RESULT_ROW_FIELDS
+    assert found.count_found == elastic_resp["hits"]["total"]
+    assert found.results[0]["title"] == "Bad  Unicode"
+    assert found.results[0]["contrib_names"] == ["Single  Name"]
+
+
+def test_search_result_cache(app, mocker):
+
+    with open("tests/files/elastic_release_search.json") as f:
+        elastic_resp = json.loads(f.read())
+
+    es_raw = mocker.patch("elasticsearch.connection.Urllib3HttpConnection.perform_request")
+    es_raw.side_effect = [
+        (200, {}, json.dumps(elastic_resp)),
+        (200, {}, json.dumps(elastic_resp)),
+    ]
+    search_cache.clear()
+    before = search_cache.stats()
+
+    # same query, modulo whitespace, only hits elasticsearch once
+    found = do_release_search(ReleaseQuery(q="blood  "))
+    found.results = []
+    found = do_release_search(ReleaseQuery(q=" blood"))
+    assert es_raw.call_count == 1
+    assert found.results
+    stats = search_cache.stats()
+    assert stats["hits"] == before["hits"] + 1
+    assert stats["misses"] == before["misses"] + 1
+    assert stats["size"] == 1
+
+    # logged-in editors bypass the cache
+    with flask_app.test_request_context():
+        mocker.patch("fatcat_web.search.current_user").is_authenticated = True
+        do_release_search(ReleaseQuery(q="blood"))
+    assert es_raw.call_count == 2
+
+    rv = app.get("/health.json")
+    assert rv.status_code == 200
+    assert rv.json["search_cache"]["size"] == 1
+
+
+def test_search_result_rows_projection(app, mocker):
+    """
+    Search result rows render from hits with only the _source fields searches
+    actually fetch.
+    """
+
+    with open("tests/files/elastic_release_search.json") as f:
+        release_resp = json.loads(f.read())
+    with open("tests/files/elastic_container_search.json") as f:
+        container_resp = json.loads(f.read())
+    for hit in release_resp["hits"]["hits"]:
+        hit["_source"]["container_is_oa"] = True
+    for hit in container_resp["hits"]["hits"]:
+        hit["_source"].update(
+            releases_total=30,
+            preservation_bright=10,
+            preservation_dark=5,
+            preservation_none=15,
+        )
+    for resp, fields in (
+        (release_resp, RELEASE_RESULT_ROW_FIELDS),
+        (container_resp, CONTAINER_RESULT_ROW_FIELDS),
+    ):
+        for hit in resp["hits"]["hits"]:
+            hit["_source"] = {k: v for k, v in hit["_source"].items() if k in fields}
+
+    es_raw = mocker.patch("elasticsearch.connection.Urllib3HttpConnection.perform_request")
+    es_raw.side_effect = [
+        (200, {}, json.dumps(release_resp)),
+        (200, {}, json.dumps(container_resp)),
+    ]
+
+    rv = app.get("/release/search?q=blood")
+    assert rv.status_code == 200
+    assert b"icon unlock" in rv.data
+
+    rv = app.get("/container/search?q=blood")
+    assert rv.status_code == 200
+    assert b"~30</b> releases" in rv.data